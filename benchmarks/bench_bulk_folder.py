@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Send a node_modules-sized tree of small files over loopback TLS and compare
+one connection per file, the streamed tar archive and the manifest bulk mode.
+
+Usage: python benchmarks/bench_bulk_folder.py [file_count] [per_file_sample]
+"""
+
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from config import TransferConfig
+from transfer.file_receiver import FileReceiver
+from transfer.file_sender import FileSender
+from utils.compression import CompressionMethod
+
+
+def make_tree(root, file_count):
+    """Packages of nested lib/ and dist/ folders; file sizes skewed small like real JS modules"""
+    rng = random.Random(42)
+    files = []
+    package = 0
+    while len(files) < file_count:
+        base = os.path.join(root, f"package-{package}")
+        package += 1
+        for folder in ("", "lib", "lib/internal", "dist", "dist/esm"):
+            os.makedirs(os.path.join(base, folder), exist_ok=True)
+            for i in range(rng.randint(2, 12)):
+                size = min(int(rng.lognormvariate(7.3, 1.4)), 2 * 1024 * 1024)
+                path = os.path.join(base, folder, f"module{i}.js")
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(size // 4).hex().encode()[:size].ljust(size, b' '))
+                files.append(path)
+    return files
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    stdout = sys.stdout
+    work = tempfile.mkdtemp()
+    try:
+        config = TransferConfig(config_dir=os.path.join(work, "config"))
+        config.config['auto_accept'] = True
+        port = free_port()
+        download_dir = os.path.join(work, "downloads")
+        receiver = FileReceiver(port, os.path.join(work, "certs"), config)
+        sender = FileSender(port, os.path.join(work, "certs"), config)
+        sender.current_user = "bench"
+
+        source = os.path.join(work, "node_modules")
+        files = make_tree(source, file_count)
+        total_bytes = sum(os.path.getsize(f) for f in files)
+        print(f"📦 {len(files)} files, {total_bytes / (1024 * 1024):.1f} MB in {source}")
+
+        # Keep sender and receiver chatter out of the results
+        sys.stdout = open(os.devnull, 'w')
+        receiver.start_receiver(download_dir)
+        time.sleep(0.5)
+
+        def run(label, count, nbytes, func):
+            start = time.perf_counter()
+            ok = func()
+            elapsed = time.perf_counter() - start
+            mb = nbytes / (1024 * 1024)
+            print(f"{label:<30} {count:>7} files {elapsed:8.2f}s  {count / elapsed:9.0f} files/s"
+                  f"  {mb / elapsed:7.1f} MB/s  {'ok' if ok else 'FAILED'}", file=stdout)
+            return elapsed
+
+        subset = files[:sample]
+        subset_bytes = sum(os.path.getsize(f) for f in subset)
+        elapsed = run("send_file per file (sample)", len(subset), subset_bytes, lambda: all(
+            sender.send_file(path, '127.0.0.1', None, None, CompressionMethod.NONE)[0] for path in subset
+        ))
+        print(f"{'  extrapolated to full tree':<30} {len(files):>7} files "
+              f"{elapsed * len(files) / len(subset):8.2f}s", file=stdout)
+
+        for mode in ("tar", "manifest"):
+            config.config['folder_archive'] = mode
+            shutil.rmtree(download_dir, ignore_errors=True)
+            run(f"send_folder ({mode})", len(files), total_bytes, lambda: sender.send_folder(
+                source, '127.0.0.1', None, None, CompressionMethod.NONE
+            )[0])
+
+        receiver.stop_receiver()
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Ratio and single-core MB/s of every compression method this machine supports,
+on source code, server logs, native binaries and random (incompressible) data.
+zstd and lz4 are measured only when their optional libraries are installed.
+
+Usage: python benchmarks/bench_codecs.py [size_mb] [methods]
+"""
+
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.compression import CompressionManager, CompressionMethod
+
+BLOCK_SIZE = 4 * 1024 * 1024  # The default compression_block_size
+
+
+def read_files(paths, size):
+    parts = []
+    total = 0
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        parts.append(data)
+        total += len(data)
+        if total >= size:
+            break
+    return b''.join(parts)[:size]
+
+
+def source_corpus(size):
+    root = os.path.dirname(os.__file__)
+    return read_files(sorted(glob.glob(os.path.join(root, '**', '*.py'), recursive=True)), size)
+
+
+def log_corpus(size):
+    rng = random.Random(7)
+    levels = ["INFO", "DEBUG", "WARN", "ERROR"]
+    lines = []
+    total = 0
+    while total < size:
+        line = (f"2024-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                f"{rng.randint(0, 59):02d}Z {rng.choice(levels)} worker-{rng.randint(1, 64)} "
+                f"request_id={rng.getrandbits(64):016x} latency_ms={rng.randint(1, 900)}\n").encode()
+        lines.append(line)
+        total += len(line)
+    return b''.join(lines)[:size]
+
+
+def shared_libraries():
+    yield sys.executable
+    for folder in ('/usr/lib', '/usr/lib64', '/usr/local/lib'):
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                if '.so' in name:
+                    yield os.path.join(root, name)
+
+
+def binary_corpus(size):
+    return read_files(shared_libraries(), size)
+
+
+def random_corpus(size):
+    return os.urandom(size)
+
+
+def measure(data, method):
+    blocks = [data[i:i + BLOCK_SIZE] for i in range(0, len(data), BLOCK_SIZE)]
+    start = time.perf_counter()
+    payloads = [CompressionManager.compress_data(block, method) for block in blocks]
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for payload in payloads:
+        CompressionManager.decompress_data(payload, method)
+    return sum(len(p) for p in payloads), compress_time, time.perf_counter() - start
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    if len(sys.argv) > 2:
+        methods = [CompressionMethod[name] for name in sys.argv[2].split(',')]
+    else:
+        methods = [m for m in CompressionMethod if m not in (CompressionMethod.NONE, CompressionMethod.ADAPTIVE)]
+    for method in methods:
+        if not CompressionManager.is_available(method):
+            print(f"⚠️  {method.name} not installed, skipped")
+    methods = [m for m in methods if CompressionManager.is_available(m)]
+
+    corpora = [("source", source_corpus), ("logs", log_corpus), ("binary", binary_corpus), ("random", random_corpus)]
+    print(f"{'data':<7} {'method':<5} {'ratio':>6} {'comp MB/s':>10} {'decomp MB/s':>12}")
+    for label, build in corpora:
+        data = build(size_mb * 1024 * 1024)
+        mb = len(data) / (1024 * 1024)
+        for method in methods:
+            size, compress_time, decompress_time = measure(data, method)
+            print(f"{label:<7} {method.name:<5} {len(data) / size:6.2f} {mb / compress_time:10.1f}"
+                  f" {mb / decompress_time:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
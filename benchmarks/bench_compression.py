@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Stream a log-like file through the compressed send path into a null socket
+and report MB/s per compression method as compression_workers grows.
+
+Usage: python benchmarks/bench_compression.py [size_mb] [methods]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer.streaming import StreamManager
+from utils.compression import CompressionMethod
+
+
+class NullSocket:
+    """Stands in for the TLS socket; counts bytes instead of sending them"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+    def getsockopt(self, *args):
+        raise OSError("not a TCP socket")
+
+
+class Settings:
+    def __init__(self, **settings):
+        self.settings = settings
+
+    def get_setting(self, key):
+        return self.settings.get(key)
+
+
+def make_log(path, size_mb):
+    rng = random.Random(7)
+    levels = ["INFO", "DEBUG", "WARN", "ERROR"]
+    with open(path, 'w') as f:
+        written = 0
+        while written < size_mb * 1024 * 1024:
+            line = (f"2024-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                    f"{rng.randint(0, 59):02d}Z {rng.choice(levels)} worker-{rng.randint(1, 64)} "
+                    f"request_id={rng.getrandbits(64):016x} latency_ms={rng.randint(1, 900)} "
+                    f"path=/api/v1/items/{rng.randint(1, 10 ** 6)}\n")
+            f.write(line)
+            written += len(line)
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    methods = sys.argv[2].split(',') if len(sys.argv) > 2 else ["ZLIB", "LZMA", "BZ2"]
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+
+    with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as f:
+        log_path = f.name
+    try:
+        make_log(log_path, size_mb)
+        file_size = os.path.getsize(log_path)
+        print(f"🗜️  Compressing a {size_mb} MB log ({cores} cores)")
+        for name in methods:
+            method = CompressionMethod[name]
+            for workers in worker_counts:
+                manager = StreamManager(Settings(compression_workers=workers))
+                sock = NullSocket()
+                start = time.perf_counter()
+                manager.stream_file_data(sock, log_path, file_size, None, method, None)
+                elapsed = time.perf_counter() - start
+                print(f"{name:<5} {workers:>3} workers  {size_mb / elapsed:8.1f} MB/s"
+                      f"  ratio {file_size / sock.sent:5.2f}")
+    finally:
+        os.unlink(log_path)
+
+
+if __name__ == "__main__":
+    main()
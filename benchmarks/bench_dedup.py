@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Bytes a deduplicated send would put on the wire for edited copies of a file
+the receiver already has (insertions, overwrites, appends), plus chunking speed.
+
+Usage: python benchmarks/bench_dedup.py [size_mb]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer import dedup
+from transfer.dedup import ChunkStore, chunk_file
+
+
+def edits(base, rng):
+    middle = len(base) // 2
+    yield "unchanged", base
+    yield "insert 10 bytes", base[:middle] + b'0123456789' + base[middle:]
+    yield "overwrite 64KB x4", b''.join(
+        base[i:i + len(base) // 4 - 65536] + rng.randbytes(65536) for i in range(0, len(base), len(base) // 4)
+    )[:len(base)]
+    yield "delete 1MB", base[:middle] + base[middle + 1024 * 1024:]
+    yield "append 4MB", base + rng.randbytes(4 * 1024 * 1024)
+
+
+def chunk_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    start = time.perf_counter()
+    chunks, _ = chunk_file(path, 'blake2b')
+    return chunks, time.perf_counter() - start
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    rng = random.Random(11)
+    base = rng.randbytes(size_mb * 1024 * 1024)
+    chunker = "fastcdc" if dedup._fastcdc else "gear (pure Python)"
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'image.bin')
+        store = ChunkStore(os.path.join(folder, 'chunks'))
+        chunks, elapsed = chunk_bytes(path, base)
+        print(f"🧩 {size_mb} MB in {len(chunks)} chunks, {chunker} at {size_mb / elapsed:.1f} MB/s")
+        for digest, length in chunks:
+            store.put(digest, b'')
+
+        for label, data in edits(base, rng):
+            chunks, _ = chunk_bytes(path, data)
+            missing = store.missing(chunks)
+            sent = sum(length for (_, length), needed in zip(chunks, missing) if needed)
+            print(f"{label:<18} sends {sent / (1024 * 1024):8.2f} MB of {len(data) / (1024 * 1024):7.2f} MB"
+                  f"  ({len(data) / max(sent, 1):8.1f}x less)")
+
+
+if __name__ == "__main__":
+    main()
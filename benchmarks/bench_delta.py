@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Delta-transfer cost for edited copies of a large file the receiver already has:
+time to build the receiver's signatures, time to scan the new version and the
+bytes that would go over the wire.
+
+Usage: python benchmarks/bench_delta.py [size_mb]
+"""
+
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer.delta import compute_signatures, delta_block_size, write_delta
+
+
+class CountingOutput:
+    """Stands in for FrameOutputStream; counts instruction bytes instead of framing them"""
+
+    def __init__(self):
+        self.total_sent = 0
+
+    def write(self, data):
+        self.total_sent += len(data)
+
+    def close(self):
+        pass
+
+
+def edits(base, rng):
+    size = len(base)
+    yield "unchanged", base
+    patched = bytearray(base)
+    for _ in range(10):
+        at = rng.randrange(size - 200)
+        patched[at:at + 200] = rng.randbytes(200)
+    yield "10 row updates", bytes(patched)
+    yield "insert at 1/3", base[:size // 3] + rng.randbytes(4096) + base[size // 3:]
+    yield "append 1%", base + rng.randbytes(size // 100)
+    yield "rewritten", os.urandom(size)
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    rng = random.Random(5)
+    base = os.urandom(size_mb * 1024 * 1024)
+    block_size = delta_block_size(len(base))
+
+    with tempfile.TemporaryDirectory() as folder:
+        old_path = os.path.join(folder, 'dump.old')
+        new_path = os.path.join(folder, 'dump.new')
+        with open(old_path, 'wb') as f:
+            f.write(base)
+        start = time.perf_counter()
+        signatures = compute_signatures(old_path, block_size)
+        elapsed = time.perf_counter() - start
+        print(f"🔏 {size_mb} MB, {len(signatures)} blocks of {block_size // 1024} KB,"
+              f" signatures in {elapsed:.2f}s ({size_mb / elapsed:.0f} MB/s)")
+
+        for label, data in edits(base, rng):
+            with open(new_path, 'wb') as f:
+                f.write(data)
+            output = CountingOutput()
+            start = time.perf_counter()
+            copied = write_delta(new_path, signatures, block_size, output, hashlib.blake2b())
+            elapsed = time.perf_counter() - start
+            print(f"{label:<15} scan {elapsed:6.2f}s ({len(data) / elapsed / (1024 * 1024):7.1f} MB/s)"
+                  f"  wire {output.total_sent / (1024 * 1024):8.2f} MB  reused {copied / (1024 * 1024):8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Compare per-chunk Fernet encryption with the per-transfer AES-GCM session.
+
+Usage: python benchmarks/bench_encryption.py [size_mb]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.crypto import CryptoManager
+
+CHUNK_SIZE = 64 * 1024
+PASSWORD = "benchmark-password"
+
+
+def bench_fernet_per_chunk(chunk, chunks):
+    """Old path: one PBKDF2 run plus Fernet per chunk"""
+    start = time.perf_counter()
+    for _ in range(chunks):
+        CryptoManager.encrypt_data(chunk, PASSWORD)
+    return time.perf_counter() - start
+
+
+def bench_stream_session(chunk, chunks):
+    """New path: one PBKDF2 run per transfer, AES-GCM per chunk"""
+    start = time.perf_counter()
+    cipher, _ = CryptoManager.create_stream_cipher(PASSWORD)
+    for _ in range(chunks):
+        cipher.seal(chunk)
+    return time.perf_counter() - start
+
+
+def report(name, total_bytes, elapsed):
+    mb = total_bytes / (1024 * 1024)
+    print(f"{name:<28} {mb:8.1f} MB in {elapsed:7.3f}s  →  {mb / elapsed:9.1f} MB/s")
+    return mb / elapsed
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    chunk = os.urandom(CHUNK_SIZE)
+    session_chunks = size_mb * 1024 * 1024 // CHUNK_SIZE
+    # The per-chunk path is slow enough that a small sample is representative
+    fernet_chunks = min(session_chunks, 32)
+
+    print(f"🔐 Encryption throughput ({CHUNK_SIZE // 1024} KB chunks)")
+    old = report("Fernet + PBKDF2 per chunk", fernet_chunks * CHUNK_SIZE,
+                 bench_fernet_per_chunk(chunk, fernet_chunks))
+    new = report("AES-GCM session", session_chunks * CHUNK_SIZE,
+                 bench_stream_session(chunk, session_chunks))
+    print(f"⚡ Speedup: {new / old:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
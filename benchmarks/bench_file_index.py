@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Cold vs warm cost of hashing, chunking and signing a folder of unchanged files
+through the persistent file index, with the index hit rate of each pass.
+
+Usage: python benchmarks/bench_file_index.py [files] [file_kb]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer.dedup import chunk_file
+from transfer.delta import compute_signatures, delta_block_size
+from utils.file_index import FileIndex
+
+
+def make_folder(folder, files, file_kb):
+    """Files old enough to be outside the racy window, so the index may keep them"""
+    past = time.time() - 3600
+    paths = []
+    for number in range(files):
+        path = os.path.join(folder, f"file{number:05d}.bin")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(file_kb * 1024))
+        os.utime(path, (past, past))
+        paths.append(path)
+    return paths
+
+
+def timed_pass(index, label, paths, work):
+    index.reset_stats()
+    start = time.perf_counter()
+    for path in paths:
+        work(path)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed:7.3f}s  hit rate {index.hit_rate:6.1%}")
+    return elapsed
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    file_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+    with tempfile.TemporaryDirectory() as folder:
+        data = os.path.join(folder, 'data')
+        os.makedirs(data)
+        paths = make_folder(data, files, file_kb)
+        index = FileIndex(os.path.join(folder, 'index.db'))
+        print(f"🗂️  {files} files of {file_kb} KB")
+
+        workloads = [
+            ("hash", lambda path: index.hash_file(path, 'blake2b')),
+            ("chunk list", lambda path: chunk_file(path, 'blake2b', index)),
+            ("signatures", lambda path: compute_signatures(path, delta_block_size(file_kb * 1024), index)),
+        ]
+        for name, work in workloads:
+            cold = timed_pass(index, f"{name} (cold)", paths, work)
+            warm = timed_pass(index, f"{name} (warm)", paths, work)
+            print(f"{'':<22} {cold / warm:7.1f}x faster warm")
+
+        index.clear()
+        index.reset_stats()
+        start = time.perf_counter()
+        index.warm([data], 'blake2b', background=True).join()
+        print(f"background warm        {time.perf_counter() - start:7.3f}s  {index.stats()['entries']} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+JSON vs packed metadata: encode and decode time and bytes on the wire for
+transfer requests and file metadata, a bulk folder manifest, and a sync
+manifest streamed in frames, each through the same code the transfers use.
+
+Usage: python benchmarks/bench_metadata.py [entries]
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer.bulk import ENTRY_DIR, ENTRY_FILE, read_manifest, write_manifest
+from transfer.metadata import decode_message, encode_message
+from transfer.sync import read_sync_manifest, write_sync_manifest
+
+MESSAGE_ROUNDS = 20000
+
+
+class FrameRecorder:
+    """Stands in for the FrameWriter and FrameReader of a connection"""
+
+    def __init__(self):
+        self.frames = []
+        self._unread = None
+
+    def write_frame(self, payload, frame_type: int = 0, flags: int = 0):
+        self.frames.append((frame_type, flags, bytes(payload)))
+
+    def read_frame(self) -> tuple:
+        if self._unread is None:
+            self._unread = iter(self.frames)
+        return next(self._unread)
+
+    def size(self) -> int:
+        return sum(len(payload) for _, _, payload in self.frames)
+
+
+def make_messages():
+    request = {
+        'type': 'transfer_request', 'file_name': 'quarterly-report-final.pdf', 'file_size': 48213377,
+        'sender': 'alice', 'timestamp': time.time(), 'request_id': '5d0c1f4e-8f0a-4c55-9a43-0fa5e4f0a1b2',
+        'is_folder': False, 'keep_alive': True
+    }
+    metadata = {
+        'file_name': 'quarterly-report-final.pdf', 'file_size': 48213377, 'compression_method': 'adaptive',
+        'encrypted': True, 'hash_algorithm': 'blake2b', 'timestamp': time.time(), 'is_folder': False,
+        'encryption': 'aes-256-gcm', 'encryption_salt': os.urandom(16).hex(),
+        'compression_offer': ['zstd', 'lz4', 'zlib']
+    }
+    return [request, metadata]
+
+
+def make_bulk_manifest(entries):
+    now = time.time_ns()
+    manifest = []
+    for number in range(entries):
+        if number % 100 == 0:
+            manifest.append([f"src/module{number // 100:05d}", ENTRY_DIR, 0, 0o755, now, None])
+        manifest.append([f"src/module{number // 100:05d}/file{number:07d}.py", ENTRY_FILE,
+                         number * 37 % 65536, 0o644, now - number * 1000, None])
+    return manifest
+
+
+def make_sync_manifest(entries):
+    now = time.time_ns()
+    for number in range(entries):
+        versions = {'9f1c2a7e4b3d4e8f': number % 7 + 1}
+        if number % 3 == 0:
+            versions['0a6e5b1d2c3f4a9b'] = number % 5 + 1
+        digest = hashlib.blake2b(str(number).encode()).hexdigest()
+        yield [f"docs/d{number // 1000:04d}/f{number:07d}.txt", number * 37 % 65536, 0o644,
+               now - number * 1000, digest, versions, 0]
+
+
+def timed(work):
+    start = time.perf_counter()
+    result = work()
+    return time.perf_counter() - start, result
+
+
+def bench_messages(messages):
+    for packed in (False, True):
+        encoded = [encode_message(message, packed) for message in messages]
+        encode_time, _ = timed(lambda: [encode_message(message, packed)
+                                        for _ in range(MESSAGE_ROUNDS) for message in messages])
+        decode_time, _ = timed(lambda: [decode_message(data) for _ in range(MESSAGE_ROUNDS) for data in encoded])
+        assert [decode_message(data) for data in encoded] == messages
+        count = MESSAGE_ROUNDS * len(messages)
+        print(f"{'messages ' + ('packed' if packed else 'json'):<18} "
+              f"{sum(len(data) for data in encoded) / len(messages):10.0f} B each   "
+              f"encode {encode_time / count * 1e6:6.2f} us  decode {decode_time / count * 1e6:6.2f} us")
+
+
+def bench_bulk(manifest):
+    for packed in (False, True):
+        recorder = FrameRecorder()
+        encode_time, _ = timed(lambda: write_manifest(recorder, manifest, None, hashlib.blake2b(), packed))
+        decode_time, decoded = timed(lambda: read_manifest(recorder, None, hashlib.blake2b()))
+        assert decoded == manifest
+        print(f"{'bulk ' + ('packed' if packed else 'json'):<18} {recorder.size() / (1024 * 1024):8.2f} MB "
+              f"compressed   encode {encode_time:6.3f}s  decode {decode_time:6.3f}s")
+
+
+def bench_sync(entries):
+    expected = list(make_sync_manifest(entries))
+    for packed in (False, True):
+        recorder = FrameRecorder()
+        encode_time, _ = timed(lambda: write_sync_manifest(recorder, iter(expected), packed))
+        decode_time, decoded = timed(lambda: list(read_sync_manifest(recorder)))
+        assert decoded == expected
+        print(f"{'sync ' + ('packed' if packed else 'json'):<18} {recorder.size() / (1024 * 1024):8.2f} MB "
+              f"compressed   encode {encode_time:6.3f}s  decode {decode_time:6.3f}s")
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    print(f"📝 Control messages, {MESSAGE_ROUNDS} rounds")
+    bench_messages(make_messages())
+    print(f"📦 Bulk manifest of {entries} files")
+    bench_bulk(make_bulk_manifest(entries))
+    print(f"🔄 Sync manifest of {entries} files")
+    bench_sync(entries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Receive a multi-GB framed stream over loopback TLS and compare the legacy
+recv()/concatenation reassembly with the pooled recv_into FrameReader.
+
+Usage: python benchmarks/bench_receive.py [size_gb] [output_path]
+"""
+
+import os
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer.framing import FRAME_HEADER, FRAME_EOF, FrameReader, FrameWriter
+from utils.crypto import CryptoManager
+
+
+def make_contexts(cert_dir):
+    certfile = os.path.join(cert_dir, "cert.pem")
+    keyfile = os.path.join(cert_dir, "key.pem")
+    CryptoManager._generate_self_signed_cert(certfile, keyfile)
+    return CryptoManager.create_ssl_context(certfile, keyfile), CryptoManager.create_ssl_client_context()
+
+
+def send_stream(port, client_context, total_bytes, frame_size):
+    payload = memoryview(os.urandom(frame_size))
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        with client_context.wrap_socket(sock, server_hostname='127.0.0.1') as ssock:
+            writer = FrameWriter(ssock)
+            sent = 0
+            while sent < total_bytes:
+                count = min(frame_size, total_bytes - sent)
+                writer.write_frame(payload[:count])
+                sent += count
+            writer.write_eof()
+            # Wait for the receiver so unread TLS tickets do not turn close() into a reset
+            ssock.recv(16)
+
+
+def receive_legacy(ssock, out):
+    """The pre-FrameReader loop: single recv for the header, 4 KB concatenation for the payload"""
+    received = 0
+    while True:
+        header = ssock.recv(FRAME_HEADER.size)
+        frame_type, _, length = FRAME_HEADER.unpack(header)
+        if frame_type == FRAME_EOF:
+            return received
+        chunk_data = b''
+        while len(chunk_data) < length:
+            chunk_data += ssock.recv(min(4096, length - len(chunk_data)))
+        out.write(chunk_data)
+        received += len(chunk_data)
+
+
+def receive_pooled(ssock, out):
+    reader = FrameReader(ssock)
+    received = 0
+    while True:
+        frame_type, _, payload = reader.read_frame()
+        if frame_type == FRAME_EOF:
+            return received
+        out.write(payload)
+        received += len(payload)
+
+
+def run(name, receive, server_context, client_context, total_bytes, frame_size, output_path):
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        port = listener.getsockname()[1]
+        sender = threading.Thread(
+            target=send_stream, args=(port, client_context, total_bytes, frame_size), daemon=True
+        )
+        sender.start()
+        client, _ = listener.accept()
+        with server_context.wrap_socket(client, server_side=True) as ssock, open(output_path, 'wb') as out:
+            start = time.perf_counter()
+            received = receive(ssock, out)
+            elapsed = time.perf_counter() - start
+            ssock.sendall(b"SUCCESS")
+        sender.join()
+    mb = received / (1024 * 1024)
+    print(f"{name:<34} {mb:8.0f} MB in {elapsed:6.2f}s  →  {mb / elapsed:8.1f} MB/s")
+
+
+def main():
+    size_gb = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    output_path = sys.argv[2] if len(sys.argv) > 2 else os.devnull
+    total_bytes = int(size_gb * 1024 ** 3)
+
+    with tempfile.TemporaryDirectory() as cert_dir:
+        server_context, client_context = make_contexts(cert_dir)
+        print(f"📥 Receiving {size_gb:g} GB over loopback TLS → {output_path}")
+        # Legacy reassembly is quadratic per frame, so it is only run with its original 64 KB frames
+        run("legacy recv + concat (64 KB)", receive_legacy, server_context, client_context,
+            total_bytes, 64 * 1024, output_path)
+        run("pooled recv_into (64 KB)", receive_pooled, server_context, client_context,
+            total_bytes, 64 * 1024, output_path)
+        run("pooled recv_into (4 MB)", receive_pooled, server_context, client_context,
+            total_bytes, 4 * 1024 * 1024, output_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Load test for the receiver: hundreds of concurrent senders against the asyncio
+and the thread-per-connection receiver modes. Reports completed transfers per
+second for a burst of small files, and the receiver's memory per connection
+while that many TLS connections are held open. The receiver runs in a child
+process so its memory can be read from /proc (Linux only).
+
+Usage: python benchmarks/bench_receiver.py [senders] [file_kb]
+"""
+
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from config import TransferConfig
+from transfer.file_receiver import FileReceiver
+from transfer.file_sender import FileSender
+from utils.compression import CompressionMethod
+from utils.crypto import CryptoManager
+
+
+def make_config(home, mode):
+    config = TransferConfig(os.path.join(home, 'config'))
+    config.config.update({'receiver_mode': mode, 'auto_accept': True, 'transfer_retries': 0, 'file_index': False})
+    return config
+
+
+def serve(home, mode, port, ready, done):
+    os.environ['HOME'] = home
+    receiver = FileReceiver(port, os.path.join(home, 'certs'), make_config(home, mode))
+    sys.stdout = open(os.devnull, 'w')
+    receiver.start_receiver(os.path.join(home, 'received'))
+    ready.set()
+    done.wait()
+    receiver.stop_receiver()
+
+
+def rss_kb(pid, field='VmRSS'):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def run_burst(home, mode, port, files):
+    sender = FileSender(port, os.path.join(home, 'certs'), make_config(home, mode))
+    sender.current_user = 'bench'
+    results = []
+    start_gate = threading.Event()
+
+    def send(path):
+        start_gate.wait()
+        results.append(sender.send_file(path, '127.0.0.1', compression_method=CompressionMethod.NONE)[0])
+
+    threads = [threading.Thread(target=send, args=(path,), daemon=True) for path in files]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    start_gate.set()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sum(results)
+
+
+def hold_connections(port, count):
+    """Open TLS connections that stay idle, like senders waiting for their turn"""
+    context = CryptoManager.create_ssl_client_context()
+    held = []
+    for _ in range(count):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port), timeout=30)
+            held.append(context.wrap_socket(sock, server_hostname='127.0.0.1'))
+        except OSError:
+            break
+    return held
+
+
+def bench_mode(mode, senders, file_kb):
+    with tempfile.TemporaryDirectory() as home:
+        os.makedirs(os.path.join(home, 'received'))
+        source = os.path.join(home, 'source')
+        os.makedirs(source)
+        files = []
+        for number in range(senders):
+            path = os.path.join(source, f"file{number:04d}.bin")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(file_kb * 1024))
+            files.append(path)
+
+        port = random.randint(20000, 60000)
+        ready, done = multiprocessing.Event(), multiprocessing.Event()
+        process = multiprocessing.Process(target=serve, args=(home, mode, port, ready, done))
+        process.start()
+        ready.wait(30)
+        time.sleep(0.5)
+        try:
+            # Warm up so certificates, imports and pools do not count as per-connection memory
+            run_burst(home, mode, port, files[:4])
+            idle = rss_kb(process.pid)
+
+            held = hold_connections(port, senders)
+            time.sleep(1.0)
+            holding = rss_kb(process.pid)
+            for ssock in held:
+                ssock.close()
+            time.sleep(1.0)
+
+            elapsed, completed = run_burst(home, mode, port, files)
+            peak = rss_kb(process.pid, 'VmHWM')
+        finally:
+            done.set()
+            process.join(30)
+
+        per_connection = (holding - idle) / max(1, len(held)) if idle and holding else None
+        print(f"{mode:<8} {completed:4d}/{senders} sent in {elapsed:6.2f}s  "
+              f"{completed / elapsed:7.1f} conn/s  "
+              f"{per_connection if per_connection is not None else float('nan'):7.1f} KB/held conn  "
+              f"peak RSS {peak / 1024 if peak else float('nan'):6.1f} MB")
+
+
+def main():
+    senders = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    file_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    print(f"🚚 {senders} concurrent senders, {file_kb} KB each")
+    for mode in ("asyncio", "threads"):
+        bench_mode(mode, senders, file_kb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Send many small files one by one to the same receiver, with pooled keep-alive
+connections and with a new (session-resumed) connection per file, and report
+files per second plus how many TLS handshakes were full, resumed or avoided.
+
+Usage: python benchmarks/bench_small_sends.py [files] [file_kb]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from config import TransferConfig
+from transfer.file_receiver import FileReceiver
+from transfer.file_sender import FileSender
+from utils.compression import CompressionMethod
+
+
+def bench(label, keepalive, mode, files, home):
+    config = TransferConfig(os.path.join(home, 'config'))
+    config.config.update({'receiver_mode': mode, 'auto_accept': True, 'keepalive_timeout': keepalive})
+    port = random.randint(20000, 60000)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        receiver = FileReceiver(port, os.path.join(home, 'certs'), config)
+        receiver.start_receiver(tempfile.mkdtemp(dir=home))
+        time.sleep(0.5)
+        sender = FileSender(port, os.path.join(home, 'certs'), config)
+        sender.current_user = 'bench'
+        start = time.perf_counter()
+        sent = sum(sender.send_file(path, '127.0.0.1', compression_method=CompressionMethod.NONE)[0]
+                   for path in files)
+        elapsed = time.perf_counter() - start
+        receiver.stop_receiver()
+    finally:
+        sys.stdout = stdout
+    stats = sender.pool.stats()
+    print(f"{label:<22} {sent:5d} sent  {sent / elapsed:7.1f} files/s  "
+          f"full handshakes {stats['created'] - stats['resumed']:4d}  "
+          f"resumed {stats['resumed']:4d}  reused {stats['reused']:4d}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    file_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ['HOME'] = home
+        source = os.path.join(home, 'source')
+        os.makedirs(source)
+        files = []
+        for number in range(count):
+            path = os.path.join(source, f"file{number:05d}.bin")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(file_kb * 1024))
+            files.append(path)
+
+        print(f"📨 {count} files of {file_kb} KB, one send_file call each")
+        for mode in ("asyncio", "threads"):
+            bench(f"{mode} keep-alive", 30, mode, files, home)
+            bench(f"{mode} new connection", 0, mode, files, home)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Compare independent per-frame compression with one stateful compressor per
+transfer on a text-heavy folder (the Python standard library sources):
+total size, compress time and decompress time per method and frame size.
+
+Usage: python benchmarks/bench_stateful_compression.py [size_mb] [methods]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.compression import CompressionManager, CompressionMethod, StreamCompressor, StreamDecompressor
+
+FRAME_SIZES = [64 * 1024, 256 * 1024, 1024 * 1024]
+
+
+def load_corpus(size_mb):
+    """Concatenate stdlib .py files in walk order, like a folder stream would"""
+    root = os.path.dirname(os.__file__)
+    parts = []
+    total = 0
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    data = f.read()
+                parts.append(data)
+                total += len(data)
+                if total >= size_mb * 1024 * 1024:
+                    return b''.join(parts)
+    return b''.join(parts)
+
+
+def frames_of(data, frame_size):
+    return [data[i:i + frame_size] for i in range(0, len(data), frame_size)]
+
+
+def run_block(frames, method):
+    start = time.perf_counter()
+    payloads = [CompressionManager.compress_block(frame, method) for frame in frames]
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for payload, used in payloads:
+        CompressionManager.decompress_data(payload, used)
+    return sum(len(p) for p, _ in payloads), compress_time, time.perf_counter() - start
+
+
+def run_stream(frames, method):
+    compressor = StreamCompressor(method)
+    start = time.perf_counter()
+    payloads = [compressor.compress(frame) for frame in frames]
+    payloads.append(compressor.flush())
+    compress_time = time.perf_counter() - start
+    decompressor = StreamDecompressor(method)
+    start = time.perf_counter()
+    for payload in payloads:
+        decompressor.decompress(payload)
+    decompressor.flush()
+    return sum(len(p) for p in payloads), compress_time, time.perf_counter() - start
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    methods = sys.argv[2].split(',') if len(sys.argv) > 2 else ["ZLIB", "GZIP", "LZMA", "BZ2"]
+    data = load_corpus(size_mb)
+    mb = len(data) / (1024 * 1024)
+    print(f"📚 {mb:.1f} MB of standard library sources")
+    print(f"{'method':<6} {'frame':>6} {'mode':<7} {'size MB':>8} {'ratio':>6} {'comp MB/s':>10} {'decomp MB/s':>12}")
+    for name in methods:
+        method = CompressionMethod[name]
+        for frame_size in FRAME_SIZES:
+            frames = frames_of(data, frame_size)
+            for mode, run in (("block", run_block), ("stream", run_stream)):
+                size, compress_time, decompress_time = run(frames, method)
+                print(f"{name:<6} {frame_size // 1024:>5}K {mode:<7} {size / (1024 * 1024):8.2f}"
+                      f" {len(data) / size:6.2f} {mb / compress_time:10.1f} {mb / decompress_time:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
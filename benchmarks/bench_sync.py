@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Sync bookkeeping cost on a large tree of small files: first scan, rescan of an
+unchanged tree, and diffing against a peer manifest, with peak Python memory.
+Memory should stay flat as the file count grows.
+
+Usage: python benchmarks/bench_sync.py [files]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transfer.sync import SyncState, bump_version
+
+
+def make_tree(folder, files):
+    past = time.time() - 3600
+    for number in range(files):
+        directory = os.path.join(folder, f"d{number // 1000:04d}")
+        if number % 1000 == 0:
+            os.makedirs(directory)
+        path = os.path.join(directory, f"f{number:07d}.txt")
+        with open(path, 'wb') as f:
+            f.write(str(number).encode())
+        os.utime(path, (past, past))
+
+
+def peer_manifest(state, edit_every):
+    """The same tree as seen by a peer that edited every nth file"""
+    for number, entry in enumerate(state.manifest()):
+        if number % edit_every == 0:
+            entry[4] = 'edited'
+            entry[5] = bump_version(entry[5], 'peer')
+        yield entry
+
+
+def measure(label, work):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = work()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<16} {elapsed:8.2f}s  peak {peak / (1024 * 1024):6.1f} MB  {result}")
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as folder:
+        tree = os.path.join(folder, 'tree')
+        make_tree(tree, files)
+        state = SyncState(tree, os.path.join(folder, 'state'))
+        print(f"🗂️  {files} files")
+        measure("first scan", state.scan)
+        measure("rescan", state.scan)
+        measure("plan vs peer", lambda: state.plan(peer_manifest(state, 100), 'peer'))
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
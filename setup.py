@@ -13,6 +13,9 @@ setup(
         "PyQt6>=6.4.0",
         "cryptography>=3.4.0",
     ],
+    extras_require={
+        "dedup": ["fastcdc>=1.7"],
+    },
     # Remove entry_points completely
     classifiers=[
         "Development Status :: 4 - Beta",
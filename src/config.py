@@ -13,7 +13,41 @@ class TransferConfig:
             "notifications": True,
             "request_timeout": 120,
             "always_ask_for_large_files": True,
-            "large_file_threshold": 104857600  # 100MB
+            "large_file_threshold": 104857600,  # 100MB
+            "decryption_password": None,  # Used to open encrypted transfers
+            "chunk_size_min": 262144,  # 256KB, adaptive frame size lower bound
+            "chunk_size_max": 8388608,  # 8MB, adaptive frame size upper bound
+            "bandwidth_limit": 0,  # Bytes per second, 0 = unlimited
+            "hash_algorithm": "blake2b",  # Integrity hash advertised to receivers
+            "parallel_streams": 1,  # TLS connections per large file, 1 = no striping
+            "parallel_min_size": 268435456,  # 256MB, smaller files use one connection
+            "resumable_transfers": True,  # Keep .part files and resume interrupted sends
+            "transfer_retries": 3,  # Automatic resume attempts after a dropped connection
+            "folder_archive": "manifest",  # "manifest" (bulk small files) or "tar"
+            "decode_workers": 4,  # Threads decrypting/decompressing received frames
+            "compression_workers": 0,  # Threads compressing outgoing blocks, 0 = one per core
+            "compression_block_size": 4194304,  # 4MB blocks for compressed sends (1MB-8MB)
+            "compression_mode": "auto",  # "stream" (one compressor per transfer), "block" or "auto"
+            "dedup_transfers": False,  # Send only chunks the receiver has not stored from earlier transfers
+            "dedup_min_size": 67108864,  # 64MB, smaller files are sent whole
+            "chunk_store_limit": 8589934592,  # 8GB of received chunks kept for deduplication
+            "delta_transfers": True,  # Send only the differences when the receiver has an older copy
+            "delta_min_size": 1048576,  # 1MB, smaller files are sent whole
+            "file_index": True,  # Reuse hashes, chunk lists and signatures of unchanged files
+            "sync_folders": {},  # Folder name -> local path that peers may two-way sync with
+            "watch_backend": "auto",  # "inotify", "watchdog", "polling" or "auto" (first one available)
+            "watch_debounce": 0.1,  # Seconds without new changes before a watched folder is synced
+            "watch_poll_interval": 1.0,  # Seconds between scans when only polling is available
+            "receiver_mode": "asyncio",  # "asyncio" (one event loop, bounded workers) or "threads" (one per connection)
+            "receiver_workers": 16,  # Threads running accepted transfers (disk writes) in asyncio mode
+            "max_connections_per_peer": 8,  # Concurrent requests per sender; the rest wait their turn
+            "max_active_transfers": 4,  # Incoming transfers written at once; the rest are queued
+            "transfer_queue_size": 32,  # Queued transfers before senders are told to retry later
+            "transfer_queue_timeout": 60,  # Seconds a queued transfer waits before the sender is told to retry
+            "busy_wait_limit": 600,  # Seconds a sender keeps retrying a busy receiver
+            "keepalive_timeout": 30,  # Seconds an idle connection stays open for the next send, 0 = one send each
+            "multiplex": True,  # Interleave concurrent requests to a peer as streams of one connection
+            "mux_window": 16777216  # 16MB, payload a stream may have in flight before its reader catches up
         }
         self.config = self._load_config()
         self._ensure_config_dir()
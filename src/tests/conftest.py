@@ -0,0 +1,109 @@
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from config import TransferConfig  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_config(**settings) -> TransferConfig:
+    """Transfer settings for a loopback peer; receivers accept without prompting"""
+    config = TransferConfig()
+    config.config.update({'auto_accept': True, 'request_timeout': 20})
+    config.config.update(settings)
+    return config
+
+
+def write_file(path, data: bytes):
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def read_file(path) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def tree_contents(root) -> dict:
+    """Relative path -> bytes (or None for directories) of everything under root"""
+    contents = {}
+    for parent, dirs, files in os.walk(root):
+        for name in dirs:
+            contents[os.path.relpath(os.path.join(parent, name), root)] = None
+        for name in files:
+            path = os.path.join(parent, name)
+            contents[os.path.relpath(path, root)] = read_file(path)
+    return contents
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    """Keep ~/.filesync (config, file index, chunk store, sync state) inside the test's temp dir"""
+    home_dir = tmp_path / 'home'
+    home_dir.mkdir()
+    monkeypatch.setenv('HOME', str(home_dir))
+    return home_dir
+
+
+@pytest.fixture(scope='session')
+def cert_dir(tmp_path_factory):
+    from utils.crypto import CryptoManager
+    path = str(tmp_path_factory.mktemp('certs'))
+    CryptoManager.generate_ssl_certificates('FileSyncTest', path)
+    return path
+
+
+class Peers:
+    """A receiver on a loopback port and a sender pointed at it"""
+
+    def __init__(self, cert_dir: str, download_dir: str, receiver_settings: dict, sender_settings: dict):
+        from transfer.file_receiver import FileReceiver
+        from transfer.file_sender import FileSender
+
+        self.download_dir = download_dir
+        self.receiver = FileReceiver(free_port(), cert_dir, make_config(**receiver_settings))
+        self.receiver.encryption_password = PASSWORD
+        self.receiver.start_receiver(download_dir)
+        time.sleep(0.2)
+        self.sender = FileSender(self.receiver.port, cert_dir, make_config(**sender_settings))
+        self.sender.current_user = 'tester'
+
+    def received(self, *parts) -> str:
+        return os.path.join(self.download_dir, *parts)
+
+    def close(self):
+        self.sender.pool.close()
+        self.receiver.stop_receiver()
+
+
+@pytest.fixture
+def peers(tmp_path, cert_dir):
+    """Factory for connected peers: peers(**settings) or peers(receiver={...}, sender={...})"""
+    started = []
+
+    def start(receiver=None, sender=None, **settings):
+        download_dir = tmp_path / 'downloads'
+        download_dir.mkdir(exist_ok=True)
+        pair = Peers(cert_dir, str(download_dir), {**settings, **(receiver or {})}, {**settings, **(sender or {})})
+        started.append(pair)
+        return pair
+
+    yield start
+    for pair in started:
+        pair.close()
@@ -0,0 +1,126 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from transfer.archive import (
+    FrameInputStream, FrameOutputStream, _check_member, extract_tar_stream, folder_size, unique_path, write_folder_tar
+)
+from transfer.framing import AdaptiveChunkSizer, FrameWriter
+from utils.compression import CompressionMethod
+from utils.hashing import HashManager
+
+from .conftest import PASSWORD, tree_contents, write_file
+from .test_framing import RecordingSocket, parse_frames
+
+
+def make_folder(root) -> str:
+    folder = os.path.join(str(root), 'project')
+    write_file(os.path.join(folder, 'readme.txt'), b'hello\n')
+    write_file(os.path.join(folder, 'src', 'main.py'), b'print("hi")\n' * 1000)
+    write_file(os.path.join(folder, 'data', 'blob.bin'), os.urandom(3 * 1024 * 1024))
+    os.makedirs(os.path.join(folder, 'empty'))
+    return folder
+
+
+def tar_bytes(*members) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for member in members:
+            tar.addfile(member, io.BytesIO(b'x' * member.size) if member.isfile() else None)
+    return buffer.getvalue()
+
+
+def test_tar_written_as_frames_extracts_to_the_same_tree(tmp_path):
+    folder = make_folder(tmp_path / 'src')
+    sock = RecordingSocket()
+    sent_hash, received_hash = HashManager.new('blake2b'), HashManager.new('blake2b')
+    output = FrameOutputStream(FrameWriter(sock), AdaptiveChunkSizer(64 * 1024, 64 * 1024),
+                               lambda chunk: (chunk, 0), sent_hash)
+    write_folder_tar(folder, output)
+
+    frames = parse_frames(bytes(sock.data))
+    payloads = [payload for _, _, payload in frames[:-1]]
+    assert len(payloads) > 1
+    extract_tar_stream(FrameInputStream(payloads, received_hash), str(tmp_path / 'dest'))
+    assert tree_contents(tmp_path / 'dest') == tree_contents(folder)
+    assert received_hash.hexdigest() == sent_hash.hexdigest()
+    assert output.total_sent == sum(len(payload) for payload in payloads)
+
+
+def test_one_large_write_still_goes_out_one_chunk_per_frame():
+    sock = RecordingSocket()
+    output = FrameOutputStream(FrameWriter(sock), AdaptiveChunkSizer(64 * 1024, 64 * 1024),
+                               lambda chunk: (chunk, 0), None)
+    data = os.urandom(1000 * 1000)
+    output.write(b'head')
+    output.write(data)
+    output.flush()
+    payloads = [payload for _, _, payload in parse_frames(bytes(sock.data))]
+    assert max(map(len, payloads)) == 64 * 1024
+    assert b''.join(payloads) == b'head' + data
+
+
+def test_input_stream_reads_across_frames_and_skips_empty_ones():
+    stream = FrameInputStream([b'abc', b'', b'defg', b'', b'h'], None)
+    assert stream.read_exactly(5) == b'abcde'
+    assert stream.read(10) == b'fg'
+    assert stream.read() == b'h'
+    assert stream.read() == b''
+    assert stream.total_received == 8
+
+
+def test_input_stream_raises_when_the_data_ends_early():
+    with pytest.raises(ValueError):
+        FrameInputStream([b'abc'], None).read_exactly(4)
+
+
+@pytest.mark.parametrize('name', ['../escape.txt', '/etc/escape.txt'])
+def test_members_outside_the_destination_are_refused(tmp_path, name):
+    member = tarfile.TarInfo(name)
+    with pytest.raises(ValueError):
+        _check_member(member, str(tmp_path))
+
+
+def test_extraction_stops_at_a_member_outside_the_destination(tmp_path):
+    member = tarfile.TarInfo('../escape.txt')
+    member.size = 3
+    with pytest.raises((ValueError, tarfile.TarError)):
+        extract_tar_stream(FrameInputStream([tar_bytes(member)], None), str(tmp_path / 'dest'))
+    assert not os.path.exists(tmp_path / 'escape.txt')
+
+
+def test_links_and_devices_are_checked(tmp_path):
+    link = tarfile.TarInfo('link')
+    link.type, link.linkname = tarfile.SYMTYPE, '../../outside'
+    device = tarfile.TarInfo('device')
+    device.type = tarfile.CHRTYPE
+    inside = tarfile.TarInfo('inside')
+    inside.type, inside.linkname = tarfile.SYMTYPE, 'readme.txt'
+    dest = str(tmp_path)
+
+    for member in (link, device):
+        with pytest.raises(ValueError):
+            _check_member(member, dest)
+    assert _check_member(inside, dest) is inside
+
+
+def test_unique_path_and_folder_size(tmp_path):
+    folder = make_folder(tmp_path)
+    assert unique_path(str(tmp_path / 'other')) == str(tmp_path / 'other')
+    assert unique_path(folder) == folder + ' (1)'
+    os.makedirs(folder + ' (1)')
+    assert unique_path(folder) == folder + ' (2)'
+    assert folder_size(folder) == 6 + 12000 + 3 * 1024 * 1024
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_folder_round_trip_in_tar_mode(peers, tmp_path, password):
+    pair = peers(folder_archive='tar')
+    folder = make_folder(tmp_path / 'src')
+
+    for copy in ['project', 'project (1)']:
+        success, message = pair.sender.send_folder(folder, '127.0.0.1', None, password, CompressionMethod.ZLIB)
+        assert success, message
+        assert tree_contents(pair.received(copy)) == tree_contents(folder)
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import socket
+import ssl
+import threading
+import time
+
+import pytest
+
+from transfer.async_receiver import STOP_CHECK_SECONDS, AsyncSocket
+from transfer.file_sender import FileSender
+from utils.compression import CompressionMethod
+
+from .conftest import PASSWORD, make_config, read_file, tree_contents, write_file
+
+RECEIVER_MODES = ['asyncio', 'threads']
+
+
+def open_tls(port: int) -> ssl.SSLSocket:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context.wrap_socket(socket.create_connection(('127.0.0.1', port), timeout=10))
+
+
+@pytest.fixture
+def loop_socket():
+    """An AsyncSocket over a stream fed by the test, with its loop running in a thread"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    reader = asyncio.run_coroutine_threadsafe(_new_reader(), loop).result()
+    yield AsyncSocket(loop, reader, None, threading.Event()), lambda data: loop.call_soon_threadsafe(
+        reader.feed_data, data
+    )
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+async def _new_reader() -> asyncio.StreamReader:
+    return asyncio.StreamReader()
+
+
+def test_blocking_reads_outlast_the_stop_check(loop_socket):
+    ssock, feed = loop_socket
+    delay = STOP_CHECK_SECONDS * 1.5
+    timer = threading.Timer(delay, feed, args=(b'late request<END>rest',))
+    timer.start()
+    started = time.monotonic()
+    assert ssock.recv_until(b'<END>', 1024) == b'late request'
+    assert time.monotonic() - started >= delay - 0.1
+    assert ssock.recv(100) == b'rest'
+
+    ssock.settimeout(STOP_CHECK_SECONDS * 1.2)
+    with pytest.raises(socket.timeout):
+        ssock.recv(100)
+
+
+@pytest.mark.parametrize('mode', RECEIVER_MODES)
+def test_files_folders_and_stripes_in_both_receiver_modes(peers, tmp_path, mode):
+    pair = peers(receiver_mode=mode, parallel_streams=3, parallel_min_size=2 * 1024 * 1024)
+    small = os.urandom(100000)
+    large = os.urandom(5 * 1024 * 1024)
+    sources = [write_file(tmp_path / 'src' / 'small.bin', small), write_file(tmp_path / 'src' / 'large.bin', large)]
+    folder = tmp_path / 'folder'
+    write_file(folder / 'a' / 'one.txt', b'one')
+    write_file(folder / 'two.txt', b'two' * 1000)
+
+    for source in sources:
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, PASSWORD, CompressionMethod.ZLIB)
+        assert success, message
+    success, message = pair.sender.send_folder(str(folder), '127.0.0.1', None, None, CompressionMethod.ZLIB)
+    assert success, message
+    assert read_file(pair.received('small.bin')) == small
+    assert read_file(pair.received('large.bin')) == large
+    assert tree_contents(pair.received('folder')) == tree_contents(folder)
+
+
+def test_many_concurrent_senders_are_all_served(peers, tmp_path, cert_dir):
+    pair = peers(receiver={'receiver_workers': 4, 'max_connections_per_peer': 2})
+    results = []
+
+    def send(number):
+        sender = FileSender(pair.receiver.port, cert_dir, make_config())
+        sender.current_user = f'sender{number}'
+        source = write_file(tmp_path / 'src' / f'file{number}.bin', bytes([number]) * 300000)
+        try:
+            results.append(sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE))
+        finally:
+            sender.pool.close()
+
+    threads = [threading.Thread(target=send, args=(number,)) for number in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert [success for success, _ in results] == [True] * 12
+    for number in range(12):
+        assert read_file(pair.received(f'file{number}.bin')) == bytes([number]) * 300000
+    assert pair.receiver.async_server.stats()['connections'] >= 12
+    deadline = time.monotonic() + 10
+    while pair.receiver.async_server.stats()['active'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pair.receiver.async_server.stats()['active'] == 0
+
+
+def test_silent_connections_do_not_hold_up_other_peers(peers, tmp_path):
+    pair = peers(receiver={'receiver_workers': 2})
+    silent = [open_tls(pair.receiver.port) for _ in range(8)]
+    try:
+        source = write_file(tmp_path / 'src' / 'file.bin', os.urandom(50000))
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+        assert success, message
+        assert pair.receiver.async_server.stats()['open'] >= 8
+    finally:
+        for sock in silent:
+            sock.close()
+
+
+def test_oversized_request_is_refused(peers):
+    pair = peers()
+    with open_tls(pair.receiver.port) as sock:
+        try:
+            sock.sendall(b'x' * (1024 * 1024))
+        except OSError:
+            pass
+        reply = b''
+        try:
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                reply += data
+        except OSError:
+            pass
+    assert reply.startswith(b'ERROR: Request too large')
+
+
+def test_stop_closes_idle_connections_promptly(peers):
+    pair = peers()
+    sock = open_tls(pair.receiver.port)
+    try:
+        started = time.monotonic()
+        pair.receiver.stop_receiver()
+        assert time.monotonic() - started < 5
+        sock.settimeout(5)
+        assert sock.recv(1) == b''
+    except (ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        sock.close()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import zlib
+
+import pytest
+
+from transfer.archive import FrameInputStream, FrameOutputStream
+from transfer.bulk import (ENTRY_DIR, ENTRY_FILE, ENTRY_LINK, LARGE_FILE_SIZE, build_manifest, inflate_manifest,
+                           read_manifest, receive_bulk, write_bulk_bodies, write_manifest)
+from transfer.framing import FRAME_MANIFEST, FRAME_SYNC_MANIFEST, AdaptiveChunkSizer, FrameWriter
+from transfer.sync import read_sync_manifest
+from utils.compression import CompressionMethod
+from utils.crypto import CryptoManager
+
+from .conftest import PASSWORD, tree_contents, write_file
+from .test_framing import RecordingSocket, parse_frames
+
+
+class FrameRecorder:
+    """Stands in for the FrameWriter and FrameReader of a connection"""
+
+    def __init__(self, frames=None):
+        self.frames = list(frames or [])
+
+    def write_frame(self, payload, frame_type: int = 0, flags: int = 0):
+        self.frames.append((frame_type, flags, bytes(payload)))
+
+    def read_frame(self) -> tuple:
+        return self.frames.pop(0)
+
+
+def make_tree(root) -> str:
+    folder = os.path.join(str(root), 'tree')
+    write_file(os.path.join(folder, 'a', 'one.txt'), b'one')
+    write_file(os.path.join(folder, 'a', 'b', 'two.txt'), b'two' * 1000)
+    write_file(os.path.join(folder, 'empty.txt'), b'')
+    os.makedirs(os.path.join(folder, 'c', 'd'))
+    os.symlink('a/one.txt', os.path.join(folder, 'link'))
+    return folder
+
+
+def test_manifest_lists_directories_before_their_contents(tmp_path):
+    entries = build_manifest(make_tree(tmp_path))
+    paths = [entry[0] for entry in entries]
+    assert paths.index('a') < paths.index('a/b') < paths.index('a/b/two.txt')
+    kinds = {entry[0]: entry[1] for entry in entries}
+    assert kinds['c/d'] == ENTRY_DIR and kinds['empty.txt'] == ENTRY_FILE and kinds['link'] == ENTRY_LINK
+    assert next(entry for entry in entries if entry[0] == 'link')[5] == 'a/one.txt'
+
+
+@pytest.mark.parametrize('packed', [False, True])
+@pytest.mark.parametrize('encrypted', [False, True])
+def test_manifest_round_trip(tmp_path, packed, encrypted):
+    entries = build_manifest(make_tree(tmp_path))
+    send_cipher = receive_cipher = None
+    if encrypted:
+        send_cipher, salt = CryptoManager.create_stream_cipher(PASSWORD)
+        receive_cipher, _ = CryptoManager.create_stream_cipher(PASSWORD, salt)
+    recorder = FrameRecorder()
+    sent_hash, received_hash = hashlib.blake2b(), hashlib.blake2b()
+
+    write_manifest(recorder, entries, send_cipher, sent_hash, packed)
+    assert read_manifest(recorder, receive_cipher, received_hash) == entries
+    assert sent_hash.digest() == received_hash.digest()
+
+
+def test_manifest_that_inflates_past_the_limit_is_refused():
+    payload = zlib.compress(b'[' + b' ' * 10 * 1024 * 1024 + b']')
+    assert len(inflate_manifest(payload)) > 10 * 1024 * 1024
+    with pytest.raises(ValueError, match='inflates past'):
+        inflate_manifest(payload, 1024 * 1024)
+
+
+def test_truncated_manifest_frame_is_refused():
+    payload = zlib.compress(b'[["a","d",0,493,0,null]]')
+    with pytest.raises(ValueError):
+        read_manifest(FrameRecorder([(FRAME_MANIFEST, 0, payload[:-4])]), None, hashlib.blake2b())
+    with pytest.raises(ValueError):
+        read_manifest(FrameRecorder([(0, 0, payload)]), None, hashlib.blake2b())
+    with pytest.raises(ValueError):
+        list(read_sync_manifest(FrameRecorder([(FRAME_SYNC_MANIFEST, 0, payload[:-4])])))
+
+
+def pack_bodies(folder: str, entries: list) -> list:
+    sock = RecordingSocket()
+    output = FrameOutputStream(FrameWriter(sock), AdaptiveChunkSizer(256 * 1024, 256 * 1024),
+                               lambda chunk: (chunk, 0), None)
+    write_bulk_bodies(folder, entries, output)
+    return [payload for _, _, payload in parse_frames(bytes(sock.data))[:-1]]
+
+
+def test_packed_bodies_recreate_the_tree_with_modes_and_times(tmp_path):
+    folder = make_tree(tmp_path / 'src')
+    write_file(os.path.join(folder, 'large.bin'), os.urandom(LARGE_FILE_SIZE + 1000))
+    os.chmod(os.path.join(folder, 'a', 'one.txt'), 0o640)
+    os.utime(os.path.join(folder, 'a'), ns=(10 ** 18, 10 ** 18))
+    entries = build_manifest(folder)
+    dest = str(tmp_path / 'dest')
+
+    files = receive_bulk(FrameInputStream(pack_bodies(folder, entries), None), entries, dest, workers=2)
+    assert files == 4
+    assert tree_contents(dest) == tree_contents(folder)
+    assert os.stat(os.path.join(dest, 'a', 'one.txt')).st_mode & 0o777 == 0o640
+    assert os.stat(os.path.join(dest, 'a')).st_mtime_ns == 10 ** 18
+
+
+@pytest.mark.parametrize('path', ['../escape.txt', '/etc/escape.txt', 'a/./b', 'a//b', ''])
+def test_manifest_paths_outside_the_folder_are_refused(tmp_path, path):
+    entries = [(path, ENTRY_FILE, 1, 0o644, 0, None)]
+    with pytest.raises(ValueError, match='Unsafe path'):
+        receive_bulk(FrameInputStream([b'x'], None), entries, str(tmp_path / 'dest'))
+    assert not os.path.exists(tmp_path / 'escape.txt')
+
+
+def test_manifest_links_outside_the_folder_are_refused(tmp_path):
+    entries = [('link', ENTRY_LINK, 0, 0o777, 0, '../../etc/passwd')]
+    with pytest.raises(ValueError, match='Unsafe link'):
+        receive_bulk(FrameInputStream([], None), entries, str(tmp_path / 'dest'))
+    assert not os.path.lexists(tmp_path / 'dest' / 'link')
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_folder_round_trip_in_manifest_mode(peers, tmp_path, password):
+    pair = peers(folder_archive='manifest')
+    folder = make_tree(tmp_path / 'src')
+    for number in range(300):
+        write_file(os.path.join(folder, 'many', f'{number:03d}.txt'), str(number).encode() * number)
+    write_file(os.path.join(folder, 'large.bin'), os.urandom(6 * 1024 * 1024))
+
+    success, message = pair.sender.send_folder(folder, '127.0.0.1', None, password, CompressionMethod.ZLIB)
+    assert success, message
+    assert tree_contents(pair.received('tree')) == tree_contents(folder)
+    assert os.readlink(pair.received('tree', 'link')) == 'a/one.txt'
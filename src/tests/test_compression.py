@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from utils.compression import AdaptiveCompressor, CompressionManager, CompressionMethod
+
+from .conftest import PASSWORD, read_file, write_file
+
+
+def test_incompressible_blocks_are_stored_as_they_are():
+    data = os.urandom(1024 * 1024)
+    payload, method = AdaptiveCompressor().compress(data)
+    assert method == CompressionMethod.NONE
+    assert payload is data
+
+
+def test_compressible_blocks_shrink_and_decode():
+    data = b'timestamp=1 level=info message="request served"\n' * 20000
+    payload, method = AdaptiveCompressor().compress(data)
+    assert method != CompressionMethod.NONE and len(payload) < len(data) // 10
+    assert CompressionManager.decompress_data(payload, method) == data
+
+
+def test_probe_samples_the_whole_block():
+    compressor = AdaptiveCompressor()
+    assert compressor.probe(b'') == 1.0
+    assert compressor.probe(bytes(1024 * 1024)) < 0.05
+    mostly_random = os.urandom(1024 * 1024) + bytes(64 * 1024)
+    assert 0.5 < compressor.probe(mostly_random) < AdaptiveCompressor.INCOMPRESSIBLE_RATIO
+
+
+def test_level_follows_the_link_speed():
+    compressor = AdaptiveCompressor(workers=4)
+    assert compressor.choose_level(0.3) == 0
+    compressor.observe_link(1024, 0)
+    assert compressor.link_rate is None
+
+    compressor.observe_link(100 * 1024, 1.0)
+    slow_link = compressor.choose_level(0.3)
+    assert compressor.LEVELS[slow_link][0] == CompressionMethod.LZMA
+
+    compressor.link_rate = 10 * 1024 ** 3
+    assert compressor.choose_level(0.3) == 0
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_adaptive_transfer_of_mixed_content(peers, tmp_path, password):
+    pair = peers(compression_block_size=1024 * 1024)
+    data = os.urandom(3 * 1024 * 1024) + b'log line\n' * 400000 + os.urandom(100)
+    source = write_file(tmp_path / 'src' / 'mixed.bin', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, password, CompressionMethod.ADAPTIVE)
+    assert success, message
+    assert read_file(pair.received('mixed.bin')) == data
+
+
+AVAILABLE_METHODS = [method for method in CompressionMethod if CompressionManager.is_available(method)]
+
+
+@pytest.mark.parametrize('method', AVAILABLE_METHODS, ids=lambda method: method.name)
+def test_block_round_trip(method):
+    data = b'abc' * 100000 + os.urandom(1000)
+    if method == CompressionMethod.ADAPTIVE:
+        payload, method = AdaptiveCompressor().compress(data)
+    else:
+        payload, method = CompressionManager.compress_block(data, method)
+    assert CompressionManager.decompress_data(payload, method) == data
+
+
+def test_offer_puts_the_requested_codec_first_and_adaptive_last(monkeypatch):
+    monkeypatch.setattr(CompressionManager, 'is_available', staticmethod(lambda method: True))
+    assert CompressionManager.compression_offer(CompressionMethod.LZ4) == [
+        CompressionMethod.LZ4, CompressionMethod.ZSTD, CompressionMethod.ADAPTIVE
+    ]
+
+
+def test_receiver_picks_the_first_codec_it_has(monkeypatch):
+    monkeypatch.setattr(CompressionManager, 'is_available',
+                        staticmethod(lambda method: method != CompressionMethod.ZSTD))
+    offer = [99, CompressionMethod.ZSTD.value, CompressionMethod.LZ4.value, CompressionMethod.ADAPTIVE.value]
+    assert CompressionManager.choose_method(offer) == CompressionMethod.LZ4
+    assert CompressionManager.choose_method([99, CompressionMethod.ZSTD.value]) == CompressionMethod.ADAPTIVE
+    with pytest.raises(ValueError, match='not installed'):
+        CompressionManager.compress_data(b'data', CompressionMethod.ZSTD)
+
+
+@pytest.mark.parametrize('mode', ['block', 'stream'])
+@pytest.mark.parametrize('password', [None, PASSWORD], ids=['plain', 'encrypted'])
+@pytest.mark.parametrize('method', list(CompressionMethod), ids=lambda method: method.name)
+def test_transfer_round_trip_for_every_codec(peers, tmp_path, method, password, mode):
+    if not CompressionManager.is_available(method):
+        pytest.skip(f"{method.name} is not installed")
+    pair = peers(compression_mode=mode, compression_block_size=1024 * 1024)
+    data = b'row,value,label\n' * 100000 + os.urandom(512 * 1024)
+    source = write_file(tmp_path / 'src' / 'data.csv', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, password, method)
+    assert success, message
+    assert read_file(pair.received('data.csv')) == data
+
+
+def test_optional_codec_falls_back_when_the_receiver_lacks_it(peers, tmp_path, monkeypatch):
+    pair = peers()
+    chosen = []
+    choose_method = CompressionManager.choose_method
+
+    def receiver_without_optional_codecs(offered):
+        offered = [value for value in offered if CompressionMethod(value) not in CompressionManager.OPTIONAL_METHODS]
+        chosen.append(choose_method(offered))
+        return chosen[-1]
+
+    monkeypatch.setattr(CompressionManager, 'choose_method', staticmethod(receiver_without_optional_codecs))
+    data = b'fallback ' * 200000
+    source = write_file(tmp_path / 'src' / 'data.txt', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, PASSWORD, CompressionMethod.ZSTD)
+    assert success, message
+    assert chosen == [CompressionMethod.ADAPTIVE]
+    assert read_file(pair.received('data.txt')) == data
@@ -0,0 +1,81 @@
+import os
+import time
+
+import pytest
+
+from transfer.connection_pool import ConnectionPool
+from utils.compression import CompressionMethod
+
+from .conftest import read_file, write_file
+
+
+class FakeSocket:
+    session = None
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def send_files(pair, tmp_path, count: int = 5):
+    for number in range(count):
+        data = os.urandom(20000)
+        source = write_file(tmp_path / 'src' / f'file{number}.bin', data)
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+        assert success, message
+        assert read_file(pair.received(f'file{number}.bin')) == data
+
+
+@pytest.mark.parametrize('mode', ['asyncio', 'threads'])
+def test_repeated_sends_reuse_one_kept_alive_connection(peers, tmp_path, mode):
+    pair = peers(receiver_mode=mode, multiplex=False)
+    send_files(pair, tmp_path)
+    stats = pair.sender.pool.stats()
+    assert (stats['created'], stats['reused'], stats['idle']) == (1, 4, 1)
+
+
+def test_new_connections_resume_the_tls_session(peers, tmp_path):
+    pair = peers(multiplex=False, keepalive_timeout=0)
+    send_files(pair, tmp_path, 3)
+    stats = pair.sender.pool.stats()
+    assert stats['created'] == 3 and stats['reused'] == 0 and stats['idle'] == 0
+    assert stats['resumed'] >= 1
+
+
+def test_a_connection_the_receiver_closed_is_not_reused(peers, tmp_path):
+    pair = peers(multiplex=False, receiver={'keepalive_timeout': 0.5})
+    send_files(pair, tmp_path, 1)
+    time.sleep(1.5)
+    send_files(pair, tmp_path, 1)
+    assert pair.sender.pool.stats()['created'] == 2
+
+
+def test_a_connection_that_failed_mid_request_is_closed(peers):
+    pair = peers(multiplex=False)
+    with pytest.raises(RuntimeError):
+        with pair.sender.pool.connection('127.0.0.1', pair.receiver.port) as ssock:
+            pair.sender.pool.mark_keep_alive(ssock)
+            pair.sender.pool.mark_reusable(ssock)
+            raise RuntimeError("request failed")
+    assert pair.sender.pool.stats()['idle'] == 0
+    assert ssock.fileno() == -1
+
+
+def test_idle_connections_per_peer_are_capped():
+    pool = ConnectionPool(max_idle_per_peer=2, multiplex=False)
+    sockets = [FakeSocket() for _ in range(4)]
+    for ssock in sockets:
+        pool.mark_keep_alive(ssock)
+        pool.mark_reusable(ssock)
+        pool.release('10.0.0.2', 9000, ssock)
+    assert [ssock.closed for ssock in sockets] == [True, True, False, False]
+    assert pool.stats()['idle'] == 2
+
+    unfinished = FakeSocket()
+    pool.mark_keep_alive(unfinished)
+    pool.release('10.0.0.2', 9000, unfinished)
+    assert unfinished.closed
+    pool.close()
+    assert all(ssock.closed for ssock in sockets) and pool.stats()['idle'] == 0
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from utils.compression import CompressionMethod
+from utils.crypto import CryptoManager, StreamCipher
+
+from .conftest import PASSWORD, read_file, write_file
+
+
+def test_stream_cipher_round_trip_in_order():
+    sender, salt = CryptoManager.create_stream_cipher(PASSWORD)
+    receiver, _ = CryptoManager.create_stream_cipher(PASSWORD, salt)
+    chunks = [os.urandom(size) for size in (0, 1, 65536, 100000)]
+    sealed = [sender.seal(chunk) for chunk in chunks]
+    assert [receiver.open(chunk) for chunk in sealed] == chunks
+    assert all(len(s) == len(c) + StreamCipher.TAG_SIZE for s, c in zip(sealed, chunks))
+
+
+def test_stream_cipher_reserved_sequences_open_out_of_order():
+    key, _ = CryptoManager.derive_raw_key(PASSWORD)
+    sender, receiver = StreamCipher(key), StreamCipher(key)
+    sequences = [sender.reserve() for _ in range(3)]
+    sealed = {sequence: sender.seal(bytes([sequence]) * 10, sequence) for sequence in reversed(sequences)}
+    assert receiver.open(sealed[2], 2) == b'\x02' * 10
+    assert receiver.open(sealed[0], 0) == b'\x00' * 10
+
+
+def test_stream_cipher_rejects_tampering_and_reordering():
+    key, _ = CryptoManager.derive_raw_key(PASSWORD)
+    sender = StreamCipher(key)
+    first, second = sender.seal(b'first'), sender.seal(b'second')
+    with pytest.raises(InvalidTag):
+        StreamCipher(key).open(second)
+    tampered = bytearray(first)
+    tampered[0] ^= 1
+    with pytest.raises(InvalidTag):
+        StreamCipher(key).open(bytes(tampered))
+    with pytest.raises(InvalidTag):
+        StreamCipher(CryptoManager.derive_raw_key('wrong')[0]).open(first)
+
+
+def test_stream_cipher_nonce_prefix_must_be_four_bytes():
+    with pytest.raises(ValueError):
+        StreamCipher(os.urandom(32), b'\x00' * 3)
+
+
+def test_encrypted_transfer_derives_the_key_once_per_side(peers, tmp_path, monkeypatch):
+    pair = peers(compression_mode='block')
+    derive = CryptoManager.derive_raw_key
+    calls = []
+
+    def counting_derive(password, salt=None):
+        calls.append(password)
+        return derive(password, salt)
+
+    monkeypatch.setattr(CryptoManager, 'derive_raw_key', staticmethod(counting_derive))
+    data = os.urandom(3 * 1024 * 1024)
+    source = write_file(tmp_path / 'src' / 'secret.bin', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, PASSWORD, CompressionMethod.NONE)
+    assert success, message
+    assert read_file(pair.received('secret.bin')) == data
+    assert calls == [PASSWORD, PASSWORD]
+
+
+def test_encrypted_transfer_with_wrong_password_fails(peers, tmp_path):
+    pair = peers()
+    source = write_file(tmp_path / 'src' / 'secret.bin', os.urandom(300000))
+    success, _ = pair.sender.send_file(source, '127.0.0.1', None, 'not the password', CompressionMethod.ZLIB)
+    assert not success
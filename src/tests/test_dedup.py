@@ -0,0 +1,156 @@
+import base64
+import io
+import os
+import time
+import zlib
+
+import pytest
+
+from transfer import dedup, streaming
+from transfer.archive import FrameInputStream
+from transfer.dedup import (
+    CHUNK_ENTRY, CHUNK_MAX_SIZE, CHUNK_MIN_SIZE, ChunkStore, _chunk_file, _cut_points, chunk_digest, decode_missing,
+    encode_missing, read_chunk_list, receive_chunks, write_chunk_list
+)
+from transfer.framing import FRAME_CHUNK_LIST
+from utils.compression import CompressionMethod
+from utils.crypto import CryptoManager
+from utils.hashing import HashManager
+
+from .conftest import PASSWORD, read_file, write_file
+from .test_bulk import FrameRecorder
+
+
+def chunk_bytes(tmp_path, data: bytes) -> list:
+    return _chunk_file(write_file(tmp_path / 'chunked.bin', data), 'blake2b')[0]
+
+
+@pytest.mark.parametrize('compiled', [True, False], ids=['fastcdc', 'gear'])
+def test_chunks_cover_the_file_within_the_size_bounds(monkeypatch, compiled):
+    if compiled and dedup._fastcdc is None:
+        pytest.skip("fastcdc is not installed")
+    if not compiled:
+        monkeypatch.setattr(dedup, '_fastcdc', None)
+    data = os.urandom(1024 * 1024 + 123)
+    cuts = list(_cut_points(memoryview(data)))
+    assert cuts[0][0] == 0 and sum(length for _, length in cuts) == len(data)
+    assert all(offset + length == following for (offset, length), (following, _) in zip(cuts, cuts[1:]))
+    assert all(CHUNK_MIN_SIZE <= length <= CHUNK_MAX_SIZE for _, length in cuts[:-1])
+
+
+def test_an_insertion_only_changes_the_chunks_around_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, '_fastcdc', None)
+    data = os.urandom(2 * 1024 * 1024)
+    before = chunk_bytes(tmp_path, data)
+    after = chunk_bytes(tmp_path, data[:1000000] + b'inserted' + data[1000000:])
+    assert len(set(before) - set(after)) <= 2
+
+
+def test_checksum_is_the_whole_file_hash(tmp_path):
+    data = os.urandom(300000)
+    chunks, checksum = _chunk_file(write_file(tmp_path / 'file.bin', data), 'sha256')
+    assert checksum == HashManager.hash_file(str(tmp_path / 'file.bin'), 'sha256')
+    assert _chunk_file(write_file(tmp_path / 'empty.bin', b''), 'sha256')[0] == []
+    assert [digest for digest, _ in chunks][0] == chunk_digest(data[:chunks[0][1]])
+
+
+def test_missing_bitmap_round_trip():
+    missing = [True, False, False, True, True, False, False, False, True]
+    assert decode_missing(encode_missing(missing), len(missing)) == missing
+    with pytest.raises(ValueError):
+        decode_missing(encode_missing(missing), 20)
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_chunk_list_round_trip_over_several_frames(monkeypatch, password):
+    monkeypatch.setattr(dedup, 'CHUNK_LIST_FRAME_ENTRIES', 3)
+    chunks = [(chunk_digest(bytes([number])), 1000 + number) for number in range(10)]
+    send_cipher, salt = CryptoManager.create_stream_cipher(password) if password else (None, None)
+
+    def receive_cipher():
+        return CryptoManager.create_stream_cipher(password, salt)[0] if password else None
+
+    recorder = FrameRecorder()
+    write_chunk_list(recorder, chunks, send_cipher)
+    assert len(recorder.frames) == 4
+    assert read_chunk_list(FrameRecorder(recorder.frames), receive_cipher(), len(chunks)) == chunks
+    with pytest.raises(ValueError):
+        read_chunk_list(FrameRecorder(recorder.frames), receive_cipher(), len(chunks) - 2)
+
+
+def test_chunk_list_frames_that_inflate_past_the_announced_count_are_refused():
+    entries = CHUNK_ENTRY.pack(chunk_digest(b'one'), 1000) * 4
+    bomb = FrameRecorder([(FRAME_CHUNK_LIST, 0, zlib.compress(bytes(64 * 1024 * 1024)))])
+    with pytest.raises(ValueError, match=f'inflates past {CHUNK_ENTRY.size} bytes'):
+        read_chunk_list(bomb, None, 1)
+    with pytest.raises(ValueError, match='truncated'):
+        read_chunk_list(FrameRecorder([(FRAME_CHUNK_LIST, 0, zlib.compress(entries)[:-4])]), None, 4)
+    with pytest.raises(ValueError, match='inside an entry'):
+        read_chunk_list(FrameRecorder([(FRAME_CHUNK_LIST, 0, zlib.compress(entries[:-1]))]), None, 4)
+    with pytest.raises(ValueError, match='inflates past 2 bytes'):
+        decode_missing(base64.b64encode(zlib.compress(bytes(1024 * 1024))).decode(), 9)
+
+
+def test_store_asks_once_for_chunks_that_repeat(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'))
+    kept, repeated, new = chunk_digest(b'kept'), chunk_digest(b'zeros'), chunk_digest(b'new')
+    store.put(kept, b'kept')
+    assert store.missing([(kept, 4), (repeated, 5), (new, 3), (repeated, 5)]) == [False, True, True, False]
+    assert store.get(kept) == b'kept'
+
+
+def test_prune_drops_the_least_recently_used_chunks_past_the_grace_period(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'), limit=2500)
+    digests = [chunk_digest(bytes([number])) for number in range(4)]
+    for age, digest in zip([5000, 4000, 3000, 0], digests):
+        store.put(digest, b'x' * 1000)
+        then = time.time() - age
+        os.utime(store._path(digest), (then, then))
+    store.prune()
+    assert [store.has(digest) for digest in digests] == [False, False, True, True]
+
+
+def test_a_chunk_that_does_not_match_its_hash_is_refused(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'))
+    chunks = [(chunk_digest(b'expected'), 8)]
+    source = FrameInputStream([b'tampered'], None)
+    with pytest.raises(ValueError):
+        receive_chunks(source, chunks, [True], store, io.BytesIO(), HashManager.new('blake2b'))
+    assert not store.has(chunks[0][0])
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_repeat_send_only_carries_the_changed_chunks(peers, tmp_path, monkeypatch, password):
+    pair = peers(dedup_transfers=True, dedup_min_size=0, delta_transfers=False)
+    sent = []
+    write_chunk_bodies = streaming.write_chunk_bodies
+
+    def spy(file_path, chunks, missing, output):
+        sent.append(sum(length for (_, length), needed in zip(chunks, missing) if needed))
+        return write_chunk_bodies(file_path, chunks, missing, output)
+
+    monkeypatch.setattr(streaming, 'write_chunk_bodies', spy)
+    image = os.urandom(4 * 1024 * 1024)
+    edited = image[:2000000] + b'patched' + image[2000000:] + bytes(CHUNK_MAX_SIZE * 4)
+    first = write_file(tmp_path / 'src' / 'image-v1.bin', image)
+    second = write_file(tmp_path / 'src' / 'image-v2.bin', edited)
+
+    for source in (first, second):
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, password, CompressionMethod.ZLIB)
+        assert success, message
+    assert read_file(pair.received('image-v1.bin')) == image
+    assert read_file(pair.received('image-v2.bin')) == edited
+    assert sent[0] == len(image)
+    assert sent[1] < 3 * CHUNK_MAX_SIZE
+
+
+def test_files_are_sent_whole_without_the_compiled_chunker(peers, tmp_path, monkeypatch, capsys):
+    pair = peers(dedup_transfers=True, dedup_min_size=0, delta_transfers=False)
+    monkeypatch.setattr(dedup, '_fastcdc', None)
+    monkeypatch.setattr(streaming, 'write_chunk_bodies', None)
+    data = os.urandom(1024 * 1024)
+    source = write_file(tmp_path / 'src' / 'whole.bin', data)
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+    assert success, message
+    assert read_file(pair.received('whole.bin')) == data
+    assert 'fastcdc is not installed' in capsys.readouterr().out
@@ -0,0 +1,153 @@
+import io
+import os
+import socket
+
+import pytest
+
+from transfer import streaming
+from transfer.archive import FrameInputStream
+from transfer.delta import (
+    COPY_OP, DELTA_MAX_BLOCK, DELTA_MIN_BLOCK, DELTA_SKIP_BLOCKS, OP_COPY, OP_END, apply_delta, compute_signatures, delta_block_size,
+    read_signatures, write_delta, write_signatures
+)
+from transfer.file_receiver import FileReceiver
+from transfer.protocols import DELTA_END, TransferProtocol
+from utils.compression import CompressionMethod
+from utils.hashing import HashManager
+
+from .conftest import PASSWORD, make_config, read_file, write_file
+from .test_bulk import FrameRecorder
+
+
+class DeltaOutput:
+    """Collects what write_delta emits instead of framing it"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        pass
+
+
+def round_trip(tmp_path, old: bytes, new: bytes, block_size: int = 4096) -> tuple:
+    """Encode new against old, apply it to old; returns (rebuilt bytes, bytes copied, delta size)"""
+    basis = write_file(tmp_path / 'old.bin', old)
+    signatures = compute_signatures(basis, block_size)
+    output = DeltaOutput()
+    sent_hash, rebuilt_hash = HashManager.new('blake2b'), HashManager.new('blake2b')
+    copied = write_delta(write_file(tmp_path / 'new.bin', new), signatures, block_size, output, sent_hash)
+    rebuilt = io.BytesIO()
+    assert apply_delta(FrameInputStream([bytes(output.data)], None), basis, block_size, len(signatures),
+                       rebuilt, rebuilt_hash) == copied
+    assert rebuilt_hash.hexdigest() == sent_hash.hexdigest()
+    return rebuilt.getvalue(), copied, len(output.data)
+
+
+@pytest.fixture
+def offer(tmp_path):
+    """Call _offer_delta for a save path and return the block size the receiver offered (0 = no delta)"""
+    receiver = FileReceiver(0, str(tmp_path / 'certs'), make_config())
+    receiver.download_dir = str(tmp_path / 'downloads')
+    os.makedirs(receiver.download_dir)
+
+    def run(save_path):
+        ours, theirs = socket.socketpair()
+        with ours, theirs:
+            receiver._offer_delta(ours, save_path)
+            return TransferProtocol().receive_message(theirs, DELTA_END)['block_size']
+
+    run.receiver = receiver
+    return run
+
+
+def test_delta_is_offered_for_a_file_in_the_download_folder(offer):
+    save_path = write_file(os.path.join(offer.receiver.download_dir, 'report.bin'), os.urandom(100000))
+    assert offer(save_path) > 0
+
+
+def test_no_delta_for_a_name_that_leaves_the_download_folder(offer, tmp_path):
+    write_file(tmp_path / 'secret.bin', os.urandom(100000))
+    assert offer(os.path.join(offer.receiver.download_dir, '..', 'secret.bin')) == 0
+    assert offer(os.path.join(offer.receiver.download_dir, str(tmp_path / 'secret.bin'))) == 0
+
+
+def test_no_delta_for_a_symlink_or_nested_name(offer, tmp_path):
+    secret = write_file(tmp_path / 'secret.bin', os.urandom(100000))
+    os.symlink(secret, os.path.join(offer.receiver.download_dir, 'link.bin'))
+    write_file(os.path.join(offer.receiver.download_dir, 'sub', 'nested.bin'), os.urandom(100000))
+    assert offer(os.path.join(offer.receiver.download_dir, 'link.bin')) == 0
+    assert offer(os.path.join(offer.receiver.download_dir, 'sub', 'nested.bin')) == 0
+
+
+OLD = os.urandom(256 * 1024)
+# After a shift the encoder probes aligned blocks for a while before it rolls again
+SHIFT_LOSS = (DELTA_SKIP_BLOCKS + 2) * 4096
+
+
+@pytest.mark.parametrize('new, copied_at_least', [
+    (OLD, len(OLD)),
+    (OLD[:1000] + b'inserted' + OLD[1000:], len(OLD) - SHIFT_LOSS),
+    (OLD[:100000] + os.urandom(20000) + OLD[120000:], len(OLD) - 24 * 1024 - SHIFT_LOSS),
+    (OLD + b'appended', len(OLD)),
+    (OLD[:70000], 68 * 1024),
+    (OLD[4096:] + OLD[:4096], len(OLD)),
+    (b'', 0),
+    (b'short', 0),
+], ids=['same', 'insert', 'rewrite', 'append', 'truncate', 'reorder', 'empty', 'short'])
+def test_delta_rebuilds_the_new_file_from_the_old_copy(tmp_path, new, copied_at_least):
+    rebuilt, copied, delta_size = round_trip(tmp_path, OLD, new)
+    assert rebuilt == new
+    assert copied >= copied_at_least
+    assert delta_size <= len(new) - copied + 1024
+
+
+def test_delta_against_an_unrelated_file_is_all_literal(tmp_path):
+    new = os.urandom(100000)
+    rebuilt, copied, delta_size = round_trip(tmp_path, OLD, new)
+    assert rebuilt == new and copied == 0 and delta_size > len(new)
+
+
+def test_apply_refuses_copies_outside_the_basis_and_unknown_instructions(tmp_path):
+    basis = write_file(tmp_path / 'old.bin', OLD)
+    for delta in (OP_COPY + COPY_OP.pack(60, 10) + OP_END, b'X' + OP_END):
+        with pytest.raises(ValueError):
+            apply_delta(FrameInputStream([delta], None), basis, 4096, 64, io.BytesIO(), HashManager.new('md5'))
+
+
+def test_block_size_grows_with_the_file_within_bounds():
+    assert delta_block_size(0) == DELTA_MIN_BLOCK
+    assert delta_block_size(64 * 1024 * 1024) == 8192
+    assert delta_block_size(1 << 40) == DELTA_MAX_BLOCK
+
+
+def test_signatures_cover_full_blocks_and_round_trip(tmp_path):
+    signatures = compute_signatures(write_file(tmp_path / 'old.bin', OLD[:10000]), 4096)
+    assert len(signatures) == 2
+    recorder = FrameRecorder()
+    write_signatures(recorder, signatures)
+    assert read_signatures(recorder, 2) == signatures
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_delta_round_trip_in_block_mode(peers, tmp_path, monkeypatch, password):
+    pair = peers(compression_mode='block', delta_min_size=0)
+    copied = []
+    apply_delta = streaming.apply_delta
+
+    def spy(*args):
+        copied.append(apply_delta(*args))
+        return copied[-1]
+
+    monkeypatch.setattr(streaming, 'apply_delta', spy)
+    old = os.urandom(2 * 1024 * 1024)
+    new = old[:500000] + b'edited' + old[500000:]
+    write_file(pair.received('report.bin'), old)
+    source = write_file(tmp_path / 'src' / 'report.bin', new)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, password, CompressionMethod.ZLIB)
+    assert success, message
+    assert read_file(pair.received('report.bin')) == new
+    assert copied and copied[0] >= len(old) - SHIFT_LOSS
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import pytest
+
+from utils.compression import CompressionMethod
+from utils.file_index import FileIndex, hash_kind
+from utils.hashing import HashManager
+
+from .conftest import write_file
+
+
+def settled_file(path, data: bytes) -> str:
+    """A file last modified well outside the racy window, so its results may be cached"""
+    write_file(path, data)
+    then = time.time() - 60
+    os.utime(path, (then, then))
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return FileIndex(str(tmp_path / 'index' / 'index.db'))
+
+
+def test_hash_is_computed_once_while_the_file_is_unchanged(index, tmp_path, monkeypatch):
+    path = settled_file(tmp_path / 'file.bin', os.urandom(10000))
+    computed = []
+    hash_file = HashManager.hash_file
+    monkeypatch.setattr(HashManager, 'hash_file', staticmethod(
+        lambda *args: computed.append(args) or hash_file(*args)
+    ))
+
+    assert index.hash_file(path, 'sha256') == index.hash_file(path, 'sha256') == hash_file(path, 'sha256')
+    assert len(computed) == 1
+    assert index.stats() == {'entries': 1, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_an_edited_file_is_hashed_again(index, tmp_path):
+    path = settled_file(tmp_path / 'file.bin', b'before')
+    before = index.hash_file(path)
+    settled_file(path, b'after!')
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1000))
+    assert index.hash_file(path) != before
+    assert index.misses == 2
+
+
+def test_recently_modified_or_changing_files_are_not_stored(index, tmp_path):
+    fresh = write_file(tmp_path / 'fresh.bin', b'fresh')
+    assert not index.put(fresh, 'kind', b'value', os.stat(fresh))
+
+    path = settled_file(tmp_path / 'file.bin', b'old')
+    info = os.stat(path)
+    settled_file(path, b'new contents')
+    assert not index.put(path, 'kind', b'value', info)
+    assert index.stats()['entries'] == 0
+
+
+def test_prune_forgets_deleted_files(index, tmp_path):
+    kept = settled_file(tmp_path / 'kept.bin', b'kept')
+    gone = settled_file(tmp_path / 'gone.bin', b'gone')
+    index.hash_file(kept)
+    index.record_hash(gone, 'blake2b', 'abc', os.stat(gone))
+    os.unlink(gone)
+    assert index.prune() == 1
+    assert index.stats()['entries'] == 1
+    index.clear()
+    assert index.stats()['entries'] == 0
+
+
+def test_warm_hashes_a_folder_on_a_background_thread(index, tmp_path):
+    paths = [settled_file(tmp_path / 'tree' / f'{number}.bin', bytes([number]) * 100) for number in range(5)]
+    index.warm([str(tmp_path / 'tree')]).join()
+    index.reset_stats()
+    for path in paths:
+        index.get(path, hash_kind('blake2b'))
+    assert index.hits == 5
+
+
+def test_threads_share_the_index(index, tmp_path):
+    path = settled_file(tmp_path / 'file.bin', b'shared')
+    errors = []
+
+    def hash_many():
+        try:
+            for _ in range(20):
+                index.hash_file(path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hash_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert index.hits + index.misses == 80
+
+
+def test_repeat_dedup_send_chunks_from_the_index(peers, tmp_path):
+    pair = peers(dedup_transfers=True, dedup_min_size=0, delta_transfers=False)
+    source = settled_file(tmp_path / 'src' / 'image.bin', os.urandom(1024 * 1024))
+
+    for _ in range(2):
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+        assert success, message
+    assert pair.sender.stream_manager.get_file_index().hits >= 1
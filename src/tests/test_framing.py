@@ -0,0 +1,174 @@
+import socket
+import time
+
+import pytest
+
+from transfer.framing import (
+    CHUNK_ALIGNMENT, FLAG_COMPRESSED, FLAG_STREAM, FRAME_DATA, FRAME_EOF, FRAME_HEADER, FRAME_TRAILER,
+    AdaptiveChunkSizer, BufferPool, FrameReader, FrameWriter, TokenBucket, compression_flags, frame_method_value
+)
+
+
+class TricklingSocket:
+    """Hands out the bytes a few at a time, as a slow network would"""
+
+    def __init__(self, data: bytes, step: int = 3):
+        self.data = memoryview(data)
+        self.step = step
+
+    def recv_into(self, view, size=0):
+        count = min(self.step, size or len(view), len(self.data))
+        view[:count] = self.data[:count]
+        self.data = self.data[count:]
+        return count
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.data = bytearray()
+
+    def sendall(self, data):
+        self.data += data
+
+
+def parse_frames(data: bytes) -> list:
+    frames = []
+    while data:
+        frame_type, flags, length = FRAME_HEADER.unpack_from(data)
+        frames.append((frame_type, flags, bytes(data[FRAME_HEADER.size:FRAME_HEADER.size + length])))
+        data = data[FRAME_HEADER.size + length:]
+    return frames
+
+
+def test_writer_emits_length_prefixed_frames_then_eof_and_trailer():
+    sock = RecordingSocket()
+    writer = FrameWriter(sock)
+    writer.write_frame(b'payload', flags=FLAG_COMPRESSED)
+    writer.write_frame(b'')
+    writer.write_eof()
+    writer.write_trailer({'checksum': 'abc'})
+    assert parse_frames(bytes(sock.data)) == [
+        (FRAME_DATA, FLAG_COMPRESSED, b'payload'), (FRAME_DATA, 0, b''), (FRAME_EOF, 0, b''),
+        (FRAME_TRAILER, 0, b'{"checksum": "abc"}')
+    ]
+
+
+def test_writer_reports_data_frame_timings_to_its_observer():
+    writer = FrameWriter(RecordingSocket())
+    observed = []
+    writer.observer = lambda nbytes, seconds: observed.append(nbytes)
+    writer.write_frame(b'x' * 100)
+    writer.write_eof()
+    writer.write_trailer({})
+    assert observed == [100]
+
+
+def test_compression_flags_carry_the_method():
+    flags = compression_flags(5, stream=True)
+    assert flags & FLAG_COMPRESSED and flags & FLAG_STREAM
+    assert frame_method_value(flags) == 5
+    assert compression_flags(0) == 0
+
+
+def test_chunk_sizer_grows_with_bandwidth_within_bounds():
+    sizer = AdaptiveChunkSizer(256 * 1024, 4 * 1024 * 1024, rtt=0.001)
+    assert sizer.chunk_size == 256 * 1024
+    for _ in range(20):
+        sizer.observe(sizer.chunk_size, sizer.chunk_size / 1e9)
+    assert sizer.chunk_size == 4 * 1024 * 1024
+    for _ in range(40):
+        sizer.observe(sizer.chunk_size, sizer.chunk_size / 1e6)
+    assert sizer.chunk_size == 256 * 1024
+    sizer.observe(0, 1.0)
+    sizer.observe(100, 0)
+    assert sizer.chunk_size % CHUNK_ALIGNMENT == 0
+
+
+def test_chunk_sizer_covers_two_round_trips_on_slow_links():
+    sizer = AdaptiveChunkSizer(64 * 1024, 64 * 1024 * 1024, rtt=0.1)
+    sizer.observe(1024 * 1024, 0.1)
+    assert sizer.chunk_size == 2 * 1024 * 1024
+
+
+def test_token_bucket_limits_the_rate(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    bucket = TokenBucket(1000)
+    bucket.consume(1000)
+    assert slept == []
+    bucket.consume(500)
+    assert slept and slept[0] == pytest.approx(0.5, abs=0.05)
+
+
+def test_throttled_writer_waits_for_tokens(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    writer = FrameWriter(RecordingSocket(), TokenBucket(10000, burst=1000))
+    writer.write_frame(b'x' * 1000)
+    writer.write_frame(b'x' * 3000)
+    assert sum(slept) == pytest.approx(0.3, abs=0.05)
+
+
+def test_frames_cross_a_real_socket():
+    left, right = socket.socketpair()
+    with left, right:
+        FrameWriter(left).write_frame(b'over the wire')
+        header = right.recv(FRAME_HEADER.size)
+        assert FRAME_HEADER.unpack(header) == (FRAME_DATA, 0, 13)
+        assert right.recv(13) == b'over the wire'
+
+
+def test_reader_reassembles_frames_from_short_reads():
+    sock = RecordingSocket()
+    writer = FrameWriter(sock)
+    writer.write_frame(b'a' * 1000, flags=FLAG_COMPRESSED)
+    writer.write_frame(b'b' * 10)
+    writer.write_eof()
+    writer.write_trailer({'checksum': 'abc'})
+    reader = FrameReader(TricklingSocket(bytes(sock.data)))
+
+    frame_type, flags, payload = reader.read_frame()
+    assert (frame_type, flags, bytes(payload)) == (FRAME_DATA, FLAG_COMPRESSED, b'a' * 1000)
+    assert bytes(reader.read_frame()[2]) == b'b' * 10
+    assert reader.read_frame()[0] == FRAME_EOF
+    assert reader.read_trailer() == {'checksum': 'abc'}
+
+
+def test_reader_reuses_pooled_buffers():
+    sock = RecordingSocket()
+    writer = FrameWriter(sock)
+    for _ in range(5):
+        writer.write_frame(b'x' * 5000)
+    pool = BufferPool(buffer_size=8192, max_buffers=2)
+    reader = FrameReader(TricklingSocket(bytes(sock.data), step=4096), pool)
+    buffers = set()
+    for _ in range(5):
+        _, _, payload = reader.read_frame()
+        buffers.add(id(payload.obj))
+    assert len(buffers) == 1
+
+
+def test_detached_buffers_stay_valid_until_released():
+    sock = RecordingSocket()
+    writer = FrameWriter(sock)
+    writer.write_frame(b'first')
+    writer.write_frame(b'second')
+    reader = FrameReader(TricklingSocket(bytes(sock.data), step=100))
+    _, _, first = reader.read_frame()
+    buffer = reader.detach()
+    _, _, second = reader.read_frame()
+    assert bytes(first) == b'first' and bytes(second) == b'second'
+    reader.pool.release(buffer)
+
+
+def test_reader_refuses_oversized_frames():
+    header = FRAME_HEADER.pack(FRAME_DATA, 0, FrameReader.MAX_FRAME_SIZE + 1)
+    with pytest.raises(ValueError):
+        FrameReader(TricklingSocket(header, step=100)).read_frame()
+
+
+def test_connection_closed_mid_frame_raises():
+    sock = RecordingSocket()
+    FrameWriter(sock).write_frame(b'x' * 100)
+    with pytest.raises(ConnectionError):
+        FrameReader(TricklingSocket(bytes(sock.data[:50]))).read_frame()
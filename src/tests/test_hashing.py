@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+import pytest
+
+from transfer.framing import FrameWriter
+from transfer.streaming import StreamManager
+from utils.compression import CompressionMethod
+from utils.hashing import TREE_SEGMENT_SIZE, HashManager
+
+from .conftest import PASSWORD, read_file, write_file
+
+
+def test_sender_hashes_while_streaming_instead_of_reading_the_file_twice(peers, tmp_path, monkeypatch):
+    pair = peers(resumable_transfers=False, file_index=False)
+    pre_reads = []
+    monkeypatch.setattr(HashManager, 'hash_file', staticmethod(lambda *args, **kwargs: pre_reads.append(args)))
+    monkeypatch.setattr(StreamManager, 'calculate_file_checksum', lambda self, *args: pre_reads.append(args))
+    data = os.urandom(4 * 1024 * 1024)
+    source = write_file(tmp_path / 'src' / 'data.bin', data)
+
+    for password, method in [(None, CompressionMethod.NONE), (PASSWORD, CompressionMethod.ZLIB)]:
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, password, method)
+        assert success, message
+        assert read_file(pair.received('data.bin')) == data
+        os.unlink(pair.received('data.bin'))
+    assert pre_reads == []
+
+
+def test_receiver_rejects_a_trailer_with_the_wrong_checksum(peers, tmp_path, monkeypatch):
+    pair = peers(resumable_transfers=False)
+    write_trailer = FrameWriter.write_trailer
+    monkeypatch.setattr(FrameWriter, 'write_trailer', lambda self, trailer: write_trailer(
+        self, {**trailer, 'checksum': '0' * len(trailer['checksum'])}
+    ))
+    source = write_file(tmp_path / 'src' / 'data.bin', os.urandom(100000))
+
+    success, _ = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.ZLIB)
+    assert not success
+    assert not os.path.exists(pair.received('data.bin'))
+    assert not os.path.exists(pair.received('data.bin.part'))
+
+
+@pytest.mark.parametrize('name', ['md5', 'sha256', 'blake2b'])
+def test_registered_algorithms_match_hashlib(name):
+    hasher = HashManager.new(name)
+    hasher.update(b'some bytes')
+    assert hasher.hexdigest() == hashlib.new(name, b'some bytes').hexdigest()
+    assert HashManager.is_available(name) and HashManager.is_available(name + '-tree')
+
+
+def test_unknown_algorithms_are_refused():
+    assert not HashManager.is_available('crc0')
+    with pytest.raises(ValueError):
+        HashManager.new('crc0')
+
+
+def test_registering_an_algorithm_makes_it_available(monkeypatch):
+    monkeypatch.setattr(HashManager, '_algorithms', dict(HashManager._algorithms))
+    HashManager.register('sha3_256', hashlib.sha3_256)
+    assert 'sha3_256' in HashManager.available_algorithms()
+    assert HashManager.new('sha3_256').hexdigest() == hashlib.sha3_256().hexdigest()
+
+
+@pytest.mark.parametrize('size', [0, 1000, TREE_SEGMENT_SIZE, 2 * TREE_SEGMENT_SIZE + 123])
+def test_tree_hash_is_the_same_streamed_or_on_several_threads(tmp_path, size):
+    data = os.urandom(size)
+    path = write_file(tmp_path / 'data.bin', data)
+    streamed = HashManager.new('blake2b-tree')
+    for start in range(0, size, 100000):
+        streamed.update(data[start:start + 100000])
+    assert HashManager.hash_file(path, 'blake2b-tree', workers=4) == streamed.hexdigest()
+    assert HashManager.hash_file(path, 'blake2b-tree', workers=1) == streamed.hexdigest()
+    assert streamed.hexdigest() != HashManager.hash_file(path, 'blake2b')
+
+
+@pytest.mark.parametrize('algorithm', ['md5', 'sha256', 'blake2b-tree'])
+def test_transfer_uses_the_advertised_algorithm(peers, tmp_path, monkeypatch, algorithm):
+    pair = peers(sender={'hash_algorithm': algorithm})
+    created = []
+    new = HashManager.new
+    monkeypatch.setattr(HashManager, 'new', staticmethod(lambda name='blake2b': created.append(name) or new(name)))
+    data = os.urandom(TREE_SEGMENT_SIZE + 4096)
+    source = write_file(tmp_path / 'src' / 'data.bin', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.ZLIB)
+    assert success, message
+    assert read_file(pair.received('data.bin')) == data
+    assert created.count(algorithm) >= 2
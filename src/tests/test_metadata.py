@@ -0,0 +1,150 @@
+import enum
+import json
+import os
+
+import pytest
+
+from transfer import bulk, protocols
+from transfer.bulk import MANIFEST_SCHEMA
+from transfer.metadata import (
+    COLUMN_ENUM, COLUMN_HEX, COLUMN_INT, COLUMN_STR, COLUMN_VERSIONS, KNOWN_STRINGS, PACKED_MAGIC, decode_message,
+    encode_message, encode_records, is_packed, iter_records
+)
+from transfer.sync import SYNC_MANIFEST_SCHEMA
+from utils.compression import CompressionMethod
+
+from .conftest import tree_contents, write_file
+
+MESSAGES = [
+    {},
+    [],
+    {'type': 'transfer_request', 'file_name': 'report.pdf', 'file_size': 123456789, 'keep_alive': True},
+    {'ints': [0, 1, -1, 63, -64, 2 ** 40, -2 ** 63, 2 ** 100], 'float': 0.25, 'none': None, 'false': False},
+    {'nested': {'list': [[], {}, ['a', 'a', 'a']], 'bytes': b'\x00\xff' * 10}},
+    {'unicode': 'наш файл 🚀', 'long': 'x' * 1000, 'surrogate': 'bad\udcff'},
+    {'compression_offer': [5, 4, 3], 'paths': [f'docs/file{number}.txt' for number in range(50)]},
+]
+
+
+class Kind(str, enum.Enum):
+    TAR = 'tar'
+
+
+class Level(enum.IntEnum):
+    FAST = 1
+
+
+@pytest.mark.parametrize('message', MESSAGES)
+def test_messages_round_trip_in_both_encodings(message):
+    packed = encode_message(message, packed=True)
+    assert is_packed(packed) and decode_message(packed) == message
+    if 'nested' not in message and 'surrogate' not in message:
+        plain = encode_message(message)
+        assert not is_packed(plain) and plain == json.dumps(message).encode()
+        assert decode_message(plain) == decode_message(packed)
+
+
+def test_known_and_repeated_strings_cost_a_reference():
+    message = {'type': 'transfer_request', 'compression_offer': [1], 'paths': ['some/long/path.txt'] * 20}
+    packed = encode_message(message, packed=True)
+    assert 'compression_offer' in KNOWN_STRINGS
+    assert packed.count(b'compression_offer') == 0 and packed.count(b'some/long/path.txt') == 1
+    assert len(packed) < len(encode_message(message)) / 3
+
+
+def test_tuples_and_enums_pack_like_json():
+    message = {'level': Level.FAST, 'archive': Kind.TAR, 'pair': (1, 2)}
+    assert decode_message(encode_message(message, packed=True)) == json.loads(json.dumps(message))
+    with pytest.raises(TypeError):
+        encode_message({'method': CompressionMethod.ZLIB}, packed=True)
+
+
+def test_malformed_messages_raise_value_error():
+    packed = encode_message(MESSAGES[3], packed=True)
+    for end in range(len(PACKED_MAGIC), len(packed)):
+        with pytest.raises(ValueError):
+            decode_message(packed[:end])
+    with pytest.raises(ValueError, match='Trailing'):
+        decode_message(packed + b'\x00')
+    with pytest.raises(ValueError, match='Unknown packed value tag'):
+        decode_message(PACKED_MAGIC + b'\x7f')
+    # A list where a dict key belongs
+    with pytest.raises(ValueError):
+        decode_message(PACKED_MAGIC + bytes([8, 1, 7, 0, 0]))
+
+
+def manifest_entries(count: int) -> list:
+    return [[f'dir{number % 7}/файл{number}.bin', 'f' if number % 5 else 'd', number * 4096, 0o644,
+             1700000000000000000 + number, None if number % 3 else f'target{number}'] for number in range(count)]
+
+
+def sync_entries(count: int) -> list:
+    return [[f'docs/{number}.txt', number, 0o600, -number, None if number % 4 == 0 else os.urandom(16).hex(),
+             {'replica-a': number, 'replica-b': 1} if number % 2 else {}, number % 2] for number in range(count)]
+
+
+@pytest.mark.parametrize('schema, records', [
+    (MANIFEST_SCHEMA, manifest_entries(500)),
+    (SYNC_MANIFEST_SCHEMA, sync_entries(500)),
+    (MANIFEST_SCHEMA, []),
+    ((COLUMN_STR, COLUMN_HEX), [[None, None], [None, None]]),
+    ((COLUMN_STR, COLUMN_ENUM), [['', 'only']]),
+    ((COLUMN_INT,), [[0], [255], [256], [2 ** 64 - 1]]),
+    ((COLUMN_INT,), [[-1], [2 ** 31 - 1]]),
+])
+def test_records_round_trip(schema, records):
+    encoded = encode_records(schema, records)
+    assert is_packed(encoded)
+    assert list(iter_records(schema, encoded)) == records
+
+
+def test_records_are_smaller_than_json():
+    records = sync_entries(2000)
+    assert len(encode_records(SYNC_MANIFEST_SCHEMA, records)) < len(json.dumps(records)) * 0.7
+
+
+@pytest.mark.parametrize('schema, records', [
+    ((COLUMN_STR, COLUMN_INT), [['a', 1, 2]]),
+    ((COLUMN_STR,), [['nul\0inside']]),
+    ((COLUMN_HEX,), [['ABCDEF']]),
+    ((COLUMN_HEX,), [['abc']]),
+    ((COLUMN_INT,), [[2 ** 64]]),
+    ((COLUMN_INT,), [[-2 ** 63 - 1]]),
+])
+def test_records_that_do_not_fit_the_schema_are_refused(schema, records):
+    with pytest.raises(ValueError):
+        encode_records(schema, records)
+
+
+def test_malformed_record_batches_raise_value_error():
+    schema = (COLUMN_STR, COLUMN_ENUM, COLUMN_INT, COLUMN_HEX, COLUMN_VERSIONS)
+    records = [[f'path{number}', 'kind', number, 'ab' * number, {'r': number}] for number in range(20)]
+    encoded = encode_records(schema, records)
+    for end in range(len(PACKED_MAGIC), len(encoded)):
+        with pytest.raises(ValueError):
+            list(iter_records(schema, encoded[:end]))
+    with pytest.raises(ValueError, match='Trailing'):
+        iter_records(schema, encoded + b'\x00')
+    with pytest.raises(ValueError, match='Not a packed'):
+        iter_records(schema, json.dumps(records).encode())
+    with pytest.raises(ValueError, match='Record count'):
+        iter_records(schema, PACKED_MAGIC + b'\xff\xff\xff\x7f')
+
+
+def test_multiplexed_folder_transfer_uses_packed_metadata(peers, tmp_path, monkeypatch):
+    packed_messages, packed_manifests = [], []
+    encode = protocols.encode_message
+    monkeypatch.setattr(protocols, 'encode_message',
+                        lambda message, packed=False: (packed_messages.append(packed), encode(message, packed))[1])
+    records = bulk.encode_records
+    monkeypatch.setattr(bulk, 'encode_records',
+                        lambda schema, entries: (packed_manifests.append(len(entries)), records(schema, entries))[1])
+
+    pair = peers(multiplex=True)
+    folder = tmp_path / 'folder'
+    for number in range(30):
+        write_file(folder / f'sub{number % 3}' / f'file{number}.txt', f'contents {number}'.encode())
+    success, message = pair.sender.send_folder(str(folder), '127.0.0.1', None, None, CompressionMethod.ZLIB)
+    assert success, message
+    assert tree_contents(pair.received('folder')) == tree_contents(folder)
+    assert True in packed_messages and packed_manifests
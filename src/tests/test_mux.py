@@ -0,0 +1,211 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from transfer import mux as mux_module
+from transfer.framing import FrameReader
+from transfer.mux import (
+    MUX_CLOSE, MUX_CONTROL, MUX_HEADER, MUX_OPEN, MUX_VERSION, MUX_WINDOW, MuxConnection, MuxParser
+)
+from utils.compression import CompressionMethod
+
+from .conftest import read_file, write_file
+
+
+def frame(frame_type: int, stream_id: int, payload: bytes = b'', flags: int = 0, version: int = MUX_VERSION) -> bytes:
+    return MUX_HEADER.pack(version, frame_type, flags, stream_id, len(payload)) + payload
+
+
+class LoopbackTransport:
+    """Delivers everything written straight to the other connection, recording the frame types"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.peer = None
+        self.sent = []
+        self._parser = MuxParser()
+        self._lock = threading.Lock()
+
+    def send_parts(self, parts: list):
+        data = b''.join(bytes(part) for part in parts)
+        with self._lock:
+            self.sent.extend(frame_type for frame_type, _, _, _ in self._parser.feed(data))
+        self.peer.feed(data)
+
+    def getpeername(self):
+        return (self.name, 0)
+
+
+def connected_pair(window: int = mux_module.MUX_WINDOW_SIZE):
+    """A sending and a receiving MuxConnection wired to each other; new streams land in the returned list"""
+    accepted = []
+    sending, receiving = LoopbackTransport('sender'), LoopbackTransport('receiver')
+    client = MuxConnection(sending, window, window)
+    server = MuxConnection(receiving, window, window, on_stream=accepted.append)
+    sending.peer, receiving.peer = server, client
+    return client, server, accepted
+
+
+def test_parser_gives_the_same_frames_whatever_the_pieces():
+    data = frame(0, 1, b'first') + frame(MUX_CONTROL, 2, b'{}', flags=3) + frame(MUX_CLOSE, 1)
+    expected = [(0, 0, 1, b'first'), (MUX_CONTROL, 3, 2, b'{}'), (MUX_CLOSE, 0, 1, b'')]
+    assert MuxParser().feed(data) == expected
+
+    parser = MuxParser()
+    frames = []
+    for offset in range(len(data)):
+        frames.extend(parser.feed(data[offset:offset + 1]))
+    assert frames == expected
+
+
+def test_parser_receives_large_payloads_in_place():
+    payload = os.urandom(10000)
+    parser = MuxParser()
+    assert parser.feed(frame(0, 1, payload)[:MUX_HEADER.size + 100]) == []
+    pending = parser.pending()
+    assert len(pending) == len(payload) - 100
+    pending[:] = payload[100:]
+    assert parser.filled(len(pending)) == [(0, 0, 1, payload)]
+    assert parser.pending() is None
+
+
+def test_parser_refuses_unknown_versions_and_oversized_frames():
+    with pytest.raises(ValueError):
+        MuxParser().feed(frame(0, 1, b'x', version=MUX_VERSION + 1))
+    with pytest.raises(ValueError):
+        MuxParser(max_payload=100).feed(frame(0, 1, b'x' * 101))
+
+
+def test_streams_open_with_their_first_frame_and_keep_their_order():
+    client, server, accepted = connected_pair()
+    stream = client.open_stream()
+    assert accepted == [] and client.transport.sent == []
+
+    stream.send_control(1, b'request')
+    assert client.transport.sent == [MUX_OPEN, MUX_CONTROL]
+    assert [peer.stream_id for peer in accepted] == [stream.stream_id]
+    for number in range(3):
+        stream.write_frame(f'payload {number}'.encode(), flags=number)
+
+    remote = accepted[0]
+    assert remote.receive_control(1) == b'request'
+    assert [(flags, bytes(payload)) for _, flags, payload in (remote.read_frame() for _ in range(3))] == [
+        (number, f'payload {number}'.encode()) for number in range(3)
+    ]
+    remote.send_status('SUCCESS')
+    assert stream.receive_status() == 'SUCCESS'
+
+    stream.close()
+    remote.close()
+    assert client.active_streams() == server.active_streams() == 0
+    assert client.transport.sent[-1] == MUX_CLOSE and server.transport.sent[-1] == MUX_CLOSE
+
+
+def test_status_or_the_wrong_frame_where_payload_is_expected():
+    client, _, accepted = connected_pair()
+    stream = client.open_stream()
+    stream.send_control(1, b'request')
+    remote = accepted[0]
+    with pytest.raises(ValueError):
+        remote.receive_control(2)
+    remote.send_status('ERROR: No space left')
+    with pytest.raises(ConnectionError, match='No space left'):
+        stream.read_frame()
+
+
+def test_writers_wait_for_the_reader_to_grant_more_window():
+    client, _, accepted = connected_pair(window=1000)
+    stream = client.open_stream()
+    stream.write_frame(b'a' * 600)
+    stream.write_frame(b'b' * 600)  # Overshoots the window; the next frame has to wait
+    stream.settimeout(0.2)
+    with pytest.raises(socket.timeout):
+        stream.write_frame(b'c' * 600)
+
+    remote = accepted[0]
+    remote.read_frame()
+    assert MUX_WINDOW in remote.connection.transport.sent
+    stream.write_frame(b'c' * 600)
+    assert [bytes(remote.read_frame()[2])[:1] for _ in range(2)] == [b'b', b'c']
+
+
+def test_a_slow_stream_does_not_hold_up_the_others():
+    client, _, accepted = connected_pair(window=1000)
+    slow, fast = client.open_stream(), client.open_stream()
+    slow.write_frame(b's' * 1000)
+    slow.settimeout(0.1)
+    with pytest.raises(socket.timeout):
+        slow.write_frame(b's')
+    for number in range(10):
+        fast.write_frame(b'f' * 500)
+        assert bytes(accepted[1].read_frame()[2]) == b'f' * 500
+
+
+def test_a_peer_that_ignores_the_window_has_its_stream_reset(monkeypatch):
+    monkeypatch.setattr(FrameReader, 'MAX_FRAME_SIZE', 1000)
+    client, server, accepted = connected_pair(window=1000)
+    client.send_frame(0, 0, 1, b'x' * 100, opening=True)
+    for _ in range(20):
+        client.send_frame(0, 0, 1, b'x' * 100)
+    assert mux_module.MUX_RESET in server.transport.sent
+    # What arrived before the reset can still be read, then the stream fails
+    with pytest.raises(ConnectionError, match='Flow control window exceeded'):
+        for _ in range(22):
+            accepted[0].read_frame()
+
+
+def test_streams_beyond_the_limit_are_refused(monkeypatch):
+    monkeypatch.setattr(mux_module, 'MAX_STREAMS', 2)
+    client, server, accepted = connected_pair()
+    streams = [client.open_stream() for _ in range(3)]
+    for stream in streams:
+        stream.send_control(1, b'request')
+    assert len(accepted) == 2 and server.active_streams() == 2
+    with pytest.raises(ConnectionError, match='Too many streams'):
+        streams[2].receive_control(1)
+
+
+def test_closing_the_connection_fails_its_open_streams():
+    client, _, accepted = connected_pair()
+    stream = client.open_stream()
+    stream.send_control(1, b'request')
+    client.close()
+    with pytest.raises(ConnectionError, match='Connection closed'):
+        stream.read_frame()
+    with pytest.raises(ConnectionError):
+        client.open_stream()
+
+
+def test_finished_stream_threads_are_pruned(peers, tmp_path):
+    pair = peers(receiver_mode='threads', multiplex=True)
+    sources = [write_file(tmp_path / 'src' / f'file{number}.bin', os.urandom(20000)) for number in range(12)]
+
+    for source in sources:
+        success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+        assert success, message
+    assert pair.sender.pool.stats()['created'] == 1
+    assert len(pair.receiver.client_threads) <= 3
+    assert all(read_file(pair.received(os.path.basename(source))) == read_file(source) for source in sources)
+
+
+@pytest.mark.parametrize('mode', ['asyncio', 'threads'])
+def test_concurrent_sends_share_one_multiplexed_connection(peers, tmp_path, mode):
+    pair = peers(receiver_mode=mode, multiplex=True)
+    files = {f'file{number}.bin': os.urandom(300000 + number) for number in range(6)}
+    results = []
+
+    def send(name):
+        source = write_file(tmp_path / 'src' / name, files[name])
+        results.append(pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.ZLIB))
+
+    threads = [threading.Thread(target=send, args=(name,)) for name in files]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert [success for success, _ in results] == [True] * len(files)
+    assert all(read_file(pair.received(name)) == data for name, data in files.items())
+    stats = pair.sender.pool.stats()
+    assert stats['created'] == 1 and stats['multiplexed'] == 1
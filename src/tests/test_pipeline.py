@@ -0,0 +1,236 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from transfer import pipeline as pipeline_module
+from transfer.framing import FRAME_DATA, FRAME_MANIFEST, FrameReader, FrameWriter
+from transfer.pipeline import (
+    COMPRESSION_MODE_BLOCK, COMPRESSION_MODE_STREAM, PIPELINE_DEPTH, DecodePipeline, EncodePipeline, FrameCompressor,
+    FrameDecoder
+)
+from transfer.streaming import StreamManager
+from utils.compression import CompressionManager, CompressionMethod
+from utils.crypto import CryptoManager
+
+from .conftest import PASSWORD, make_config, read_file, write_file
+from .test_framing import RecordingSocket, parse_frames
+
+
+class HoldingDecoder(FrameDecoder):
+    """A decoder whose decompressor still holds bytes after the last frame"""
+
+    def flush(self):
+        yield from super().flush()
+        yield b'held back'
+
+
+def send_frames(chunks, compressor=None):
+    """Socket a FrameReader can consume: the chunks as data frames, then EOF and a trailer"""
+    frames = [compressor.compress(chunk) if compressor else (chunk, 0) for chunk in chunks]
+    if compressor:
+        frames.append(compressor.flush())
+    return send_raw_frames([(FRAME_DATA, flags, payload) for payload, flags in frames])
+
+
+def send_raw_frames(frames):
+    """Socket carrying the given (type, flags, payload) frames, then EOF and a trailer"""
+    sender, receiver = socket.socketpair()
+
+    def write():
+        writer = FrameWriter(sender)
+        for frame_type, flags, payload in frames:
+            writer.write_frame(payload, frame_type, flags)
+        writer.write_eof()
+        writer.write_trailer({'checksum': 'abc'})
+        sender.close()
+
+    threading.Thread(target=write, daemon=True).start()
+    return receiver
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+def test_decoder_tail_is_yielded_after_the_last_frame(workers):
+    receiver = send_frames([b'one', b'two'])
+    pipeline = DecodePipeline(FrameReader(receiver), HoldingDecoder(None, CompressionMethod.NONE), workers)
+    assert [bytes(chunk) for chunk in pipeline] == [b'one', b'two', b'held back']
+    assert pipeline.read_trailer() == {'checksum': 'abc'}
+    receiver.close()
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+@pytest.mark.parametrize('method', [CompressionMethod.ZLIB, CompressionMethod.LZMA, CompressionMethod.BZ2],
+                         ids=lambda method: method.name)
+def test_stream_compressed_frames_decode_in_order(method, workers):
+    chunks = [bytes([number]) * 100000 for number in range(12)]
+    receiver = send_frames(chunks, FrameCompressor(method, COMPRESSION_MODE_STREAM))
+    pipeline = DecodePipeline(FrameReader(receiver), FrameDecoder(None, method), workers)
+    assert b''.join(bytes(chunk) for chunk in pipeline) == b''.join(chunks)
+    assert pipeline.read_trailer() == {'checksum': 'abc'}
+    receiver.close()
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+@pytest.mark.parametrize('method', [CompressionMethod.ZLIB, CompressionMethod.BZ2], ids=lambda method: method.name)
+def test_stream_frames_that_inflate_past_a_frame_are_refused(monkeypatch, method, workers):
+    monkeypatch.setattr(pipeline_module, 'MAX_DECODED_FRAME', 64 * 1024)
+    receiver = send_frames([bytes(1024 * 1024)], FrameCompressor(method, COMPRESSION_MODE_STREAM))
+    pipeline = DecodePipeline(FrameReader(receiver), FrameDecoder(None, method), workers)
+    with pytest.raises(ValueError, match='inflates past'):
+        for _ in pipeline:
+            pass
+    receiver.close()
+
+
+BLOCK_METHODS = [
+    pytest.param(method, marks=pytest.mark.skipif(
+        not CompressionManager.is_available(method), reason=f"{method.name} is not installed"
+    ), id=method.name)
+    for method in CompressionMethod if method not in (CompressionMethod.NONE, CompressionMethod.ADAPTIVE)
+]
+
+
+@pytest.mark.parametrize('method', BLOCK_METHODS)
+def test_blocks_inflate_up_to_the_limit_and_no_further(method):
+    limit = 256 * 1024
+    for data in (bytes(limit), b'text ' * (limit // 5)):
+        payload = CompressionManager.compress_data(data, method)
+        assert CompressionManager.decompress_data(payload, method, limit) == data
+    bomb = CompressionManager.compress_data(bytes(limit + 1), method)
+    with pytest.raises(ValueError):
+        CompressionManager.decompress_data(bomb, method, limit)
+    with pytest.raises(ValueError):
+        CompressionManager.decompress_data(payload[:len(payload) // 2], method, limit)
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+def test_block_frames_that_inflate_past_a_frame_are_refused(monkeypatch, workers):
+    monkeypatch.setattr(pipeline_module, 'MAX_DECODED_FRAME', 64 * 1024)
+    compressor = FrameCompressor(CompressionMethod.ZLIB)
+    frames = [compressor.compress(chunk) for chunk in (b'x' * 1000, bytes(1024 * 1024))]
+    receiver = send_raw_frames([(FRAME_DATA, flags, payload) for payload, flags in frames])
+    pipeline = DecodePipeline(FrameReader(receiver), FrameDecoder(None, CompressionMethod.ZLIB), workers)
+    with pytest.raises(ValueError, match='inflates past'):
+        for _ in pipeline:
+            pass
+    receiver.close()
+
+
+def sealed_block_frames(chunks, method):
+    """Block-compress then seal every chunk, as the sender does, returning the frames and a receive cipher"""
+    cipher, salt = CryptoManager.create_stream_cipher(PASSWORD)
+    compressor = FrameCompressor(method, COMPRESSION_MODE_BLOCK)
+    frames = []
+    for chunk in chunks:
+        payload, flags = compressor.compress(chunk)
+        frames.append((FRAME_DATA, flags, cipher.seal(payload)))
+    return frames, CryptoManager.create_stream_cipher(PASSWORD, salt)[0]
+
+
+@pytest.mark.parametrize('workers', [0, 1, 4])
+@pytest.mark.parametrize('method', [CompressionMethod.ZLIB, CompressionMethod.LZMA], ids=lambda method: method.name)
+def test_sealed_block_frames_decode_in_order_on_workers(method, workers):
+    chunks = [bytes([number]) * (50000 + number) for number in range(3 * PIPELINE_DEPTH)]
+    frames, cipher = sealed_block_frames(chunks, method)
+    receiver = send_raw_frames(frames)
+    pipeline = DecodePipeline(FrameReader(receiver), FrameDecoder(cipher, method), workers)
+    assert [bytes(chunk) for chunk in pipeline] == chunks
+    assert pipeline.read_trailer() == {'checksum': 'abc'}
+    receiver.close()
+
+
+def test_workers_get_enough_pooled_buffers_for_the_frames_in_flight():
+    receiver = send_frames([])
+    pipeline = DecodePipeline(FrameReader(receiver), FrameDecoder(None, CompressionMethod.NONE), 4, depth=6)
+    assert pipeline.reader.pool.max_buffers >= 6 + 4 + 2
+    assert list(pipeline) == []
+    receiver.close()
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+def test_a_tampered_frame_fails_the_transfer(workers):
+    frames, cipher = sealed_block_frames([b'a' * 1000, b'b' * 1000], CompressionMethod.ZLIB)
+    frame_type, flags, payload = frames[1]
+    frames[1] = (frame_type, flags, payload[:-1] + bytes([payload[-1] ^ 1]))
+    receiver = send_raw_frames(frames)
+    with pytest.raises(Exception):
+        list(DecodePipeline(FrameReader(receiver), FrameDecoder(cipher, CompressionMethod.ZLIB), workers))
+    receiver.close()
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+def test_unexpected_frame_types_are_refused(workers):
+    receiver = send_raw_frames([(FRAME_DATA, 0, b'data'), (FRAME_MANIFEST, 0, b'manifest')])
+    pipeline = DecodePipeline(FrameReader(receiver), FrameDecoder(None, CompressionMethod.NONE), workers)
+    with pytest.raises(ValueError, match='Unexpected frame type'):
+        list(pipeline)
+    receiver.close()
+
+
+def test_encoded_frames_go_out_in_submission_order():
+    sock = RecordingSocket()
+
+    def slow_for_early_blocks(chunk, sequence):
+        time.sleep(0.02 * (5 - chunk[0]))
+        return chunk, chunk[0]
+
+    pipeline = EncodePipeline(FrameWriter(sock), slow_for_early_blocks, workers=4)
+    for number in range(6):
+        pipeline.submit(bytes([number]) * 10)
+        assert len(pipeline._pending) < pipeline.depth
+    pipeline.close()
+    assert [(flags, payload) for _, flags, payload in parse_frames(bytes(sock.data))] == [
+        (number, bytes([number]) * 10) for number in range(6)
+    ]
+
+
+def test_blocks_sealed_on_workers_open_in_frame_order():
+    cipher, salt = CryptoManager.create_stream_cipher(PASSWORD)
+    compressor = FrameCompressor(CompressionMethod.ZLIB, COMPRESSION_MODE_BLOCK)
+
+    def encode(chunk, sequence):
+        payload, flags = compressor.compress(chunk)
+        return cipher.seal(payload, sequence), flags
+
+    sock = RecordingSocket()
+    pipeline = EncodePipeline(FrameWriter(sock), encode, workers=4, cipher=cipher)
+    chunks = [os.urandom(1000) + bytes(50000) for _ in range(20)]
+    for chunk in chunks:
+        pipeline.submit(chunk)
+    pipeline.close()
+
+    receive_cipher, _ = CryptoManager.create_stream_cipher(PASSWORD, salt)
+    receiver = send_raw_frames(parse_frames(bytes(sock.data)))
+    decoded = DecodePipeline(FrameReader(receiver), FrameDecoder(receive_cipher, CompressionMethod.ZLIB), 2)
+    assert [bytes(chunk) for chunk in decoded] == chunks
+    receiver.close()
+
+
+@pytest.mark.parametrize('setting, workers, method, expected', [
+    ('auto', 4, CompressionMethod.LZMA, COMPRESSION_MODE_BLOCK),
+    ('auto', 1, CompressionMethod.LZMA, COMPRESSION_MODE_STREAM),
+    ('auto', 4, CompressionMethod.ZLIB, COMPRESSION_MODE_STREAM),
+    ('block', 4, CompressionMethod.ZLIB, COMPRESSION_MODE_BLOCK),
+    ('stream', 4, CompressionMethod.ADAPTIVE, COMPRESSION_MODE_BLOCK),
+])
+def test_compression_mode_uses_blocks_where_the_pool_pays_off(setting, workers, method, expected):
+    manager = StreamManager(make_config(compression_mode=setting, compression_workers=workers))
+    assert manager.get_compression_mode(method) == expected
+    writer = FrameWriter(RecordingSocket())
+    pipeline = manager.create_encode_pipeline(writer, None, manager.create_frame_compressor(writer, method))
+    assert (pipeline is not None) == (expected == COMPRESSION_MODE_BLOCK and workers > 1)
+    if pipeline:
+        pipeline.close()
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_block_compressed_transfer_on_the_worker_pool(peers, tmp_path, password):
+    pair = peers(compression_mode='block', compression_workers=4, compression_block_size=1024 * 1024)
+    data = b''.join(os.urandom(4096) + bytes(60000) for _ in range(160))
+    source = write_file(tmp_path / 'src' / 'blocks.bin', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, password, CompressionMethod.LZMA)
+    assert success, message
+    assert read_file(pair.received('blocks.bin')) == data
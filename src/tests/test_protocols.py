@@ -0,0 +1,84 @@
+import json
+import socket
+
+import pytest
+
+from transfer.framing import FRAME_DATA, FrameReader, FrameWriter
+from transfer.protocols import CODEC_END, METADATA_END, REQUEST_END, TransferProtocol, busy_reply, parse_busy
+
+
+@pytest.fixture
+def pair():
+    sender, receiver = socket.socketpair()
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+class CountingSocket:
+    """Wraps a socket and records the size of every recv"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reads = []
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        self.reads.append(len(data))
+        return data
+
+    def recv_into(self, view, size=0):
+        return self.sock.recv_into(view, size)
+
+
+def test_bytes_after_the_sentinel_are_kept_for_the_frame_reader(pair):
+    sender, receiver = pair
+    protocol = TransferProtocol()
+    sender.sendall(json.dumps({'file_name': 'a.txt', 'file_size': 5}).encode() + METADATA_END)
+    FrameWriter(sender).write_frame(b'hello')
+
+    assert protocol.receive_file_metadata(receiver) == {'file_name': 'a.txt', 'file_size': 5}
+    frame_type, _, payload = FrameReader(receiver).read_frame()
+    assert (frame_type, bytes(payload)) == (FRAME_DATA, b'hello')
+
+
+def test_back_to_back_messages_and_status_are_read_separately(pair):
+    sender, receiver = pair
+    protocol = TransferProtocol()
+    sender.sendall(b'{"type": "transfer_request"}' + REQUEST_END + b'{"compression_method": 3}' + CODEC_END + b'SUCCESS')
+
+    assert protocol.receive_request_metadata(receiver) == {'type': 'transfer_request'}
+    assert protocol.receive_message(receiver, CODEC_END) == {'compression_method': 3}
+    assert protocol.receive_status(receiver) == 'SUCCESS'
+
+
+def test_sentinel_split_across_reads_is_found(pair):
+    sender, receiver = pair
+    counting = CountingSocket(receiver)
+    body = json.dumps({'padding': 'x' * 200000}).encode()
+    sender.sendall(body + REQUEST_END[:5])
+    sender.sendall(REQUEST_END[5:])
+
+    received = TransferProtocol()._receive_until(counting, REQUEST_END, limit=1024 * 1024)
+    assert received == body
+    assert len(counting.reads) < 10
+
+
+def test_oversized_message_is_refused(pair):
+    sender, receiver = pair
+    sender.sendall(b'x' * 5000 + REQUEST_END)
+    assert TransferProtocol()._receive_until(receiver, REQUEST_END, limit=1000) is None
+
+
+def test_closed_connection_before_the_sentinel_raises(pair):
+    sender, receiver = pair
+    sender.sendall(b'{"type": ')
+    sender.close()
+    with pytest.raises(ConnectionError):
+        TransferProtocol().receive_request_metadata(receiver)
+
+
+def test_busy_reply_round_trip():
+    assert parse_busy(busy_reply(7)) == 7
+    assert parse_busy('BUSY soon') is None
+    assert parse_busy('ACCEPTED') is None
@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+from transfer.resume import RESUME_BLOCK_SIZE, ResumeJournal
+from transfer.streaming import StreamManager
+from utils.compression import CompressionMethod
+
+from .conftest import PASSWORD, read_file, write_file
+
+
+def write_journaled(save_path: str, data: bytes, block_size: int = 1000) -> ResumeJournal:
+    journal = ResumeJournal(save_path, 'request', 10000, 'blake2b', block_size)
+    with journal.open_part() as file:
+        journal.journaled_writer(file)(data)
+    return journal
+
+
+def test_interrupted_part_offers_its_whole_verified_blocks(tmp_path):
+    save_path = str(tmp_path / 'file.bin')
+    data = os.urandom(3500)
+    write_journaled(save_path, data)
+
+    journal = ResumeJournal.load(save_path, 'request', 10000, 'blake2b')
+    assert journal.verify_part() == 3000
+    assert journal.offer() == {'resume_offset': 3000, 'block_size': 1000, 'block_hashes': journal.block_hashes}
+    with journal.open_part() as file:
+        assert file.tell() == 3000
+    assert read_file(save_path + '.part') == data[:3000]
+
+
+def test_a_damaged_block_and_everything_after_it_is_sent_again(tmp_path):
+    save_path = str(tmp_path / 'file.bin')
+    write_journaled(save_path, os.urandom(3500))
+    with open(save_path + '.part', 'r+b') as file:
+        file.seek(1500)
+        file.write(b'\x00')
+
+    journal = ResumeJournal.load(save_path, 'request', 10000, 'blake2b')
+    assert journal.verify_part() == 1000
+    journal.rewind(0)
+    assert journal.offset == 0
+
+
+@pytest.mark.parametrize('request_id, file_size', [('other request', 10000), ('request', 20000)])
+def test_a_journal_for_another_request_is_ignored(tmp_path, request_id, file_size):
+    save_path = str(tmp_path / 'file.bin')
+    write_journaled(save_path, os.urandom(3500))
+    assert ResumeJournal.load(save_path, request_id, file_size, 'blake2b').verify_part() == 0
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_second_attempt_resumes_from_the_part_file(peers, tmp_path, monkeypatch, password):
+    pair = peers(transfer_retries=0, delta_transfers=False, compression_mode='block')
+    offsets = []
+    stream_file_data = StreamManager.stream_file_data
+
+    def spy(self, ssock, file_path, file_size, cipher, method, callback, algorithm, offset=0, *args):
+        offsets.append(offset)
+        return stream_file_data(
+            self, ssock, file_path, file_size, cipher, method, callback, algorithm, offset, *args
+        )
+
+    monkeypatch.setattr(StreamManager, 'stream_file_data', spy)
+    data = os.urandom(2 * RESUME_BLOCK_SIZE + 5 * 1024 * 1024)
+    source = write_file(tmp_path / 'src' / 'big.bin', data)
+
+    def drop_connection(sent, total, stage):
+        if sent > RESUME_BLOCK_SIZE + 4 * 1024 * 1024:
+            raise IOError("simulated drop")
+
+    success, _ = pair.sender.send_file(source, '127.0.0.1', drop_connection, password, CompressionMethod.NONE)
+    assert not success
+    deadline = time.monotonic() + 10
+    while pair.receiver.scheduler.stats()['active'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert os.path.exists(pair.received('big.bin.part'))
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, password, CompressionMethod.NONE)
+    assert success, message
+    assert offsets[0] == 0 and offsets[1] > 0 and offsets[1] % RESUME_BLOCK_SIZE == 0
+    assert read_file(pair.received('big.bin')) == data
+    assert not os.path.exists(pair.received('big.bin.part'))
+    assert not os.path.exists(pair.received('big.bin.part.journal'))
@@ -0,0 +1,87 @@
+import collections
+import os
+import time
+
+from transfer.file_sender import FileSender
+from transfer.protocols import ReceiverBusy
+from transfer.scheduler import MAX_RETRY_AFTER, MIN_RETRY_AFTER, TransferScheduler
+from utils.compression import CompressionMethod
+
+from .conftest import make_config, read_file, write_file
+
+
+def test_transfers_start_until_the_slots_are_full():
+    scheduler = TransferScheduler(max_active=2, queue_size=4)
+    started = []
+    tickets = [scheduler.submit('alice', lambda number=number: started.append(number)) for number in range(3)]
+    assert started == [0, 1]
+    assert scheduler.stats()['queued'] == 1
+
+    scheduler.release(tickets[0])
+    assert started == [0, 1, 2]
+    assert scheduler.stats() == {'active': 2, 'queued': 0, 'senders_waiting': 0, 'admitted': 3, 'rejected': 0}
+
+
+def test_freed_slots_go_to_waiting_senders_in_turn():
+    scheduler = TransferScheduler(max_active=1, queue_size=10)
+    started = []
+    tickets = {}
+    for sender in ['alice', 'alice', 'alice', 'alice', 'bob', 'carol']:
+        ticket = scheduler.submit(sender, lambda sender=sender: started.append(sender))
+        tickets.setdefault(sender, collections.deque()).append(ticket)
+
+    for _ in range(5):
+        scheduler.release(tickets[started[-1]].popleft())
+    assert started == ['alice', 'alice', 'bob', 'carol', 'alice', 'alice']
+
+
+def test_a_full_queue_is_refused_and_counted():
+    scheduler = TransferScheduler(max_active=1, queue_size=1)
+    assert scheduler.submit('alice', lambda: None)
+    assert scheduler.submit('bob', lambda: None)
+    assert scheduler.submit('carol', lambda: None) is None
+    assert scheduler.stats()['rejected'] == 1
+    assert MIN_RETRY_AFTER <= scheduler.retry_after() <= MAX_RETRY_AFTER
+
+
+def test_waiting_for_a_slot_times_out_and_withdraws_the_ticket():
+    scheduler = TransferScheduler(max_active=1, queue_size=4)
+    held = scheduler.wait_for_slot('alice', 1)
+    assert held is not None
+    assert scheduler.wait_for_slot('bob', 0.1) is None
+    assert scheduler.stats()['queued'] == 0
+    scheduler.release(held)
+    assert scheduler.wait_for_slot('bob', 0.1) is not None
+
+
+def test_busy_receiver_is_retried_once_per_wait(tmp_path, monkeypatch):
+    sender = FileSender(0, str(tmp_path / 'certs'), make_config(
+        parallel_streams=2, parallel_min_size=0, busy_wait_limit=3
+    ))
+    source = write_file(tmp_path / 'big.bin', b'x' * 1024)
+    attempts, sleeps = [], []
+
+    def busy(*args):
+        attempts.append(args)
+        raise ReceiverBusy(1)
+
+    monkeypatch.setattr(FileSender, '_send_file_striped', busy)
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+
+    assert sender.send_file(source, '127.0.0.1') == (False, "Receiver is busy, try again later")
+    assert len(attempts) == 4
+    assert sleeps == [1, 1, 1]
+
+
+def test_receiver_answers_busy_when_the_queue_is_full(peers, tmp_path):
+    pair = peers(receiver={'max_active_transfers': 1, 'transfer_queue_size': 0}, sender={'busy_wait_limit': 0})
+    source = write_file(tmp_path / 'src' / 'file.bin', os.urandom(50000))
+    held = pair.receiver.scheduler.submit('someone else', lambda: None)
+
+    assert pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE) == (
+        False, "Receiver is busy, try again later"
+    )
+    pair.receiver.scheduler.release(held)
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+    assert success, message
+    assert read_file(pair.received('file.bin')) == read_file(source)
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from transfer.streaming import StreamManager
+from utils.compression import CompressionManager, CompressionMethod, StreamCompressor, StreamDecompressor
+
+from .conftest import PASSWORD, read_file, tree_contents, write_file
+
+STREAM_METHODS = [CompressionMethod.ZLIB, CompressionMethod.LZMA, CompressionMethod.BZ2]
+ALL_STREAM_METHODS = [
+    pytest.param(method, marks=pytest.mark.skipif(
+        not CompressionManager.is_available(method), reason=f"{method.name} is not installed"
+    ), id=method.name)
+    for method in CompressionMethod if method not in (CompressionMethod.NONE, CompressionMethod.ADAPTIVE)
+]
+CAP = 256 * 1024
+
+
+def make_folder(root) -> str:
+    folder = os.path.join(str(root), 'project')
+    for number in range(40):
+        write_file(os.path.join(folder, 'docs', f'note{number:02d}.txt'), b'line of text\n' * number * 20)
+    write_file(os.path.join(folder, 'data', 'random.bin'), os.urandom(1536 * 1024))
+    write_file(os.path.join(folder, 'data', 'zeros.bin'), bytes(2 * 1024 * 1024))
+    os.makedirs(os.path.join(folder, 'empty'))
+    return folder
+
+
+@pytest.mark.parametrize('method', STREAM_METHODS, ids=lambda method: method.name)
+def test_stream_compressor_frames_decode_to_the_input(method):
+    compressor, decompressor = StreamCompressor(method), StreamDecompressor(method)
+    blocks = [b'abc' * 50000, os.urandom(70000), bytes(200000)]
+    inflated = [decompressor.decompress(compressor.compress(block)) for block in blocks]
+    inflated.append(decompressor.decompress(compressor.flush()) + decompressor.flush())
+    assert b''.join(inflated) == b''.join(blocks)
+
+
+@pytest.mark.parametrize('method', ALL_STREAM_METHODS)
+def test_capped_decompressor_hands_out_at_most_the_cap_per_call(method):
+    compressor, decompressor = StreamCompressor(method), StreamDecompressor(method, CAP)
+    blocks = [bytes(CAP)] * 6 + [os.urandom(CAP), b'text ' * (CAP // 5)]
+    pieces = [decompressor.decompress(compressor.compress(block)) for block in blocks]
+    pieces.append(decompressor.decompress(compressor.flush()))
+    pieces.extend(decompressor.drain())
+    assert max(map(len, pieces)) <= CAP
+    assert b''.join(pieces) == b''.join(blocks)
+
+
+@pytest.mark.parametrize('method', ALL_STREAM_METHODS)
+def test_a_frame_that_inflates_past_the_cap_is_refused(method):
+    compressor, decompressor = StreamCompressor(method), StreamDecompressor(method, CAP)
+    with pytest.raises(ValueError, match='inflates past'):
+        decompressor.decompress(compressor.compress(bytes(8 * CAP)))
+        decompressor.decompress(compressor.flush())
+        for _ in decompressor.drain():
+            pass
+
+
+@pytest.mark.parametrize('decode_workers', [0, 4])
+@pytest.mark.parametrize('archive', ['manifest', 'tar'])
+@pytest.mark.parametrize('method', STREAM_METHODS, ids=lambda method: method.name)
+def test_folder_round_trip_in_stream_mode(peers, tmp_path, method, archive, decode_workers):
+    pair = peers(compression_mode='stream', folder_archive=archive, decode_workers=decode_workers)
+    folder = make_folder(tmp_path / 'src')
+
+    success, message = pair.sender.send_folder(folder, '127.0.0.1', None, PASSWORD, method)
+    assert success, message
+    assert tree_contents(pair.received('project')) == tree_contents(folder)
+
+
+@pytest.mark.parametrize('decode_workers', [0, 4])
+@pytest.mark.parametrize('method', STREAM_METHODS, ids=lambda method: method.name)
+def test_delta_round_trip_in_stream_mode(peers, tmp_path, monkeypatch, method, decode_workers):
+    pair = peers(compression_mode='stream', decode_workers=decode_workers, delta_min_size=0)
+    deltas = []
+    receive_delta_file = StreamManager.receive_delta_file
+
+    def spy(self, *args):
+        deltas.append(args[1])
+        return receive_delta_file(self, *args)
+
+    monkeypatch.setattr(StreamManager, 'receive_delta_file', spy)
+    old = os.urandom(3 * 1024 * 1024)
+    new = old[:1024 * 1024] + os.urandom(4096) + old[1024 * 1024 + 4096:] + b'appended tail'
+    write_file(pair.received('report.bin'), old)
+    source = write_file(tmp_path / 'src' / 'report.bin', new)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, PASSWORD, method)
+    assert success, message
+    assert deltas == [pair.received('report.bin')]
+    assert read_file(pair.received('report.bin')) == new
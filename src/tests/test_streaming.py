@@ -0,0 +1,87 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from transfer.streaming import StreamManager
+from utils.compression import CompressionMethod
+from utils.hashing import HashManager
+
+from .conftest import make_config, read_file, write_file
+
+
+def stream_over_socketpair(manager: StreamManager, file_path: str, file_info: dict, **stream_args):
+    """Run stream_file_data on one end of a socketpair and receive_frames on the other"""
+    sender, receiver = socket.socketpair()
+    results = {}
+
+    def send():
+        with sender:
+            results['sent'] = manager.stream_file_data(
+                sender, file_path, os.path.getsize(file_path), None, CompressionMethod.NONE, None,
+                **stream_args
+            )
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    received = bytearray()
+    file_hash = HashManager.new(stream_args.get('hash_algorithm', 'blake2b'))
+    with receiver:
+        trailer = manager.receive_frames(receiver, received.extend, file_info, None, file_hash)
+    thread.join()
+    assert results['sent']
+    return bytes(received), trailer, file_hash.hexdigest()
+
+
+@pytest.mark.parametrize('sendfile', [True, False], ids=['sendfile', 'readinto'])
+def test_plain_data_path_round_trip(tmp_path, monkeypatch, sendfile):
+    manager = StreamManager(make_config(chunk_size_min=65536, chunk_size_max=262144))
+    calls = []
+    if sendfile:
+        real_sendfile = socket.socket.sendfile
+
+        def counting_sendfile(self, file, offset=0, count=None):
+            calls.append(count)
+            return real_sendfile(self, file, offset, count)
+
+        monkeypatch.setattr(socket.socket, 'sendfile', counting_sendfile)
+    else:
+        monkeypatch.setattr(StreamManager, '_can_sendfile', staticmethod(lambda ssock: False))
+    data = os.urandom(3 * 1024 * 1024 + 5)
+    path = write_file(tmp_path / 'plain.bin', data)
+
+    received, trailer, checksum = stream_over_socketpair(manager, path, {'file_size': len(data)})
+    assert received == data
+    assert trailer['checksum'] == checksum == HashManager.hash_file(path, 'blake2b')
+    assert bool(calls) == sendfile
+    assert sum(calls) == (len(data) if sendfile else 0)
+
+
+def test_plain_data_path_sends_a_byte_range(tmp_path):
+    manager = StreamManager(make_config())
+    data = os.urandom(2 * 1024 * 1024)
+    path = write_file(tmp_path / 'plain.bin', data)
+
+    received, trailer, checksum = stream_over_socketpair(
+        manager, path, {'file_size': len(data)}, offset=1000, length=500000
+    )
+    assert received == data[1000:501000]
+    assert trailer['checksum'] == checksum
+
+
+def test_sendfile_is_only_used_on_plain_or_ktls_sockets():
+    left, right = socket.socketpair()
+    with left, right:
+        assert StreamManager._can_sendfile(left) == hasattr(os, 'sendfile')
+    assert not StreamManager._can_sendfile(object())
+
+
+def test_plain_transfer_round_trip(peers, tmp_path):
+    pair = peers()
+    data = os.urandom(5 * 1024 * 1024)
+    source = write_file(tmp_path / 'src' / 'plain.bin', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, None, CompressionMethod.NONE)
+    assert success, message
+    assert read_file(pair.received('plain.bin')) == data
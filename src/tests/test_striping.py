@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from transfer.striping import STRIPE_ALIGNMENT, StripedTransfer, check_stripes, plan_stripes
+from utils.compression import CompressionMethod
+
+from .conftest import PASSWORD, read_file, write_file
+
+
+@pytest.mark.parametrize('file_size, count', [(0, 4), (1, 4), (STRIPE_ALIGNMENT * 10 + 7, 4), (STRIPE_ALIGNMENT * 3, 8)])
+def test_planned_stripes_tile_the_file(file_size, count):
+    stripes = plan_stripes(file_size, count)
+    check_stripes(stripes, file_size)
+    assert len(stripes) <= count
+    assert all(stripe['offset'] % STRIPE_ALIGNMENT == 0 for stripe in stripes)
+
+
+@pytest.mark.parametrize('stripes', [
+    [],
+    [{'offset': 0, 'length': 60}, {'offset': 50, 'length': 50}],
+    [{'offset': 0, 'length': 40}, {'offset': 50, 'length': 50}],
+    [{'offset': 0, 'length': 50}],
+    [{'offset': 0, 'length': 150}],
+    [{'offset': -10, 'length': 10}, {'offset': 0, 'length': 100}],
+    [{'offset': 0, 'length': 100.0}],
+    [{'offset': 0}],
+    ['0-100'],
+], ids=['empty', 'overlap', 'gap', 'short', 'long', 'negative', 'float', 'missing', 'not-a-dict'])
+def test_invalid_stripe_plans_are_refused_before_the_part_file_exists(tmp_path, stripes):
+    save_path = str(tmp_path / 'big.bin')
+    with pytest.raises(ValueError):
+        StripedTransfer('id', save_path, {'file_size': 100, 'stripes': stripes}, '127.0.0.1')
+    assert not os.path.exists(save_path + '.part')
+
+
+def test_stripes_land_in_any_order(tmp_path):
+    data = os.urandom(300)
+    stripes = [{'offset': 200, 'length': 100}, {'offset': 0, 'length': 120}, {'offset': 120, 'length': 80}]
+    transfer = StripedTransfer('id', str(tmp_path / 'out.bin'), {'file_size': 300, 'stripes': stripes}, '127.0.0.1')
+    for index in (2, 0, 1):
+        stripe = transfer.claim(index)
+        transfer.range_writer(index)(data[stripe['offset']:stripe['offset'] + stripe['length']])
+        transfer.mark_landed(index, True)
+    assert transfer.completed.is_set()
+    assert transfer.finish()
+    assert read_file(tmp_path / 'out.bin') == data
+
+
+def test_writes_without_pwrite_retry_short_writes(tmp_path, monkeypatch):
+    monkeypatch.delattr(os, 'pwrite')
+    write = os.write
+    monkeypatch.setattr(os, 'write', lambda fd, data: write(fd, bytes(data[:7])))
+    data = os.urandom(100)
+    stripes = [{'offset': 0, 'length': 40}, {'offset': 40, 'length': 60}]
+    transfer = StripedTransfer('id', str(tmp_path / 'out.bin'), {'file_size': 100, 'stripes': stripes}, '127.0.0.1')
+    for index, stripe in enumerate(stripes):
+        transfer.claim(index)
+        transfer.range_writer(index)(data[stripe['offset']:stripe['offset'] + stripe['length']])
+        transfer.mark_landed(index, True)
+    assert transfer.finish()
+    assert read_file(tmp_path / 'out.bin') == data
+
+
+def test_overrunning_and_duplicate_stripes_are_refused(tmp_path):
+    stripes = [{'offset': 0, 'length': 10}, {'offset': 10, 'length': 10}]
+    transfer = StripedTransfer('id', str(tmp_path / 'out.bin'), {'file_size': 20, 'stripes': stripes}, '127.0.0.1')
+    transfer.claim(0)
+    with pytest.raises(ValueError):
+        transfer.claim(0)
+    with pytest.raises(ValueError):
+        transfer.claim(2)
+    with pytest.raises(ValueError):
+        transfer.range_writer(1)(b'x' * 11)
+    transfer.abort()
+    assert not transfer.finish()
+    assert not os.path.exists(tmp_path / 'out.bin.part')
+
+
+@pytest.mark.parametrize('password', [None, PASSWORD])
+def test_striped_send_reassembles_the_file(peers, tmp_path, password):
+    pair = peers(parallel_streams=4, parallel_min_size=0, resumable_transfers=False, delta_transfers=False)
+    data = os.urandom(STRIPE_ALIGNMENT * 5 + 12345)
+    source = write_file(tmp_path / 'src' / 'big.bin', data)
+
+    success, message = pair.sender.send_file(source, '127.0.0.1', None, password, CompressionMethod.ZLIB)
+    assert success, message
+    assert 'streams' in message
+    assert read_file(pair.received('big.bin')) == data
+    assert not os.path.exists(pair.received('big.bin.part'))
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+from transfer.sync import (
+    VERSIONS_CONCURRENT, VERSIONS_EQUAL, VERSIONS_NEWER, VERSIONS_OLDER, SyncState, bump_version, compare_versions,
+    conflict_name, merge_versions
+)
+from utils.compression import CompressionMethod
+
+from .conftest import read_file, tree_contents, write_file
+
+
+@pytest.mark.parametrize('local, remote, expected', [
+    ({'a': 1}, {'a': 1}, VERSIONS_EQUAL),
+    ({'a': 2}, {'a': 1}, VERSIONS_NEWER),
+    ({'a': 1}, {'a': 1, 'b': 1}, VERSIONS_OLDER),
+    ({'a': 2, 'b': 1}, {'a': 1, 'b': 2}, VERSIONS_CONCURRENT),
+    ({}, {}, VERSIONS_EQUAL),
+])
+def test_version_vectors_compare(local, remote, expected):
+    assert compare_versions(local, remote) == expected
+
+
+def test_version_vectors_merge_and_bump():
+    assert merge_versions({'a': 2, 'b': 1}, {'b': 3, 'c': 1}) == {'a': 2, 'b': 3, 'c': 1}
+    versions = {'a': 1}
+    assert bump_version(versions, 'a') == {'a': 2} and bump_version(versions, 'b') == {'a': 1, 'b': 1}
+    assert versions == {'a': 1}
+
+
+def test_conflict_copies_keep_their_folder_and_extension():
+    assert conflict_name('docs/report.txt', 'abcdef0123456789').startswith('docs/report (conflict abcdef01 ')
+    assert conflict_name('docs/report.txt', 'abcdef0123456789').endswith(').txt')
+    assert conflict_name('Makefile', 'abcdef01').startswith('Makefile (conflict abcdef01 ')
+
+
+def test_scan_keeps_tombstones_for_deleted_files(tmp_path):
+    folder = tmp_path / 'folder'
+    write_file(folder / 'kept.txt', b'kept')
+    write_file(folder / 'gone.txt', b'gone')
+    state = SyncState(str(folder))
+    try:
+        state.scan()
+        os.unlink(folder / 'gone.txt')
+        counts = state.scan()
+        assert counts['deleted'] == 1
+        manifest = {entry[0]: entry for entry in state.manifest()}
+        assert set(manifest) == {'gone.txt', 'kept.txt'}
+    finally:
+        state.close()
+
+
+class SyncedPair:
+    """Two folders that sync through a loopback receiver"""
+
+    def __init__(self, peers, tmp_path):
+        self.local = tmp_path / 'local'
+        self.remote = tmp_path / 'remote'
+        os.makedirs(self.local)
+        os.makedirs(self.remote)
+        self.pair = peers(receiver={'sync_folders': {'shared': str(self.remote)}})
+
+    def sync(self) -> str:
+        success, message = self.pair.sender.sync_folder(
+            str(self.local), '127.0.0.1', 'shared', CompressionMethod.ZLIB
+        )
+        assert success, message
+        return message
+
+
+@pytest.fixture
+def synced(peers, tmp_path):
+    return SyncedPair(peers, tmp_path)
+
+
+def conflict_copies(folder) -> list:
+    return sorted(name for name in os.listdir(folder) if '(conflict ' in name)
+
+
+def test_first_sync_merges_both_folders(synced):
+    write_file(synced.local / 'mine.txt', b'mine')
+    write_file(synced.local / 'docs' / 'notes.txt', b'notes' * 1000)
+    write_file(synced.remote / 'theirs.txt', b'theirs')
+
+    synced.sync()
+    assert tree_contents(synced.local) == tree_contents(synced.remote)
+    assert read_file(synced.remote / 'docs' / 'notes.txt') == b'notes' * 1000
+    assert read_file(synced.local / 'theirs.txt') == b'theirs'
+
+
+def test_edits_travel_both_ways(synced):
+    write_file(synced.local / 'a.txt', b'one')
+    write_file(synced.local / 'b.txt', b'one')
+    synced.sync()
+
+    write_file(synced.local / 'a.txt', b'edited locally')
+    write_file(synced.remote / 'b.txt', b'edited remotely')
+    synced.sync()
+    assert read_file(synced.remote / 'a.txt') == b'edited locally'
+    assert read_file(synced.local / 'b.txt') == b'edited remotely'
+    assert conflict_copies(synced.local) == []
+
+
+def test_deletion_wins_over_the_older_copy_and_stays_deleted(synced):
+    write_file(synced.local / 'old.txt', b'old')
+    synced.sync()
+
+    os.unlink(synced.remote / 'old.txt')
+    synced.sync()
+    assert not os.path.exists(synced.local / 'old.txt')
+    synced.sync()
+    assert not os.path.exists(synced.local / 'old.txt')
+    assert not os.path.exists(synced.remote / 'old.txt')
+
+
+def test_edit_beats_a_concurrent_delete(synced):
+    write_file(synced.local / 'draft.txt', b'draft')
+    synced.sync()
+
+    os.unlink(synced.local / 'draft.txt')
+    write_file(synced.remote / 'draft.txt', b'draft, edited')
+    synced.sync()
+    assert read_file(synced.local / 'draft.txt') == b'draft, edited'
+    assert read_file(synced.remote / 'draft.txt') == b'draft, edited'
+
+
+def test_concurrent_edits_keep_both_copies(synced):
+    write_file(synced.local / 'plan.txt', b'plan')
+    synced.sync()
+
+    write_file(synced.local / 'plan.txt', b'local plan')
+    write_file(synced.remote / 'plan.txt', b'remote plan!')
+    message = synced.sync()
+    assert '1 conflicts' in message
+    assert read_file(synced.local / 'plan.txt') == read_file(synced.remote / 'plan.txt') == b'local plan'
+    copies = conflict_copies(synced.local)
+    assert len(copies) == 1 and conflict_copies(synced.remote) == copies
+    assert read_file(synced.local / copies[0]) == b'remote plan!'
+
+    synced.sync()
+    assert tree_contents(synced.local) == tree_contents(synced.remote)
+
+
+def test_a_moved_file_is_renamed_on_the_peer(synced):
+    write_file(synced.local / 'big.bin', os.urandom(200000))
+    synced.sync()
+
+    os.rename(synced.local / 'big.bin', synced.local / 'moved.bin')
+    message = synced.sync()
+    assert message.startswith('Folder synced: 0 sent, 0 received, 1 deleted/renamed/updated')
+    assert not os.path.exists(synced.remote / 'big.bin')
+    assert read_file(synced.remote / 'moved.bin') == read_file(synced.local / 'moved.bin')
+
+
+def test_sync_of_an_unknown_folder_is_declined(synced):
+    success, message = synced.pair.sender.sync_folder(str(synced.local), '127.0.0.1', 'unknown')
+    assert not success and message.startswith('Sync declined')
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from transfer import watcher as watcher_module
+from transfer.sync import SYNC_STAGING
+from transfer.watcher import (
+    WATCH_INOTIFY, WATCH_POLLING, ChangeQueue, FolderWatcher, InotifyWatcher, PollingWatcher, create_watcher
+)
+from utils.compression import CompressionMethod
+
+from .conftest import read_file, write_file
+
+BACKENDS = [WATCH_POLLING, pytest.param(WATCH_INOTIFY, marks=pytest.mark.skipif(
+    watcher_module._inotify is None, reason="inotify is not available"
+))]
+
+
+def wait_until(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def covered(path: str, seen: set) -> bool:
+    """A reported directory covers its contents: the sync walks it"""
+    parts = path.split('/')
+    return any('/'.join(parts[:end]) in seen for end in range(1, len(parts) + 1))
+
+
+def collect(queue: ChangeQueue, wanted: set, timeout: float = 5.0) -> set:
+    """Gather batches until every wanted path was reported"""
+    seen = set()
+    stop = threading.Event()
+    deadline = time.monotonic() + timeout
+    while not all(covered(path, seen) for path in wanted) and time.monotonic() < deadline:
+        seen.update(queue.get_batch(stop, 0.2) or [])
+    return seen
+
+
+def test_repeated_events_coalesce_into_one_sorted_batch():
+    queue = ChangeQueue(debounce=0.05)
+    for path in ['b.txt', 'a.txt', 'b.txt']:
+        queue.add(path)
+    assert queue.get_batch(threading.Event(), 1.0) == ['a.txt', 'b.txt']
+    assert queue.get_batch(threading.Event(), 0.05) == []
+
+
+def test_steady_events_still_go_out_after_the_max_delay():
+    queue = ChangeQueue(debounce=0.2, max_delay=0.3)
+    stop = threading.Event()
+
+    def keep_writing():
+        while not stop.is_set():
+            queue.add('busy.log')
+            time.sleep(0.02)
+
+    thread = threading.Thread(target=keep_writing)
+    thread.start()
+    try:
+        started = time.monotonic()
+        assert queue.get_batch(threading.Event(), 5.0) == ['busy.log']
+        assert time.monotonic() - started < 1.0
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_lost_events_or_too_many_changes_ask_for_a_full_sync(monkeypatch):
+    queue = ChangeQueue(debounce=0)
+    queue.add('a.txt')
+    queue.add(None)
+    assert queue.get_batch(threading.Event(), 1.0) is None
+
+    monkeypatch.setattr(watcher_module, 'FULL_SYNC_PATHS', 3)
+    for number in range(4):
+        queue.add(f'{number}.txt')
+    assert queue.get_batch(threading.Event(), 1.0) is None
+
+
+def test_path_lists_too_long_for_one_message_ask_for_a_full_sync():
+    queue = ChangeQueue(debounce=0)
+    for number in range(300):
+        queue.add(f'{number:04}/' + 'x' * 1000)
+    assert queue.get_batch(threading.Event(), 1.0) is None
+
+
+def test_wake_and_stop_return_an_empty_batch():
+    queue = ChangeQueue()
+    queue.wake()
+    assert queue.get_batch(threading.Event()) == []
+    stop = threading.Event()
+    stop.set()
+    assert queue.get_batch(stop) == []
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_report_files_and_new_folders_but_not_staging(tmp_path, backend):
+    folder = tmp_path / 'watched'
+    write_file(folder / 'existing.txt', b'old')
+    queue = ChangeQueue(debounce=0.05)
+    watcher = create_watcher(str(folder), queue, backend, poll_interval=0.05)
+    assert isinstance(watcher, PollingWatcher if backend == WATCH_POLLING else InotifyWatcher)
+    watcher.start()
+    try:
+        write_file(folder / SYNC_STAGING / 'body.bin', b'staged')
+        write_file(folder / 'existing.txt', b'changed')
+        os.makedirs(folder / 'new' / 'deep')
+        write_file(folder / 'new' / 'deep' / 'file.txt', b'nested')
+        os.unlink(folder / 'existing.txt')
+        seen = collect(queue, {'existing.txt', 'new/deep/file.txt'})
+    finally:
+        watcher.stop()
+    # Files written before the new folder's watch exists are covered by the folder itself
+    assert 'existing.txt' in seen and covered('new/deep/file.txt', seen)
+    assert not any(path.startswith(SYNC_STAGING) for path in seen)
+
+
+def test_unknown_backend_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        create_watcher(str(tmp_path), ChangeQueue(), 'telepathy')
+
+
+def test_new_peers_get_a_full_sync_then_the_changed_paths(tmp_path):
+    folder = tmp_path / 'watched'
+    os.makedirs(folder)
+    calls = []
+    watcher = FolderWatcher(str(folder), lambda *args: calls.append(args) or (True, 'ok'),
+                            WATCH_POLLING, debounce=0.05, poll_interval=0.05)
+    watcher.start()
+    try:
+        watcher.subscribe('10.0.0.2', 'shared')
+        wait_until(lambda: calls)
+        write_file(folder / 'note.txt', b'note')
+        wait_until(lambda: len(calls) >= 2)
+    finally:
+        watcher.stop()
+    assert calls[0] == ('10.0.0.2', 'shared', None)
+    assert calls[1] == ('10.0.0.2', 'shared', ['note.txt'])
+    assert watcher.peers == [('10.0.0.2', 'shared')]
+
+
+def test_a_failing_peer_keeps_its_changes_for_the_retry(tmp_path, monkeypatch):
+    monkeypatch.setattr(watcher_module, 'RETRY_DELAY_MAX', 0.2)
+    folder = tmp_path / 'watched'
+    os.makedirs(folder)
+    calls = []
+
+    def flaky_sync(peer_ip, remote_name, paths):
+        calls.append((peer_ip, paths))
+        return (peer_ip == 'good' or len(calls) > 3), 'unreachable'
+
+    watcher = FolderWatcher(str(folder), flaky_sync, WATCH_POLLING, debounce=0.05, poll_interval=0.05)
+    watcher._pending.update({('good', 'shared'): set(), ('flaky', 'shared'): set()})
+    watcher._peers.update(watcher._pending)
+    watcher.start()
+    try:
+        write_file(folder / 'a.txt', b'a')
+        wait_until(lambda: ('flaky', ['a.txt']) in calls[2:])
+    finally:
+        watcher.stop()
+    assert ('good', ['a.txt']) in calls
+
+
+def test_a_refused_path_list_turns_into_a_full_sync(tmp_path, monkeypatch):
+    monkeypatch.setattr(watcher_module, 'RETRY_DELAY_MAX', 0.2)
+    folder = tmp_path / 'watched'
+    os.makedirs(folder)
+    calls = []
+
+    def refusing_sync(peer_ip, remote_name, paths):
+        calls.append(paths)
+        if len(calls) == 1:
+            return False, "Error syncing folder: Peer replied ERROR: Message too large"
+        return True, 'ok'
+
+    watcher = FolderWatcher(str(folder), refusing_sync, WATCH_POLLING, debounce=0.05, poll_interval=0.05)
+    watcher._pending[('peer', 'shared')] = {'a.txt'}
+    watcher._peers.add(('peer', 'shared'))
+    watcher.start()
+    try:
+        watcher.queue.wake()
+        wait_until(lambda: len(calls) >= 2)
+    finally:
+        watcher.stop()
+    assert calls[:2] == [['a.txt'], None]
+
+
+def test_sync_with_a_path_list_over_the_message_limit_falls_back_to_a_full_sync(peers, tmp_path):
+    local, remote = tmp_path / 'local', tmp_path / 'remote'
+    write_file(local / 'kept.txt', b'kept')
+    os.makedirs(remote)
+    pair = peers(receiver={'sync_folders': {'shared': str(remote)}})
+    paths = [f'{number:04}/' + 'p' * 205 for number in range(5000)]
+    assert len(json.dumps(paths)) > 1024 * 1024
+    success, message = pair.sender.sync_folder(str(local), '127.0.0.1', 'shared', CompressionMethod.ZLIB, paths)
+    assert success, message
+    assert read_file(remote / 'kept.txt') == b'kept'
+
+
+def test_watched_folder_reaches_the_peer(peers, tmp_path):
+    local, remote = tmp_path / 'local', tmp_path / 'remote'
+    os.makedirs(local)
+    os.makedirs(remote)
+    pair = peers(receiver={'sync_folders': {'shared': str(remote)}})
+    watcher = FolderWatcher(
+        str(local), lambda peer_ip, remote_name, paths: pair.sender.sync_folder(
+            str(local), peer_ip, remote_name, CompressionMethod.ZLIB, paths
+        ), WATCH_POLLING, debounce=0.05, poll_interval=0.05
+    )
+    watcher.start()
+    try:
+        watcher.subscribe('127.0.0.1', 'shared')
+        write_file(local / 'docs' / 'live.txt', b'pushed on change')
+        wait_until(lambda: os.path.exists(remote / 'docs' / 'live.txt'))
+    finally:
+        watcher.stop()
+    assert read_file(remote / 'docs' / 'live.txt') == b'pushed on change'
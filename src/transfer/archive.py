@@ -0,0 +1,208 @@
+import os
+import shutil
+import tarfile
+import time
+from typing import Callable, Iterable, Optional
+
+from .framing import AdaptiveChunkSizer, FrameWriter
+
+ARCHIVE_FORMAT = 'tar'
+TAR_BUFFER_SIZE = 1024 * 1024
+
+
+def folder_size(folder_path: str) -> int:
+    """Total bytes of regular files under a folder, used for progress and the accept prompt"""
+    total = 0
+    for root, _, files in os.walk(folder_path):
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                try:
+                    total += os.path.getsize(path)
+                except OSError:
+                    pass
+    return total
+
+
+def unique_path(path: str) -> str:
+    """Pick `path`, or `path (n)` when something already lives there"""
+    candidate = path
+    counter = 1
+    while os.path.lexists(candidate):
+        candidate = f"{path} ({counter})"
+        counter += 1
+    return candidate
+
+
+def _check_member(member: tarfile.TarInfo, dest: str) -> tarfile.TarInfo:
+    """Reject members that would land outside dest (for Pythons without tarfile filters)"""
+    target = os.path.realpath(os.path.join(dest, member.name))
+    if os.path.isabs(member.name) or os.path.commonpath([dest, target]) != dest:
+        raise ValueError(f"Unsafe path in archive: {member.name}")
+    if member.islnk() or member.issym():
+        base = dest if member.islnk() else os.path.dirname(target)
+        link_target = os.path.realpath(os.path.join(base, member.linkname))
+        if os.path.isabs(member.linkname) or os.path.commonpath([dest, link_target]) != dest:
+            raise ValueError(f"Unsafe link in archive: {member.name}")
+    elif not (member.isfile() or member.isdir()):
+        raise ValueError(f"Unsupported member type in archive: {member.name}")
+    return member
+
+
+class FrameOutputStream:
+    """Write-only file object that turns a byte stream (e.g. tarfile output) into data frames"""
+
+    def __init__(self, writer: FrameWriter, sizer: AdaptiveChunkSizer, process: Callable, file_hash,
+                 progress_callback: Optional[Callable] = None, total_size: int = 0,
+                 pipeline=None, block_size: Optional[int] = None, finish: Optional[Callable] = None):
+        self.writer = writer
+        self.finish = finish
+        self.pipeline = pipeline
+        self.block_size = block_size
+        self.sizer = sizer
+        self.process = process
+        self.file_hash = file_hash
+        self.progress_callback = progress_callback
+        self.total_size = total_size
+        self.total_sent = 0
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        # Frames never carry more than one chunk, however much a single write brings
+        size = self.block_size or self.sizer.chunk_size
+        while len(self._buffer) >= size:
+            chunk = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._send(chunk)
+            size = self.block_size or self.sizer.chunk_size
+        return len(data)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        self._send(chunk)
+
+    def _send(self, chunk: bytes):
+        if self.file_hash is not None:
+            self.file_hash.update(chunk)
+        if self.pipeline:
+            self.pipeline.submit(chunk)
+        else:
+            processed_chunk, flags = self.process(chunk)
+
+            started = time.perf_counter()
+            self.writer.write_frame(processed_chunk, flags=flags)
+            self.sizer.observe(len(processed_chunk), time.perf_counter() - started)
+
+        self.total_sent += len(chunk)
+        if self.progress_callback:
+            total = max(self.total_size, self.total_sent)
+            self.progress_callback(self.total_sent, total, "Sending")
+
+    def close(self):
+        """Flush the tail and end the data stream"""
+        self.flush()
+        if self.pipeline:
+            self.pipeline.flush()
+        if self.finish:
+            self.finish()
+        self.writer.write_eof()
+
+
+class FrameInputStream:
+    """Read-only file object over decoded data frames, so tarfile can extract while bytes arrive"""
+
+    def __init__(self, chunks: Iterable, file_hash, progress_callback: Optional[Callable] = None):
+        self._chunks = iter(chunks)
+        self.file_hash = file_hash
+        self.progress_callback = progress_callback
+        self.total_received = 0
+        self.at_eof = False
+        self._pending = memoryview(b'')
+
+    def _next_chunk(self) -> bool:
+        """Load the next non-empty chunk; False only at the real end of the stream"""
+        while not self.at_eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.at_eof = True
+                return False
+            # Stream codecs (lzma, bz2) cannot flush mid-stream, so a frame may inflate to nothing
+            if not chunk:
+                continue
+            chunk = bytes(chunk)
+            if self.file_hash is not None:
+                self.file_hash.update(chunk)
+            self.total_received += len(chunk)
+            if self.progress_callback:
+                self.progress_callback(self.total_received)
+            self._pending = memoryview(chunk)
+            return True
+        return False
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._pending and not self._next_chunk():
+            return b''
+        if size < 0 or size >= len(self._pending):
+            data = bytes(self._pending)
+            self._pending = memoryview(b'')
+        else:
+            data = bytes(self._pending[:size])
+            self._pending = self._pending[size:]
+        return data
+
+    def read_exactly(self, size: int) -> bytes:
+        """Read exactly size bytes, which may span several frames"""
+        if len(self._pending) >= size:
+            data = bytes(self._pending[:size])
+            self._pending = self._pending[size:]
+            return data
+        parts = []
+        remaining = size
+        while remaining:
+            part = self.read(remaining)
+            if not part:
+                raise ValueError("Data stream ended early")
+            parts.append(part)
+            remaining -= len(part)
+        return b''.join(parts)
+
+    def drain(self):
+        """Consume padding after the end-of-archive marker up to the EOF frame"""
+        self._pending = memoryview(b'')
+        while self._next_chunk():
+            self._pending = memoryview(b'')
+
+
+def write_folder_tar(folder_path: str, output: FrameOutputStream):
+    """Stream a folder's contents as tar; members are relative to the folder itself"""
+    with tarfile.open(fileobj=output, mode='w|', bufsize=TAR_BUFFER_SIZE) as tar:
+        for name in sorted(os.listdir(folder_path)):
+            tar.add(os.path.join(folder_path, name), arcname=name)
+    output.close()
+
+
+def extract_tar_stream(source: FrameInputStream, dest: str):
+    """Extract members into dest as they arrive, then drain the frame stream"""
+    os.makedirs(dest, exist_ok=True)
+    dest = os.path.realpath(dest)
+    with tarfile.open(fileobj=source, mode='r|', bufsize=TAR_BUFFER_SIZE) as tar:
+        for member in tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(member, dest, filter='data')
+            else:
+                tar.extract(_check_member(member, dest), dest)
+    source.drain()
+
+
+def remove_tree(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,323 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .mux import MUX_UPGRADE, MuxConnection
+from .protocols import busy_reply
+
+LISTEN_BACKLOG = 512
+STREAM_LIMIT = 256 * 1024  # Per-connection read buffer; the transport pauses reading at twice this
+HANDSHAKE_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 60.0  # Seconds a connected peer has to send its request
+STOP_TIMEOUT = 5.0
+STOP_CHECK_SECONDS = 1.0
+REQUEST_END = b'<REQUEST_END>'
+
+
+class AsyncSocket:
+    """Blocking socket calls over an asyncio stream, so the existing handlers can run in worker threads"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, closed: threading.Event):
+        self._loop = loop
+        self._reader = reader
+        self._writer = writer
+        self._closed = closed
+        self._timeout = None
+        self._loop_thread = threading.get_ident()  # Built on the loop, which must never wait on itself
+
+    def _call(self, coroutine):
+        if self._closed.is_set():
+            coroutine.close()
+            raise ConnectionError("Receiver stopped")
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while True:
+            wait = STOP_CHECK_SECONDS
+            if deadline is not None:
+                wait = max(0.0, min(wait, deadline - time.monotonic()))
+            try:
+                return future.result(wait)
+            except concurrent.futures.TimeoutError:  # Not the built-in TimeoutError before Python 3.11
+                if self._closed.is_set():
+                    future.cancel()
+                    raise ConnectionError("Receiver stopped")
+                if deadline is not None and time.monotonic() >= deadline:
+                    future.cancel()
+                    raise socket.timeout("timed out")
+
+    async def _write(self, parts: list):
+        self._writer.writelines(parts)
+        await self._writer.drain()
+
+    def recv(self, size: int) -> bytes:
+        return self._call(self._reader.read(size))
+
+    def recv_into(self, buffer, size: int = 0) -> int:
+        data = self.recv(size or len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    async def _read_until(self, sentinel: bytes, limit: int) -> Optional[bytes]:
+        data = b''
+        try:
+            while len(data) <= limit:
+                try:
+                    return data + (await self._reader.readuntil(sentinel))[:-len(sentinel)]
+                except asyncio.LimitOverrunError as e:
+                    data += await self._reader.readexactly(e.consumed)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed before message end")
+        return None
+
+    def recv_until(self, sentinel: bytes, limit: int) -> Optional[bytes]:
+        """Bytes before the sentinel, or None when too large; nothing after the sentinel is consumed
+
+        The stream has no TLS record boundaries, so control messages cannot be read in recv() pieces.
+        """
+        return self._call(self._read_until(sentinel, limit))
+
+    def sendall(self, data):
+        self.send_parts([data])
+
+    def send_parts(self, parts: list):
+        """Write the parts back to back; called on the loop itself it queues them without waiting"""
+        # Copied because callers reuse their buffers as soon as this returns
+        parts = [bytes(part) for part in parts]
+        if threading.get_ident() != self._loop_thread:
+            self._call(self._write(parts))
+        elif self._closed.is_set() or self._writer.is_closing():
+            raise ConnectionError("Connection closed")
+        else:
+            self._writer.writelines(parts)
+
+    def send(self, data) -> int:
+        self.sendall(data)
+        return len(data)
+
+    def settimeout(self, timeout: Optional[float]):
+        self._timeout = timeout
+
+    def gettimeout(self) -> Optional[float]:
+        return self._timeout
+
+    def getpeername(self):
+        return self._writer.get_extra_info('peername')
+
+    def getsockopt(self, *args):
+        return self._writer.get_extra_info('socket').getsockopt(*args)
+
+
+class AsyncReceiverServer:
+    """Accept and TLS-handshake connections on one event loop and hand them to bounded worker pools
+
+    A connection only takes a worker thread once it is admitted: each peer may run
+    `per_peer` requests at once and the rest wait on the loop, which costs a few KB
+    instead of a thread. Stripes of an already accepted transfer use their own pool so
+    they never queue behind new requests that the transfer is holding workers from.
+    """
+
+    def __init__(self, receiver, workers: int = 16, per_peer: int = 8):
+        self.receiver = receiver
+        self.per_peer = max(1, per_peer)
+        self._transfers = ThreadPoolExecutor(max(1, workers), thread_name_prefix='receiver')
+        self._stripes = ThreadPoolExecutor(max(1, workers), thread_name_prefix='receiver-stripe')
+        self._closed = threading.Event()
+        self._loop = None
+        self._server = None
+        self._stopping = None
+        self._writers = set()
+        self._tasks = set()
+        self._peers = {}  # peer ip -> [semaphore, connections using it]
+        self.connections = 0
+        self.active = 0
+
+    def run(self, sock: socket.socket, context):
+        """Serve on an already bound and listening socket until stop() is called"""
+        try:
+            asyncio.run(self._main(sock, context))
+        finally:
+            self._closed.set()
+            self._transfers.shutdown(wait=False, cancel_futures=True)
+            self._stripes.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        self._closed.set()
+        loop = self._loop
+        if loop and not loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(STOP_TIMEOUT)
+            except Exception:
+                pass
+
+    async def _shutdown(self):
+        if self._server:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+        self._stopping.set()
+
+    async def _main(self, sock: socket.socket, context):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._server = await asyncio.start_server(
+            self._handle, sock=sock, ssl=context, limit=STREAM_LIMIT,
+            backlog=LISTEN_BACKLOG, ssl_handshake_timeout=HANDSHAKE_TIMEOUT
+        )
+        if self._closed.is_set():
+            await self._shutdown()
+        await self._stopping.wait()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=STOP_TIMEOUT)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._closed.is_set():
+            # Finished its handshake after _shutdown() aborted the open connections
+            writer.transport.abort()
+            return
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self._writers.add(writer)
+        self.connections += 1
+        peer = writer.get_extra_info('peername')
+        # asyncio only disables Nagle for sockets created with IPPROTO_TCP, which the listener was not
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f"🔗 Connection from {peer}")
+        try:
+            request_info = await self._read_request(reader, writer, REQUEST_TIMEOUT)
+            ssock = AsyncSocket(self._loop, reader, writer, self._closed)
+            if request_info is not None and request_info.get('type') == MUX_UPGRADE and self.receiver.multiplex:
+                await self._serve_multiplexed(peer[0], reader, ssock, request_info)
+                return
+            while request_info is not None:
+                if not await self._serve(peer[0], ssock, request_info):
+                    break
+                if not self.receiver._keeps_alive(request_info):
+                    break
+                # A kept-alive connection waits for its next request here, without a worker thread
+                request_info = await self._read_request(reader, writer, self.receiver.keepalive_timeout)
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._tasks.discard(task)
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), STOP_TIMEOUT)
+            except Exception:
+                writer.transport.abort()
+
+    async def _read_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            timeout: float) -> Optional[dict]:
+        try:
+            data = await asyncio.wait_for(reader.readuntil(REQUEST_END), timeout)
+        except asyncio.LimitOverrunError:
+            writer.write("ERROR: Request too large".encode())
+            return None
+        return self.receiver.protocol.decode_request(data[:-len(REQUEST_END)])
+
+    async def _serve_multiplexed(self, peer_ip: str, reader: asyncio.StreamReader, ssock: AsyncSocket,
+                                 request_info: dict):
+        """Feed a multiplexed connection's frames to its streams; each new stream is served as a task"""
+        connection = MuxConnection(
+            ssock, self.receiver.mux_window, on_stream=lambda stream: self._start_stream(peer_ip, stream)
+        )
+        if not connection.accept(request_info, self.receiver.keepalive_timeout):
+            return
+        idle_timeout = self.receiver.keepalive_timeout
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(STREAM_LIMIT), max(idle_timeout, STOP_CHECK_SECONDS))
+                except asyncio.TimeoutError:
+                    if connection.idle_for() >= idle_timeout:
+                        return
+                    continue
+                if not data:
+                    return
+                connection.feed(data)
+        finally:
+            connection.close()
+
+    def _start_stream(self, peer_ip: str, stream):
+        task = self._loop.create_task(self._serve_stream(peer_ip, stream))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _serve_stream(self, peer_ip: str, stream):
+        try:
+            # The request arrived with the stream's first frame, so this does not wait
+            request_info = self.receiver.protocol.receive_request_metadata(stream)
+            if request_info is not None:
+                await self._serve(peer_ip, stream, request_info)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            stream.close()
+
+    async def _serve(self, peer_ip: str, ssock, request_info: dict) -> bool:
+        """Run one request; True if the connection can take another"""
+        if request_info.get('type') == 'stripe':
+            return await self._run(self._stripes, ssock, request_info)
+        async with self._peer_slot(peer_ip):
+            if request_info.get('type') == 'transfer_request':
+                return await self._run_scheduled(peer_ip, ssock, request_info)
+            return await self._run(self._transfers, ssock, request_info)
+
+    async def _run(self, executor: ThreadPoolExecutor, ssock, request_info: dict) -> bool:
+        self.active += 1
+        try:
+            return await self._loop.run_in_executor(executor, self.receiver._handle_request, ssock, request_info)
+        finally:
+            self.active -= 1
+
+    async def _run_scheduled(self, peer_ip: str, ssock, request_info: dict) -> bool:
+        """Wait on the loop for a transfer slot, or answer busy when the scheduler has no room"""
+        scheduler = self.receiver.scheduler
+        started = self._loop.create_future()
+
+        def start():
+            self._loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+
+        ticket = scheduler.submit(peer_ip, start)
+        if ticket is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(started), self.receiver.queue_timeout)
+            except asyncio.TimeoutError:
+                if scheduler.cancel(ticket):
+                    ticket = None
+                else:
+                    await started
+            except BaseException:
+                # Connection dropped or the server is stopping: give up the place in the queue
+                if not scheduler.cancel(ticket):
+                    scheduler.release(ticket)
+                raise
+        if ticket is None:
+            self.receiver.protocol.send_status(ssock, busy_reply(scheduler.retry_after()))
+            return False
+        try:
+            return await self._run(self._transfers, ssock, request_info)
+        finally:
+            scheduler.release(ticket)
+
+    @contextlib.asynccontextmanager
+    async def _peer_slot(self, peer_ip: str):
+        """Wait until the peer has fewer than per_peer requests running"""
+        entry = self._peers.setdefault(peer_ip, [asyncio.Semaphore(self.per_peer), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._peers[peer_ip]
+
+    def stats(self) -> dict:
+        return {'connections': self.connections, 'active': self.active, 'open': len(self._writers)}
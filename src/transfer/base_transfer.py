@@ -8,6 +8,7 @@ from typing import Optional, Callable
 from .file_sender import FileSender
 from .file_receiver import FileReceiver
 from .streaming import StreamManager
+from .watcher import FolderWatcher
 from utils.crypto import CryptoManager
 from utils.compression import CompressionMethod
 from config import TransferConfig
@@ -21,9 +22,10 @@ class FileTransfer:
         self.transfer_config = TransferConfig()
         
         # Initialize components
-        self.sender = FileSender(port, cert_dir)
-        self.receiver = FileReceiver(port, cert_dir)
-        self.stream_manager = StreamManager()
+        self.sender = FileSender(port, cert_dir, self.transfer_config)
+        self.receiver = FileReceiver(port, cert_dir, self.transfer_config)
+        self.stream_manager = StreamManager(self.transfer_config)
+        self.watchers = {}
         
         # Ensure certificate directory exists
         os.makedirs(self.cert_dir, exist_ok=True)
@@ -37,7 +39,7 @@ class FileTransfer:
     def send_file(self, file_path: str, recipient_ip: str, 
                  progress_callback: Optional[Callable] = None,
                  encryption_password: Optional[str] = None,
-                 compression_method: CompressionMethod = CompressionMethod.ZLIB) -> tuple:
+                 compression_method: CompressionMethod = CompressionMethod.ADAPTIVE) -> tuple:
         """Send file using streaming to handle large files"""
         self.sender.current_user = self.current_user
         return self.sender.send_file(
@@ -48,7 +50,7 @@ class FileTransfer:
     def send_folder(self, folder_path: str, recipient_ip: str, 
                    progress_callback: Optional[Callable] = None,
                    encryption_password: Optional[str] = None,
-                   compression_method: CompressionMethod = CompressionMethod.ZLIB) -> tuple:
+                   compression_method: CompressionMethod = CompressionMethod.ADAPTIVE) -> tuple:
         """Send folder with streaming support"""
         self.sender.current_user = self.current_user
         return self.sender.send_folder(
@@ -56,6 +58,39 @@ class FileTransfer:
             encryption_password, compression_method
         )
 
+    def sync_folder(self, folder_path: str, recipient_ip: str, remote_name: Optional[str] = None,
+                    compression_method: CompressionMethod = CompressionMethod.ADAPTIVE,
+                    paths: Optional[list] = None) -> tuple:
+        """Two-way sync of a folder with one the recipient lists in its sync_folders setting"""
+        self.sender.current_user = self.current_user
+        return self.sender.sync_folder(folder_path, recipient_ip, remote_name, compression_method, paths)
+
+    def watch_folder(self, folder_path: str, peers: list) -> FolderWatcher:
+        """Keep a folder in sync with peers ([(ip, remote_name), ...]) as files change"""
+        folder_path = os.path.abspath(folder_path)
+        watcher = self.watchers.get(folder_path)
+        if watcher is None:
+            watcher = FolderWatcher(
+                folder_path,
+                lambda peer_ip, remote_name, paths: self.sync_folder(folder_path, peer_ip, remote_name, paths=paths),
+                self.transfer_config.get_setting('watch_backend') or 'auto',
+                self.transfer_config.get_setting('watch_debounce') or 0.1,
+                poll_interval=self.transfer_config.get_setting('watch_poll_interval') or 1.0
+            )
+            watcher.start()
+            self.watchers[folder_path] = watcher
+        for peer_ip, remote_name in peers:
+            watcher.subscribe(peer_ip, remote_name)
+        return watcher
+
+    def stop_watching(self, folder_path: Optional[str] = None):
+        """Stop watching one folder, or all of them"""
+        folders = [os.path.abspath(folder_path)] if folder_path else list(self.watchers)
+        for folder in folders:
+            watcher = self.watchers.pop(folder, None)
+            if watcher:
+                watcher.stop()
+
     def start_receiver(self, download_dir: str):
         """Start file receiver"""
         self.receiver.current_user = self.current_user
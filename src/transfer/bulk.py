@@ -0,0 +1,259 @@
+import ctypes
+import json
+import os
+import stat
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from utils.crypto import StreamCipher
+from .archive import FrameInputStream, FrameOutputStream
+from .framing import FRAME_MANIFEST, FrameReader, FrameWriter
+from .metadata import (COLUMN_ENUM, COLUMN_INT, COLUMN_STR, PACKED_ZLIB_LEVEL, encode_records, is_packed,
+                       iter_records)
+
+MANIFEST_FORMAT = 'manifest'
+
+ENTRY_DIR = 'd'
+ENTRY_FILE = 'f'
+ENTRY_LINK = 'l'
+# Packed form of [path, kind, size, mode, mtime_ns, target]
+MANIFEST_SCHEMA = (COLUMN_STR, COLUMN_ENUM, COLUMN_INT, COLUMN_INT, COLUMN_INT, COLUMN_STR)
+
+MAX_MANIFEST_BYTES = 256 * 1024 * 1024  # Decompressed size of one manifest frame
+READ_SIZE = 1024 * 1024
+LARGE_FILE_SIZE = 4 * 1024 * 1024  # Bigger bodies are written straight from the receive loop
+BATCH_BYTES = 64 * 1024 * 1024
+BATCH_FILES = 4096
+BULK_WRITER_THREADS = 4
+
+try:
+    _syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+except (AttributeError, OSError, TypeError):
+    _syncfs = None
+
+
+def sync_filesystem(path: str):
+    """Flush everything written to the filesystem holding path in one call"""
+    if _syncfs is not None:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if _syncfs(fd) == 0:
+                return
+        finally:
+            os.close(fd)
+    if hasattr(os, 'sync'):
+        os.sync()
+
+
+def build_manifest(folder_path: str) -> list:
+    """List every directory, file and symlink under a folder as [path, kind, size, mode, mtime_ns, target]
+
+    Directories come before their contents; paths are relative and '/'-separated.
+    """
+    entries = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        relative_root = os.path.relpath(root, folder_path)
+        prefix = '' if relative_root == '.' else relative_root.replace(os.sep, '/') + '/'
+        for name in list(dirs) + sorted(files):
+            path = os.path.join(root, name)
+            info = os.lstat(path)
+            relative = prefix + name
+            if stat.S_ISLNK(info.st_mode):
+                entries.append([relative, ENTRY_LINK, 0, 0, info.st_mtime_ns, os.readlink(path)])
+                if name in dirs:
+                    dirs.remove(name)
+            elif stat.S_ISDIR(info.st_mode):
+                entries.append([relative, ENTRY_DIR, 0, stat.S_IMODE(info.st_mode), info.st_mtime_ns, None])
+            elif stat.S_ISREG(info.st_mode):
+                entries.append([relative, ENTRY_FILE, info.st_size, stat.S_IMODE(info.st_mode),
+                                info.st_mtime_ns, None])
+    return entries
+
+
+def manifest_size(entries: list) -> int:
+    return sum(entry[2] for entry in entries)
+
+
+def write_manifest(writer: FrameWriter, entries: list, cipher: Optional[StreamCipher], file_hash,
+                   packed: bool = False):
+    """Send the manifest as one compressed (and sealed) frame ahead of the bodies, packed or as JSON"""
+    if packed:
+        encoded = encode_records(MANIFEST_SCHEMA, entries)
+    else:
+        encoded = json.dumps(entries, separators=(',', ':')).encode()
+    file_hash.update(encoded)
+    payload = zlib.compress(encoded, PACKED_ZLIB_LEVEL if packed else 6)
+    if cipher:
+        payload = cipher.seal(payload)
+    writer.write_frame(payload, FRAME_MANIFEST)
+
+
+def inflate_manifest(payload, limit: int = MAX_MANIFEST_BYTES) -> bytes:
+    """Decompress one manifest frame, refusing a frame that would inflate past limit"""
+    inflater = zlib.decompressobj()
+    encoded = inflater.decompress(payload, limit)
+    if inflater.unconsumed_tail:
+        raise ValueError(f"Manifest frame inflates past {limit} bytes")
+    if not inflater.eof:
+        raise ValueError("Manifest frame is truncated")
+    return encoded
+
+
+def read_manifest(reader: FrameReader, cipher: Optional[StreamCipher], file_hash) -> list:
+    frame_type, _, payload = reader.read_frame()
+    if frame_type != FRAME_MANIFEST:
+        raise ValueError(f"Expected manifest frame, got type {frame_type}")
+    if cipher:
+        payload = cipher.open(payload)
+    encoded = inflate_manifest(payload)
+    file_hash.update(encoded)
+    if is_packed(encoded):
+        return list(iter_records(MANIFEST_SCHEMA, encoded))
+    return json.loads(encoded)
+
+
+def write_bulk_bodies(folder_path: str, entries: list, output: FrameOutputStream):
+    """Pack file bodies back to back, in manifest order, into large data frames"""
+    for relative, kind, size, _, _, _ in entries:
+        if kind != ENTRY_FILE:
+            continue
+        with open(os.path.join(folder_path, *relative.split('/')), 'rb') as f:
+            remaining = size
+            while remaining:
+                data = f.read(min(remaining, READ_SIZE))
+                if not data:
+                    raise IOError(f"{relative} shrank during transfer")
+                output.write(data)
+                remaining -= len(data)
+    output.close()
+
+
+def _safe_relative_path(relative: str) -> str:
+    """Turn a manifest path into a local relative path, refusing anything that leaves the folder"""
+    parts = relative.split('/')
+    if not relative or relative.startswith('/') or any(part in ('', '.', '..') for part in parts):
+        raise ValueError(f"Unsafe path in manifest: {relative}")
+    if any(os.sep in part or (os.altsep and os.altsep in part) for part in parts):
+        raise ValueError(f"Unsafe path in manifest: {relative}")
+    return os.path.join(*parts)
+
+
+class BulkWriter:
+    """Write many small files from a thread pool and sync the filesystem once per batch"""
+
+    def __init__(self, dest: str, workers: int = BULK_WRITER_THREADS,
+                 batch_bytes: int = BATCH_BYTES, batch_files: int = BATCH_FILES):
+        self.dest = dest
+        self.batch_bytes = batch_bytes
+        self.batch_files = batch_files
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = []
+        self._batch_size = 0
+        # Bodies waiting for a writer thread are bounded to one batch worth of memory
+        self._pending_bytes = 0
+        self._pending_lock = threading.Condition()
+
+    def _write(self, path: str, data: bytes, mode: int, mtime_ns: int):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), mode)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        finally:
+            with self._pending_lock:
+                self._pending_bytes -= len(data)
+                self._pending_lock.notify_all()
+
+    def write_small(self, path: str, data: bytes, mode: int, mtime_ns: int):
+        with self._pending_lock:
+            while self._pending_bytes and self._pending_bytes + len(data) > self.batch_bytes:
+                self._pending_lock.wait()
+            self._pending_bytes += len(data)
+        self._futures.append(self._executor.submit(self._write, path, data, mode, mtime_ns))
+        self._count(len(data))
+
+    def write_large(self, path: str, source: FrameInputStream, size: int, mode: int, mtime_ns: int):
+        """Copy a big body straight from the stream instead of buffering it for the pool"""
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining:
+                data = source.read(min(remaining, READ_SIZE))
+                if not data:
+                    raise ValueError("Data stream ended early")
+                f.write(data)
+                remaining -= len(data)
+        os.chmod(path, mode)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        self._count(size)
+
+    def _count(self, size: int):
+        self._batch_size += size
+        if self._batch_size >= self.batch_bytes or len(self._futures) >= self.batch_files:
+            self.end_batch()
+
+    def end_batch(self):
+        """Wait for queued writes, surface their errors, then sync once for the whole batch"""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        self._batch_size = 0
+        sync_filesystem(self.dest)
+
+    def close(self, wait: bool = True):
+        try:
+            if wait:
+                self.end_batch()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+def receive_bulk(source: FrameInputStream, entries: list, dest: str,
+                 workers: int = BULK_WRITER_THREADS) -> int:
+    """Recreate a manifest transfer under dest; returns the number of files written"""
+    os.makedirs(dest, exist_ok=True)
+    dest = os.path.realpath(dest)
+    writer = BulkWriter(dest, workers)
+    directories = []
+    links = []
+    files = 0
+    try:
+        for relative, kind, size, mode, mtime_ns, target in entries:
+            path = os.path.join(dest, _safe_relative_path(relative))
+            if kind == ENTRY_DIR:
+                os.makedirs(path, exist_ok=True)
+                directories.append((path, mode, mtime_ns))
+            elif kind == ENTRY_FILE:
+                if size > LARGE_FILE_SIZE:
+                    writer.write_large(path, source, size, mode & 0o777, mtime_ns)
+                else:
+                    writer.write_small(path, source.read_exactly(size), mode & 0o777, mtime_ns)
+                files += 1
+            elif kind == ENTRY_LINK:
+                links.append((path, target, relative))
+            else:
+                raise ValueError(f"Unknown manifest entry type: {kind}")
+        source.drain()
+        writer.close()
+    except BaseException:
+        writer.close(wait=False)
+        raise
+
+    # Links are created last so no write above can be redirected through one
+    for path, target, relative in links:
+        resolved = os.path.realpath(os.path.join(os.path.dirname(path), target))
+        if os.path.isabs(target) or os.path.commonpath([dest, resolved]) != dest:
+            raise ValueError(f"Unsafe link in manifest: {relative}")
+        os.symlink(target, path)
+
+    # Directory times are restored deepest first, after their contents stopped changing
+    for path, mode, mtime_ns in reversed(directories):
+        os.chmod(path, (mode & 0o777) | stat.S_IRWXU)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return files
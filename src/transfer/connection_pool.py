@@ -0,0 +1,249 @@
+import select
+import socket
+import ssl
+import threading
+import time
+import weakref
+from typing import Optional
+
+from utils.crypto import CryptoManager
+from .mux import MAX_STREAMS, MUX_WINDOW_SIZE, MuxConnection, MuxStream
+
+KEEPALIVE_TIMEOUT = 30  # Seconds a receiver keeps an idle connection open for the next request
+MAX_IDLE_PER_PEER = 4
+CONNECT_TIMEOUT = 120
+
+
+class ConnectionPool:
+    """Idle TLS connections per peer for the next request, and TLS sessions to resume new ones with
+
+    One client context lives as long as the pool, so a fresh connection to a known peer
+    resumes the last session instead of doing a full handshake. A connection is only
+    pooled after the receiver agreed to keep it alive and the exchange on it finished.
+
+    With multiplex, requests to a peer are streams of one shared connection instead,
+    run concurrently; peers that decline the upgrade get plain connections from then on.
+    """
+
+    def __init__(self, keepalive_timeout: float = KEEPALIVE_TIMEOUT, max_idle_per_peer: int = MAX_IDLE_PER_PEER,
+                 multiplex: bool = True, window: int = MUX_WINDOW_SIZE):
+        self.context = CryptoManager.create_ssl_client_context()
+        # Give idle connections back well before the receiver's own timeout closes them
+        self.max_idle = keepalive_timeout / 2
+        self.max_idle_per_peer = max_idle_per_peer
+        self._idle = {}  # (ip, port) -> [(ssock, idle since), ...], most recent last
+        self._sessions = {}  # (ip, port) -> ssl.SSLSession
+        self._keep_alive = weakref.WeakSet()  # Connections whose receiver agreed to keep-alive
+        self._reusable = weakref.WeakSet()  # Connections whose last exchange completed cleanly
+        self.multiplex = multiplex
+        self.window = window
+        self._muxed = {}  # (ip, port) -> [MuxConnection, ...] shared by concurrent requests
+        self._legacy = set()  # Peers that closed the connection on the upgrade request
+        self._connecting = {}  # (ip, port) -> lock, so concurrent first requests share one new connection
+        self._lock = threading.Lock()
+        self.created = 0
+        self.resumed = 0
+        self.reused = 0
+
+    def connection(self, peer_ip: str, port: int, dedicated: bool = False) -> 'PooledConnection':
+        """Context manager yielding a stream or idle connection to the peer, or a new one
+
+        A dedicated stream gets a connection of its own, e.g. for one stripe of a striped transfer.
+        """
+        return PooledConnection(self, peer_ip, port, dedicated)
+
+    def open_stream(self, peer_ip: str, port: int, dedicated: bool = False,
+                    timeout: float = CONNECT_TIMEOUT) -> Optional[MuxStream]:
+        """A new stream to the peer, or None when it only speaks the sentinel protocol"""
+        key = (peer_ip, port)
+        if not self.multiplex or key in self._legacy:
+            return None
+        if dedicated:
+            connection = self._connect_multiplexed(peer_ip, port, timeout)
+        else:
+            with self._lock:
+                gate = self._connecting.setdefault(key, threading.Lock())
+            with gate:
+                connection = self._shared(key)
+                if connection is None:
+                    connection = self._connect_multiplexed(peer_ip, port, timeout)
+                    if connection is not None:
+                        with self._lock:
+                            self._muxed.setdefault(key, []).append(connection)
+                else:
+                    with self._lock:
+                        self.reused += 1
+        if connection is None:
+            return None
+        stream = connection.open_stream()
+        stream.settimeout(timeout)
+        return stream
+
+    def _shared(self, key) -> Optional[MuxConnection]:
+        """An open connection to the peer with room for another stream; drops closed and long idle ones"""
+        with self._lock:
+            connections = self._muxed.get(key, [])
+            stale = [connection for connection in connections
+                     if connection.closed or connection.idle_for() > self._max_idle(connection)]
+            connections[:] = [connection for connection in connections if connection not in stale]
+        for connection in stale:
+            connection.close()
+        for connection in connections:
+            if connection.active_streams() < MAX_STREAMS:
+                return connection
+        return None
+
+    def _max_idle(self, connection: MuxConnection) -> float:
+        # The receiver closes idle connections after its own timeout, which it announced
+        return min(self.max_idle, connection.settings.get('idle_timeout', self.max_idle * 2) / 2)
+
+    def _connect_multiplexed(self, peer_ip: str, port: int, timeout: float) -> Optional[MuxConnection]:
+        ssock = self.connect(peer_ip, port, timeout)
+        try:
+            connection = MuxConnection.connect(ssock, self.window)
+        except Exception:
+            self._close(ssock)
+            raise
+        if connection is None:
+            print(f"ℹ️  {peer_ip} does not multiplex, using one connection per request")
+            self._close(ssock)
+            with self._lock:
+                self._legacy.add((peer_ip, port))
+            return None
+        # The session ticket arrives after the handshake, so it is only there now
+        self._remember_session((peer_ip, port), ssock)
+        threading.Thread(target=connection.read_loop, daemon=True).start()
+        return connection
+
+    def acquire(self, peer_ip: str, port: int, timeout: float = CONNECT_TIMEOUT) -> ssl.SSLSocket:
+        key = (peer_ip, port)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                ssock, since = idle.pop()
+            if time.monotonic() - since < self.max_idle and self._is_open(ssock):
+                ssock.settimeout(timeout)
+                with self._lock:
+                    self.reused += 1
+                return ssock
+            self._close(ssock)
+        return self.connect(peer_ip, port, timeout)
+
+    def connect(self, peer_ip: str, port: int, timeout: float = CONNECT_TIMEOUT) -> ssl.SSLSocket:
+        """A new connection, resuming the peer's last TLS session when there is one"""
+        with self._lock:
+            session = self._sessions.get((peer_ip, port))
+        sock = socket.create_connection((peer_ip, port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            ssock = self.context.wrap_socket(sock, server_hostname=peer_ip, session=session)
+        except Exception:
+            sock.close()
+            raise
+        with self._lock:
+            self.created += 1
+            if ssock.session_reused:
+                self.resumed += 1
+        return ssock
+
+    def mark_keep_alive(self, ssock):
+        """The receiver will wait for another request on this connection"""
+        self._keep_alive.add(ssock)
+
+    def mark_reusable(self, ssock):
+        """The request on this connection completed and nothing is left unread"""
+        self._reusable.add(ssock)
+
+    def release(self, peer_ip: str, port: int, ssock):
+        """Pool the connection if it can take another request, otherwise close it"""
+        key = (peer_ip, port)
+        self._remember_session(key, ssock)
+        if ssock not in self._keep_alive or ssock not in self._reusable:
+            self._close(ssock)
+            return
+        self._reusable.discard(ssock)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((ssock, time.monotonic()))
+            surplus = idle[:-self.max_idle_per_peer] if len(idle) > self.max_idle_per_peer else []
+            del idle[:len(surplus)]
+        for old, _ in surplus:
+            self._close(old)
+
+    def _remember_session(self, key, ssock):
+        try:
+            session = ssock.session
+        except (OSError, ValueError):
+            return
+        if session is not None:
+            with self._lock:
+                self._sessions[key] = session
+
+    @staticmethod
+    def _is_open(ssock) -> bool:
+        """An idle connection must have nothing to read; readable means the peer closed it"""
+        try:
+            if ssock.pending():
+                return False
+            readable, _, _ = select.select([ssock], [], [], 0)
+            return not readable
+        except (OSError, ValueError):
+            return False
+
+    @staticmethod
+    def _close(ssock):
+        try:
+            ssock.close()
+        except OSError:
+            pass
+
+    def close(self):
+        """Close every idle connection and every multiplexed one"""
+        with self._lock:
+            idle = [ssock for connections in self._idle.values() for ssock, _ in connections]
+            self._idle.clear()
+            muxed = [connection for connections in self._muxed.values() for connection in connections]
+            self._muxed.clear()
+        for ssock in idle:
+            self._close(ssock)
+        for connection in muxed:
+            connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(connections) for connections in self._idle.values())
+            muxed = sum(len(connections) for connections in self._muxed.values())
+            return {'created': self.created, 'resumed': self.resumed, 'reused': self.reused, 'idle': idle,
+                    'multiplexed': muxed}
+
+
+class PooledConnection:
+    """with pool.connection(ip, port) as ssock: the connection goes back to the pool on exit if it can"""
+
+    def __init__(self, pool: ConnectionPool, peer_ip: str, port: int, dedicated: bool = False):
+        self.pool = pool
+        self.peer_ip = peer_ip
+        self.port = port
+        self.dedicated = dedicated
+        self.ssock = None
+        self.stream = None
+
+    def __enter__(self):
+        self.stream = self.pool.open_stream(self.peer_ip, self.port, self.dedicated)
+        if self.stream is not None:
+            return self.stream
+        self.ssock = self.pool.acquire(self.peer_ip, self.port)
+        return self.ssock
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.stream is not None:
+            self.stream.close()
+            if self.dedicated:
+                self.stream.connection.close()
+            return False
+        if exc_type is not None:
+            self.pool._reusable.discard(self.ssock)
+        self.pool.release(self.peer_ip, self.port, self.ssock)
+        return False
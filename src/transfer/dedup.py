@@ -0,0 +1,296 @@
+import base64
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Optional
+
+from utils.crypto import StreamCipher
+from utils.file_index import FileIndex
+from utils.hashing import HashManager
+from .archive import FrameInputStream, FrameOutputStream
+from .framing import FRAME_CHUNK_LIST, FrameReader, FrameWriter
+
+try:
+    from fastcdc.fastcdc_cy import fastcdc_cy as _fastcdc
+except ImportError:
+    _fastcdc = None
+
+CHUNK_HASH = 'blake2b-256'
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+CHUNK_ENTRY = struct.Struct('>32sI')  # digest, length
+CHUNK_LIST_FRAME_ENTRIES = 65536
+
+DEFAULT_CHUNK_STORE = '~/.filesync/chunks'
+CHUNK_STORE_LIMIT = 8 * 1024 * 1024 * 1024
+PRUNE_GRACE_SECONDS = 3600  # Chunks offered or stored this recently are never pruned
+
+# Gear table for the pure Python chunker: one pseudo-random 32-bit value per byte
+GEAR = [int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=4).digest(), 'big') for i in range(256)]
+_AVG_BITS = CHUNK_AVG_SIZE.bit_length() - 1
+# Normalized chunking: a stricter mask before the average size, a looser one after it.
+# The masks test high bits, which depend on the last 32 bytes rather than the last few.
+MASK_S = ((1 << (_AVG_BITS + 1)) - 1) << (32 - _AVG_BITS - 1)
+MASK_L = ((1 << (_AVG_BITS - 1)) - 1) << (32 - _AVG_BITS + 1)
+
+
+def chunk_digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def _cut_point(data, min_size: int = CHUNK_MIN_SIZE, normal_size: int = CHUNK_AVG_SIZE,
+               max_size: int = CHUNK_MAX_SIZE) -> int:
+    """Length of the next chunk at the start of data (FastCDC with a gear rolling hash)"""
+    size = len(data)
+    if size <= min_size:
+        return size
+    normal = min(normal_size, size)
+    end = min(max_size, size)
+    gear = GEAR
+    h = 0
+    for position, byte in enumerate(data[min_size:normal], min_size + 1):
+        h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+        if not h & MASK_S:
+            return position
+    for position, byte in enumerate(data[normal:end], normal + 1):
+        h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+        if not h & MASK_L:
+            return position
+    return end
+
+
+def fast_chunking() -> bool:
+    """Whether the compiled fastcdc chunker is installed; the gear fallback only manages a few MB/s"""
+    return _fastcdc is not None
+
+
+def _cut_points(view):
+    """(offset, length) of every content-defined chunk; the compiled fastcdc is used when installed"""
+    if _fastcdc is not None:
+        for chunk in _fastcdc(view, CHUNK_MIN_SIZE, CHUNK_AVG_SIZE, CHUNK_MAX_SIZE):
+            yield chunk.offset, chunk.length
+        return
+    offset = 0
+    while offset < len(view):
+        length = _cut_point(bytes(view[offset:offset + CHUNK_MAX_SIZE]))
+        yield offset, length
+        offset += length
+
+
+def chunk_file(file_path: str, hash_algorithm: str, index: Optional[FileIndex] = None) -> tuple:
+    """Split a file at content-defined boundaries; returns ([(digest, length), ...], file checksum)
+
+    Boundaries follow the content, so an insertion only changes the chunks around it.
+    With an index, an unchanged file is not read again.
+    """
+    if index is None:
+        return _chunk_file(file_path, hash_algorithm)
+    chunker = 'fastcdc' if _fastcdc is not None else 'gear'
+    encoded = index.cached(
+        file_path, f"chunks:{CHUNK_HASH}:{chunker}:{hash_algorithm}",
+        lambda: _encode_chunk_file(*_chunk_file(file_path, hash_algorithm))
+    )
+    checksum, _, entries = encoded.partition(b'\n')
+    return list(CHUNK_ENTRY.iter_unpack(entries)), checksum.decode()
+
+
+def _encode_chunk_file(chunks: list, checksum: str) -> bytes:
+    return checksum.encode() + b'\n' + b''.join(CHUNK_ENTRY.pack(digest, length) for digest, length in chunks)
+
+
+def _chunk_file(file_path: str, hash_algorithm: str) -> tuple:
+    file_hash = HashManager.new(hash_algorithm)
+    chunks = []
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return chunks, file_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset, length in _cut_points(view):
+                    data = view[offset:offset + length]
+                    chunks.append((chunk_digest(data), length))
+                    file_hash.update(data)
+                    data.release()
+            finally:
+                view.release()
+    return chunks, file_hash.hexdigest()
+
+
+def write_chunk_list(writer: FrameWriter, chunks: list, cipher: Optional[StreamCipher]):
+    """Send the chunk digests and lengths ahead of the bodies, in compressed (and sealed) frames"""
+    for start in range(0, len(chunks), CHUNK_LIST_FRAME_ENTRIES):
+        encoded = b''.join(
+            CHUNK_ENTRY.pack(digest, length) for digest, length in chunks[start:start + CHUNK_LIST_FRAME_ENTRIES]
+        )
+        payload = zlib.compress(encoded, 1)
+        if cipher:
+            payload = cipher.seal(payload)
+        writer.write_frame(payload, FRAME_CHUNK_LIST)
+
+
+def _inflate(payload, limit: int, what: str) -> bytes:
+    """Decompress payload, refusing anything that inflates past the limit the caller already knows"""
+    inflater = zlib.decompressobj()
+    encoded = inflater.decompress(payload, limit)
+    if inflater.unconsumed_tail:
+        raise ValueError(f"{what} inflates past {limit} bytes")
+    if not inflater.eof:
+        raise ValueError(f"{what} is truncated")
+    return encoded
+
+
+def read_chunk_list(reader: FrameReader, cipher: Optional[StreamCipher], count: int) -> list:
+    chunks = []
+    while len(chunks) < count:
+        frame_type, _, payload = reader.read_frame()
+        if frame_type != FRAME_CHUNK_LIST:
+            raise ValueError(f"Expected chunk list frame, got type {frame_type}")
+        if cipher:
+            payload = cipher.open(payload)
+        encoded = _inflate(payload, (count - len(chunks)) * CHUNK_ENTRY.size, "Chunk list frame")
+        if len(encoded) % CHUNK_ENTRY.size:
+            raise ValueError("Chunk list frame ends inside an entry")
+        chunks.extend(CHUNK_ENTRY.iter_unpack(encoded))
+    if len(chunks) != count:
+        raise ValueError("Chunk list does not match the announced chunk count")
+    return chunks
+
+
+def encode_missing(missing: list) -> str:
+    """Pack one bit per chunk for the reply to the sender"""
+    bitmap = bytearray((len(missing) + 7) // 8)
+    for index, needed in enumerate(missing):
+        if needed:
+            bitmap[index >> 3] |= 1 << (index & 7)
+    return base64.b64encode(zlib.compress(bytes(bitmap))).decode()
+
+
+def decode_missing(encoded: str, count: int) -> list:
+    # zlib reads a limit of 0 as no limit at all
+    bitmap = _inflate(base64.b64decode(encoded), max((count + 7) // 8, 1), "Missing-chunk bitmap")
+    if len(bitmap) != (count + 7) // 8:
+        raise ValueError("Missing-chunk bitmap does not match the chunk list")
+    return [bool(bitmap[index >> 3] & (1 << (index & 7))) for index in range(count)]
+
+
+def write_chunk_bodies(file_path: str, chunks: list, missing: list, output: FrameOutputStream):
+    """Send only the chunks the receiver asked for, in file order"""
+    offset = 0
+    with open(file_path, 'rb') as f:
+        for (_, length), needed in zip(chunks, missing):
+            if needed:
+                f.seek(offset)
+                data = f.read(length)
+                if len(data) != length:
+                    raise IOError(f"{file_path} changed during transfer")
+                output.write(data)
+            offset += length
+    output.close()
+
+
+class ChunkStore:
+    """Chunks from earlier transfers, one file per chunk named by its hash, pruned least recently used first"""
+
+    def __init__(self, root: str = DEFAULT_CHUNK_STORE, limit: int = CHUNK_STORE_LIMIT):
+        self.root = os.path.expanduser(root)
+        self.limit = limit
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, digest: bytes) -> str:
+        name = digest.hex()
+        return os.path.join(self.root, name[:2], name)
+
+    def has(self, digest: bytes) -> bool:
+        """True if the chunk is stored; touching it keeps it out of the next prune"""
+        try:
+            os.utime(self._path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def missing(self, chunks: list) -> list:
+        """Which chunks must be sent; repeats inside the file are sent once and reused afterwards"""
+        wanted = set()
+        result = []
+        for digest, _ in chunks:
+            needed = digest not in wanted and not self.has(digest)
+            if needed:
+                wanted.add(digest)
+            result.append(needed)
+        return result
+
+    def get(self, digest: bytes) -> bytes:
+        with open(self._path(digest), 'rb') as f:
+            return f.read()
+
+    def put(self, digest: bytes, data: bytes):
+        path = self._path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+
+    def _entries(self) -> list:
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def prune(self):
+        """Delete the least recently used chunks until the store fits its size limit"""
+        with self._lock:
+            if self._size is not None and self._size <= self.limit:
+                return
+            entries = self._entries()
+            self._size = sum(size for _, size, _ in entries)
+            if self._size <= self.limit:
+                return
+            cutoff = time.time() - PRUNE_GRACE_SECONDS
+            for mtime, size, path in sorted(entries):
+                if self._size <= self.limit or mtime > cutoff:
+                    break
+                try:
+                    os.unlink(path)
+                    self._size -= size
+                except FileNotFoundError:
+                    pass
+
+
+def receive_chunks(source: FrameInputStream, chunks: list, missing: list, store: ChunkStore,
+                   file, file_hash) -> int:
+    """Rebuild a file from stored chunks and the ones arriving on source; returns bytes reused"""
+    reused = 0
+    for (digest, length), needed in zip(chunks, missing):
+        if needed:
+            data = source.read_exactly(length)
+            if chunk_digest(data) != digest:
+                raise ValueError("Received chunk does not match its hash")
+            store.put(digest, data)
+        else:
+            data = store.get(digest)
+            if len(data) != length:
+                raise ValueError("Stored chunk has the wrong length")
+            reused += length
+        file.write(data)
+        file_hash.update(data)
+    source.drain()
+    return reused
@@ -0,0 +1,223 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import zlib
+from typing import Callable, Optional
+
+from utils.file_index import FileIndex
+from .archive import FrameInputStream, FrameOutputStream
+from .framing import FRAME_SIGNATURES, FrameReader, FrameWriter
+
+DELTA_MIN_BLOCK = 4 * 1024
+DELTA_MAX_BLOCK = 128 * 1024
+SIGNATURE = struct.Struct('>I16s')  # adler32 weak sum, blake2b-128 strong sum
+SIGNATURE_FRAME_ENTRIES = 65536
+ADLER_MOD = 65521
+# After one block of byte-by-byte rolling finds nothing, only block-aligned positions are
+# probed for this many blocks before rolling again, so rewritten regions don't crawl
+DELTA_SKIP_BLOCKS = 16
+LITERAL_PIECE = 1024 * 1024
+
+OP_COPY = b'C'  # start block, block count
+OP_LITERAL = b'L'  # length, then the bytes
+OP_END = b'E'
+COPY_OP = struct.Struct('>II')
+LITERAL_OP = struct.Struct('>I')
+
+
+def delta_block_size(file_size: int) -> int:
+    """Roughly sqrt(size) like rsync, rounded to a power of two and clamped"""
+    size = 1 << max(0, math.isqrt(max(file_size, 1)).bit_length() - 1)
+    return min(DELTA_MAX_BLOCK, max(DELTA_MIN_BLOCK, size))
+
+
+def strong_sum(block) -> bytes:
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def compute_signatures(file_path: str, block_size: int, index: Optional[FileIndex] = None) -> list:
+    """(weak, strong) sums of every full block of the receiver's existing copy"""
+    if index is not None:
+        encoded = index.cached(
+            file_path, f"signatures:{block_size}",
+            lambda: b''.join(SIGNATURE.pack(*entry) for entry in compute_signatures(file_path, block_size))
+        )
+        return list(SIGNATURE.iter_unpack(encoded))
+    signatures = []
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            signatures.append((zlib.adler32(block), strong_sum(block)))
+    return signatures
+
+
+def write_signatures(writer: FrameWriter, signatures: list):
+    for start in range(0, len(signatures), SIGNATURE_FRAME_ENTRIES):
+        writer.write_frame(
+            b''.join(SIGNATURE.pack(*entry) for entry in signatures[start:start + SIGNATURE_FRAME_ENTRIES]),
+            FRAME_SIGNATURES
+        )
+
+
+def read_signatures(reader: FrameReader, count: int) -> list:
+    signatures = []
+    while len(signatures) < count:
+        frame_type, _, payload = reader.read_frame()
+        if frame_type != FRAME_SIGNATURES:
+            raise ValueError(f"Expected signature frame, got type {frame_type}")
+        signatures.extend(SIGNATURE.iter_unpack(payload))
+    if len(signatures) != count:
+        raise ValueError("Signature list does not match the announced block count")
+    return signatures
+
+
+class DeltaEncoder:
+    """Turn a new file into copy/literal instructions against the receiver's block signatures"""
+
+    def __init__(self, signatures: list, block_size: int):
+        self.block_size = block_size
+        self.table = {}
+        for index, (weak, strong) in enumerate(signatures):
+            self.table.setdefault(weak, []).append((strong, index))
+        self.copied = 0
+        self._pending_copy = None
+        self._literal_start = 0
+
+    def _match(self, view, pos: int, weak: int) -> Optional[int]:
+        candidates = self.table.get(weak)
+        if not candidates:
+            return None
+        strong = strong_sum(view[pos:pos + self.block_size])
+        for candidate, index in candidates:
+            if candidate == strong:
+                return index
+        return None
+
+    def _roll(self, view, pos: int, weak: int) -> tuple:
+        """Slide the window a byte at a time for up to one block; returns (block index or None, position)"""
+        block_size = self.block_size
+        table = self.table
+        a, b = weak & 0xFFFF, weak >> 16
+        end = min(pos + block_size, len(view) - block_size)
+        while pos < end:
+            out, new = view[pos], view[pos + block_size]
+            a = (a - out + new) % ADLER_MOD
+            b = (b - block_size * out + a - 1) % ADLER_MOD
+            pos += 1
+            weak = (b << 16) | a
+            if weak in table:
+                index = self._match(view, pos, weak)
+                if index is not None:
+                    return index, pos
+        return None, pos
+
+    def _emit_literal(self, view, end: int, output: FrameOutputStream):
+        self._flush_copy(output)
+        for start in range(self._literal_start, end, LITERAL_PIECE):
+            piece = view[start:min(end, start + LITERAL_PIECE)]
+            output.write(OP_LITERAL + LITERAL_OP.pack(len(piece)))
+            output.write(piece)
+
+    def _emit_copy(self, view, pos: int, index: int, output: FrameOutputStream):
+        if pos > self._literal_start:
+            self._emit_literal(view, pos, output)
+        if self._pending_copy and self._pending_copy[0] + self._pending_copy[1] == index:
+            self._pending_copy[1] += 1
+        else:
+            self._flush_copy(output)
+            self._pending_copy = [index, 1]
+        self.copied += self.block_size
+        self._literal_start = pos + self.block_size
+
+    def _flush_copy(self, output: FrameOutputStream):
+        if self._pending_copy:
+            output.write(OP_COPY + COPY_OP.pack(*self._pending_copy))
+            self._pending_copy = None
+
+    def encode(self, view, output: FrameOutputStream, progress_callback: Optional[Callable] = None):
+        """Write the instructions for the whole of view, then OP_END"""
+        block_size = self.block_size
+        size = len(view)
+        pos = 0
+        while pos + block_size <= size:
+            weak = zlib.adler32(view[pos:pos + block_size])
+            index = self._match(view, pos, weak)
+            if index is None:
+                index, pos = self._roll(view, pos, weak)
+            if index is not None:
+                self._emit_copy(view, pos, index, output)
+                pos += block_size
+            else:
+                # Probably rewritten rather than shifted: probe aligned blocks only for a while
+                for _ in range(DELTA_SKIP_BLOCKS):
+                    if pos + block_size > size:
+                        break
+                    index = self._match(view, pos, zlib.adler32(view[pos:pos + block_size]))
+                    if index is not None:
+                        self._emit_copy(view, pos, index, output)
+                        pos += block_size
+                        break
+                    pos += block_size
+            if progress_callback:
+                progress_callback(pos, size, "Sending")
+        self._emit_literal(view, size, output)
+        self._flush_copy(output)
+        output.write(OP_END)
+
+
+def write_delta(file_path: str, signatures: list, block_size: int, output: FrameOutputStream,
+                file_hash, progress_callback: Optional[Callable] = None) -> int:
+    """Stream a file as a delta against the signatures; returns the bytes the receiver copies locally"""
+    encoder = DeltaEncoder(signatures, block_size)
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            output.write(OP_END)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    if file_hash is not None:
+                        file_hash.update(view)
+                    encoder.encode(view, output, progress_callback)
+                finally:
+                    view.release()
+    output.close()
+    return encoder.copied
+
+
+def apply_delta(source: FrameInputStream, basis_path: str, block_size: int, block_count: int,
+                file, file_hash) -> int:
+    """Rebuild the new file from the old copy and the sender's instructions; returns bytes copied"""
+    copied = 0
+    with open(basis_path, 'rb') as basis:
+        while True:
+            op = source.read_exactly(1)
+            if op == OP_END:
+                break
+            if op == OP_COPY:
+                start, count = COPY_OP.unpack(source.read_exactly(COPY_OP.size))
+                if start + count > block_count:
+                    raise ValueError("Delta copies a block outside the existing file")
+                basis.seek(start * block_size)
+                remaining = count * block_size
+                while remaining:
+                    data = basis.read(min(remaining, LITERAL_PIECE))
+                    if not data:
+                        raise ValueError("Existing file shrank during delta transfer")
+                    file.write(data)
+                    file_hash.update(data)
+                    remaining -= len(data)
+                copied += count * block_size
+            elif op == OP_LITERAL:
+                length, = LITERAL_OP.unpack(source.read_exactly(LITERAL_OP.size))
+                data = source.read_exactly(length)
+                file.write(data)
+                file_hash.update(data)
+            else:
+                raise ValueError(f"Unknown delta instruction: {op!r}")
+    source.drain()
+    return copied
@@ -3,33 +3,67 @@ import os
 import threading
 import time
 from utils.crypto import CryptoManager
+from utils.compression import CompressionManager, CompressionMethod
 from .streaming import StreamManager
-from .protocols import TransferProtocol
+from .protocols import (
+    TransferProtocol, ACCEPTED_KEEP_ALIVE, CODEC_END, DEDUP_END, DELTA_END, RESUME_END, SYNC_END, busy_reply
+)
+from .resume import ResumeJournal
+from .striping import StripedTransfer
+from .archive import unique_path
+from .bulk import _safe_relative_path
+from .dedup import CHUNK_HASH, CHUNK_STORE_LIMIT, ChunkStore, encode_missing
+from .delta import compute_signatures, delta_block_size, write_signatures
+from .framing import FrameWriter
+from .sync import SYNC_LOCK_WAIT, FolderSync, SyncState, folder_lock
+from .async_receiver import LISTEN_BACKLOG, AsyncReceiverServer
+from .scheduler import MAX_ACTIVE_TRANSFERS, TRANSFER_QUEUE_SIZE, QUEUE_TIMEOUT, TransferScheduler
+from .connection_pool import KEEPALIVE_TIMEOUT
+from .mux import MUX_UPGRADE, MUX_WINDOW_SIZE, MuxConnection, SocketTransport
 
 
 class FileReceiver:
-    def __init__(self, port=8889, cert_dir="~/.filesync/certs"):
+    def __init__(self, port=8889, cert_dir="~/.filesync/certs", transfer_config=None):
         self.port = port
         self.cert_dir = os.path.expanduser(cert_dir)
         self.client_threads = []
+        self.client_threads_lock = threading.Lock()  # Accept loop and mux readers add threads concurrently
 
         os.makedirs(self.cert_dir, exist_ok=True)
 
         self.transfer_socket = None
         self.receiver_running = False
+        self.async_server = None
         self.receiver_thread = threading.Thread(
             target=self._receiver_loop,
             daemon=False
         )
         self.current_user = None
         self.download_dir = None
-        self.transfer_config = None
-        self.stream_manager = StreamManager()
+        self.transfer_config = transfer_config
+        self.encryption_password = None
+        self.stream_manager = StreamManager(transfer_config)
         self.protocol = TransferProtocol()
+        self.striped_transfers = {}
+        self.striped_lock = threading.Lock()
+        self.chunk_store = ChunkStore(
+            limit=(transfer_config.get_setting('chunk_store_limit') if transfer_config else None) or CHUNK_STORE_LIMIT
+        )
+        setting = transfer_config.get_setting if transfer_config else lambda key: None
+        self.scheduler = TransferScheduler(
+            setting('max_active_transfers') or MAX_ACTIVE_TRANSFERS,
+            TRANSFER_QUEUE_SIZE if setting('transfer_queue_size') is None else setting('transfer_queue_size')
+        )
+        self.queue_timeout = setting('transfer_queue_timeout') or QUEUE_TIMEOUT
+        keepalive = setting('keepalive_timeout')
+        self.keepalive_timeout = KEEPALIVE_TIMEOUT if keepalive is None else keepalive
+        self.multiplex = setting('multiplex') is not False
+        self.mux_window = setting('mux_window') or MUX_WINDOW_SIZE
 
     def start_receiver(self, download_dir: str):
         """Start file receiver in a separate thread"""
         self.stop_receiver()  # Ensure previous receiver is stopped
+        self.stream_manager.transfer_config = self.transfer_config
         time.sleep(0.5)  # Increased delay to ensure socket release
         
         try:
@@ -38,15 +72,11 @@ class FileReceiver:
             self.transfer_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             
             self.transfer_socket.bind(('', self.port))
-            self.transfer_socket.listen(5)
+            self.transfer_socket.listen(LISTEN_BACKLOG)
             self.receiver_running = True
             self.download_dir = download_dir
             
-            self.receiver_thread = threading.Thread(
-                target=self._receiver_loop, 
-                daemon=True
-            )
-            self.receiver_thread.start()
+            self._start_receiver_thread()
             print(f"✅ File receiver started on port {self.port}")
             
         except OSError as e:
@@ -70,15 +100,11 @@ class FileReceiver:
                 self.transfer_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                 
                 self.transfer_socket.bind(('', self.port))
-                self.transfer_socket.listen(5)
+                self.transfer_socket.listen(LISTEN_BACKLOG)
                 self.receiver_running = True
                 self.download_dir = download_dir
                 
-                self.receiver_thread = threading.Thread(
-                    target=self._receiver_loop, 
-                    daemon=True
-                )
-                self.receiver_thread.start()
+                self._start_receiver_thread()
                 print(f"✅ File receiver started on alternative port {self.port}")
                 return
                 
@@ -92,6 +118,19 @@ class FileReceiver:
         # If all ports fail
         raise OSError("All attempted ports are busy")
 
+    def _start_receiver_thread(self):
+        """Run the accept loop on an asyncio event loop, or one thread per connection in "threads" mode"""
+        setting = self.transfer_config.get_setting if self.transfer_config else lambda key: None
+        if (setting('receiver_mode') or 'asyncio') == 'asyncio':
+            self.async_server = AsyncReceiverServer(
+                self, setting('receiver_workers') or 16, setting('max_connections_per_peer') or 8
+            )
+        self.receiver_thread = threading.Thread(
+            target=self._receiver_loop, 
+            daemon=True
+        )
+        self.receiver_thread.start()
+
     def _receiver_loop(self):
         """Main receiver loop that accepts incoming connections"""
 
@@ -106,11 +145,15 @@ class FileReceiver:
             CryptoManager.generate_ssl_certificates("FileSyncServer", cert_path)
 
         context = CryptoManager.create_ssl_server_context(self.cert_dir)
+        if self.async_server:
+            self.async_server.run(self.transfer_socket, context)
+            return
         
         while self.receiver_running:
             try:
                 self.transfer_socket.settimeout(1.0)
                 client_socket, client_address = self.transfer_socket.accept()
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 print(f"🔗 Connection from {client_address}")
                 
                 client_thread = threading.Thread(
@@ -119,7 +162,7 @@ class FileReceiver:
                     daemon=False
             )
                 client_thread.start()
-                self.client_threads.append(client_thread)
+                self._track_client_thread(client_thread)
                 
             except socket.timeout:
                 # Expected timeout, continue loop
@@ -133,49 +176,132 @@ class FileReceiver:
                 break
 
     def _handle_client(self, client_socket: socket.socket, context, client_address: tuple):
-        """Handle a client connection"""
+        """Handle a client connection, and further requests on it while the sender keeps it alive"""
         try:
             with context.wrap_socket(client_socket, server_side=True) as ssock:
                 # Receive request metadata
                 request_info = self.protocol.receive_request_metadata(ssock)
-                if not request_info:
+                if request_info and request_info.get('type') == MUX_UPGRADE and self.multiplex:
+                    self._serve_multiplexed(ssock, request_info, client_address[0])
                     return
-                
-                # Handle transfer request
-                if request_info.get('type') == 'transfer_request':
-                    self._handle_transfer_request(ssock, request_info)
+                while request_info:
+                    if not self._serve_request(ssock, request_info, client_address[0]):
+                        return
+                    if not self._keeps_alive(request_info):
+                        return
+                    request_info = self._wait_for_next_request(ssock)
                     
         except Exception as e:
             print(f"❌ Client handling error: {e}")
+        finally:
             try:
-                ssock.send(f"ERROR: {str(e)}".encode())
+                client_socket.close()
             except:
                 pass
+
+    def _serve_multiplexed(self, ssock, request_info, peer_ip: str):
+        """Read the frames of a multiplexed connection and serve each new stream in its own thread"""
+        connection = MuxConnection(
+            SocketTransport(ssock), self.mux_window, on_stream=lambda stream: self._start_stream(stream, peer_ip)
+        )
+        if connection.accept(request_info, self.keepalive_timeout):
+            connection.read_loop(self.keepalive_timeout, lambda: self.receiver_running)
+
+    def _start_stream(self, stream, peer_ip: str):
+        thread = threading.Thread(target=self._serve_stream, args=(stream, peer_ip), daemon=False)
+        thread.start()
+        self._track_client_thread(thread)
+
+    def _track_client_thread(self, thread: threading.Thread):
+        """Remember a handler thread for stop_receiver, dropping the ones that have finished"""
+        with self.client_threads_lock:
+            self.client_threads = [t for t in self.client_threads if t.is_alive()]
+            self.client_threads.append(thread)
+
+    def _serve_stream(self, stream, peer_ip: str):
+        """Serve the request that opened a stream; the stream closes with it"""
+        try:
+            request_info = self.protocol.receive_request_metadata(stream)
+            if request_info:
+                self._serve_request(stream, request_info, peer_ip)
+        except Exception as e:
+            print(f"❌ Client handling error: {e}")
         finally:
+            stream.close()
+
+    def _serve_request(self, ssock, request_info, peer_ip: str) -> bool:
+        """Handle one request in the threaded receiver; True if the connection can take another"""
+        if request_info.get('type') != 'transfer_request':
+            return self._handle_request(ssock, request_info)
+        
+        # Transfers wait for a slot; when the queue is full the sender is told when to retry
+        ticket = self.scheduler.wait_for_slot(peer_ip, self.queue_timeout)
+        if ticket is None:
+            self.protocol.send_status(ssock, busy_reply(self.scheduler.retry_after()))
+            return False
+        try:
+            return self._handle_request(ssock, request_info)
+        finally:
+            self.scheduler.release(ticket)
+
+    def _keeps_alive(self, request_info) -> bool:
+        return bool(request_info.get('keep_alive')) and self.keepalive_timeout > 0
+
+    def _wait_for_next_request(self, ssock):
+        """Next request on a kept-alive connection, or None once the sender closes it or stays idle"""
+        ssock.settimeout(self.keepalive_timeout)
+        try:
+            request_info = self.protocol.receive_request_metadata(ssock)
+        except OSError:
+            return None
+        ssock.settimeout(None)
+        return request_info
+
+    def _handle_request(self, ssock, request_info) -> bool:
+        """Dispatch one request; runs in a worker thread in either receiver mode
+
+        Returns True when the request completed and left nothing unread on the connection.
+        """
+        try:
+            if request_info.get('type') == 'transfer_request':
+                return self._handle_transfer_request(ssock, request_info)
+            elif request_info.get('type') == 'stripe':
+                self._handle_stripe(ssock, request_info)
+            elif request_info.get('type') == 'sync_request':
+                self._handle_sync_request(ssock, request_info)
+        except Exception as e:
+            print(f"❌ Client handling error: {e}")
             try:
-                client_socket.close()
+                self.protocol.send_status(ssock, f"ERROR: {str(e)}")
             except:
                 pass
+        return False
 
-    def _handle_transfer_request(self, ssock, request_info):
+    def _handle_transfer_request(self, ssock, request_info) -> bool:
         """Handle file transfer request"""
         accepted = self._prompt_for_acceptance(request_info)
         
         if accepted:
-            ssock.send("ACCEPTED".encode())
-            self._receive_file_data(ssock, request_info)
+            self.protocol.send_status(
+                ssock, ACCEPTED_KEEP_ALIVE if self._keeps_alive(request_info) else "ACCEPTED"
+            )
+            return self._receive_file_data(ssock, request_info)
         else:
-            ssock.send("DECLINED".encode())
+            self.protocol.send_status(ssock, "DECLINED")
+            return False
 
-    def _receive_file_data(self, ssock, request_info):
+    def _receive_file_data(self, ssock, request_info) -> bool:
         """Receive file data using streaming"""
         file_info = self.protocol.receive_file_metadata(ssock)
         if not file_info:
-            return
+            return False
+        if file_info.get('compression_offer'):
+            self._negotiate_compression(ssock, file_info)
         
         # Determine save path
         if file_info.get('is_folder', False):
-            save_path = os.path.join(self.download_dir, file_info.get('original_folder_name', file_info['file_name']))
+            folder_name = os.path.basename(file_info.get('original_folder_name', file_info['file_name']))
+            save_path = unique_path(os.path.join(self.download_dir, folder_name))
         else:
             save_path = os.path.join(self.download_dir, file_info['file_name'])
         
@@ -183,14 +309,173 @@ class FileReceiver:
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
         
         # Receive file with streaming
-        success = self.stream_manager.receive_streamed_file(ssock, save_path, file_info, request_info)
+        if file_info.get('is_folder') and file_info.get('archive'):
+            success = self.stream_manager.receive_streamed_folder(
+                ssock, save_path, file_info, request_info, self._get_encryption_password()
+            )
+        elif file_info.get('dedup'):
+            success = self._receive_deduplicated_file(ssock, save_path, file_info, request_info)
+        elif file_info.get('stripes'):
+            success = self._receive_striped_file(ssock, save_path, file_info, request_info)
+        else:
+            delta = self._offer_delta(ssock, save_path) if file_info.get('delta') else None
+            if delta:
+                success = self.stream_manager.receive_delta_file(
+                    ssock, save_path, file_info, request_info, self._get_encryption_password(), *delta
+                )
+            else:
+                journal = None
+                if file_info.get('resumable'):
+                    journal = self._negotiate_resume(ssock, save_path, file_info, request_info)
+                success = self.stream_manager.receive_streamed_file(
+                    ssock, save_path, file_info, request_info, self._get_encryption_password(), journal
+                )
         
         if success:
-            ssock.send("SUCCESS".encode())
+            self.protocol.send_status(ssock, "SUCCESS")
             item_type = "Folder" if file_info.get('is_folder') else "File"
             print(f"✅ {item_type} received: {os.path.basename(save_path)}")
         else:
-            ssock.send("ERROR: Transfer failed".encode())
+            self.protocol.send_status(ssock, "ERROR: Transfer failed")
+        return success
+
+    def _negotiate_compression(self, ssock, file_info):
+        """Pick the sender's best offered codec that this peer can decode"""
+        chosen = CompressionManager.choose_method(file_info['compression_offer'])
+        file_info['compression_method'] = chosen.value
+        self.protocol.send_message(ssock, {'compression_method': chosen.value}, CODEC_END)
+
+    def _receive_deduplicated_file(self, ssock, save_path, file_info, request_info):
+        """Rebuild the file from the chunk store plus the chunks the sender still has to send"""
+        if file_info['dedup'].get('chunk_hash') != CHUNK_HASH:
+            print(f"❌ Unsupported chunk hash: {file_info['dedup'].get('chunk_hash')}")
+            return False
+        return self.stream_manager.receive_deduplicated_file(
+            ssock, save_path, file_info, request_info, self._get_encryption_password(), self.chunk_store,
+            lambda missing: self.protocol.send_message(ssock, {'missing': encode_missing(missing)}, DEDUP_END)
+        )
+
+    def _offer_delta(self, ssock, save_path):
+        """Send block signatures of an existing copy so the sender streams only what changed"""
+        enabled = not self.transfer_config or self.transfer_config.get_setting('delta_transfers') is not False
+        signatures = []
+        if enabled and self._is_delta_basis(save_path):
+            block_size = delta_block_size(os.path.getsize(save_path))
+            signatures = compute_signatures(save_path, block_size, self.stream_manager.get_file_index())
+        if not signatures:
+            self.protocol.send_message(ssock, {'block_size': 0}, DELTA_END)
+            return None
+        
+        self.protocol.send_message(ssock, {'block_size': block_size, 'blocks': len(signatures)}, DELTA_END)
+        write_signatures(FrameWriter(ssock), signatures)
+        return block_size, len(signatures)
+
+    def _is_delta_basis(self, save_path: str) -> bool:
+        """True for a regular file directly in the download folder; the name comes from the sender"""
+        download_dir = os.path.realpath(self.download_dir)
+        try:
+            basis = os.path.join(download_dir, _safe_relative_path(os.path.basename(save_path)))
+        except ValueError:
+            return False
+        if os.path.realpath(save_path) != basis:
+            return False
+        return os.path.isfile(basis)
+
+    def _negotiate_resume(self, ssock, save_path, file_info, request_info):
+        """Offer the verified prefix of an interrupted attempt and agree on where to continue"""
+        journal = ResumeJournal.load(
+            save_path, request_info['request_id'], file_info['file_size'],
+            file_info.get('hash_algorithm', 'md5')
+        )
+        offered = journal.verify_part()
+        self.protocol.send_message(ssock, journal.offer(), RESUME_END)
+        reply = self.protocol.receive_message(ssock, RESUME_END)
+        journal.rewind(min(offered, (reply or {}).get('resume_offset', 0)))
+        if journal.offset:
+            print(f"⏩ Resuming {file_info['file_name']} at {self.stream_manager.format_size(journal.offset)}")
+        return journal
+
+    def _receive_striped_file(self, ssock, save_path, file_info, request_info):
+        """Preallocate the file and wait for every stripe connection to land its range"""
+        try:
+            transfer = StripedTransfer(
+                request_info['request_id'], save_path, file_info,
+                ssock.getpeername()[0], self._get_encryption_password()
+            )
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return False
+        
+        timeout = (self.transfer_config.get_setting('request_timeout') if self.transfer_config else None) or 120
+        with self.striped_lock:
+            self.striped_transfers[transfer.request_id] = transfer
+        try:
+            self.protocol.send_status(ssock, "READY")
+            while not transfer.completed.wait(1.0):
+                if not self.receiver_running or time.monotonic() - transfer.last_activity > timeout:
+                    transfer.abort()
+            return transfer.finish()
+        finally:
+            with self.striped_lock:
+                self.striped_transfers.pop(transfer.request_id, None)
+
+    def _handle_stripe(self, ssock, request_info):
+        """Receive one byte range for a striped transfer that was already accepted"""
+        with self.striped_lock:
+            transfer = self.striped_transfers.get(request_info.get('request_id'))
+        if not transfer or transfer.sender_ip != ssock.getpeername()[0]:
+            self.protocol.send_status(ssock, "DECLINED")
+            return
+        
+        index = request_info.get('stripe_index', -1)
+        try:
+            transfer.claim(index)
+        except ValueError as e:
+            self.protocol.send_status(ssock, f"ERROR: {e}")
+            return
+        
+        self.protocol.send_status(ssock, "ACCEPTED")
+        success = self.stream_manager.receive_stripe(ssock, transfer, index)
+        transfer.mark_landed(index, success)
+        self.protocol.send_status(ssock, "SUCCESS" if success else "ERROR: Stripe failed")
+
+    def _handle_sync_request(self, ssock, request_info):
+        """Serve a two-way sync of one of the folders listed in the sync_folders setting"""
+        folders = (self.transfer_config.get_setting('sync_folders') if self.transfer_config else None) or {}
+        folder = folders.get(request_info.get('folder'))
+        if not folder or not os.path.isdir(os.path.expanduser(folder)):
+            self.protocol.send_message(ssock, {'accepted': False, 'reason': 'Unknown sync folder'}, SYNC_END)
+            return
+        folder = os.path.expanduser(folder)
+        lock = folder_lock(folder)
+        # The previous session replies before it lets go of the folder, so its peer may already be back
+        if not lock.acquire(timeout=SYNC_LOCK_WAIT):
+            self.protocol.send_message(ssock, {'accepted': False, 'reason': 'Folder is already being synced'}, SYNC_END)
+            return
+        
+        state = SyncState(folder)
+        try:
+            if request_info.get('compression_offer'):
+                method = CompressionManager.choose_method(request_info['compression_offer'])
+            else:
+                method = CompressionMethod(request_info.get('compression_method', 0))
+            print(f"🔄 Sync of {request_info['folder']} requested by {request_info.get('sender', 'Unknown')}")
+            self.protocol.send_message(
+                ssock, {'accepted': True, 'replica': state.replica, 'compression_method': method.value}, SYNC_END
+            )
+            FolderSync(state, self.stream_manager, self.protocol, method).serve(ssock)
+            print(f"✅ Folder synced: {request_info['folder']}")
+        finally:
+            state.close()
+            lock.release()
+
+    def _get_encryption_password(self):
+        """Password used to open encrypted transfers"""
+        if self.encryption_password:
+            return self.encryption_password
+        if self.transfer_config:
+            return self.transfer_config.get_setting('decryption_password')
+        return None
 
     def _prompt_for_acceptance(self, request_info):
         """Prompt user to accept transfer"""
@@ -208,6 +493,8 @@ class FileReceiver:
     def stop_receiver(self):
         """Stop the file receiver with proper cleanup"""
         self.receiver_running = False
+        if self.async_server:
+            self.async_server.stop()
 
         # shutdown and close listening socket to unblock accept()
         if self.transfer_socket:
@@ -230,11 +517,15 @@ class FileReceiver:
                 print("⚠️ Receiver thread didn't terminate cleanly")
 
         # Wait for client handler threads to finish
-        for t in list(self.client_threads):
+        with self.client_threads_lock:
+            client_threads = list(self.client_threads)
+        for t in client_threads:
             if t.is_alive():
                 t.join(timeout=3.0)
 
         # Remove finished threads from list
-        self.client_threads = [t for t in self.client_threads if t.is_alive()]
+        with self.client_threads_lock:
+            self.client_threads = [t for t in self.client_threads if t.is_alive()]
+        self.async_server = None
 
         print("🛑 File receiver stopped")
\ No newline at end of file
@@ -1,30 +1,75 @@
 import socket
 import os
-import json
 import uuid
 import time
+import threading
+import functools
 from typing import Optional, Callable
-from utils.crypto import CryptoManager
+from utils.crypto import CryptoManager, StreamCipher
 from utils.compression import CompressionManager, CompressionMethod
+from utils.hashing import HashManager, DEFAULT_HASH_ALGORITHM
 from .streaming import StreamManager
+from .protocols import (
+    TransferProtocol, ReceiverBusy, parse_busy, ACCEPTED_KEEP_ALIVE,
+    CODEC_END, DEDUP_END, DELTA_END, METADATA_END, REQUEST_END, RESUME_END, SYNC_END
+)
+from .resume import RESUME_BLOCK_SIZE, hash_matching_prefix
+from .striping import plan_stripes, stripe_nonce_prefix
+from .archive import ARCHIVE_FORMAT, folder_size
+from .bulk import MANIFEST_FORMAT, build_manifest, manifest_size
+from .dedup import CHUNK_HASH, chunk_file, decode_missing, fast_chunking, write_chunk_list
+from .delta import read_signatures
+from .framing import FrameReader
+from .sync import FolderSync, SyncState, folder_lock, paths_fit
+from .connection_pool import KEEPALIVE_TIMEOUT, ConnectionPool
+from .mux import MUX_WINDOW_SIZE
+
+BUSY_WAIT_LIMIT = 600  # Seconds to keep retrying a receiver that answers busy
+
+
+def retry_when_busy(send):
+    """Run a send again after the delay a busy receiver asks for, up to busy_wait_limit seconds in total"""
+    @functools.wraps(send)
+    def wrapper(self, *args, **kwargs):
+        limit = self.stream_manager._get_setting('busy_wait_limit', BUSY_WAIT_LIMIT)
+        waited = 0
+        while True:
+            try:
+                return send(self, *args, **kwargs)
+            except ReceiverBusy as busy:
+                if waited + busy.retry_after > limit:
+                    return False, "Receiver is busy, try again later"
+                print(f"⏳ Receiver busy, retrying in {busy.retry_after}s")
+                time.sleep(busy.retry_after)
+                waited += busy.retry_after
+    return wrapper
 
 
 class FileSender:
-    def __init__(self, port=8889, cert_dir="~/.filesync/certs"):
+    def __init__(self, port=8889, cert_dir="~/.filesync/certs", transfer_config=None):
         self.port = port
         self.cert_dir = cert_dir
         self.current_user = None
-        self.stream_manager = StreamManager()
+        self.transfer_config = transfer_config
+        self.stream_manager = StreamManager(transfer_config)
+        self.protocol = TransferProtocol()
+        keepalive = transfer_config.get_setting('keepalive_timeout') if transfer_config else None
+        self.keep_alive = keepalive != 0
+        setting = transfer_config.get_setting if transfer_config else lambda key: None
+        self.pool = ConnectionPool(
+            KEEPALIVE_TIMEOUT if keepalive is None else keepalive, multiplex=setting('multiplex') is not False,
+            window=setting('mux_window') or MUX_WINDOW_SIZE
+        )
 
+    @retry_when_busy
     def send_file(self, file_path: str, recipient_ip: str, 
                  progress_callback: Optional[Callable] = None,
                  encryption_password: Optional[str] = None,
-                 compression_method: CompressionMethod = CompressionMethod.ZLIB) -> tuple:
+                 compression_method: CompressionMethod = CompressionMethod.ADAPTIVE) -> tuple:
         """Send file using streaming to handle large files"""
         if not os.path.exists(file_path):
             return False, "File does not exist"
             
-        file_name = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
         
         # Warn about large files
@@ -32,92 +77,480 @@ class FileSender:
             print(f"⚠️  Large file detected: {self.stream_manager.format_size(file_size)}")
             print("⏳ This may take several minutes...")
         
+        dedup = self._chunk_for_dedup(file_path, file_size)
+        streams = self._get_stripe_count(file_size)
+        if streams > 1 and not dedup:
+            return self._send_file_striped(
+                file_path, recipient_ip, progress_callback,
+                encryption_password, compression_method, streams
+            )
+        
+        # Chunks delivered by a failed deduplicated attempt are already in the receiver's store
+        resumable = not dedup and self._is_resumable(file_size)
+        request_id = self._resume_request_id(file_path, recipient_ip) if resumable else str(uuid.uuid4())
+        retries = (self.transfer_config.get_setting('transfer_retries') or 0) if resumable or dedup else 0
+        
+        for attempt in range(retries + 1):
+            success, message, retryable = self._send_file_attempt(
+                file_path, recipient_ip, request_id, resumable, progress_callback,
+                encryption_password, compression_method, dedup
+            )
+            if success or not retryable or attempt == retries:
+                return success, message
+            delay = min(2 ** attempt, 30)
+            print(f"🔄 {message} - resuming in {delay}s (retry {attempt + 1}/{retries})")
+            time.sleep(delay)
+
+    def _send_file_attempt(self, file_path: str, recipient_ip: str, request_id: str, resumable: bool,
+                           progress_callback: Optional[Callable], encryption_password: Optional[str],
+                           compression_method: CompressionMethod, dedup: Optional[tuple] = None) -> tuple:
+        """One connection's worth of send_file; returns (success, message, retryable)"""
+        file_name = os.path.basename(file_path)
+        file_size = os.path.getsize(file_path)
+        
         try:
-            context = CryptoManager.create_ssl_client_context()
-            with socket.create_connection((recipient_ip, self.port), timeout=120) as sock:
-                with context.wrap_socket(sock, server_hostname=recipient_ip) as ssock:
-                    
-                    # Send transfer request
-                    if not self._send_transfer_request(ssock, file_name, file_size, False):
-                        return False, "Transfer request failed"
-                    
-                    # Calculate checksum
-                    print("🔍 Calculating file checksum...")
-                    file_checksum = self.stream_manager.calculate_file_checksum(file_path)
+            with self.pool.connection(recipient_ip, self.port) as ssock:
+                
+                # Send transfer request
+                if not self._send_transfer_request(ssock, file_name, file_size, False, request_id, self.keep_alive):
+                    return False, "Transfer request failed", False
+                
+                # Derive the encryption key once for the whole transfer
+                cipher, encryption_salt = None, None
+                if encryption_password:
+                    cipher, encryption_salt = CryptoManager.create_stream_cipher(encryption_password)
+                
+                # Send file metadata
+                hash_algorithm = self.stream_manager.get_hash_algorithm()
+                extra = {'resumable': resumable}
+                if dedup:
+                    extra['dedup'] = {'chunks': len(dedup[0]), 'chunk_hash': CHUNK_HASH}
+                elif self._offers_delta(file_size):
+                    extra['delta'] = True
+                if not self._send_file_metadata(ssock, file_name, file_size,
+                                               encryption_salt, compression_method, False,
+                                               hash_algorithm, extra):
+                    return False, "Failed to send metadata", True
+                compression_method = self._negotiate_compression(ssock, compression_method)
+                delta = self._negotiate_delta(ssock) if extra.get('delta') else None
+                
+                if dedup:
+                    chunks, checksum = dedup
+                    missing = self._negotiate_dedup(ssock, chunks, cipher)
+                    success = self.stream_manager.stream_deduplicated_file(
+                        ssock, file_path, chunks, missing, checksum,
+                        cipher, compression_method, progress_callback
+                    )
+                elif delta:
+                    block_size, signatures = delta
+                    success = self.stream_manager.stream_delta_file(
+                        ssock, file_path, file_size, signatures, block_size,
+                        cipher, compression_method, progress_callback, hash_algorithm
+                    )
+                else:
+                    # Skip whatever an earlier attempt already delivered
+                    offset, file_hash = 0, None
+                    if resumable:
+                        offset, file_hash = self._negotiate_resume(ssock, file_path, hash_algorithm)
+                        if offset:
+                            print(f"⏩ Resuming at {self.stream_manager.format_size(offset)}")
                     
-                    # Send file metadata
-                    if not self._send_file_metadata(ssock, file_name, file_size, file_checksum, 
-                                                   encryption_password, compression_method, False):
-                        return False, "Failed to send metadata"
+                    stream_progress = progress_callback
+                    if progress_callback and offset:
+                        def stream_progress(sent, total, stage):
+                            progress_callback(offset + sent, file_size, stage)
                     
                     # Stream file data
                     success = self.stream_manager.stream_file_data(
                         ssock, file_path, file_size, 
-                        encryption_password, compression_method, 
-                        progress_callback
+                        cipher, compression_method, 
+                        stream_progress, hash_algorithm,
+                        offset, file_size - offset, file_hash
                     )
-                    
-                    if success:
-                        ack = ssock.recv(1024).decode()
-                        if ack == "SUCCESS":
-                            return True, "File sent successfully"
-                        else:
-                            return False, f"Transfer failed: {ack}"
+                
+                if success:
+                    ack = self.protocol.receive_status(ssock)
+                    if ack == "SUCCESS":
+                        self.pool.mark_reusable(ssock)
+                        return True, "File sent successfully", False
                     else:
-                        return False, "File streaming failed"
-                        
+                        return False, f"Transfer failed: {ack}", not ack
+                else:
+                    return False, "File streaming failed", True
+                    
+        except socket.timeout:
+            return False, "Connection timeout - file may be too large", True
+        except ConnectionRefusedError:
+            return False, "Connection refused", True
+        except ReceiverBusy:
+            raise
+        except Exception as e:
+            return False, f"Error sending file: {str(e)}", isinstance(e, OSError)
+
+    def _is_resumable(self, file_size: int) -> bool:
+        """Only files larger than one journal block benefit from resuming"""
+        if not self.transfer_config or not self.transfer_config.get_setting('resumable_transfers'):
+            return False
+        return file_size > RESUME_BLOCK_SIZE
+
+    def _resume_request_id(self, file_path: str, recipient_ip: str) -> str:
+        """Stable request_id for the same file version and peer, so retries find their journal"""
+        stat = os.stat(file_path)
+        identity = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{recipient_ip}|{self.current_user}"
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, identity))
+
+    def _negotiate_resume(self, ssock, file_path: str, hash_algorithm: str) -> tuple:
+        """Check the receiver's verified blocks against the local file and agree on an offset"""
+        offer = self.protocol.receive_message(ssock, RESUME_END)
+        if not offer:
+            raise ConnectionError("No resume offer from receiver")
+        file_hash = HashManager.new(hash_algorithm)
+        offset = 0
+        if offer.get('resume_offset'):
+            offset = hash_matching_prefix(
+                file_path, offer['block_size'], offer['block_hashes'], hash_algorithm, file_hash
+            )
+        self.protocol.send_message(ssock, {'resume_offset': offset}, RESUME_END)
+        return offset, file_hash
+
+    def _offers_delta(self, file_size: int) -> bool:
+        """Ask the receiver for signatures of an older copy, if it has one"""
+        if not self.transfer_config:
+            return False
+        if not self.transfer_config.get_setting('delta_transfers'):
+            return False
+        return file_size >= (self.transfer_config.get_setting('delta_min_size') or 0)
+
+    def _negotiate_delta(self, ssock) -> Optional[tuple]:
+        """(block_size, signatures) of the receiver's existing copy, or None when it has none"""
+        reply = self.protocol.receive_message(ssock, DELTA_END)
+        if not reply:
+            raise ConnectionError("No delta reply from receiver")
+        if not reply.get('block_size'):
+            return None
+        return reply['block_size'], read_signatures(FrameReader(ssock), reply['blocks'])
+
+    def _chunk_for_dedup(self, file_path: str, file_size: int) -> Optional[tuple]:
+        """(chunks, checksum) when deduplicated sending is enabled and the file is large enough"""
+        if not self.transfer_config or not self.transfer_config.get_setting('dedup_transfers'):
+            return None
+        if file_size < (self.transfer_config.get_setting('dedup_min_size') or 0):
+            return None
+        if not fast_chunking():
+            # Chunking in pure Python is slower than sending the whole file over the network
+            print("⚠️  fastcdc is not installed, sending the file whole (pip install fastcdc)")
+            return None
+        print("🧩 Chunking file for deduplication...")
+        return chunk_file(file_path, self.stream_manager.get_hash_algorithm(), self.stream_manager.get_file_index())
+
+    def _negotiate_dedup(self, ssock, chunks: list, cipher: Optional[StreamCipher]) -> list:
+        """Offer the chunk list and learn which chunks the receiver still needs"""
+        write_chunk_list(self.stream_manager.create_frame_writer(ssock), chunks, cipher)
+        reply = self.protocol.receive_message(ssock, DEDUP_END)
+        if not reply:
+            raise ConnectionError("No chunk request from receiver")
+        missing = decode_missing(reply['missing'], len(chunks))
+        needed = sum(length for (_, length), wanted in zip(chunks, missing) if wanted)
+        total = sum(length for _, length in chunks)
+        print(f"♻️  Receiver already has {self.stream_manager.format_size(total - needed)}, "
+              f"sending {self.stream_manager.format_size(needed)}")
+        return missing
+
+    def _get_stripe_count(self, file_size: int) -> int:
+        """Number of parallel connections to use for a file of this size"""
+        if not self.transfer_config:
+            return 1
+        streams = self.transfer_config.get_setting('parallel_streams') or 1
+        threshold = self.transfer_config.get_setting('parallel_min_size') or 0
+        return streams if streams > 1 and file_size >= threshold else 1
+
+    @retry_when_busy
+    def send_file_striped(self, file_path: str, recipient_ip: str,
+                          progress_callback: Optional[Callable] = None,
+                          encryption_password: Optional[str] = None,
+                          compression_method: CompressionMethod = CompressionMethod.ADAPTIVE,
+                          streams: int = 4) -> tuple:
+        """Send one file as byte ranges over several concurrent TLS connections"""
+        return self._send_file_striped(
+            file_path, recipient_ip, progress_callback, encryption_password, compression_method, streams
+        )
+
+    def _send_file_striped(self, file_path: str, recipient_ip: str, progress_callback: Optional[Callable],
+                           encryption_password: Optional[str], compression_method: CompressionMethod,
+                           streams: int) -> tuple:
+        """One striped send; a busy receiver is left to the caller's retry_when_busy"""
+        if not os.path.exists(file_path):
+            return False, "File does not exist"
+        
+        file_name = os.path.basename(file_path)
+        file_size = os.path.getsize(file_path)
+        request_id = str(uuid.uuid4())
+        stripes = plan_stripes(file_size, streams)
+        hash_algorithm = self.stream_manager.get_hash_algorithm()
+        
+        key, encryption_salt = None, None
+        if encryption_password:
+            key, encryption_salt = CryptoManager.derive_raw_key(encryption_password)
+        
+        try:
+            with self.pool.connection(recipient_ip, self.port) as ssock:
+                if not self._send_transfer_request(ssock, file_name, file_size, False, request_id):
+                    return False, "Transfer request failed"
+                
+                if not self._send_file_metadata(ssock, file_name, file_size,
+                                               encryption_salt, compression_method, False,
+                                               hash_algorithm, {'stripes': stripes}):
+                    return False, "Failed to send metadata"
+                compression_method = self._negotiate_compression(ssock, compression_method)
+                
+                response = self.protocol.receive_status(ssock)
+                if response != "READY":
+                    return False, f"Transfer failed: {response}"
+                
+                sent_per_stripe = [0] * len(stripes)
+                progress_lock = threading.Lock()
+                results = [False] * len(stripes)
+                
+                def run_stripe(index):
+                    def stripe_progress(sent, total, stage):
+                        with progress_lock:
+                            sent_per_stripe[index] = sent
+                            if progress_callback:
+                                progress_callback(sum(sent_per_stripe), file_size, stage)
+                    
+                    cipher = StreamCipher(key, stripe_nonce_prefix(index)) if key else None
+                    results[index] = self._send_stripe(
+                        recipient_ip, request_id, index, stripes[index], file_path, file_size,
+                        cipher, compression_method, hash_algorithm, stripe_progress
+                    )
+                
+                threads = [threading.Thread(target=run_stripe, args=(i,), daemon=True)
+                           for i in range(len(stripes))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                
+                ack = self.protocol.receive_status(ssock)
+                if ack == "SUCCESS" and all(results):
+                    return True, f"File sent successfully over {len(stripes)} streams"
+                return False, f"Transfer failed: {ack}"
+        
         except socket.timeout:
             return False, "Connection timeout - file may be too large"
         except ConnectionRefusedError:
             return False, "Connection refused"
+        except ReceiverBusy:
+            raise
         except Exception as e:
             return False, f"Error sending file: {str(e)}"
 
-    def _send_transfer_request(self, ssock, file_name: str, file_size: int, is_folder: bool) -> bool:
-        """Send transfer request to recipient"""
+    def _send_stripe(self, recipient_ip: str, request_id: str, index: int, stripe: dict,
+                     file_path: str, file_size: int, cipher: Optional[StreamCipher],
+                     compression_method: CompressionMethod, hash_algorithm: str,
+                     progress_callback: Optional[Callable]) -> bool:
+        """Stream one byte range of a striped transfer on its own connection"""
+        try:
+            with self.pool.connection(recipient_ip, self.port, dedicated=True) as ssock:
+                request = {'type': 'stripe', 'request_id': request_id, 'stripe_index': index}
+                self.protocol.send_message(ssock, request, REQUEST_END)
+                if self.protocol.receive_status(ssock) != "ACCEPTED":
+                    return False
+                
+                if not self.stream_manager.stream_file_data(
+                    ssock, file_path, file_size, cipher, compression_method,
+                    progress_callback, hash_algorithm, stripe['offset'], stripe['length']
+                ):
+                    return False
+                return self.protocol.receive_status(ssock) == "SUCCESS"
+        except Exception as e:
+            print(f"❌ Stripe {index} failed: {e}")
+            return False
+
+    def _send_transfer_request(self, ssock, file_name: str, file_size: int, is_folder: bool,
+                               request_id: Optional[str] = None, keep_alive: bool = False) -> bool:
+        """Send transfer request to recipient; with keep_alive the connection may be reused afterwards"""
         request_metadata = {
             'type': 'transfer_request',
             'file_name': file_name,
             'file_size': file_size,
             'sender': self.current_user,
             'timestamp': time.time(),
-            'request_id': str(uuid.uuid4()),
+            'request_id': request_id or str(uuid.uuid4()),
             'is_folder': is_folder
         }
+        if keep_alive:
+            request_metadata['keep_alive'] = True
         
         try:
-            ssock.send(json.dumps(request_metadata).encode() + b'<REQUEST_END>')
-            response = ssock.recv(1024).decode()
-            return response == "ACCEPTED"
+            self.protocol.send_message(ssock, request_metadata, REQUEST_END)
+            response = self.protocol.receive_status(ssock)
         except:
             return False
+        retry_after = parse_busy(response)
+        if retry_after is not None:
+            raise ReceiverBusy(retry_after)
+        if response == ACCEPTED_KEEP_ALIVE:
+            self.pool.mark_keep_alive(ssock)
+            return True
+        return response == "ACCEPTED"
 
-    def _send_file_metadata(self, ssock, file_name: str, file_size: int, checksum: str,
-                           encryption_password: Optional[str], compression_method: CompressionMethod,
-                           is_folder: bool) -> bool:
+    def _send_file_metadata(self, ssock, file_name: str, file_size: int,
+                           encryption_salt: Optional[bytes], compression_method: CompressionMethod,
+                           is_folder: bool, hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+                           extra: Optional[dict] = None) -> bool:
         """Send file metadata to recipient"""
         metadata = {
             'file_name': file_name,
             'file_size': file_size,
             'compression_method': compression_method.value,
-            'encrypted': encryption_password is not None,
-            'checksum': checksum,
+            'encrypted': encryption_salt is not None,
+            'hash_algorithm': hash_algorithm,
             'timestamp': time.time(),
             'is_folder': is_folder
         }
+        if compression_method in CompressionManager.OPTIONAL_METHODS:
+            metadata['compression_offer'] = [
+                method.value for method in CompressionManager.compression_offer(compression_method)
+            ]
+        if encryption_salt is not None:
+            metadata['encryption'] = CryptoManager.STREAM_CIPHER_NAME
+            metadata['encryption_salt'] = encryption_salt.hex()
+        if extra:
+            metadata.update(extra)
         
         try:
-            ssock.send(json.dumps(metadata).encode() + b'<METADATA_END>')
+            self.protocol.send_message(ssock, metadata, METADATA_END)
             return True
         except:
             return False
 
+    def _negotiate_compression(self, ssock, compression_method: CompressionMethod) -> CompressionMethod:
+        """Wait for the receiver to pick one of the offered codecs; other methods need no reply"""
+        if compression_method not in CompressionManager.OPTIONAL_METHODS:
+            return compression_method
+        offer = CompressionManager.compression_offer(compression_method)
+        reply = self.protocol.receive_message(ssock, CODEC_END)
+        if not reply or reply.get('compression_method') not in [method.value for method in offer]:
+            raise ConnectionError("Receiver did not agree on a compression method")
+        chosen = CompressionMethod(reply['compression_method'])
+        if chosen != compression_method:
+            print(f"🗜️  {compression_method.name} unavailable on one side, using {chosen.name}")
+        return chosen
+
+    @retry_when_busy
     def send_folder(self, folder_path: str, recipient_ip: str, 
                    progress_callback: Optional[Callable] = None,
                    encryption_password: Optional[str] = None,
-                   compression_method: CompressionMethod = CompressionMethod.ZLIB) -> tuple:
-        """Send folder with streaming support"""
-        return self.stream_manager.send_folder_as_archive(
-            self, folder_path, recipient_ip, progress_callback,
-            encryption_password, compression_method
-        )
\ No newline at end of file
+                   compression_method: CompressionMethod = CompressionMethod.ADAPTIVE) -> tuple:
+        """Send folder as one manifest plus packed bodies, or as a tar stream generated on the fly"""
+        if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+            return False, "Folder does not exist or is not a directory"
+        
+        folder_name = os.path.basename(os.path.abspath(folder_path))
+        manifest, extra = None, {'archive': ARCHIVE_FORMAT}
+        if self.stream_manager._get_setting('folder_archive', MANIFEST_FORMAT) == MANIFEST_FORMAT:
+            manifest = build_manifest(folder_path)
+            total_size = manifest_size(manifest)
+            extra = {'archive': MANIFEST_FORMAT, 'file_count': len(manifest)}
+        else:
+            total_size = folder_size(folder_path)
+        
+        try:
+            with self.pool.connection(recipient_ip, self.port) as ssock:
+                
+                if not self._send_transfer_request(ssock, folder_name, total_size, True, keep_alive=self.keep_alive):
+                    return False, "Transfer request failed"
+                
+                cipher, encryption_salt = None, None
+                if encryption_password:
+                    cipher, encryption_salt = CryptoManager.create_stream_cipher(encryption_password)
+                
+                hash_algorithm = self.stream_manager.get_hash_algorithm()
+                if not self._send_file_metadata(ssock, folder_name, total_size,
+                                               encryption_salt, compression_method, True,
+                                               hash_algorithm, extra):
+                    return False, "Failed to send metadata"
+                compression_method = self._negotiate_compression(ssock, compression_method)
+                
+                print("📦 Streaming folder archive...")
+                success = self.stream_manager.stream_folder_data(
+                    ssock, folder_path, total_size, cipher,
+                    compression_method, progress_callback, hash_algorithm, manifest
+                )
+                
+                if success:
+                    ack = self.protocol.receive_status(ssock)
+                    if ack == "SUCCESS":
+                        self.pool.mark_reusable(ssock)
+                        return True, "Folder sent successfully"
+                    return False, f"Transfer failed: {ack}"
+                return False, "Folder streaming failed"
+                
+        except socket.timeout:
+            return False, "Connection timeout"
+        except ConnectionRefusedError:
+            return False, "Connection refused"
+        except ReceiverBusy:
+            raise
+        except Exception as e:
+            return False, f"Error sending folder: {str(e)}"
+
+    def sync_folder(self, folder_path: str, recipient_ip: str, remote_name: Optional[str] = None,
+                    compression_method: CompressionMethod = CompressionMethod.ADAPTIVE,
+                    paths: Optional[list] = None) -> tuple:
+        """Two-way sync of a folder with one the recipient has configured under remote_name
+
+        With paths (relative, '/'-separated) only those files and directories are compared; a
+        list too long for one message is replaced by a full sync.
+        """
+        if not os.path.isdir(folder_path):
+            return False, "Folder does not exist or is not a directory"
+        remote_name = remote_name or os.path.basename(os.path.abspath(folder_path))
+        if paths is not None and not paths_fit(paths):
+            paths = None
+        lock = folder_lock(folder_path)
+        if not lock.acquire(blocking=False):
+            return False, "Folder is already being synced"
+        
+        state = SyncState(folder_path)
+        try:
+            with self.pool.connection(recipient_ip, self.port) as ssock:
+                request = {
+                    'type': 'sync_request',
+                    'folder': remote_name,
+                    'sender': self.current_user,
+                    'replica': state.replica,
+                    'compression_method': compression_method.value,
+                    'timestamp': time.time()
+                }
+                if compression_method in CompressionManager.OPTIONAL_METHODS:
+                    request['compression_offer'] = [
+                        method.value for method in CompressionManager.compression_offer(compression_method)
+                    ]
+                self.protocol.send_message(ssock, request, REQUEST_END)
+                reply = self.protocol.receive_message(ssock, SYNC_END)
+                if not reply or not reply.get('accepted'):
+                    return False, f"Sync declined: {(reply or {}).get('reason', 'no reply')}"
+                session = FolderSync(
+                    state, self.stream_manager, self.protocol, CompressionMethod(reply['compression_method'])
+                )
+                
+                # Both sides scan at the same time; the peer's manifest follows its scan
+                ssock.settimeout(None)
+                self.protocol.send_message(ssock, {'paths': paths}, SYNC_END)
+                session.scan(paths)
+                summary = session.run(ssock, reply['replica'])
+                return True, (f"Folder synced: {summary['sent']} sent, {summary['received']} received, "
+                              f"{summary['changed']} deleted/renamed/updated, {summary['conflicts']} conflicts, "
+                              f"{summary['skipped']} skipped")
+        
+        except socket.timeout:
+            return False, "Connection timeout"
+        except ConnectionRefusedError:
+            return False, "Connection refused"
+        except Exception as e:
+            return False, f"Error syncing folder: {str(e)}"
+        finally:
+            state.close()
+            lock.release()
@@ -0,0 +1,290 @@
+import json
+import socket
+import struct
+import threading
+import time
+import weakref
+from typing import Optional
+
+# Frame header: frame type, flags, payload length
+FRAME_HEADER = struct.Struct('>BBI')
+
+FRAME_DATA = 0
+FRAME_EOF = 1
+FRAME_TRAILER = 2  # Follows FRAME_EOF with values only known once all data is sent
+FRAME_MANIFEST = 3  # Path listing that precedes the packed bodies of a bulk folder transfer
+FRAME_CHUNK_LIST = 4  # Chunk digests and lengths offered ahead of a deduplicated file
+FRAME_SIGNATURES = 5  # Block checksums of the receiver's existing copy, sent back for a delta transfer
+FRAME_SYNC_MANIFEST = 6  # Sorted state entries of a synced folder; an empty frame ends the listing
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_ALIGNMENT = 64 * 1024
+CONTROL_RECV_SIZE = 64 * 1024  # Read size while looking for the sentinel of a control message
+
+# Frame flags
+FLAG_COMPRESSED = 0x01  # Payload is compressed; stored frames leave it clear
+FLAG_STREAM = 0x02  # Payload continues the transfer's persistent compression stream
+METHOD_SHIFT = 4  # High nibble: CompressionMethod of a compressed frame, 0 = the transfer's method
+
+
+def compression_flags(method_value: int, stream: bool = False) -> int:
+    """Flags for a frame compressed with the given CompressionMethod value"""
+    if not method_value:
+        return 0
+    return FLAG_COMPRESSED | (FLAG_STREAM if stream else 0) | (method_value << METHOD_SHIFT)
+
+
+def frame_method_value(flags: int) -> int:
+    return flags >> METHOD_SHIFT
+
+
+def measure_rtt(sock) -> Optional[float]:
+    """Smoothed round-trip time of a connected TCP socket in seconds, if the OS reports it"""
+    tcp_info = getattr(socket, 'TCP_INFO', None)
+    if tcp_info is None:
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, tcp_info, 104)
+        # struct tcp_info: 8 single-byte fields, then u32 fields; tcpi_rtt is the 16th (usec)
+        rtt_usec = struct.unpack_from('=I', info, 8 + 15 * 4)[0]
+        return rtt_usec / 1_000_000 if rtt_usec else None
+    except (OSError, struct.error):
+        return None
+
+
+_unread = weakref.WeakKeyDictionary()  # Socket -> bytes recv_until read past a sentinel
+
+
+def recv_until(ssock, sentinel: bytes, limit: int) -> Optional[bytes]:
+    """Bytes before the sentinel on a blocking socket, or None when the message is over limit
+
+    Each read only searches the bytes that just arrived, and whatever follows the sentinel is
+    kept for the next read of the socket (take_unread, recv_buffered).
+    """
+    data = bytearray(_unread.pop(ssock, b''))
+    start = 0
+    while True:
+        end = data.find(sentinel, start)
+        if end >= 0:
+            rest = end + len(sentinel)
+            if rest < len(data):
+                _unread[ssock] = bytes(data[rest:])
+            return bytes(data[:end]) if end <= limit else None
+        if len(data) > limit:
+            return None
+        start = max(0, len(data) - len(sentinel) + 1)
+        chunk = ssock.recv(CONTROL_RECV_SIZE)
+        if not chunk:
+            raise ConnectionError("Connection closed before message end")
+        data += chunk
+
+
+def take_unread(ssock, view: memoryview) -> int:
+    """Copy bytes recv_until read ahead on this socket into view; 0 when there are none"""
+    if not _unread:
+        return 0
+    pending = _unread.pop(ssock, None)
+    if not pending:
+        return 0
+    count = min(len(view), len(pending))
+    view[:count] = pending[:count]
+    if count < len(pending):
+        _unread[ssock] = pending[count:]
+    return count
+
+
+def recv_buffered(ssock, size: int) -> bytes:
+    """ssock.recv(size), served first from bytes recv_until read ahead"""
+    if _unread:
+        pending = _unread.pop(ssock, None)
+        if pending:
+            if len(pending) > size:
+                _unread[ssock] = pending[size:]
+            return pending[:size]
+    return ssock.recv(size)
+
+
+class AdaptiveChunkSizer:
+    """Pick frame sizes from the measured bandwidth and round-trip time"""
+
+    def __init__(self, min_size: int = MIN_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE,
+                 rtt: Optional[float] = None, target_interval: float = 0.02):
+        self.min_size = max(CHUNK_ALIGNMENT, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.rtt = rtt or 0.001
+        # Each frame should cover at least this long on the wire so per-frame costs stay small
+        self.target_interval = target_interval
+        self.bandwidth = None
+        self.chunk_size = self.min_size
+
+    def observe(self, nbytes: int, seconds: float):
+        """Record how long a frame took to hand to the socket and resize the next one"""
+        if seconds <= 0 or nbytes <= 0:
+            return
+        rate = nbytes / seconds
+        self.bandwidth = rate if self.bandwidth is None else 0.8 * self.bandwidth + 0.2 * rate
+        window = max(2 * self.rtt, self.target_interval)
+        size = int(self.bandwidth * window) // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT
+        self.chunk_size = min(self.max_size, max(self.min_size, size))
+
+
+class TokenBucket:
+    """Token-bucket bandwidth limit; consume() blocks until the bytes are allowed"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Frames may be larger than the bucket; run into debt and wait it off
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class FrameWriter:
+    """Write typed, length-prefixed frames with sendall and an optional rate limit
+
+    On a multiplexed stream (anything with write_frame) each frame is handed over whole
+    and the stream's own header carries its type and flags.
+    """
+
+    def __init__(self, ssock, throttle: Optional[TokenBucket] = None):
+        self.ssock = ssock
+        self.throttle = throttle
+        self._stream = ssock if hasattr(ssock, 'write_frame') else None
+        # Optional observer(nbytes, seconds) told how long each data frame took to send
+        self.observer = None
+
+    def write_frame(self, payload, frame_type: int = FRAME_DATA, flags: int = 0):
+        if self.throttle:
+            self.throttle.consume(len(payload))
+        started = time.perf_counter()
+        if self._stream:
+            self._stream.write_frame(payload, frame_type, flags)
+        else:
+            self.ssock.sendall(FRAME_HEADER.pack(frame_type, flags, len(payload)))
+            if payload:
+                self.ssock.sendall(payload)
+        if self.observer and frame_type == FRAME_DATA:
+            self.observer(len(payload), time.perf_counter() - started)
+
+    def write_packed(self, view):
+        """Send a buffer that already starts with a packed FRAME_HEADER"""
+        if self.throttle:
+            self.throttle.consume(len(view) - FRAME_HEADER.size)
+        if self._stream:
+            frame_type, flags, _ = FRAME_HEADER.unpack_from(view)
+            self._stream.write_frame(view[FRAME_HEADER.size:], frame_type, flags)
+        else:
+            self.ssock.sendall(view)
+
+    def write_header(self, length: int, frame_type: int = FRAME_DATA, flags: int = 0):
+        """Send only a header; the caller sends the payload itself (e.g. via sendfile)"""
+        if self.throttle:
+            self.throttle.consume(length)
+        self.ssock.sendall(FRAME_HEADER.pack(frame_type, flags, length))
+
+    def write_eof(self):
+        if self._stream:
+            self._stream.write_frame(b'', FRAME_EOF)
+        else:
+            self.ssock.sendall(FRAME_HEADER.pack(FRAME_EOF, 0, 0))
+
+    def write_trailer(self, trailer: dict):
+        self.write_frame(json.dumps(trailer).encode(), FRAME_TRAILER)
+
+
+class BufferPool:
+    """Reusable receive buffers so frames are read without per-frame allocations"""
+
+    def __init__(self, buffer_size: int = MAX_CHUNK_SIZE, max_buffers: int = 4):
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size: int) -> bytearray:
+        with self._lock:
+            for i, buffer in enumerate(self._free):
+                if len(buffer) >= size:
+                    return self._free.pop(i)
+        return bytearray(max(size, self.buffer_size))
+
+    def release(self, buffer: bytearray):
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+
+
+class FrameReader:
+    """Read frames written by FrameWriter straight into pooled buffers with recv_into
+
+    A multiplexed stream (anything with read_frame) delivers frames already parsed, each
+    in a buffer of its own, so those are passed through and never go back to the pool.
+    """
+    MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, ssock, pool: Optional[BufferPool] = None):
+        self.ssock = ssock
+        self._stream = ssock if hasattr(ssock, 'read_frame') else None
+        self.pool = pool or BufferPool()
+        self._header = bytearray(FRAME_HEADER.size)
+        self._current = None
+
+    def recv_exactly_into(self, view: memoryview):
+        """Fill the whole view; a short read only means the rest is still in flight"""
+        received = 0
+        size = len(view)
+        while received < size:
+            count = take_unread(self.ssock, view[received:])
+            if not count:
+                count = self.ssock.recv_into(view[received:], size - received)
+            if not count:
+                raise ConnectionError("Connection closed mid-frame")
+            received += count
+
+    def read_frame(self) -> tuple:
+        """Return (frame_type, flags, payload); payload is valid until the next read_frame"""
+        self.release()
+        if self._stream:
+            return self._stream.read_frame()
+        self.recv_exactly_into(memoryview(self._header))
+        frame_type, flags, length = FRAME_HEADER.unpack(self._header)
+        if length > self.MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {length} bytes exceeds the {self.MAX_FRAME_SIZE} byte limit")
+        if not length:
+            return frame_type, flags, memoryview(b'')
+        self._current = self.pool.acquire(length)
+        payload = memoryview(self._current)[:length]
+        self.recv_exactly_into(payload)
+        return frame_type, flags, payload
+
+    def read_trailer(self) -> dict:
+        """Read the trailer frame that follows FRAME_EOF"""
+        frame_type, _, payload = self.read_frame()
+        if frame_type != FRAME_TRAILER:
+            raise ValueError(f"Expected trailer frame, got type {frame_type}")
+        trailer = json.loads(bytes(payload).decode())
+        self.release()
+        return trailer
+
+    def detach(self) -> Optional[bytearray]:
+        """Take ownership of the last frame's buffer; the caller releases it to the pool when done"""
+        buffer, self._current = self._current, None
+        return buffer
+
+    def release(self):
+        """Hand the buffer of the last frame back to the pool"""
+        if self._current is not None:
+            self.pool.release(self._current)
+            self._current = None
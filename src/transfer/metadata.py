@@ -0,0 +1,382 @@
+import itertools
+import json
+import struct
+from typing import Iterator, Optional
+
+METADATA_JSON = 'json'
+METADATA_PACKED = 'packed'
+PACKED_MAGIC = b'\xb1\x01'  # Marker and format version; JSON text never starts with 0xb1
+
+# Value tags of packed messages
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3  # Zigzag varint
+TAG_FLOAT = 4  # 8-byte double
+TAG_STR = 5  # Varint length and UTF-8; short ones join the string table
+TAG_REF = 6  # Varint index into the string table
+TAG_LIST = 7
+TAG_DICT = 8
+TAG_BYTES = 9
+
+# Start of every string table, so common keys and values cost one byte; append only
+KNOWN_STRINGS = (
+    'type', 'transfer_request', 'stripe', 'sync_request', 'file_name', 'file_size', 'sender', 'timestamp',
+    'request_id', 'is_folder', 'keep_alive', 'compression_method', 'compression_offer', 'encrypted',
+    'encryption', 'encryption_salt', 'hash_algorithm', 'stripes', 'stripe_index', 'offset', 'length',
+    'archive', 'file_count', 'folder', 'replica', 'accepted', 'reason', 'paths', 'op', 'apply', 'pull',
+    'push', 'done', 'changes', 'entries', 'skipped', 'installed', 'resume_offset', 'block_size', 'blocks',
+    'missing', 'sha256', 'blake2b', 'manifest', 'tar',
+)
+_KNOWN_INDEX = {string: index for index, string in enumerate(KNOWN_STRINGS)}
+TABLE_STRING_MAX = 64  # Longer strings are rarely repeated, so they are not worth a table slot
+TABLE_SIZE_MAX = 4096
+PACKED_ZLIB_LEVEL = 1  # Packed columns are dense already; higher levels cost far more time than they save
+
+# Column types of packed records
+COLUMN_INT = 'int'
+COLUMN_STR = 'str'  # Strings without NUL characters, or None
+COLUMN_ENUM = 'enum'  # Few distinct strings, stored once each
+COLUMN_HEX = 'hex'  # Hex digests sent as raw bytes, or None
+COLUMN_VERSIONS = 'versions'  # {replica: counter} version vectors
+
+INT_CODES = ('B', 'H', 'I', 'Q')
+SIGNED_INT_CODES = ('b', 'h', 'i', 'q')
+
+
+def metadata_format(ssock) -> str:
+    """The encoding the connection agreed on; only multiplexed streams negotiate packed metadata"""
+    return getattr(ssock, 'metadata_format', METADATA_JSON)
+
+
+def packs_metadata(ssock) -> bool:
+    return metadata_format(ssock) == METADATA_PACKED
+
+
+def is_packed(data) -> bool:
+    return data[:len(PACKED_MAGIC)] == PACKED_MAGIC
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+class _Packer:
+    """Writes tagged values; strings seen before are written as a reference to their first occurrence"""
+
+    def __init__(self):
+        self.out = bytearray(PACKED_MAGIC)
+        self.table = dict(_KNOWN_INDEX)
+
+    def pack(self, value):
+        out = self.out
+        kind = type(value)
+        if kind is str:
+            self._pack_str(value)
+        elif kind is int:
+            out.append(TAG_INT)
+            _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+        elif kind is dict:
+            out.append(TAG_DICT)
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                self.pack(key)
+                self.pack(item)
+        elif kind is list or kind is tuple:
+            out.append(TAG_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self.pack(item)
+        elif value is None:
+            out.append(TAG_NONE)
+        elif kind is bool:
+            out.append(TAG_TRUE if value else TAG_FALSE)
+        elif kind is float:
+            out.append(TAG_FLOAT)
+            out += struct.pack('>d', value)
+        elif kind is bytes or kind is bytearray:
+            out.append(TAG_BYTES)
+            _write_varint(out, len(value))
+            out += value
+        elif isinstance(value, str):
+            # Subclasses such as string enums go as their plain value, as in JSON
+            self._pack_str(str.__str__(value))
+        elif isinstance(value, (int, float)):
+            self.pack(float(value) if isinstance(value, float) else int(value))
+        else:
+            raise TypeError(f"Cannot pack {kind.__name__}")
+
+    def _pack_str(self, value: str):
+        out = self.out
+        index = self.table.get(value)
+        if index is not None:
+            out.append(TAG_REF)
+            _write_varint(out, index)
+            return
+        encoded = value.encode('utf-8', 'surrogatepass')
+        out.append(TAG_STR)
+        _write_varint(out, len(encoded))
+        out += encoded
+        if len(encoded) <= TABLE_STRING_MAX and len(self.table) < TABLE_SIZE_MAX:
+            self.table[value] = len(self.table)
+
+
+class _Unpacker:
+    """Reads tagged values in the order they were written, growing the same string table as the packer"""
+
+    def __init__(self, data, position: int = len(PACKED_MAGIC)):
+        self.data = memoryview(data)
+        self.position = position
+        self.table = list(KNOWN_STRINGS)
+
+    def unpack(self):
+        data = self.data
+        tag = data[self.position]
+        self.position += 1
+        if tag == TAG_REF:
+            index, self.position = _read_varint(data, self.position)
+            return self.table[index]
+        if tag == TAG_STR:
+            length, start = _read_varint(data, self.position)
+            self.position = start + length
+            value = str(data[start:self.position], 'utf-8', 'surrogatepass')
+            if length <= TABLE_STRING_MAX and len(self.table) < TABLE_SIZE_MAX:
+                self.table.append(value)
+            return value
+        if tag == TAG_INT:
+            value, self.position = _read_varint(data, self.position)
+            return value >> 1 if not value & 1 else -((value + 1) >> 1)
+        if tag == TAG_DICT:
+            count, self.position = _read_varint(data, self.position)
+            result = {}
+            for _ in range(count):
+                key = self.unpack()
+                result[key] = self.unpack()
+            return result
+        if tag == TAG_LIST:
+            count, self.position = _read_varint(data, self.position)
+            return [self.unpack() for _ in range(count)]
+        if tag == TAG_NONE:
+            return None
+        if tag == TAG_TRUE or tag == TAG_FALSE:
+            return tag == TAG_TRUE
+        if tag == TAG_FLOAT:
+            self.position += 8
+            return struct.unpack_from('>d', data, self.position - 8)[0]
+        if tag == TAG_BYTES:
+            length, start = _read_varint(data, self.position)
+            self.position = start + length
+            return bytes(data[start:self.position])
+        raise ValueError(f"Unknown packed value tag {tag}")
+
+
+def encode_message(message, packed: bool = False) -> bytes:
+    """A control message as packed bytes, or as the JSON every receiver understands"""
+    if not packed:
+        return json.dumps(message).encode()
+    packer = _Packer()
+    packer.pack(message)
+    return bytes(packer.out)
+
+
+def decode_message(data: bytes):
+    """Decode a control message in either encoding"""
+    if not is_packed(data):
+        return json.loads(bytes(data).decode())
+    try:
+        unpacker = _Unpacker(data)
+        message = unpacker.unpack()
+    except (IndexError, TypeError, struct.error, UnicodeDecodeError) as e:
+        # TypeError: a list or dict where a dict key was expected
+        raise ValueError(f"Malformed packed message: {e}")
+    if unpacker.position != len(data):
+        raise ValueError("Trailing bytes after packed message")
+    return message
+
+
+def _pack_ints(out: bytearray, values: list):
+    """One struct call for the column, in the narrowest width that holds all of it"""
+    low, high = (min(values), max(values)) if values else (0, 0)
+    for code in (INT_CODES if low >= 0 else SIGNED_INT_CODES):
+        bits = 8 * struct.calcsize(code) - (low < 0)
+        if -(1 << bits) <= low and high < 1 << bits:
+            break
+    else:
+        raise ValueError(f"Integer column out of range: {low}..{high}")
+    out += code.encode()
+    out += struct.pack(f'<{len(values)}{code}', *values)
+
+
+def _unpack_ints(data, position: int, count: int) -> tuple:
+    code = chr(data[position])
+    if code not in INT_CODES and code not in SIGNED_INT_CODES:
+        raise ValueError(f"Unknown integer column code {code!r}")
+    layout = struct.Struct(f'<{count}{code}')
+    return layout.unpack_from(data, position + 1), position + 1 + layout.size
+
+
+def _pack_nulls(out: bytearray, values) -> list:
+    """Write which values are None, one flag byte per value unless none or all are, and return the others"""
+    nulls = values.count(None)
+    _write_varint(out, nulls)
+    if not nulls:
+        return values
+    if nulls < len(values):
+        out += bytes(value is None for value in values)
+    return [value for value in values if value is not None]
+
+
+def _unpack_nulls(data, position: int, count: int) -> tuple:
+    """(flags or None, number of None values, position after them)"""
+    nulls, position = _read_varint(data, position)
+    if nulls > count:
+        raise ValueError("More null values than records")
+    if not nulls or nulls == count:
+        return None, nulls, position
+    flags = bytes(data[position:position + count])
+    if flags.count(0) != count - nulls:
+        raise ValueError("Null flags do not match the null count")
+    return flags, nulls, position + count
+
+
+def _with_nulls(values: list, flags: Optional[bytes], nulls: int, count: int) -> list:
+    if not nulls:
+        return values
+    if flags is None:
+        return [None] * count
+    present = iter(values)
+    return [None if flag else next(present) for flag in flags]
+
+
+def _pack_strings(out: bytearray, values):
+    present = _pack_nulls(out, values)
+    # One join and one encode for the whole column
+    joined = '\0'.join(present).encode('utf-8', 'surrogatepass')
+    if joined.count(b'\0') != max(len(present) - 1, 0):
+        raise ValueError("String column values cannot contain NUL")
+    _write_varint(out, len(joined))
+    out += joined
+
+
+def _unpack_strings(data, position: int, count: int) -> tuple:
+    flags, nulls, position = _unpack_nulls(data, position, count)
+    length, start = _read_varint(data, position)
+    end = start + length
+    values = str(data[start:end], 'utf-8', 'surrogatepass').split('\0') if count > nulls else []
+    if len(values) != count - nulls:
+        raise ValueError("String column does not match the record count")
+    return _with_nulls(values, flags, nulls, count), end
+
+
+def _pack_enum(out: bytearray, values):
+    names = list(dict.fromkeys(values))
+    _write_varint(out, len(names))
+    _pack_strings(out, names)
+    _pack_ints(out, list(map({name: code for code, name in enumerate(names)}.__getitem__, values)))
+
+
+def _unpack_enum(data, position: int, count: int) -> tuple:
+    distinct, position = _read_varint(data, position)
+    if distinct > count:
+        raise ValueError("More enum names than values")
+    names, position = _unpack_strings(data, position, distinct)
+    codes, position = _unpack_ints(data, position, count)
+    return list(map(names.__getitem__, codes)), position
+
+
+def _pack_hex(out: bytearray, values):
+    present = _pack_nulls(out, values)
+    digits = ''.join(present)
+    joined = bytes.fromhex(digits)
+    lengths = list(map(len, present))
+    # Anything that would not come back the same, like upper case, must not be packed
+    if joined.hex() != digits or any(length % 2 for length in lengths):
+        raise ValueError("Hex column values must be lowercase hex digests")
+    _pack_ints(out, [length // 2 for length in lengths])
+    _write_varint(out, len(joined))
+    out += joined
+
+
+def _unpack_hex(data, position: int, count: int) -> tuple:
+    flags, nulls, position = _unpack_nulls(data, position, count)
+    lengths, position = _unpack_ints(data, position, count - nulls)
+    length, start = _read_varint(data, position)
+    digits = bytes(data[start:start + length]).hex()
+    offsets = [0, *itertools.accumulate(2 * size for size in lengths)]
+    values = [digits[offsets[index]:offsets[index + 1]] for index in range(len(lengths))]
+    return _with_nulls(values, flags, nulls, count), start + length
+
+
+def _pack_versions(out: bytearray, values):
+    _pack_ints(out, list(map(len, values)))
+    _pack_enum(out, list(itertools.chain.from_iterable(values)))
+    _pack_ints(out, list(itertools.chain.from_iterable(map(dict.values, values))))
+
+
+def _unpack_versions(data, position: int, count: int) -> tuple:
+    sizes, position = _unpack_ints(data, position, count)
+    total = sum(sizes)
+    if total > len(data):
+        raise ValueError("Version vectors longer than the batch")
+    replicas, position = _unpack_enum(data, position, total)
+    counters, position = _unpack_ints(data, position, total)
+    pairs = zip(replicas, counters)
+    return [dict(itertools.islice(pairs, size)) for size in sizes], position
+
+
+_COLUMNS = {
+    COLUMN_INT: (_pack_ints, _unpack_ints),
+    COLUMN_STR: (_pack_strings, _unpack_strings),
+    COLUMN_ENUM: (_pack_enum, _unpack_enum),
+    COLUMN_HEX: (_pack_hex, _unpack_hex),
+    COLUMN_VERSIONS: (_pack_versions, _unpack_versions),
+}
+
+
+def encode_records(schema: tuple, records: list) -> bytes:
+    """Pack same-shaped records column by column, each column with one struct call or one join
+
+    schema names the column type of each field, e.g. (COLUMN_STR, COLUMN_INT) for [path, size].
+    """
+    columns = list(zip(*records)) if records else [()] * len(schema)
+    if len(columns) != len(schema) or (records and set(map(len, records)) != {len(schema)}):
+        raise ValueError(f"Records do not have the {len(schema)} fields of the schema")
+    out = bytearray(PACKED_MAGIC)
+    _write_varint(out, len(records))
+    for column, values in zip(schema, columns):
+        _COLUMNS[column][0](out, values)
+    return bytes(out)
+
+
+def iter_records(schema: tuple, data) -> Iterator:
+    """The records of encode_records() as lists, built one at a time from the decoded columns"""
+    if not is_packed(data):
+        raise ValueError("Not a packed record batch")
+    try:
+        count, position = _read_varint(data, len(PACKED_MAGIC))
+        # Integer and enum columns take at least a byte per record
+        if count > len(data):
+            raise ValueError("Record count larger than the batch")
+        columns = []
+        for column in schema:
+            values, position = _COLUMNS[column][1](data, position, count)
+            columns.append(values)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed packed records: {e}")
+    if position != len(data):
+        raise ValueError("Trailing bytes after packed records")
+    return map(list, zip(*columns))
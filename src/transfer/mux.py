@@ -0,0 +1,523 @@
+import collections
+import json
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+from typing import Callable, Optional
+
+from .framing import FrameReader, recv_buffered, take_unread
+from .metadata import METADATA_JSON, METADATA_PACKED
+from .protocols import REQUEST_END
+
+# Frame header: protocol version, frame type, flags, stream id, payload length
+MUX_HEADER = struct.Struct('>BBBII')
+MUX_VERSION = 1
+
+# Types below MUX_CONTROL are the payload frames of framing.py, carried with their own flags
+MUX_CONTROL = 16  # Control message, JSON or packed; flags name the message kind
+MUX_STATUS = 17  # One-line reply such as ACCEPTED, SUCCESS or ERROR: ...
+MUX_OPEN = 18  # Starts a stream; written together with the stream's first frame
+MUX_CLOSE = 19  # The sender of this frame is done with the stream
+MUX_RESET = 20  # The stream is aborted; payload is the reason
+MUX_WINDOW = 21  # 4-byte grant of more stream payload
+MUX_HELLO = 22  # Stream 0, first frame after the upgrade: the receiver's settings
+
+MUX_UPGRADE = 'mux'  # Request type that switches a fresh connection to multiplexed frames
+MUX_WINDOW_SIZE = 16 * 1024 * 1024  # Payload bytes a stream may have in flight before the reader grants more
+MAX_STREAMS = 128  # Concurrent streams per connection
+READ_SIZE = 256 * 1024
+POLL_SECONDS = 1.0
+SMALL_PAYLOAD = 64 * 1024  # Payloads up to this size are sent in one piece with their header
+WINDOW_GRANT = struct.Struct('>I')
+
+
+class MuxParser:
+    """Incremental frame parser: feed() whatever the transport delivered, get back the frames it completed
+
+    Every byte is looked at once. A header is decoded as soon as its last byte arrives
+    and the payload is copied straight into a buffer of its own, so nothing is
+    rescanned and nothing read past the end of a frame is lost.
+    """
+
+    def __init__(self, max_payload: int = FrameReader.MAX_FRAME_SIZE):
+        self.max_payload = max_payload
+        self._header = bytearray()
+        self._frame = None  # (frame_type, flags, stream_id) of the payload being filled
+        self._payload = None
+        self._filled = 0
+
+    def feed(self, data) -> list:
+        """Frames completed by data, as (frame_type, flags, stream_id, payload) tuples"""
+        frames = []
+        view = memoryview(data).cast('B')
+        while view:
+            if self._frame is None:
+                needed = MUX_HEADER.size - len(self._header)
+                self._header += view[:needed]
+                view = view[needed:]
+                if len(self._header) < MUX_HEADER.size:
+                    break
+                version, frame_type, flags, stream_id, length = MUX_HEADER.unpack(self._header)
+                self._header.clear()
+                if version != MUX_VERSION:
+                    raise ValueError(f"Unsupported frame version {version}")
+                if length > self.max_payload:
+                    raise ValueError(f"Frame of {length} bytes exceeds the {self.max_payload} byte limit")
+                self._frame = (frame_type, flags, stream_id)
+                self._payload = bytearray(length)
+                self._filled = 0
+            count = min(len(view), len(self._payload) - self._filled)
+            self._payload[self._filled:self._filled + count] = view[:count]
+            view = view[count:]
+            frames.extend(self.filled(count))
+        return frames
+
+    def pending(self) -> Optional[memoryview]:
+        """The unfilled rest of the payload being read, for a transport that can receive straight into it"""
+        if self._payload is None:
+            return None
+        return memoryview(self._payload)[self._filled:]
+
+    def filled(self, count: int) -> list:
+        """Account for count bytes written into pending(); returns the frame once it is complete"""
+        self._filled += count
+        if self._filled < len(self._payload):
+            return []
+        frame = self._frame + (self._payload,)
+        self._frame, self._payload = None, None
+        return [frame]
+
+
+class SocketTransport:
+    """Full-duplex use of one TLS socket by a reader thread and any number of writer threads
+
+    An SSL object must not be used by two threads at once, so each call on it holds a
+    lock. The socket is non-blocking, so nobody holds the lock while waiting for the network.
+    """
+
+    def __init__(self, ssock):
+        self.ssock = ssock
+        self._ssl_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Keeps the parts of one frame together
+        ssock.setblocking(False)
+
+    def send_parts(self, parts: list):
+        with self._write_lock:
+            for part in parts:
+                view = memoryview(part).cast('B')
+                while view:
+                    with self._ssl_lock:
+                        try:
+                            sent = self.ssock.send(view)
+                        except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                            sent = 0
+                    if sent:
+                        view = view[sent:]
+                    else:
+                        select.select([], [self.ssock], [], POLL_SECONDS)
+
+    def recv_into(self, view: memoryview, timeout: float) -> Optional[int]:
+        """Bytes received into view, 0 once the peer closed, or None if nothing arrived within timeout"""
+        count = take_unread(self.ssock, view)
+        if count:
+            return count
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._ssl_lock:
+                try:
+                    return self.ssock.recv_into(view)
+                except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                    pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            select.select([self.ssock], [], [], remaining)
+
+    def getpeername(self):
+        return self.ssock.getpeername()
+
+    def getsockopt(self, *args):
+        return self.ssock.getsockopt(*args)
+
+    def close(self):
+        try:
+            self.ssock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.ssock.close()
+        except OSError:
+            pass
+
+
+class MuxStream:
+    """One logical stream of a MuxConnection, used by the handlers like a connected socket
+
+    Payload frames, control messages and status replies arrive in the order the peer
+    sent them. Writes wait while the peer has not granted room for more payload.
+    """
+
+    def __init__(self, connection: 'MuxConnection', stream_id: int, send_window: int, opening: bool = False):
+        self.connection = connection
+        self.stream_id = stream_id
+        # Streams are opened by their first frame, so opens reach the peer in the order they are used
+        self._opening = opening
+        self._initiated = opening
+        self._frames = collections.deque()
+        self._condition = threading.Condition()
+        self._send_window = send_window
+        self._buffered = 0
+        self._consumed = 0
+        self._peer_closed = False
+        self._error = None
+        self._closed = False
+        self._timeout = None
+
+    # Called by the connection's reader
+
+    def _deliver(self, frame_type: int, flags: int, payload: bytearray) -> int:
+        with self._condition:
+            self._frames.append((frame_type, flags, payload))
+            if frame_type <= MUX_CONTROL:
+                self._buffered += len(payload)
+            self._condition.notify_all()
+            return self._buffered
+
+    def _grant(self, increment: int):
+        with self._condition:
+            self._send_window += increment
+            self._condition.notify_all()
+
+    def _finish(self, error: Optional[str] = None) -> bool:
+        """The peer closed or reset the stream; True if this side had closed it already"""
+        with self._condition:
+            if error:
+                self._error = self._error or error
+            else:
+                self._peer_closed = True
+            self._condition.notify_all()
+            return self._closed
+
+    # Reading
+
+    def _wait(self, ready: Callable[[], bool]):
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while not ready():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise socket.timeout("timed out")
+            self._condition.wait(remaining)
+
+    def _next_frame(self) -> Optional[tuple]:
+        """The next frame, or None once the peer closed the stream and everything was read"""
+        with self._condition:
+            self._wait(lambda: self._frames or self._peer_closed or self._error)
+            if not self._frames:
+                if self._error:
+                    raise ConnectionError(self._error)
+                return None
+            frame_type, flags, payload = self._frames.popleft()
+            grant = 0
+            if frame_type <= MUX_CONTROL:
+                self._buffered -= len(payload)
+                self._consumed += len(payload)
+                if self._consumed >= self.connection.window // 2:
+                    grant, self._consumed = self._consumed, 0
+        if grant and not self._peer_closed:
+            try:
+                self._send(MUX_WINDOW, 0, WINDOW_GRANT.pack(grant))
+            except OSError:
+                pass  # The frame was read; a lost connection surfaces on the next call
+        return frame_type, flags, payload
+
+    def read_frame(self) -> tuple:
+        """(frame_type, flags, payload) of the next payload frame; the payload is never reused"""
+        frame = self._next_frame()
+        if frame is None:
+            raise ConnectionError("Stream closed mid-frame")
+        frame_type, flags, payload = frame
+        if frame_type == MUX_STATUS:
+            raise ConnectionError(f"Peer replied {payload.decode(errors='replace')}")
+        if frame_type >= MUX_CONTROL:
+            raise ValueError(f"Expected a payload frame, got type {frame_type}")
+        return frame_type, flags, memoryview(payload)
+
+    def receive_control(self, kind: int) -> bytes:
+        """Payload of the next control message, which must be of the given kind"""
+        frame = self._next_frame()
+        if frame is None:
+            raise ConnectionError("Stream closed before message end")
+        frame_type, flags, payload = frame
+        if frame_type == MUX_STATUS:
+            raise ConnectionError(f"Peer replied {payload.decode(errors='replace')}")
+        if frame_type != MUX_CONTROL or flags != kind:
+            raise ValueError(f"Expected control message {kind}, got frame type {frame_type} flags {flags}")
+        return bytes(payload)
+
+    def receive_status(self) -> str:
+        """The next status reply; '' when the peer closed the stream instead"""
+        frame = self._next_frame()
+        if frame is None:
+            return ''
+        frame_type, _, payload = frame
+        if frame_type != MUX_STATUS:
+            raise ValueError(f"Expected a status reply, got frame type {frame_type}")
+        return payload.decode()
+
+    # Writing
+
+    def write_frame(self, payload, frame_type: int = 0, flags: int = 0):
+        """Send a payload frame (or control message) once the peer has room for it"""
+        with self._condition:
+            self._wait(lambda: self._send_window > 0 or self._peer_closed or self._error or self._closed)
+            if self._error:
+                raise ConnectionError(self._error)
+            if self._peer_closed or self._closed:
+                raise ConnectionError("Stream closed")
+            # A frame may overshoot the window; the next one waits for the grant
+            self._send_window -= len(payload)
+        self._send(frame_type, flags, payload)
+
+    def send_control(self, kind: int, payload: bytes):
+        self.write_frame(payload, MUX_CONTROL, kind)
+
+    def send_status(self, status: str):
+        """Status replies are not flow controlled, so they can be sent from the event loop"""
+        self._send(MUX_STATUS, 0, status.encode())
+
+    def _send(self, frame_type: int, flags: int, payload=b''):
+        with self._condition:
+            opening, self._opening = self._opening, False
+        self.connection.send_frame(frame_type, flags, self.stream_id, payload, opening)
+
+    def close(self):
+        """Tell the peer this side is done and forget the stream"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            # A stream the peer never heard of needs no goodbye
+            notify = not self._error and not self._opening
+            # The opening side counts a stream until the peer is done with it too, so it
+            # never believes there is room for a stream the peer would still refuse
+            done = not self._initiated or self._peer_closed or self._error or not notify
+            self._condition.notify_all()
+        if done:
+            self.connection._forget(self)
+        if notify:
+            try:
+                self._send(MUX_CLOSE, 0)
+            except OSError:
+                pass
+
+    # Socket-like helpers used by the handlers
+
+    def settimeout(self, timeout: Optional[float]):
+        self._timeout = timeout
+
+    def gettimeout(self) -> Optional[float]:
+        return self._timeout
+
+    def getpeername(self):
+        return self.connection.peer
+
+    def getsockopt(self, *args):
+        return self.connection.transport.getsockopt(*args)
+
+    @property
+    def metadata_format(self) -> str:
+        return self.connection.metadata_format
+
+
+class MuxConnection:
+    """Logical streams interleaved over one connection
+
+    The sending side opens streams; the first frame of a new stream id (its request)
+    announces it to the receiving side through on_stream. Every stream gets `window`
+    bytes of payload in flight, so one whose reader is busy cannot hold up the others.
+    The transport is a SocketTransport or any object with send_parts().
+    """
+
+    def __init__(self, transport, window: int = MUX_WINDOW_SIZE, peer_window: int = MUX_WINDOW_SIZE,
+                 on_stream: Optional[Callable[[MuxStream], None]] = None):
+        self.transport = transport
+        self.window = window
+        self.peer_window = peer_window
+        self.on_stream = on_stream
+        self.peer = transport.getpeername()
+        self.settings = {}  # What the receiver announced in its hello
+        self.metadata_format = METADATA_JSON  # Encoding of control messages and manifests on the streams
+        self.closed = False
+        self._parser = MuxParser()
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._unannounced = set()  # Streams the peer opened whose first frame has not arrived yet
+        self._idle_since = time.monotonic()
+        self.opened = 0
+
+    @classmethod
+    def connect(cls, ssock, window: int = MUX_WINDOW_SIZE) -> Optional['MuxConnection']:
+        """Switch a fresh client connection to frames; None if the receiver only speaks the sentinel protocol"""
+        request = {'type': MUX_UPGRADE, 'versions': [MUX_VERSION], 'window': window,
+                   'metadata': [METADATA_PACKED]}
+        ssock.sendall(json.dumps(request).encode() + REQUEST_END)
+        # Older receivers close connections that carry a request type they do not know
+        header = _recv_exactly(ssock, MUX_HEADER.size)
+        if header is None:
+            return None
+        version, frame_type, _, _, length = MUX_HEADER.unpack(header)
+        if version != MUX_VERSION or frame_type != MUX_HELLO or length > SMALL_PAYLOAD:
+            return None
+        settings = json.loads(_recv_exactly(ssock, length) or b'{}')
+        connection = cls(SocketTransport(ssock), window, settings.get('window', MUX_WINDOW_SIZE))
+        connection.settings = settings
+        if settings.get('metadata') == METADATA_PACKED:
+            connection.metadata_format = METADATA_PACKED
+        return connection
+
+    def accept(self, request_info: dict, idle_timeout: float) -> bool:
+        """Answer an upgrade request with this side's settings; False if no version is shared"""
+        if MUX_VERSION not in request_info.get('versions', []):
+            return False
+        self.peer_window = request_info.get('window') or MUX_WINDOW_SIZE
+        if METADATA_PACKED in request_info.get('metadata', []):
+            self.metadata_format = METADATA_PACKED
+        settings = {'version': MUX_VERSION, 'window': self.window, 'max_streams': MAX_STREAMS,
+                    'idle_timeout': idle_timeout, 'metadata': self.metadata_format}
+        self.send_frame(MUX_HELLO, 0, 0, json.dumps(settings).encode())
+        return True
+
+    def open_stream(self) -> MuxStream:
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("Connection closed")
+            stream = MuxStream(self, self._next_id, self.peer_window, opening=True)
+            self._next_id += 1
+            self._streams[stream.stream_id] = stream
+            self.opened += 1
+        return stream
+
+    def send_frame(self, frame_type: int, flags: int, stream_id: int, payload=b'', opening: bool = False):
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        header = MUX_HEADER.pack(MUX_VERSION, frame_type, flags, stream_id, len(payload))
+        if opening:
+            header = MUX_HEADER.pack(MUX_VERSION, MUX_OPEN, 0, stream_id, 0) + header
+        if len(payload) <= SMALL_PAYLOAD:
+            self.transport.send_parts([header + bytes(payload)])
+        else:
+            self.transport.send_parts([header, payload])
+
+    def feed(self, data):
+        """Dispatch the frames completed by bytes read from the transport; never blocks"""
+        self._dispatch_all(self._parser.feed(data))
+
+    def _dispatch_all(self, frames: list):
+        for frame_type, flags, stream_id, payload in frames:
+            self._dispatch(frame_type, flags, stream_id, payload)
+
+    def _dispatch(self, frame_type: int, flags: int, stream_id: int, payload: bytearray):
+        if not stream_id:
+            return
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if frame_type == MUX_OPEN:
+                if stream is not None or self.on_stream is None:
+                    raise ValueError(f"Unexpected open of stream {stream_id}")
+                refused = len(self._streams) >= MAX_STREAMS or self.closed
+                if not refused:
+                    self._streams[stream_id] = MuxStream(self, stream_id, self.peer_window)
+                    self._unannounced.add(stream_id)
+                    self.opened += 1
+        if frame_type == MUX_OPEN:
+            if refused:
+                self.send_frame(MUX_RESET, 0, stream_id, b"Too many streams")
+            return
+        if stream is None:
+            return  # A late frame of a stream this side already closed
+        if frame_type == MUX_WINDOW:
+            stream._grant(WINDOW_GRANT.unpack(payload)[0])
+        elif frame_type in (MUX_CLOSE, MUX_RESET):
+            error = None
+            if frame_type == MUX_RESET:
+                error = payload.decode(errors='replace') or "Stream reset by peer"
+            if stream._finish(error):
+                self._forget(stream)
+        elif stream._deliver(frame_type, flags, payload) > self.window + FrameReader.MAX_FRAME_SIZE:
+            stream._finish("Flow control window exceeded")
+            self.send_frame(MUX_RESET, 0, stream_id, b"Flow control window exceeded")
+        elif stream_id in self._unannounced:
+            # Handed over once its first frame (the request) can be read without waiting
+            self._unannounced.discard(stream_id)
+            self.on_stream(stream)
+
+    def _forget(self, stream: MuxStream):
+        with self._lock:
+            if self._streams.get(stream.stream_id) is stream:
+                del self._streams[stream.stream_id]
+            if not self._streams:
+                self._idle_since = time.monotonic()
+
+    def active_streams(self) -> int:
+        with self._lock:
+            return len(self._streams)
+
+    def idle_for(self) -> float:
+        """Seconds since the last stream closed, 0 while any is open"""
+        with self._lock:
+            return 0.0 if self._streams else time.monotonic() - self._idle_since
+
+    def read_loop(self, idle_timeout: Optional[float] = None, running: Callable[[], bool] = lambda: True):
+        """Read and dispatch frames from a SocketTransport until either side closes the connection
+
+        Large payloads are received straight into their frame's buffer; headers and small
+        frames go through one reusable read buffer.
+        """
+        buffer = memoryview(bytearray(READ_SIZE))
+        try:
+            while not self.closed and running():
+                pending = self._parser.pending()
+                direct = pending is not None and len(pending) >= READ_SIZE
+                count = self.transport.recv_into(pending if direct else buffer, POLL_SECONDS)
+                if count is None:
+                    if idle_timeout is not None and self.idle_for() >= idle_timeout:
+                        break
+                    continue
+                if not count:
+                    break
+                if direct:
+                    self._dispatch_all(self._parser.filled(count))
+                else:
+                    self.feed(buffer[:count])
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        """Fail every open stream and close the transport if it can be closed"""
+        with self._lock:
+            self.closed = True
+            streams = list(self._streams.values())
+            self._streams.clear()
+        for stream in streams:
+            stream._finish("Connection closed")
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
+
+
+def _recv_exactly(ssock, size: int) -> Optional[bytes]:
+    """size bytes from a blocking socket; None if it closes before the first one"""
+    data = b''
+    while len(data) < size:
+        chunk = recv_buffered(ssock, size - len(data))
+        if not chunk:
+            if not data:
+                return None
+            raise ConnectionError("Connection closed mid-frame")
+        data += chunk
+    return data
@@ -0,0 +1,234 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+from utils.compression import (
+    AdaptiveCompressor, CompressionManager, CompressionMethod, StreamCompressor, StreamDecompressor
+)
+from utils.crypto import StreamCipher
+from .framing import (
+    FRAME_DATA, FRAME_EOF, FLAG_COMPRESSED, FLAG_STREAM, MAX_CHUNK_SIZE, FrameReader, FrameWriter,
+    compression_flags, frame_method_value
+)
+
+DEFAULT_DECODE_WORKERS = 4
+PIPELINE_DEPTH = 8
+COMPRESSION_BLOCK_MIN = 1024 * 1024
+COMPRESSION_BLOCK_MAX = 8 * 1024 * 1024
+# Most data a sender puts in one frame; a compressed frame that inflates past it is refused
+MAX_DECODED_FRAME = max(MAX_CHUNK_SIZE, COMPRESSION_BLOCK_MAX)
+
+COMPRESSION_MODE_BLOCK = 'block'  # Every frame compressed on its own; can run on a worker pool
+COMPRESSION_MODE_STREAM = 'stream'  # One compressor per transfer; better ratio, one core
+
+
+class FrameCompressor:
+    """Sender side of FrameDecoder: compress each chunk for one transfer and pick its frame flags"""
+
+    def __init__(self, method: CompressionMethod, mode: str = COMPRESSION_MODE_BLOCK,
+                 adaptive: Optional[AdaptiveCompressor] = None):
+        self.method = method
+        self.adaptive = adaptive
+        self.stream = None
+        if mode == COMPRESSION_MODE_STREAM and method not in (CompressionMethod.NONE, CompressionMethod.ADAPTIVE):
+            self.stream = StreamCompressor(method)
+
+    @property
+    def stateful(self) -> bool:
+        """Stateful compression has to see the chunks in order, so it cannot use the worker pool"""
+        return self.stream is not None
+
+    def compress(self, chunk) -> tuple:
+        """Returns (payload, frame flags)"""
+        if self.stream:
+            return self.stream.compress(chunk), compression_flags(self.method.value, stream=True)
+        if self.adaptive:
+            payload, method = self.adaptive.compress(chunk)
+        else:
+            payload, method = CompressionManager.compress_block(chunk, self.method)
+        return payload, compression_flags(method.value)
+
+    def flush(self) -> Optional[tuple]:
+        """Final frame that ends the compression stream, if there is one"""
+        if not self.stream:
+            return None
+        return self.stream.flush(), compression_flags(self.method.value, stream=True)
+
+
+class FrameDecoder:
+    """Undo the sender's per-frame processing: open the AES-GCM seal, then decompress flagged frames
+
+    decode() is safe on any thread; inflate() continues a compression stream and must see frames in order.
+    """
+
+    def __init__(self, cipher: Optional[StreamCipher], compression_method: CompressionMethod):
+        self.cipher = cipher
+        self.compression_method = compression_method
+        self._streams = {}
+
+    @property
+    def has_work(self) -> bool:
+        return self.cipher is not None or self.compression_method != CompressionMethod.NONE
+
+    def claim(self) -> Optional[int]:
+        """Sequence number of the next frame; called in frame order"""
+        return self.cipher.reserve() if self.cipher else None
+
+    def decode(self, payload, flags: int, sequence: Optional[int]):
+        """Safe to run on any thread once the frame's sequence has been claimed"""
+        if self.cipher:
+            payload = self.cipher.open(payload, sequence)
+        if flags & FLAG_COMPRESSED and not flags & FLAG_STREAM:
+            payload = CompressionManager.decompress_data(payload, self._frame_method(flags), MAX_DECODED_FRAME)
+        return payload
+
+    def _frame_method(self, flags: int) -> CompressionMethod:
+        method_value = frame_method_value(flags)
+        return CompressionMethod(method_value) if method_value else self.compression_method
+
+    def inflate(self, payload, flags: int):
+        """Feed a stream-compressed frame to the transfer's decompressor, in frame order"""
+        if not flags & FLAG_STREAM:
+            return payload
+        method = self._frame_method(flags)
+        if method not in self._streams:
+            self._streams[method] = StreamDecompressor(method, MAX_DECODED_FRAME)
+        return self._streams[method].decompress(payload)
+
+    def flush(self) -> Iterator[bytes]:
+        """Whatever the decompressors still hold once the last frame is in, a frame's worth at a time"""
+        for stream in self._streams.values():
+            yield from stream.drain()
+
+
+class DecodePipeline:
+    """Yield decoded data frames in order until EOF, then expose the trailer
+
+    With workers, a reader thread pulls frames off the socket while a pool decodes them
+    (zlib, lzma, bz2 and AES-GCM release the GIL) and the caller writes the results, so
+    network, CPU and disk overlap. Without workers everything runs inline in the caller.
+    """
+
+    def __init__(self, reader: FrameReader, decoder: FrameDecoder, workers: int = 0,
+                 depth: int = PIPELINE_DEPTH):
+        self.reader = reader
+        self.decoder = decoder
+        self.workers = workers
+        self.depth = depth
+        self.trailer = None
+        if workers:
+            # Every queued frame keeps its buffer until it has been written
+            self.reader.pool.max_buffers = max(self.reader.pool.max_buffers, depth + workers + 2)
+
+    def __iter__(self):
+        if self.workers:
+            return self._pipelined()
+        return self._inline()
+
+    def read_trailer(self) -> dict:
+        if self.trailer is None:
+            self.trailer = self.reader.read_trailer()
+        return self.trailer
+
+    def _inline(self):
+        while True:
+            frame_type, flags, payload = self.reader.read_frame()
+            if frame_type == FRAME_EOF:
+                break
+            if frame_type != FRAME_DATA:
+                raise ValueError(f"Unexpected frame type {frame_type}")
+            yield self.decoder.inflate(self.decoder.decode(payload, flags, self.decoder.claim()), flags)
+        yield from self.decoder.flush()
+
+    def _read_loop(self, executor: ThreadPoolExecutor, frames: queue.Queue, stop: threading.Event):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        try:
+            while not stop.is_set():
+                frame_type, flags, payload = self.reader.read_frame()
+                if frame_type == FRAME_EOF:
+                    self.trailer = self.reader.read_trailer()
+                    put(None)
+                    return
+                if frame_type != FRAME_DATA:
+                    raise ValueError(f"Unexpected frame type {frame_type}")
+                buffer = self.reader.detach()
+                future = executor.submit(self.decoder.decode, payload, flags, self.decoder.claim())
+                put((future, buffer, flags))
+        except Exception as e:
+            put(e)
+
+    def _pipelined(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        frames = queue.Queue(self.depth)
+        stop = threading.Event()
+        reader_thread = threading.Thread(
+            target=self._read_loop, args=(executor, frames, stop), daemon=True
+        )
+        reader_thread.start()
+        written = None
+        try:
+            while True:
+                item = frames.get()
+                if written is not None:
+                    self.reader.pool.release(written)
+                    written = None
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                future, buffer, flags = item
+                data = self.decoder.inflate(future.result(), flags)
+                written = buffer
+                yield data
+            reader_thread.join()
+            yield from self.decoder.flush()
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class EncodePipeline:
+    """Compress and seal blocks on a worker pool while frames still go out in submission order
+
+    At most `depth` blocks are in flight, so memory stays bounded to depth * block size.
+    """
+
+    def __init__(self, writer: FrameWriter, encode: Callable, workers: int,
+                 cipher: Optional[StreamCipher] = None, depth: Optional[int] = None):
+        self.writer = writer
+        self.encode = encode
+        self.cipher = cipher
+        self.depth = depth or workers * 2
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = deque()
+
+    def submit(self, chunk):
+        """Queue one block; blocks while the oldest frame is written once the pipeline is full"""
+        # Sequence numbers are claimed here, in frame order, not on the workers
+        sequence = self.cipher.reserve() if self.cipher else None
+        self._pending.append(self._executor.submit(self.encode, chunk, sequence))
+        while len(self._pending) >= self.depth:
+            self._write_next()
+
+    def _write_next(self):
+        payload, flags = self._pending.popleft().result()
+        self.writer.write_frame(payload, flags=flags)
+
+    def flush(self):
+        while self._pending:
+            self._write_next()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,37 +1,107 @@
-import json
 import socket
+from typing import Optional
+
+from .framing import recv_buffered, recv_until
+from .metadata import decode_message, encode_message, packs_metadata
+
+RESUME_END = b'<RESUME_END>'
+CODEC_END = b'<CODEC_END>'
+DEDUP_END = b'<DEDUP_END>'
+DELTA_END = b'<DELTA_END>'
+SYNC_END = b'<SYNC_END>'
+REQUEST_END = b'<REQUEST_END>'
+METADATA_END = b'<METADATA_END>'
+# On a multiplexed stream each control message is one frame, and its kind replaces the sentinel
+MESSAGE_KINDS = {
+    REQUEST_END: 1, METADATA_END: 2, RESUME_END: 3, CODEC_END: 4, DEDUP_END: 5, DELTA_END: 6, SYNC_END: 7
+}
+MAX_MESSAGE_SIZE = 1024 * 1024  # Largest control message a peer accepts
+MESSAGE_TOO_LARGE = "Message too large"
+BUSY = "BUSY"
+ACCEPTED_KEEP_ALIVE = "ACCEPTED KEEP-ALIVE"  # Accepted, and the connection stays open for another request
+
+
+class ReceiverBusy(Exception):
+    """The receiver had no free transfer slot; the sender should retry after retry_after seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Receiver busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def busy_reply(retry_after: int) -> str:
+    return f"{BUSY} {retry_after}"
+
+
+def parse_busy(response: str) -> Optional[int]:
+    """Seconds to wait if the response is a busy reply, else None"""
+    parts = response.split()
+    if len(parts) == 2 and parts[0] == BUSY and parts[1].isdigit():
+        return int(parts[1])
+    return None
 
 
 class TransferProtocol:
     def __init__(self):
         pass
 
+    def _receive_until(self, ssock, sentinel: bytes, limit: int = 65536):
+        """Read until the sentinel and return the bytes before it, or None when too large"""
+        if hasattr(ssock, 'receive_control'):
+            data = ssock.receive_control(MESSAGE_KINDS[sentinel])
+            return data if len(data) <= limit else None
+        if hasattr(ssock, 'recv_until'):
+            return ssock.recv_until(sentinel, limit)
+        return recv_until(ssock, sentinel, limit)
+
+    def send_message(self, ssock, message: dict, sentinel: bytes):
+        """Send a JSON control message terminated by a sentinel, or as one frame on a multiplexed stream
+
+        Streams whose connection agreed on packed metadata send it packed instead of as JSON.
+        """
+        data = encode_message(message, packs_metadata(ssock))
+        if hasattr(ssock, 'send_control'):
+            ssock.send_control(MESSAGE_KINDS[sentinel], data)
+        else:
+            ssock.sendall(data + sentinel)
+
+    def send_status(self, ssock, status: str):
+        """Send a one-line reply such as ACCEPTED, SUCCESS or ERROR: ..."""
+        if hasattr(ssock, 'send_status'):
+            ssock.send_status(status)
+        else:
+            ssock.send(status.encode())
+
+    def receive_status(self, ssock) -> str:
+        """Receive a one-line reply; '' when the peer closed the connection instead"""
+        if hasattr(ssock, 'receive_status'):
+            return ssock.receive_status()
+        return recv_buffered(ssock, 1024).decode()
+
+    def receive_message(self, ssock, sentinel: bytes, limit: int = MAX_MESSAGE_SIZE):
+        """Receive a control message terminated by a sentinel, JSON or packed"""
+        data = self._receive_until(ssock, sentinel, limit)
+        if data is None:
+            self.send_status(ssock, f"ERROR: {MESSAGE_TOO_LARGE}")
+            return None
+        return decode_message(data)
+
     def receive_request_metadata(self, ssock):
         """Receive request metadata"""
-        request_data = b''
-        while True:
-            chunk = ssock.recv(1024)
-            request_data += chunk
-            if b'<REQUEST_END>' in request_data:
-                break
-            if len(request_data) > 65536:
-                ssock.send("ERROR: Request too large".encode())
-                return None
-        
-        request_str = request_data.split(b'<REQUEST_END>')[0].decode()
-        return json.loads(request_str)
+        request_data = self._receive_until(ssock, REQUEST_END)
+        if request_data is None:
+            self.send_status(ssock, "ERROR: Request too large")
+            return None
+        return self.decode_request(request_data)
+
+    def decode_request(self, request_data: bytes):
+        """Parse request metadata read by the caller"""
+        return decode_message(request_data)
 
     def receive_file_metadata(self, ssock):
         """Receive file metadata"""
-        metadata = b''
-        while True:
-            chunk = ssock.recv(1024)
-            metadata += chunk
-            if b'<METADATA_END>' in metadata:
-                break
-            if len(metadata) > 65536:
-                ssock.send("ERROR: Metadata too large".encode())
-                return None
-        
-        metadata_str = metadata.split(b'<METADATA_END>')[0].decode()
-        return json.loads(metadata_str)
\ No newline at end of file
+        metadata = self._receive_until(ssock, METADATA_END)
+        if metadata is None:
+            self.send_status(ssock, "ERROR: Metadata too large")
+            return None
+        return decode_message(metadata)
@@ -0,0 +1,143 @@
+import json
+import os
+from typing import Optional
+
+from utils.hashing import HashManager
+
+RESUME_BLOCK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def hash_matching_prefix(file_path: str, block_size: int, block_hashes: list,
+                         hash_algorithm: str, file_hash) -> int:
+    """Re-hash leading blocks of a file against known block hashes.
+
+    Every block that matches is also fed into `file_hash`; returns the byte offset of
+    the first block that is missing or differs.
+    """
+    offset = 0
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    try:
+        with open(file_path, 'rb') as f:
+            for expected in block_hashes:
+                read = f.readinto(view)
+                if read != block_size:
+                    break
+                block_hash = HashManager.new(hash_algorithm)
+                block_hash.update(view)
+                if block_hash.hexdigest() != expected:
+                    break
+                file_hash.update(view)
+                offset += block_size
+    except FileNotFoundError:
+        return 0
+    return offset
+
+
+class ResumeJournal:
+    """Verified offsets and per-block hashes of a .part file, kept beside it"""
+
+    def __init__(self, save_path: str, request_id: str, file_size: int, hash_algorithm: str,
+                 block_size: int = RESUME_BLOCK_SIZE, block_hashes: Optional[list] = None):
+        self.save_path = save_path
+        self.temp_path = save_path + '.part'
+        self.journal_path = self.temp_path + '.journal'
+        self.request_id = request_id
+        self.file_size = file_size
+        self.hash_algorithm = hash_algorithm
+        self.block_size = block_size
+        self.block_hashes = block_hashes or []
+        self.offset = 0
+        self.file_hash = HashManager.new(hash_algorithm)
+
+    @classmethod
+    def load(cls, save_path: str, request_id: str, file_size: int, hash_algorithm: str) -> 'ResumeJournal':
+        """Reuse the journal of an interrupted attempt of the same request, or start fresh"""
+        journal = cls(save_path, request_id, file_size, hash_algorithm)
+        try:
+            with open(journal.journal_path, 'r') as f:
+                saved = json.load(f)
+            if (saved.get('request_id') == request_id and saved.get('file_size') == file_size
+                    and saved.get('hash_algorithm') == hash_algorithm):
+                journal.block_size = saved['block_size']
+                journal.block_hashes = saved['block_hashes']
+        except (OSError, ValueError, KeyError):
+            pass
+        return journal
+
+    def verify_part(self) -> int:
+        """Check the .part file against the journal; returns the offset that can be offered"""
+        self.file_hash = HashManager.new(self.hash_algorithm)
+        self.offset = hash_matching_prefix(
+            self.temp_path, self.block_size, self.block_hashes, self.hash_algorithm, self.file_hash
+        )
+        del self.block_hashes[self.offset // self.block_size:]
+        return self.offset
+
+    def rewind(self, offset: int):
+        """Resume from an earlier block than offered because the sender's copy differs"""
+        if offset >= self.offset:
+            return
+        del self.block_hashes[offset // self.block_size:]
+        self.file_hash = HashManager.new(self.hash_algorithm)
+        self.offset = hash_matching_prefix(
+            self.temp_path, self.block_size, self.block_hashes, self.hash_algorithm, self.file_hash
+        )
+
+    def offer(self) -> dict:
+        return {
+            'resume_offset': self.offset,
+            'block_size': self.block_size,
+            'block_hashes': self.block_hashes,
+        }
+
+    def save(self):
+        """Atomically replace the journal on disk"""
+        temp_journal = self.journal_path + '.tmp'
+        with open(temp_journal, 'w') as f:
+            json.dump({
+                'request_id': self.request_id,
+                'file_size': self.file_size,
+                'hash_algorithm': self.hash_algorithm,
+                'block_size': self.block_size,
+                'block_hashes': self.block_hashes,
+            }, f)
+        os.replace(temp_journal, self.journal_path)
+
+    def delete(self):
+        try:
+            os.unlink(self.journal_path)
+        except OSError:
+            pass
+
+    def open_part(self):
+        """Open the .part file positioned at the negotiated offset"""
+        mode = 'r+b' if self.offset and os.path.exists(self.temp_path) else 'wb'
+        file = open(self.temp_path, mode)
+        file.seek(self.offset)
+        file.truncate()
+        return file
+
+    def journaled_writer(self, file):
+        """Wrap file.write so every completed block is fsynced and recorded"""
+        block_hash = [HashManager.new(self.hash_algorithm)]
+        block_filled = [0]
+
+        def write(data):
+            view = memoryview(data).cast('B')
+            while view:
+                take = min(len(view), self.block_size - block_filled[0])
+                file.write(view[:take])
+                block_hash[0].update(view[:take])
+                block_filled[0] += take
+                view = view[take:]
+                if block_filled[0] == self.block_size:
+                    file.flush()
+                    os.fsync(file.fileno())
+                    self.block_hashes.append(block_hash[0].hexdigest())
+                    self.save()
+                    block_hash[0] = HashManager.new(self.hash_algorithm)
+                    block_filled[0] = 0
+
+        return write
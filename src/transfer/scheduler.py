@@ -0,0 +1,121 @@
+import collections
+import threading
+import time
+from typing import Callable, Optional
+
+MAX_ACTIVE_TRANSFERS = 4
+TRANSFER_QUEUE_SIZE = 32
+QUEUE_TIMEOUT = 60.0  # Senders give up on a silent connection after 120s, so answer well before that
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+DEFAULT_TRANSFER_SECONDS = 5.0  # Assumed transfer duration until some have finished
+
+
+class Ticket:
+    """One transfer request: queued until start() is called, active until released"""
+
+    def __init__(self, sender: str, start: Callable[[], None]):
+        self.sender = sender
+        self.start = start
+        self.started_at = None
+
+
+class TransferScheduler:
+    """Admit incoming transfers to a fixed number of slots, taking waiting senders in turn
+
+    Requests beyond the free slots wait in a queue per sender; a freed slot goes to the
+    next sender round-robin, so one peer pushing many files cannot starve the others.
+    When the queue is full the caller answers "busy" with retry_after() seconds.
+    """
+
+    def __init__(self, max_active: int = MAX_ACTIVE_TRANSFERS, queue_size: int = TRANSFER_QUEUE_SIZE):
+        self.max_active = max(1, max_active)
+        self.queue_size = max(0, queue_size)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = collections.OrderedDict()  # sender -> deque of tickets, in round-robin order
+        self._queued = 0
+        self._average = None  # Moving average of transfer durations in seconds
+        self.admitted = 0
+        self.rejected = 0
+
+    def submit(self, sender: str, start: Callable[[], None]) -> Optional[Ticket]:
+        """Start the transfer now or queue it; None means the queue is full"""
+        ticket = Ticket(sender, start)
+        with self._lock:
+            if self._active < self.max_active and not self._queued:
+                self._activate(ticket)
+            elif self._queued < self.queue_size:
+                self._waiting.setdefault(sender, collections.deque()).append(ticket)
+                self._queued += 1
+                return ticket
+            else:
+                self.rejected += 1
+                return None
+        ticket.start()
+        return ticket
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """Withdraw a queued ticket; False if it was started meanwhile and must be released"""
+        with self._lock:
+            queue = self._waiting.get(ticket.sender)
+            if queue is None or ticket not in queue:
+                return False
+            queue.remove(ticket)
+            if not queue:
+                del self._waiting[ticket.sender]
+            self._queued -= 1
+            self.rejected += 1
+            return True
+
+    def release(self, ticket: Ticket):
+        """Free the ticket's slot and start the next sender's transfer"""
+        with self._lock:
+            duration = time.monotonic() - ticket.started_at
+            self._average = duration if self._average is None else 0.8 * self._average + 0.2 * duration
+            self._active -= 1
+            following = self._next()
+        if following:
+            following.start()
+
+    def wait_for_slot(self, sender: str, timeout: float = QUEUE_TIMEOUT) -> Optional[Ticket]:
+        """Blocking form of submit() for the threaded receiver; None means answer busy"""
+        started = threading.Event()
+        ticket = self.submit(sender, started.set)
+        if ticket is None:
+            return None
+        if started.wait(timeout) or not self.cancel(ticket):
+            return ticket
+        return None
+
+    def retry_after(self) -> int:
+        """Seconds a rejected sender should wait, from the queue length and recent transfer times"""
+        with self._lock:
+            average = self._average if self._average is not None else DEFAULT_TRANSFER_SECONDS
+            estimate = average * (self._queued + 1) / self.max_active
+        return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, round(estimate))))
+
+    def _activate(self, ticket: Ticket):
+        self._active += 1
+        self.admitted += 1
+        ticket.started_at = time.monotonic()
+
+    def _next(self) -> Optional[Ticket]:
+        if self._active >= self.max_active or not self._waiting:
+            return None
+        sender, queue = next(iter(self._waiting.items()))
+        ticket = queue.popleft()
+        if queue:
+            self._waiting.move_to_end(sender)
+        else:
+            del self._waiting[sender]
+        self._queued -= 1
+        self._activate(ticket)
+        return ticket
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'active': self._active, 'queued': self._queued, 'senders_waiting': len(self._waiting),
+                'admitted': self.admitted, 'rejected': self.rejected
+            }
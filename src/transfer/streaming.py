@@ -1,113 +1,339 @@
 import os
-import hashlib
-import tempfile
-import tarfile
+import socket
+import ssl
 import time
 from typing import Optional, Callable
-from utils.crypto import CryptoManager
-from utils.compression import CompressionManager, CompressionMethod
+from utils.crypto import CryptoManager, StreamCipher
+from utils.compression import AdaptiveCompressor, CompressionMethod
+from utils.hashing import HashManager, DEFAULT_HASH_ALGORITHM
+from utils.file_index import FileIndex, hash_kind
+from .resume import ResumeJournal
+from .pipeline import (
+    COMPRESSION_BLOCK_MAX, COMPRESSION_BLOCK_MIN, COMPRESSION_MODE_BLOCK, COMPRESSION_MODE_STREAM,
+    DEFAULT_DECODE_WORKERS, DecodePipeline, EncodePipeline, FrameCompressor, FrameDecoder
+)
+from .archive import (
+    ARCHIVE_FORMAT, FrameInputStream, FrameOutputStream, extract_tar_stream, remove_tree, write_folder_tar
+)
+from .bulk import MANIFEST_FORMAT, read_manifest, receive_bulk, write_bulk_bodies, write_manifest
+from .dedup import ChunkStore, read_chunk_list, receive_chunks, write_chunk_bodies
+from .delta import apply_delta, write_delta
+from .metadata import packs_metadata
+from .framing import (
+    FRAME_HEADER, FRAME_DATA, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE,
+    AdaptiveChunkSizer, FrameReader, FrameWriter, TokenBucket, measure_rtt
+)
 
 
 class StreamManager:
-    def __init__(self):
-        pass
+    def __init__(self, transfer_config=None):
+        self.transfer_config = transfer_config
+        self._file_index = None
+
+    def _get_setting(self, key, default):
+        """Read a transfer setting, falling back when no config is attached"""
+        if self.transfer_config:
+            value = self.transfer_config.get_setting(key)
+            if value is not None:
+                return value
+        return default
+
+    def get_file_index(self) -> Optional[FileIndex]:
+        """Shared index of hashes, chunk lists and signatures, or None when disabled"""
+        if self._file_index is None and self._get_setting('file_index', True):
+            try:
+                self._file_index = FileIndex()
+            except Exception as e:
+                print(f"⚠️  File index unavailable: {e}")
+                return None
+        return self._file_index
+
+    def get_hash_algorithm(self) -> str:
+        """Configured integrity hash, if this peer can compute it"""
+        algorithm = self._get_setting('hash_algorithm', DEFAULT_HASH_ALGORITHM)
+        return algorithm if HashManager.is_available(algorithm) else DEFAULT_HASH_ALGORITHM
+
+    def create_frame_writer(self, ssock) -> FrameWriter:
+        """Frame writer honouring the configured bandwidth limit"""
+        limit = self._get_setting('bandwidth_limit', 0)
+        return FrameWriter(ssock, TokenBucket(limit) if limit else None)
+
+    def get_compression_workers(self) -> int:
+        return self._get_setting('compression_workers', 0) or os.cpu_count() or 1
+
+    def get_compression_mode(self, compression_method: CompressionMethod) -> str:
+        """Stream (stateful) or block compression; 'auto' keeps blocks only where the pool pays off"""
+        mode = self._get_setting('compression_mode', 'auto')
+        if compression_method == CompressionMethod.ADAPTIVE:
+            return COMPRESSION_MODE_BLOCK
+        if mode in (COMPRESSION_MODE_BLOCK, COMPRESSION_MODE_STREAM):
+            return mode
+        # lzma and bz2 are too slow for one core; zlib and gzip keep up and gain the shared dictionary
+        if compression_method in (CompressionMethod.LZMA, CompressionMethod.BZ2) and self.get_compression_workers() > 1:
+            return COMPRESSION_MODE_BLOCK
+        return COMPRESSION_MODE_STREAM
+
+    def create_frame_compressor(self, writer: FrameWriter,
+                                compression_method: CompressionMethod) -> Optional[FrameCompressor]:
+        """Per-transfer compressor; the adaptive policy also watches how fast frames reach the wire"""
+        if compression_method == CompressionMethod.NONE:
+            return None
+        adaptive = None
+        if compression_method == CompressionMethod.ADAPTIVE:
+            adaptive = AdaptiveCompressor(self.get_compression_workers())
+            writer.observer = adaptive.observe_link
+        return FrameCompressor(compression_method, self.get_compression_mode(compression_method), adaptive)
+
+    def create_encode_pipeline(self, writer: FrameWriter, cipher: Optional[StreamCipher],
+                               compressor: Optional[FrameCompressor]) -> Optional[EncodePipeline]:
+        """Parallel compression pool for block-compressed sends, or None when one core is enough"""
+        workers = self.get_compression_workers()
+        if compressor is None or compressor.stateful or workers < 2:
+            return None
+        return EncodePipeline(
+            writer, lambda chunk, sequence: self._process_chunk(chunk, cipher, compressor, sequence),
+            workers, cipher
+        )
+
+    def get_compression_block_size(self) -> int:
+        """Compressed sends use larger fixed blocks than the adaptive wire frames"""
+        size = self._get_setting('compression_block_size', COMPRESSION_BLOCK_MAX // 2)
+        return min(COMPRESSION_BLOCK_MAX, max(COMPRESSION_BLOCK_MIN, size))
+
+    def create_chunk_sizer(self, ssock) -> AdaptiveChunkSizer:
+        """Chunk sizer bounded by the configured sizes and seeded with the socket RTT"""
+        return AdaptiveChunkSizer(
+            self._get_setting('chunk_size_min', MIN_CHUNK_SIZE),
+            # Receivers refuse compressed frames that inflate past MAX_CHUNK_SIZE
+            min(self._get_setting('chunk_size_max', MAX_CHUNK_SIZE), MAX_CHUNK_SIZE),
+            rtt=measure_rtt(ssock)
+        )
 
     def stream_file_data(self, ssock, file_path: str, file_size: int,
-                        encryption_password: Optional[str], 
+                        cipher: Optional[StreamCipher],
                         compression_method: CompressionMethod,
-                        progress_callback: Optional[Callable]) -> bool:
-        """Stream file data in chunks without loading entire file into memory"""
-        chunk_size = 64 * 1024  # 64KB chunks
+                        progress_callback: Optional[Callable],
+                        hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+                        offset: int = 0, length: Optional[int] = None,
+                        file_hash=None) -> bool:
+        """Stream file data (or the byte range offset..offset+length) without loading it into memory
+
+        file_hash may come pre-seeded with the bytes before offset (resumed transfers).
+        """
+        writer = self.create_frame_writer(ssock)
+        sizer = self.create_chunk_sizer(ssock)
+        if file_hash is None:
+            file_hash = HashManager.new(hash_algorithm)
+        end = file_size if length is None else offset + length
+        if cipher is None and compression_method == CompressionMethod.NONE:
+            return self.stream_file_raw(writer, file_path, offset, end, sizer, file_hash, progress_callback)
+        
         total_sent = 0
+        compressor = self.create_frame_compressor(writer, compression_method)
+        pipeline = self.create_encode_pipeline(writer, cipher, compressor)
         
         try:
             with open(file_path, 'rb') as file:
-                while True:
-                    chunk = file.read(chunk_size)
+                file.seek(offset)
+                remaining = end - offset
+                while remaining:
+                    size = self.get_compression_block_size() if pipeline else sizer.chunk_size
+                    chunk = file.read(min(size, remaining))
                     if not chunk:
                         break
+                    remaining -= len(chunk)
+                    file_hash.update(chunk)
                     
-                    processed_chunk = self._process_chunk(
-                        chunk, encryption_password, compression_method
-                    )
-                    
-                    chunk_size_data = len(processed_chunk).to_bytes(4, byteorder='big')
-                    ssock.send(chunk_size_data + processed_chunk)
+                    if pipeline:
+                        pipeline.submit(chunk)
+                    else:
+                        processed_chunk, flags = self._process_chunk(chunk, cipher, compressor)
+                        
+                        started = time.perf_counter()
+                        writer.write_frame(processed_chunk, flags=flags)
+                        sizer.observe(len(processed_chunk), time.perf_counter() - started)
                     
                     total_sent += len(chunk)
                     
                     if progress_callback:
-                        progress_callback(total_sent, file_size, "Sending")
-                    
-                    time.sleep(0.001)
+                        progress_callback(total_sent, end - offset, "Sending")
                 
-                ssock.send(b'\x00\x00\x00\x00')  # EOF marker
+                if pipeline:
+                    pipeline.flush()
+                self._write_compression_tail(writer, cipher, compressor)
+                writer.write_eof()
+                writer.write_trailer({'checksum': file_hash.hexdigest()})
                 return True
                 
         except Exception as e:
             print(f"Streaming error: {e}")
             return False
+        finally:
+            if pipeline:
+                pipeline.close()
 
-    def _process_chunk(self, chunk, encryption_password, compression_method):
-        """Process a single chunk of data"""
-        if compression_method != CompressionMethod.NONE:
+    def stream_file_raw(self, writer: FrameWriter, file_path: str, offset: int, end: int,
+                        sizer: AdaptiveChunkSizer, file_hash, progress_callback: Optional[Callable]) -> bool:
+        """Fast path for plain transfers: kernel sendfile or a reusable readinto buffer"""
+        try:
+            with open(file_path, 'rb') as file:
+                if self._can_sendfile(writer.ssock):
+                    self._sendfile_frames(writer, file, offset, end, sizer, file_hash, progress_callback)
+                else:
+                    self._readinto_frames(writer, file, offset, end, sizer, file_hash, progress_callback)
+                writer.write_eof()
+                writer.write_trailer({'checksum': file_hash.hexdigest()})
+                return True
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            return False
+
+    @staticmethod
+    def _can_sendfile(ssock) -> bool:
+        """True when the kernel can move file pages to the socket without Python copies"""
+        if not hasattr(os, 'sendfile') or not isinstance(ssock, socket.socket):
+            return False
+        if not isinstance(ssock, ssl.SSLSocket):
+            return True
+        # TLS records can only be built in the kernel when kTLS is active for sending
+        uses_ktls = getattr(ssock._sslobj, 'uses_ktls_for_send', None)
+        try:
+            return bool(uses_ktls and uses_ktls())
+        except Exception:
+            return False
+
+    def _sendfile_frames(self, writer: FrameWriter, file, offset: int, end: int,
+                         sizer: AdaptiveChunkSizer, file_hash, progress_callback: Optional[Callable]):
+        """Send frames whose payload goes through sendfile"""
+        # The payload never enters Python, so hash each range right after it was sent
+        # while its pages are still in the page cache
+        hash_buffer = memoryview(bytearray(sizer.max_size))
+        start = offset
+        while offset < end:
+            count = min(sizer.chunk_size, end - offset)
+            started = time.perf_counter()
+            writer.write_header(count)
+            sent = writer.ssock.sendfile(file, offset, count)
+            if sent != count:
+                raise IOError("File changed size while sending")
+            sizer.observe(count, time.perf_counter() - started)
+            file.seek(offset)
+            file.readinto(hash_buffer[:count])
+            file_hash.update(hash_buffer[:count])
+            offset += count
+            
+            if progress_callback:
+                progress_callback(offset - start, end - start, "Sending")
+
+    def _readinto_frames(self, writer: FrameWriter, file, offset: int, end: int,
+                         sizer: AdaptiveChunkSizer, file_hash, progress_callback: Optional[Callable]):
+        """Send frames from one preallocated buffer with the header packed in place"""
+        header_size = FRAME_HEADER.size
+        buffer = bytearray(header_size + sizer.max_size)
+        view = memoryview(buffer)
+        file.seek(offset)
+        total = end - offset
+        total_sent = 0
+        while total_sent < total:
+            count = min(sizer.chunk_size, total - total_sent)
+            read = file.readinto(view[header_size:header_size + count])
+            if not read:
+                break
+            file_hash.update(view[header_size:header_size + read])
+            FRAME_HEADER.pack_into(buffer, 0, FRAME_DATA, 0, read)
+            started = time.perf_counter()
+            writer.write_packed(view[:header_size + read])
+            sizer.observe(read, time.perf_counter() - started)
+            total_sent += read
+            
+            if progress_callback:
+                progress_callback(total_sent, total, "Sending")
+
+    def _process_chunk(self, chunk, cipher, compressor: Optional[FrameCompressor],
+                       sequence: Optional[int] = None):
+        """Process a single chunk of data; returns (payload, frame flags)
+
+        Chunks that compression does not shrink go out stored, with FLAG_COMPRESSED clear.
+        """
+        flags = 0
+        if compressor:
             try:
-                chunk = CompressionManager.compress_data(chunk, compression_method)
+                chunk, flags = compressor.compress(chunk)
             except:
-                pass
+                # A compression stream cannot skip a chunk without desynchronising the receiver
+                if compressor.stateful:
+                    raise
         
-        if encryption_password:
-            try:
-                chunk = CryptoManager.encrypt_data(chunk, encryption_password)
-            except:
-                pass
+        # Never fall back to plaintext if sealing fails
+        if cipher:
+            chunk = cipher.seal(chunk, sequence)
         
-        return chunk
+        return chunk, flags
+
+    def _write_compression_tail(self, writer: FrameWriter, cipher, compressor: Optional[FrameCompressor]):
+        """End a compression stream with its final frame"""
+        tail = compressor.flush() if compressor else None
+        if tail:
+            payload, flags = tail
+            if cipher:
+                payload = cipher.seal(payload)
+            writer.write_frame(payload, flags=flags)
 
-    def receive_streamed_file(self, ssock, save_path: str, file_info: dict, request_info: dict) -> bool:
-        """Receive file using streaming"""
+    def create_receive_cipher(self, file_info: dict, encryption_password: Optional[str]) -> Optional[StreamCipher]:
+        """Rebuild the sender's encryption session from the salt in the metadata"""
+        if not file_info.get('encrypted'):
+            return None
+        if file_info.get('encryption') != CryptoManager.STREAM_CIPHER_NAME:
+            raise ValueError(f"Unsupported encryption: {file_info.get('encryption')}")
+        if not encryption_password:
+            raise ValueError("Transfer is encrypted but no decryption password is set")
+        cipher, _ = CryptoManager.create_stream_cipher(
+            encryption_password, bytes.fromhex(file_info['encryption_salt'])
+        )
+        return cipher
+
+    def receive_streamed_file(self, ssock, save_path: str, file_info: dict, request_info: dict,
+                              encryption_password: Optional[str] = None,
+                              journal: Optional[ResumeJournal] = None) -> bool:
+        """Receive file using streaming; with a journal, continue at its offset and keep progress on failure"""
         temp_path = save_path + '.part'
-        hash_md5 = hashlib.md5()
-        total_received = 0
         
         try:
-            with open(temp_path, 'wb') as file:
-                while True:
-                    chunk_size_data = ssock.recv(4)
-                    if not chunk_size_data:
-                        break
-                    
-                    chunk_size = int.from_bytes(chunk_size_data, byteorder='big')
-                    if chunk_size == 0:
-                        break
-                    
-                    chunk_data = b''
-                    while len(chunk_data) < chunk_size:
-                        remaining = chunk_size - len(chunk_data)
-                        chunk_data += ssock.recv(min(4096, remaining))
-                    
-                    processed_chunk = self._process_received_chunk(chunk_data, file_info)
-                    file.write(processed_chunk)
-                    hash_md5.update(processed_chunk)
-                    
-                    total_received += len(processed_chunk)
-                    
-                    if request_info['file_size'] > 100 * 1024 * 1024:
-                        progress = (total_received / request_info['file_size']) * 100
-                        print(f"📥 Receiving: {progress:.1f}%", end='\r')
-                
-                print()
+            cipher = self.create_receive_cipher(file_info, encryption_password)
+            # Honour the algorithm the sender advertised (older senders used MD5)
+            hash_algorithm = file_info.get('hash_algorithm', 'md5')
+            file_hash = journal.file_hash if journal else HashManager.new(hash_algorithm)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+        
+        try:
+            with (journal.open_part() if journal else open(temp_path, 'wb')) as file:
+                trailer = self.receive_frames(
+                    ssock, journal.journaled_writer(file) if journal else file.write,
+                    file_info, cipher, file_hash,
+                    show_progress=request_info['file_size'] > 100 * 1024 * 1024
+                )
                 
-            if hash_md5.hexdigest() != file_info['checksum']:
+            # The checksum arrives in the trailer; verify it before the .part file is renamed
+            if file_hash.hexdigest() != trailer.get('checksum'):
                 print("❌ Checksum mismatch - file may be corrupted")
                 os.unlink(temp_path)
+                if journal:
+                    journal.delete()
                 return False
             
             os.rename(temp_path, save_path)
+            if journal:
+                journal.delete()
             return True
             
         except Exception as e:
             print(f"❌ Receive error: {e}")
+            if journal:
+                # Verified blocks stay on disk for the sender's next attempt
+                print("💾 Keeping partial file for resume")
+                return False
             if os.path.exists(temp_path):
                 try:
                     os.unlink(temp_path)
@@ -115,53 +341,298 @@ class StreamManager:
                     pass
             return False
 
-    def _process_received_chunk(self, chunk_data, file_info):
-        """Process a received chunk"""
-        # Add decompression/decryption logic here
-        return chunk_data
-
-    def calculate_file_checksum(self, file_path):
-        """Calculate MD5 checksum incrementally for large files"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-
-    def send_folder_as_archive(self, sender, folder_path: str, recipient_ip: str, 
-                              progress_callback: Optional[Callable],
-                              encryption_password: Optional[str],
-                              compression_method: CompressionMethod) -> tuple:
-        """Send folder as tar archive"""
-        if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-            return False, "Folder does not exist or is not a directory"
+    def create_decode_pipeline(self, reader: FrameReader, file_info: dict,
+                               cipher: Optional[StreamCipher]) -> DecodePipeline:
+        """Frames are decoded on a worker pool whenever there is decryption or decompression to do"""
+        decoder = FrameDecoder(cipher, CompressionMethod(file_info.get('compression_method', 0)))
+        workers = self._get_setting('decode_workers', DEFAULT_DECODE_WORKERS) if decoder.has_work else 0
+        return DecodePipeline(reader, decoder, workers)
+
+    def receive_frames(self, ssock, write: Callable, file_info: dict, cipher: Optional[StreamCipher],
+                       file_hash, show_progress: bool = False) -> dict:
+        """Decode data frames into write() until EOF and return the trailer"""
+        pipeline = self.create_decode_pipeline(FrameReader(ssock), file_info, cipher)
+        expected_size = file_info.get('file_size') or 0
+        total_received = 0
+        for processed_chunk in pipeline:
+            write(processed_chunk)
+            file_hash.update(processed_chunk)
             
-        temp_path = None
+            total_received += len(processed_chunk)
+            
+            if show_progress and expected_size:
+                progress = (total_received / expected_size) * 100
+                print(f"📥 Receiving: {progress:.1f}%", end='\r')
         
+        if show_progress:
+            print()
+        return pipeline.read_trailer()
+
+    def receive_stripe(self, ssock, transfer, index: int) -> bool:
+        """Receive one byte range of a striped transfer and verify it against its trailer"""
         try:
-            with tempfile.NamedTemporaryFile(suffix='.tar', delete=False) as temp_tar:
-                temp_path = temp_tar.name
-            
-            print("📦 Creating archive...")
-            folder_name = os.path.basename(folder_path.rstrip(os.sep))
-            with tarfile.open(temp_path, 'w') as tar:
-                tar.add(folder_path, arcname=folder_name)
-            
-            success, message = sender.send_file(
-                temp_path, recipient_ip, progress_callback,
-                encryption_password, compression_method
+            file_hash = HashManager.new(transfer.file_info.get('hash_algorithm', 'md5'))
+            trailer = self.receive_frames(
+                ssock, transfer.range_writer(index), transfer.file_info,
+                transfer.create_cipher(index), file_hash
             )
+            if file_hash.hexdigest() != trailer.get('checksum'):
+                print(f"❌ Checksum mismatch in stripe {index}")
+                return False
+            return True
+        except Exception as e:
+            print(f"❌ Stripe {index} receive error: {e}")
+            return False
+
+    def calculate_file_checksum(self, file_path, algorithm: str = DEFAULT_HASH_ALGORITHM):
+        """Calculate a file checksum incrementally for large files, or take it from the file index"""
+        index = self.get_file_index()
+        if index:
+            return index.hash_file(file_path, algorithm)
+        return HashManager.hash_file(file_path, algorithm)
+
+    def create_output_stream(self, ssock, writer: FrameWriter, cipher: Optional[StreamCipher],
+                             compression_method: CompressionMethod, file_hash,
+                             progress_callback: Optional[Callable], total_size: int) -> tuple:
+        """File object that compresses, seals and frames whatever is written; returns (stream, pipeline)"""
+        compressor = self.create_frame_compressor(writer, compression_method)
+        pipeline = self.create_encode_pipeline(writer, cipher, compressor)
+        output = FrameOutputStream(
+            writer, self.create_chunk_sizer(ssock),
+            lambda chunk: self._process_chunk(chunk, cipher, compressor),
+            file_hash, progress_callback, total_size,
+            pipeline, self.get_compression_block_size() if pipeline else None,
+            lambda: self._write_compression_tail(writer, cipher, compressor)
+        )
+        return output, pipeline
+
+    def stream_deduplicated_file(self, ssock, file_path: str, chunks: list, missing: list, checksum: str,
+                                 cipher: Optional[StreamCipher], compression_method: CompressionMethod,
+                                 progress_callback: Optional[Callable]) -> bool:
+        """Stream only the chunks the receiver is missing; the trailer still carries the whole-file checksum"""
+        writer = self.create_frame_writer(ssock)
+        total_size = sum(length for (_, length), needed in zip(chunks, missing) if needed)
+        output, pipeline = self.create_output_stream(
+            ssock, writer, cipher, compression_method, None, progress_callback, total_size
+        )
+        try:
+            write_chunk_bodies(file_path, chunks, missing, output)
+            writer.write_trailer({'checksum': checksum})
+            return True
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            return False
+        finally:
+            if pipeline:
+                pipeline.close()
+
+    def receive_deduplicated_file(self, ssock, save_path: str, file_info: dict, request_info: dict,
+                                  encryption_password: Optional[str], store: ChunkStore,
+                                  send_missing: Callable) -> bool:
+        """Read the sender's chunk list, ask for the chunks not in the store, then rebuild the file"""
+        temp_path = save_path + '.part'
+        try:
+            cipher = self.create_receive_cipher(file_info, encryption_password)
+            file_hash = HashManager.new(file_info.get('hash_algorithm', 'md5'))
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+        
+        expected_size = request_info.get('file_size') or 0
+        progress = None
+        if expected_size > 100 * 1024 * 1024:
+            def progress(received):
+                print(f"📥 Receiving new chunks: {self.format_size(received)}", end='\r')
+        
+        reader = FrameReader(ssock)
+        try:
+            # The chunk list frames are opened before the data frames claim their sequences
+            chunks = read_chunk_list(reader, cipher, file_info['dedup']['chunks'])
+            missing = store.missing(chunks)
+            send_missing(missing)
+            pipeline = self.create_decode_pipeline(reader, file_info, cipher)
+            with open(temp_path, 'wb') as file:
+                reused = receive_chunks(
+                    FrameInputStream(pipeline, None, progress), chunks, missing, store, file, file_hash
+                )
+            trailer = pipeline.read_trailer()
+            if progress:
+                print()
             
-            return success, message
+            if file_hash.hexdigest() != trailer.get('checksum'):
+                print("❌ Checksum mismatch - file may be corrupted")
+                os.unlink(temp_path)
+                return False
+            
+            os.rename(temp_path, save_path)
+            if expected_size:
+                print(f"♻️  Reused {self.format_size(reused)} of {self.format_size(expected_size)} from earlier transfers")
+            store.prune()
+            return True
             
         except Exception as e:
-            return False, f"Error preparing folder: {str(e)}"
+            print(f"❌ Receive error: {e}")
+            if os.path.exists(temp_path):
+                try:
+                    os.unlink(temp_path)
+                except:
+                    pass
+            return False
+
+    def stream_delta_file(self, ssock, file_path: str, file_size: int, signatures: list, block_size: int,
+                          cipher: Optional[StreamCipher], compression_method: CompressionMethod,
+                          progress_callback: Optional[Callable],
+                          hash_algorithm: str = DEFAULT_HASH_ALGORITHM) -> bool:
+        """Stream copy/literal instructions against the receiver's existing copy"""
+        index = self.get_file_index()
+        info = os.stat(file_path)
+        cached = index.get(file_path, hash_kind(hash_algorithm), info) if index else None
+        file_hash = None if cached else HashManager.new(hash_algorithm)
+        writer = self.create_frame_writer(ssock)
+        output, pipeline = self.create_output_stream(
+            ssock, writer, cipher, compression_method, None, None, file_size
+        )
+        try:
+            copied = write_delta(file_path, signatures, block_size, output, file_hash, progress_callback)
+            checksum = cached.decode() if cached else file_hash.hexdigest()
+            if index and not cached:
+                index.record_hash(file_path, hash_algorithm, checksum, info)
+            writer.write_trailer({'checksum': checksum})
+            print(f"🔁 Delta reused {self.format_size(copied)}, sent {self.format_size(output.total_sent)}")
+            return True
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            return False
         finally:
-            if temp_path and os.path.exists(temp_path):
+            if pipeline:
+                pipeline.close()
+
+    def receive_delta_file(self, ssock, save_path: str, file_info: dict, request_info: dict,
+                           encryption_password: Optional[str], block_size: int, block_count: int) -> bool:
+        """Rebuild the file next to the old copy from the delta, then swap it in atomically"""
+        temp_path = save_path + '.part'
+        try:
+            cipher = self.create_receive_cipher(file_info, encryption_password)
+            file_hash = HashManager.new(file_info.get('hash_algorithm', 'md5'))
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+        
+        try:
+            pipeline = self.create_decode_pipeline(FrameReader(ssock), file_info, cipher)
+            with open(temp_path, 'wb') as file:
+                copied = apply_delta(
+                    FrameInputStream(pipeline, None), save_path, block_size, block_count, file, file_hash
+                )
+            trailer = pipeline.read_trailer()
+            
+            if file_hash.hexdigest() != trailer.get('checksum'):
+                print("❌ Checksum mismatch - file may be corrupted")
+                os.unlink(temp_path)
+                return False
+            
+            os.replace(temp_path, save_path)
+            print(f"🔁 Delta reused {self.format_size(copied)} of the existing copy")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Receive error: {e}")
+            if os.path.exists(temp_path):
                 try:
                     os.unlink(temp_path)
                 except:
                     pass
+            return False
+
+    def stream_folder_data(self, ssock, folder_path: str, total_size: int,
+                           cipher: Optional[StreamCipher],
+                           compression_method: CompressionMethod,
+                           progress_callback: Optional[Callable],
+                           hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+                           manifest: Optional[list] = None) -> bool:
+        """Stream a folder straight into data frames, no temp archive
+
+        With a manifest the bodies are packed back to back after it (bulk mode), otherwise as tar.
+        """
+        file_hash = HashManager.new(hash_algorithm)
+        writer = self.create_frame_writer(ssock)
+        output, pipeline = self.create_output_stream(
+            ssock, writer, cipher, compression_method, file_hash, progress_callback, total_size
+        )
+        try:
+            if manifest is not None:
+                write_manifest(writer, manifest, cipher, file_hash, packs_metadata(ssock))
+                write_bulk_bodies(folder_path, manifest, output)
+            else:
+                write_folder_tar(folder_path, output)
+            writer.write_trailer({'checksum': file_hash.hexdigest()})
+            return True
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            return False
+        finally:
+            if pipeline:
+                pipeline.close()
+
+    def receive_streamed_folder(self, ssock, save_path: str, file_info: dict, request_info: dict,
+                                encryption_password: Optional[str] = None) -> bool:
+        """Extract a streamed folder archive as it arrives; the folder appears only once verified"""
+        temp_path = save_path + '.part'
+        if file_info.get('archive') not in (ARCHIVE_FORMAT, MANIFEST_FORMAT):
+            print(f"❌ Unsupported folder archive: {file_info.get('archive')}")
+            return False
+        
+        try:
+            cipher = self.create_receive_cipher(file_info, encryption_password)
+            file_hash = HashManager.new(file_info.get('hash_algorithm', 'md5'))
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+        
+        expected_size = request_info.get('file_size') or 0
+        progress = None
+        if expected_size > 100 * 1024 * 1024:
+            def progress(received):
+                print(f"📥 Receiving: {min(received / expected_size, 1) * 100:.1f}%", end='\r')
+        
+        reader = FrameReader(ssock)
+        try:
+            remove_tree(temp_path)
+            if file_info['archive'] == MANIFEST_FORMAT:
+                # The manifest frame is opened before the data frames claim their sequences
+                entries = read_manifest(reader, cipher, file_hash)
+                pipeline = self.create_decode_pipeline(reader, file_info, cipher)
+                receive_bulk(FrameInputStream(pipeline, file_hash, progress), entries, temp_path)
+            else:
+                pipeline = self.create_decode_pipeline(reader, file_info, cipher)
+                extract_tar_stream(FrameInputStream(pipeline, file_hash, progress), temp_path)
+            trailer = pipeline.read_trailer()
+            if progress:
+                print()
+            
+            if file_hash.hexdigest() != trailer.get('checksum'):
+                print("❌ Checksum mismatch - folder may be corrupted")
+                remove_tree(temp_path)
+                return False
+            
+            os.rename(temp_path, save_path)
+            return True
+            
+        except Exception as e:
+            print(f"❌ Receive error: {e}")
+            remove_tree(temp_path)
+            return False
+
+    def receive_bulk_batch(self, ssock, dest: str, file_info: dict) -> list:
+        """Receive one manifest-format stream into dest and return its entries once the checksum verifies"""
+        file_hash = HashManager.new(file_info.get('hash_algorithm', 'md5'))
+        reader = FrameReader(ssock)
+        entries = read_manifest(reader, None, file_hash)
+        pipeline = self.create_decode_pipeline(reader, file_info, None)
+        receive_bulk(FrameInputStream(pipeline, file_hash), entries, dest)
+        if file_hash.hexdigest() != pipeline.read_trailer().get('checksum'):
+            raise ValueError("Checksum mismatch in sync batch")
+        return entries
 
     def format_size(self, size_bytes):
         """Format file size human-readably"""
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from utils.crypto import CryptoManager, StreamCipher
+
+STRIPE_ALIGNMENT = 1024 * 1024
+
+
+def plan_stripes(file_size: int, count: int) -> list:
+    """Split a file into `count` contiguous, 1MB-aligned byte ranges"""
+    count = max(1, min(count, file_size // STRIPE_ALIGNMENT or 1))
+    stripe_size = -(-file_size // count)
+    stripe_size = -(-stripe_size // STRIPE_ALIGNMENT) * STRIPE_ALIGNMENT
+    stripes = []
+    offset = 0
+    while offset < file_size:
+        length = min(stripe_size, file_size - offset)
+        stripes.append({'offset': offset, 'length': length})
+        offset += length
+    return stripes or [{'offset': 0, 'length': 0}]
+
+
+def check_stripes(stripes, file_size: int):
+    """Reject a sender's plan unless its ranges are non-negative, disjoint and tile [0, file_size) exactly"""
+    if not isinstance(stripes, list) or not stripes:
+        raise ValueError("Striped transfer has no stripes")
+    ranges = []
+    for stripe in stripes:
+        values = (stripe.get('offset'), stripe.get('length')) if isinstance(stripe, dict) else (None,)
+        if not all(type(value) is int and value >= 0 for value in values):
+            raise ValueError(f"Invalid stripe range: {stripe}")
+        ranges.append(values)
+    position = 0
+    for offset, length in sorted(ranges):
+        if offset != position:
+            raise ValueError(f"Stripes overlap or leave a gap at byte {min(offset, position)}")
+        position += length
+    if position != file_size:
+        raise ValueError(f"Stripes cover {position} bytes of a {file_size} byte file")
+
+
+def stripe_nonce_prefix(index: int) -> bytes:
+    """Each stripe seals with its own nonce space under the shared transfer key"""
+    return index.to_bytes(StreamCipher.NONCE_PREFIX_SIZE, byteorder='big')
+
+
+class StripedTransfer:
+    """Receiver-side state of one file arriving as byte ranges over several connections"""
+
+    def __init__(self, request_id: str, save_path: str, file_info: dict, sender_ip: str,
+                 encryption_password: Optional[str] = None):
+        self.request_id = request_id
+        self.save_path = save_path
+        self.temp_path = save_path + '.part'
+        self.file_info = file_info
+        self.sender_ip = sender_ip
+        check_stripes(file_info['stripes'], file_info['file_size'])
+        self.stripes = file_info['stripes']
+        self.landed = [False] * len(self.stripes)
+        self.claimed = [False] * len(self.stripes)
+        self.failed = False
+        self.completed = threading.Event()
+        self.last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._writes_done = threading.Condition(self._lock)
+        self._active_writes = 0
+        self._closed = False
+
+        self._key = None
+        if file_info.get('encrypted'):
+            if file_info.get('encryption') != CryptoManager.STREAM_CIPHER_NAME:
+                raise ValueError(f"Unsupported encryption: {file_info.get('encryption')}")
+            if not encryption_password:
+                raise ValueError("Transfer is encrypted but no decryption password is set")
+            # One key derivation for every stripe
+            self._key, _ = CryptoManager.derive_raw_key(
+                encryption_password, bytes.fromhex(file_info['encryption_salt'])
+            )
+
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        self._fd = os.open(self.temp_path, flags, 0o644)
+        self._preallocate(file_info['file_size'])
+
+    def _preallocate(self, size: int):
+        """Reserve the whole file up front so ranges can land in any order"""
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._fd, 0, size)
+                return
+            except OSError:
+                pass
+        os.ftruncate(self._fd, size)
+
+    def create_cipher(self, index: int) -> Optional[StreamCipher]:
+        if self._key is None:
+            return None
+        return StreamCipher(self._key, stripe_nonce_prefix(index))
+
+    def claim(self, index: int) -> dict:
+        """Reserve a stripe for one incoming connection"""
+        with self._lock:
+            if not 0 <= index < len(self.stripes) or self.claimed[index]:
+                raise ValueError(f"Invalid or duplicate stripe {index}")
+            self.claimed[index] = True
+        return self.stripes[index]
+
+    def range_writer(self, index: int):
+        """Return a write(data) callable that fills stripe `index` at its offset"""
+        position = [self.stripes[index]['offset']]
+        end = position[0] + self.stripes[index]['length']
+
+        def write(data):
+            if position[0] + len(data) > end:
+                raise ValueError(f"Stripe {index} overran its range")
+            with self._lock:
+                if self._closed:
+                    raise IOError("Striped transfer was aborted")
+                self._active_writes += 1
+            try:
+                if hasattr(os, 'pwrite'):
+                    written = 0
+                    while written < len(data):
+                        written += os.pwrite(self._fd, data[written:], position[0] + written)
+                else:
+                    with self._lock:
+                        os.lseek(self._fd, position[0], os.SEEK_SET)
+                        view = memoryview(data)
+                        while view:
+                            view = view[os.write(self._fd, view):]
+            finally:
+                with self._lock:
+                    self._active_writes -= 1
+                    self._writes_done.notify_all()
+            position[0] += len(data)
+            self.last_activity = time.monotonic()
+
+        return write
+
+    def mark_landed(self, index: int, ok: bool):
+        with self._lock:
+            if ok:
+                self.landed[index] = True
+            else:
+                self.failed = True
+            if self.failed or all(self.landed):
+                self.completed.set()
+
+    def abort(self):
+        with self._lock:
+            self.failed = True
+            self.completed.set()
+
+    def finish(self) -> bool:
+        """Rename the preallocated file once every range has landed and verified"""
+        with self._lock:
+            # Stragglers from an aborted transfer must not write to a closed (or reused) fd
+            self._closed = True
+            while self._active_writes:
+                self._writes_done.wait()
+        os.close(self._fd)
+        if not self.failed and all(self.landed):
+            os.replace(self.temp_path, self.save_path)
+            return True
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+        return False
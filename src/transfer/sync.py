@@ -0,0 +1,714 @@
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import threading
+import time
+import uuid
+import zlib
+from typing import Callable, Iterator, Optional
+
+from utils.file_index import RACY_WINDOW_NS
+from utils.hashing import HashManager
+from .archive import remove_tree
+from .bulk import ENTRY_DIR, ENTRY_FILE, _safe_relative_path, inflate_manifest
+from .framing import FRAME_SYNC_MANIFEST, FrameReader, FrameWriter
+from .metadata import (COLUMN_HEX, COLUMN_INT, COLUMN_STR, COLUMN_VERSIONS, PACKED_ZLIB_LEVEL, encode_records,
+                       is_packed, iter_records, packs_metadata)
+from .protocols import MAX_MESSAGE_SIZE, SYNC_END
+
+SYNC_HASH = 'blake2b'
+SYNC_STATE_DIR = '~/.filesync/sync'
+SYNC_STAGING = '.filesync-sync'  # Received bodies land here before they replace the real files; never synced
+SYNC_MANIFEST_FRAME_ENTRIES = 4096
+SYNC_BATCH_FILES = 1000
+SYNC_BATCH_BYTES = 256 * 1024 * 1024
+SCAN_COMMIT_ROWS = 10000
+# Changed paths go in one message; a longer list is replaced by a full sync
+SYNC_PATHS_MAX_BYTES = MAX_MESSAGE_SIZE // 4
+SYNC_LOCK_WAIT = 5.0  # Seconds a peer's request waits for a session on the same folder that is wrapping up
+# Packed form of the manifest rows [path, size, mode, mtime_ns, hash, versions, deleted]
+SYNC_MANIFEST_SCHEMA = (COLUMN_STR, COLUMN_INT, COLUMN_INT, COLUMN_INT, COLUMN_HEX, COLUMN_VERSIONS, COLUMN_INT)
+
+SIDE_LOCAL = 'local'
+SIDE_REMOTE = 'remote'
+
+OP_PUSH = 'push'  # Send our copy to the peer
+OP_PULL = 'pull'  # Fetch the peer's copy
+OP_DELETE = 'delete'
+OP_RENAME = 'rename'
+OP_VERSION = 'version'  # Same content on both sides, only the version vector changes
+CHANGE_OPS = (OP_DELETE, OP_RENAME, OP_VERSION)
+
+VERSIONS_EQUAL = 'equal'
+VERSIONS_NEWER = 'newer'
+VERSIONS_OLDER = 'older'
+VERSIONS_CONCURRENT = 'concurrent'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT,
+    versions TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    stable INTEGER NOT NULL DEFAULT 1,
+    scan INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS plan (
+    id INTEGER PRIMARY KEY,
+    side TEXT NOT NULL,
+    op TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    versions TEXT NOT NULL,
+    target TEXT,
+    target_versions TEXT,
+    base TEXT,
+    creates INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS plan_hash ON plan (side, op, hash);
+"""
+
+_folder_locks = {}
+_folder_locks_guard = threading.Lock()
+
+
+def paths_fit(paths) -> bool:
+    """Whether a list of changed paths is small enough to send instead of syncing everything"""
+    return len(json.dumps(list(paths))) <= SYNC_PATHS_MAX_BYTES
+
+
+def folder_lock(folder: str) -> threading.Lock:
+    """One sync session per folder at a time, whichever side started it"""
+    with _folder_locks_guard:
+        return _folder_locks.setdefault(os.path.realpath(folder), threading.Lock())
+
+
+def compare_versions(local: dict, remote: dict) -> str:
+    """How two version vectors relate: equal, newer, older or concurrent"""
+    newer = older = False
+    for replica in set(local) | set(remote):
+        mine, theirs = local.get(replica, 0), remote.get(replica, 0)
+        newer |= mine > theirs
+        older |= mine < theirs
+    if newer and older:
+        return VERSIONS_CONCURRENT
+    if newer:
+        return VERSIONS_NEWER
+    return VERSIONS_OLDER if older else VERSIONS_EQUAL
+
+
+def merge_versions(local: dict, remote: dict) -> dict:
+    return {replica: max(local.get(replica, 0), remote.get(replica, 0)) for replica in set(local) | set(remote)}
+
+
+def bump_version(versions: dict, replica: str) -> dict:
+    versions = dict(versions)
+    versions[replica] = versions.get(replica, 0) + 1
+    return versions
+
+
+def encode_versions(versions: dict) -> str:
+    return json.dumps(versions, separators=(',', ':'), sort_keys=True)
+
+
+def conflict_name(path: str, replica: str) -> str:
+    """Where the losing side of a conflict is kept, next to the file it conflicted with"""
+    folder, _, name = path.rpartition('/')
+    stem, dot, extension = name.rpartition('.')
+    if not stem:
+        stem, dot, extension = name, '', ''
+    renamed = f"{stem} (conflict {replica[:8]} {time.strftime('%Y%m%d-%H%M%S')}){dot}{extension}"
+    return f"{folder}/{renamed}" if folder else renamed
+
+
+def _encode_manifest_batch(batch: list, packed: bool) -> bytes:
+    """Each frame is decoded on its own, so a batch that does not fit the schema can go as JSON"""
+    if packed:
+        try:
+            return zlib.compress(encode_records(SYNC_MANIFEST_SCHEMA, batch), PACKED_ZLIB_LEVEL)
+        except ValueError:
+            pass
+    return zlib.compress(json.dumps(batch, separators=(',', ':')).encode(), 6)
+
+
+def write_sync_manifest(writer: FrameWriter, entries: Iterator, packed: bool = False):
+    """Stream sorted state entries in compressed frames, packed or as JSON, then an empty frame"""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= SYNC_MANIFEST_FRAME_ENTRIES:
+            writer.write_frame(_encode_manifest_batch(batch, packed), FRAME_SYNC_MANIFEST)
+            batch = []
+    if batch:
+        writer.write_frame(_encode_manifest_batch(batch, packed), FRAME_SYNC_MANIFEST)
+    writer.write_frame(b'', FRAME_SYNC_MANIFEST)
+
+
+def read_sync_manifest(reader: FrameReader) -> Iterator:
+    """Yield the peer's entries one frame at a time, so a huge listing is never held in memory"""
+    previous = None
+    while True:
+        frame_type, _, payload = reader.read_frame()
+        if frame_type != FRAME_SYNC_MANIFEST:
+            raise ValueError(f"Expected sync manifest frame, got type {frame_type}")
+        if not payload:
+            return
+        encoded = inflate_manifest(payload)
+        entries = iter_records(SYNC_MANIFEST_SCHEMA, encoded) if is_packed(encoded) else json.loads(encoded)
+        for entry in entries:
+            if previous is not None and entry[0] <= previous:
+                raise ValueError("Sync manifest is not sorted by path")
+            previous = entry[0]
+            yield entry
+
+
+def _with_parents(files: list) -> list:
+    """Bulk manifest entries for the files, each preceded by directories that are not listed yet"""
+    entries = []
+    seen = set()
+    for entry in files:
+        parts = entry[0].split('/')[:-1]
+        for depth in range(1, len(parts) + 1):
+            directory = '/'.join(parts[:depth])
+            if directory not in seen:
+                seen.add(directory)
+                entries.append([directory, ENTRY_DIR, 0, 0o755, time.time_ns(), None])
+        entries.append(entry)
+    return entries
+
+
+class SyncState:
+    """What this side knows about a synced folder: one row per path with its hash and version vector
+
+    Rows live in SQLite next to the other per-user state, so scanning, diffing and applying
+    a tree of millions of files never needs the whole listing in memory. Deleted files stay
+    as tombstones so their deletion can win over older copies elsewhere.
+    """
+
+    def __init__(self, folder: str, state_dir: str = SYNC_STATE_DIR):
+        self.folder = os.path.abspath(folder)
+        self.real_folder = os.path.realpath(folder)
+        state_dir = os.path.expanduser(state_dir)
+        os.makedirs(state_dir, exist_ok=True)
+        name = hashlib.sha256(self.real_folder.encode('utf-8', 'surrogateescape')).hexdigest()[:24]
+        self.path = os.path.join(state_dir, f"{name}.db")
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self.replica = self._meta('replica')
+        if not self.replica:
+            self.replica = uuid.uuid4().hex
+            self._set_meta('replica', self.replica)
+        self._connection.create_function(
+            'bump_version', 1, lambda versions: encode_versions(bump_version(json.loads(versions), self.replica))
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def _get(self, path: str) -> Optional[sqlite3.Row]:
+        return self._connection.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+
+    def _put(self, path: str, info: os.stat_result, digest: str, versions: dict, scan: int = 0):
+        stable = time.time_ns() - info.st_mtime_ns >= RACY_WINDOW_NS
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)",
+            (path, info.st_size, stat.S_IMODE(info.st_mode), info.st_mtime_ns, digest,
+             encode_versions(versions), int(stable), scan)
+        )
+
+    def _tombstone(self, path: str, versions: dict):
+        self._connection.execute(
+            "UPDATE files SET deleted = 1, size = 0, versions = ? WHERE path = ?", (encode_versions(versions), path)
+        )
+
+    def _full_path(self, relative: str) -> str:
+        """Local path of a synced entry; refuses anything outside the folder or inside the staging area"""
+        full = os.path.join(self.folder, _safe_relative_path(relative))
+        if relative.split('/')[0] == SYNC_STAGING:
+            raise ValueError(f"Unsafe path in sync: {relative}")
+        parent = os.path.realpath(os.path.dirname(full))
+        if os.path.commonpath([self.real_folder, parent]) != self.real_folder:
+            raise ValueError(f"Unsafe path in sync: {relative}")
+        return full
+
+    def _walk(self, prefix: str = '') -> Iterator:
+        """(relative path, lstat) of every regular file under prefix; symlinks and the staging area are skipped"""
+        pending = [prefix]
+        while pending:
+            prefix = pending.pop()
+            try:
+                with os.scandir(os.path.join(self.folder, prefix) if prefix else self.folder) as entries:
+                    for entry in entries:
+                        relative = prefix + entry.name
+                        if not prefix and entry.name == SYNC_STAGING:
+                            continue
+                        try:
+                            relative.encode('utf-8')
+                        except UnicodeEncodeError:
+                            print(f"⚠️  Skipping undecodable name: {relative!r}")
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(relative + '/')
+                        elif entry.is_file(follow_symlinks=False):
+                            yield relative, entry.stat(follow_symlinks=False)
+            except OSError as e:
+                print(f"⚠️  Cannot scan {prefix or self.folder}: {e}")
+
+    def expand(self, paths: list) -> list:
+        """Sorted paths a change to `paths` can touch: the paths, files under them and rows under them"""
+        expanded = set()
+        for path in paths:
+            path = path.strip('/')
+            try:
+                full = self._full_path(path)
+            except ValueError:
+                continue
+            expanded.add(path)
+            if os.path.isdir(full) and not os.path.islink(full):
+                expanded.update(relative for relative, _ in self._walk(path + '/'))
+            # '0' sorts right after '/', so this range is exactly the rows below the directory
+            expanded.update(row[0] for row in self._connection.execute(
+                "SELECT path FROM files WHERE path > ? AND path < ?", (path + '/', path + '0')))
+        return sorted(expanded)
+
+    def _stat_paths(self, paths: list) -> Iterator:
+        for relative in paths:
+            try:
+                info = os.lstat(self._full_path(relative))
+            except (OSError, ValueError):
+                continue
+            if stat.S_ISREG(info.st_mode):
+                yield relative, info
+
+    def scan(self, hash_file: Callable[[str], str] = lambda path: HashManager.hash_file(path, SYNC_HASH),
+             paths: Optional[list] = None) -> dict:
+        """Bring the rows up to date with the folder, or only with the given expanded paths
+
+        Only new or modified files are hashed.
+        """
+        connection = self._connection
+        scan_id = int(self._meta('scan') or 0) + 1
+        counts = {'files': 0, 'hashed': 0, 'changed': 0, 'deleted': 0}
+        unchanged = []
+        for relative, info in self._walk() if paths is None else self._stat_paths(paths):
+            counts['files'] += 1
+            row = self._get(relative)
+            if (row and not row['deleted'] and row['stable']
+                    and (row['size'], row['mtime_ns']) == (info.st_size, info.st_mtime_ns)):
+                unchanged.append((scan_id, relative))
+            else:
+                try:
+                    digest = hash_file(os.path.join(self.folder, relative))
+                except OSError:
+                    continue
+                counts['hashed'] += 1
+                versions = json.loads(row['versions']) if row else {}
+                if not row or row['deleted'] or row['hash'] != digest:
+                    versions = bump_version(versions, self.replica)
+                    counts['changed'] += 1
+                self._put(relative, info, digest, versions, scan_id)
+            if counts['files'] % SCAN_COMMIT_ROWS == 0:
+                connection.executemany("UPDATE files SET scan = ? WHERE path = ?", unchanged)
+                unchanged = []
+                connection.commit()
+        connection.executemany("UPDATE files SET scan = ? WHERE path = ?", unchanged)
+        # Whatever was not seen this time is gone: keep it as a tombstone with a newer version
+        tombstone = ("UPDATE files SET deleted = 1, size = 0, versions = bump_version(versions), scan = ?"
+                     " WHERE deleted = 0 AND scan != ?")
+        if paths is None:
+            counts['deleted'] = connection.execute(tombstone, (scan_id, scan_id)).rowcount
+        else:
+            counts['deleted'] = connection.executemany(
+                tombstone + " AND path = ?", [(scan_id, scan_id, path) for path in paths]
+            ).rowcount
+        self._set_meta('scan', scan_id)
+        connection.commit()
+        return counts
+
+    def manifest(self, paths: Optional[list] = None) -> Iterator:
+        """[path, size, mode, mtime_ns, hash, versions, deleted] for every row (or the given sorted paths)"""
+        query = "SELECT path, size, mode, mtime_ns, hash, versions, deleted FROM files"
+        if paths is None:
+            rows = self._connection.cursor().execute(query + " ORDER BY path")
+        else:
+            rows = (self._connection.execute(query + " WHERE path = ?", (path,)).fetchone() for path in paths)
+        for row in rows:
+            if row is not None:
+                yield [row[0], row[1], row[2], row[3], row[4], json.loads(row[5]), row[6]]
+
+    def plan(self, remote_entries: Iterator, remote_replica: str, paths: Optional[list] = None) -> dict:
+        """Merge our sorted rows with the peer's sorted manifest into pushes, pulls, deletes and renames"""
+        connection = self._connection
+        connection.execute("DELETE FROM plan")
+        local_rows = self.manifest(paths)
+        local = next(local_rows, None)
+        remote = next(remote_entries, None)
+        conflicts = 0
+        while local is not None or remote is not None:
+            if remote is None or (local is not None and local[0] < remote[0]):
+                conflicts += self._reconcile(local, None, remote_replica)
+                local = next(local_rows, None)
+            elif local is None or remote[0] < local[0]:
+                conflicts += self._reconcile(None, remote, remote_replica)
+                remote = next(remote_entries, None)
+            else:
+                conflicts += self._reconcile(local, remote, remote_replica)
+                local = next(local_rows, None)
+                remote = next(remote_entries, None)
+        self._pair_renames()
+        connection.commit()
+        counts = {f"{side}_{op}": count for side, op, count in connection.execute(
+            "SELECT side, op, COUNT(*) FROM plan GROUP BY side, op")}
+        counts['conflicts'] = conflicts
+        return counts
+
+    def _add(self, side: str, op: str, path: str, digest: Optional[str], versions: dict, size: int = 0,
+             target: Optional[str] = None, target_versions: Optional[dict] = None,
+             base: Optional[str] = None, creates: bool = False):
+        """Queue one step; base is the hash the receiving side must still have for a push or pull"""
+        self._connection.execute(
+            "INSERT INTO plan (side, op, path, hash, size, versions, target, target_versions, base, creates)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (side, op, path, digest, size, encode_versions(versions), target,
+             encode_versions(target_versions) if target_versions is not None else None, base, int(creates))
+        )
+
+    def _reconcile(self, local: Optional[list], remote: Optional[list], remote_replica: str) -> int:
+        """Plan one path from both sides' entries; returns 1 for a real conflict"""
+        if local is None or remote is None:
+            entry = local or remote
+            if not entry[6]:
+                side, op = (SIDE_REMOTE, OP_PUSH) if local else (SIDE_LOCAL, OP_PULL)
+                self._add(side, op, entry[0], entry[4], entry[5], entry[1], creates=True)
+            return 0
+
+        path = local[0]
+        order = compare_versions(local[5], remote[5])
+        same = bool(local[6]) == bool(remote[6]) and (local[6] or local[4] == remote[4])
+        if order == VERSIONS_EQUAL:
+            if same:
+                return 0
+            order = VERSIONS_CONCURRENT  # Equal versions but different content: state was lost on one side
+
+        if order in (VERSIONS_NEWER, VERSIONS_OLDER):
+            newer, older = (local, remote) if order == VERSIONS_NEWER else (remote, local)
+            side = SIDE_REMOTE if order == VERSIONS_NEWER else SIDE_LOCAL
+            expected = None if older[6] else older[4]
+            if same:
+                self._add(side, OP_VERSION, path, expected, newer[5])
+            elif newer[6]:
+                self._add(side, OP_DELETE, path, expected, newer[5])
+            else:
+                op = OP_PUSH if side == SIDE_REMOTE else OP_PULL
+                self._add(side, op, path, newer[4], newer[5], newer[1], base=expected, creates=bool(older[6]))
+            return 0
+
+        merged = bump_version(merge_versions(local[5], remote[5]), self.replica)
+        if same:
+            expected = None if local[6] else local[4]
+            self._add(SIDE_LOCAL, OP_VERSION, path, expected, merged)
+            self._add(SIDE_REMOTE, OP_VERSION, path, expected, merged)
+            return 0
+        if remote[6]:
+            # An edit beats a concurrent delete
+            self._add(SIDE_REMOTE, OP_PUSH, path, local[4], merged, local[1], creates=True)
+            return 0
+        if local[6]:
+            self._add(SIDE_REMOTE, OP_VERSION, path, remote[4], merged)
+            self._add(SIDE_LOCAL, OP_PULL, path, remote[4], merged, remote[1], creates=True)
+            return 0
+
+        # Both edited: ours keeps the name, theirs is kept on both sides under a conflict name
+        renamed = conflict_name(path, remote_replica)
+        self._add(SIDE_REMOTE, OP_RENAME, path, remote[4], remote[5], target=renamed, target_versions=remote[5])
+        self._add(SIDE_LOCAL, OP_PULL, renamed, remote[4], remote[5], remote[1], creates=True)
+        self._add(SIDE_REMOTE, OP_PUSH, path, local[4], merged, local[1], creates=True)
+        return 1
+
+    def _pair_renames(self):
+        """A delete and a create of the same content on one side become a rename, so nothing is resent"""
+        connection = self._connection
+        for side, create in ((SIDE_REMOTE, OP_PUSH), (SIDE_LOCAL, OP_PULL)):
+            last = 0
+            while True:
+                deletes = connection.execute(
+                    "SELECT id, hash FROM plan WHERE side = ? AND op = ? AND id > ? ORDER BY id LIMIT ?",
+                    (side, OP_DELETE, last, SYNC_BATCH_FILES)
+                ).fetchall()
+                if not deletes:
+                    break
+                for delete_id, digest in deletes:
+                    last = delete_id
+                    match = connection.execute(
+                        "SELECT id, path, versions FROM plan WHERE side = ? AND op = ? AND creates = 1 AND hash = ?"
+                        " LIMIT 1", (side, create, digest)
+                    ).fetchone()
+                    if match:
+                        connection.execute(
+                            "UPDATE plan SET op = ?, target = ?, target_versions = ? WHERE id = ?",
+                            (OP_RENAME, match['path'], match['versions'], delete_id)
+                        )
+                        connection.execute("DELETE FROM plan WHERE id = ?", (match['id'],))
+
+    def planned(self, side: str, ops: tuple) -> Iterator:
+        """Batches of [op, path, hash, versions, target, target_versions, size, base], bounded in count and bytes"""
+        last = 0
+        marks = ','.join('?' * len(ops))
+        batch, batch_bytes = [], 0
+        while True:
+            rows = self._connection.execute(
+                f"SELECT * FROM plan WHERE side = ? AND op IN ({marks}) AND id > ? ORDER BY id LIMIT ?",
+                (side, *ops, last, SYNC_BATCH_FILES)
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                last = row['id']
+                batch.append([
+                    row['op'], row['path'], row['hash'], json.loads(row['versions']), row['target'],
+                    json.loads(row['target_versions']) if row['target_versions'] else None, row['size'], row['base']
+                ])
+                batch_bytes += row['size']
+                if len(batch) >= SYNC_BATCH_FILES or batch_bytes >= SYNC_BATCH_BYTES:
+                    yield batch
+                    batch, batch_bytes = [], 0
+        if batch:
+            yield batch
+
+    def _untouched(self, row: Optional[sqlite3.Row], full: str) -> bool:
+        """The file is still exactly as the last scan saw it (or still absent)"""
+        if row is None or row['deleted']:
+            return not os.path.lexists(full)
+        try:
+            info = os.lstat(full)
+        except OSError:
+            return False
+        return stat.S_ISREG(info.st_mode) and (info.st_size, info.st_mtime_ns) == (row['size'], row['mtime_ns'])
+
+    def _expected(self, row: Optional[sqlite3.Row], digest: Optional[str], full: str) -> bool:
+        current = None if row is None or row['deleted'] else row['hash']
+        return current == digest and self._untouched(row, full)
+
+    def apply_change(self, op: str, path: str, digest: Optional[str], versions: dict,
+                     target: Optional[str] = None, target_versions: Optional[dict] = None) -> bool:
+        """Delete, rename or re-version one entry if it is still what the plan expected"""
+        try:
+            full = self._full_path(path)
+            row = self._get(path)
+            if not self._expected(row, digest, full):
+                return False
+            if op == OP_VERSION:
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE files SET versions = ? WHERE path = ?", (encode_versions(versions), path)
+                    )
+            elif op == OP_DELETE:
+                os.unlink(full)
+                self._tombstone(path, versions)
+            elif op == OP_RENAME:
+                target_full = self._full_path(target)
+                if os.path.lexists(target_full):
+                    return False
+                os.makedirs(os.path.dirname(target_full), exist_ok=True)
+                os.rename(full, target_full)
+                self._put(target, os.lstat(target_full), digest, target_versions)
+                self._tombstone(path, versions)
+            else:
+                raise ValueError(f"Unknown sync change: {op}")
+            self._connection.commit()
+            return True
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not {op} {path}: {e}")
+            return False
+
+    def bulk_entries(self, requested: list) -> list:
+        """Bulk manifest entries for the requested [path, hash] pairs whose files are still unchanged"""
+        files = []
+        for path, digest in requested:
+            try:
+                full = self._full_path(path)
+            except ValueError:
+                continue
+            row = self._get(path)
+            if row is not None and not row['deleted'] and self._expected(row, digest, full):
+                files.append([path, ENTRY_FILE, row['size'], row['mode'], row['mtime_ns'], None])
+        return _with_parents(files)
+
+    def install(self, staging: str, entries: list, expected: dict) -> list:
+        """Move verified bodies from the staging area into place; returns the paths installed
+
+        expected maps each path to (hash, versions, base): the body must hash to hash, and the
+        local copy must still be the base the plan saw (None: absent), or it is left alone.
+        """
+        installed = []
+        for path, kind, _, _, _, _ in entries:
+            if kind != ENTRY_FILE or path not in expected:
+                continue
+            digest, versions, base = expected[path]
+            try:
+                staged = os.path.join(staging, _safe_relative_path(path))
+                full = self._full_path(path)
+                if HashManager.hash_file(staged, SYNC_HASH) != digest:
+                    print(f"⚠️  {path} changed on the other side during sync, skipped")
+                    continue
+                if not self._expected(self._get(path), base, full):
+                    print(f"⚠️  {path} changed here during sync, skipped")
+                    continue
+                os.makedirs(os.path.dirname(full), exist_ok=True)
+                os.replace(staged, full)
+                self._put(path, os.lstat(full), digest, versions)
+                installed.append(path)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not install {path}: {e}")
+        self._connection.commit()
+        return installed
+
+    def confirm_pushed(self, pushed: list):
+        """Adopt the versions the peer stored for files we sent, if ours did not change meanwhile"""
+        self._connection.executemany(
+            "UPDATE files SET versions = ? WHERE path = ? AND deleted = 0 AND hash = ?",
+            [(encode_versions(versions), path, digest) for path, digest, versions in pushed]
+        )
+        self._connection.commit()
+
+    def staging_path(self) -> str:
+        return os.path.join(self.folder, SYNC_STAGING, uuid.uuid4().hex)
+
+    def remove_staging(self):
+        remove_tree(os.path.join(self.folder, SYNC_STAGING))
+
+
+class FolderSync:
+    """One sync session over an established connection: the initiator plans and drives, the peer serves"""
+
+    def __init__(self, state: SyncState, stream_manager, protocol, compression_method):
+        self.state = state
+        self.stream_manager = stream_manager
+        self.protocol = protocol
+        self.compression_method = compression_method
+        self.file_info = {'compression_method': compression_method.value, 'hash_algorithm': SYNC_HASH}
+        self.paths = None
+
+    def scan(self, paths: Optional[list] = None) -> dict:
+        """Scan the whole folder, or only what the changed paths can touch for an incremental sync"""
+        self.paths = self.state.expand(paths) if paths is not None else None
+        counts = self.state.scan(
+            lambda path: self.stream_manager.calculate_file_checksum(path, SYNC_HASH), self.paths
+        )
+        if paths is None:
+            print(f"🔍 Scanned {counts['files']} files in {self.state.folder}: {counts['changed']} changed,"
+                  f" {counts['deleted']} deleted since the last sync")
+        return counts
+
+    def _send(self, ssock, message: dict):
+        self.protocol.send_message(ssock, message, SYNC_END)
+
+    def _receive(self, ssock) -> dict:
+        message = self.protocol.receive_message(ssock, SYNC_END)
+        if not message:
+            raise ConnectionError("Sync peer closed the session")
+        return message
+
+    def _send_batch(self, ssock, files: list) -> bool:
+        return self.stream_manager.stream_folder_data(
+            ssock, self.state.folder, sum(entry[2] for entry in files), None,
+            self.compression_method, None, SYNC_HASH, files
+        )
+
+    def _receive_batch(self, ssock, expected: dict) -> list:
+        staging = self.state.staging_path()
+        try:
+            entries = self.stream_manager.receive_bulk_batch(ssock, staging, self.file_info)
+            return self.state.install(staging, entries, expected)
+        finally:
+            remove_tree(staging)
+
+    def run(self, ssock, remote_replica: str) -> dict:
+        """Diff against the peer's manifest, then apply remote changes, local changes, pulls and pushes"""
+        counts = self.state.plan(read_sync_manifest(FrameReader(ssock)), remote_replica, self.paths)
+        summary = {'sent': 0, 'received': 0, 'changed': 0, 'skipped': 0, 'conflicts': counts['conflicts']}
+        print(f"🔄 Sync plan: {counts.get('remote_push', 0)} to send, {counts.get('local_pull', 0)} to fetch,"
+              f" {counts.get('remote_delete', 0) + counts.get('local_delete', 0)} deletes,"
+              f" {counts.get('remote_rename', 0) + counts.get('local_rename', 0)} renames,"
+              f" {counts['conflicts']} conflicts")
+        try:
+            for batch in self.state.planned(SIDE_REMOTE, CHANGE_OPS):
+                self._send(ssock, {'op': 'apply', 'changes': [change[:6] for change in batch]})
+                skipped = len(self._receive(ssock).get('skipped', []))
+                summary['changed'] += len(batch) - skipped
+                summary['skipped'] += skipped
+
+            for batch in self.state.planned(SIDE_LOCAL, CHANGE_OPS):
+                for change in batch:
+                    applied = self.state.apply_change(*change[:6])
+                    summary['changed' if applied else 'skipped'] += 1
+
+            for batch in self.state.planned(SIDE_LOCAL, (OP_PULL,)):
+                self._send(ssock, {'op': 'pull', 'entries': [[change[1], change[2]] for change in batch]})
+                expected = {change[1]: (change[2], change[3], change[7]) for change in batch}
+                installed = self._receive_batch(ssock, expected)
+                summary['received'] += len(installed)
+                summary['skipped'] += len(batch) - len(installed)
+
+            for batch in self.state.planned(SIDE_REMOTE, (OP_PUSH,)):
+                files = self.state.bulk_entries([[change[1], change[2]] for change in batch])
+                self._send(ssock, {'op': 'push', 'entries': [
+                    [change[1], change[2], change[3], change[7]] for change in batch
+                ]})
+                if not self._send_batch(ssock, files):
+                    raise ConnectionError("Sync upload failed")
+                installed = set(self._receive(ssock).get('installed', []))
+                self.state.confirm_pushed([
+                    (change[1], change[2], change[3]) for change in batch if change[1] in installed
+                ])
+                summary['sent'] += len(installed)
+                summary['skipped'] += len(batch) - len(installed)
+
+            self._send(ssock, {'op': 'done'})
+        finally:
+            self.state.remove_staging()
+        return summary
+
+    def serve(self, ssock):
+        """Answer the initiator's requests until it is done"""
+        self.scan(self._receive(ssock).get('paths'))
+        write_sync_manifest(
+            self.stream_manager.create_frame_writer(ssock), self.state.manifest(self.paths), packs_metadata(ssock)
+        )
+        try:
+            while True:
+                request = self._receive(ssock)
+                op = request.get('op')
+                if op == 'done':
+                    return
+                if op == 'apply':
+                    skipped = [change[1] for change in request['changes'] if not self.state.apply_change(*change)]
+                    self._send(ssock, {'skipped': skipped})
+                elif op == 'pull':
+                    if not self._send_batch(ssock, self.state.bulk_entries(request['entries'])):
+                        raise ConnectionError("Sync download failed")
+                elif op == 'push':
+                    expected = {path: (digest, versions, base) for path, digest, versions, base in request['entries']}
+                    self._send(ssock, {'installed': self._receive_batch(ssock, expected)})
+                else:
+                    raise ValueError(f"Unknown sync request: {op}")
+        finally:
+            self.state.remove_staging()
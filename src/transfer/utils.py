@@ -1,14 +1,10 @@
-import hashlib
 import os
+from utils.hashing import HashManager, DEFAULT_HASH_ALGORITHM
 
 
-def calculate_file_checksum(file_path: str) -> str:
-    """Calculate MD5 checksum of a file"""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+def calculate_file_checksum(file_path: str, algorithm: str = DEFAULT_HASH_ALGORITHM) -> str:
+    """Calculate the checksum of a file with a registered hash algorithm"""
+    return HashManager.hash_file(file_path, algorithm)
 
 
 def format_size(size_bytes: int) -> str:
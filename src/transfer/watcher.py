@@ -0,0 +1,478 @@
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+from .protocols import MESSAGE_TOO_LARGE
+from .sync import SYNC_STAGING, paths_fit
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler, Observer = object, None
+
+WATCH_AUTO = 'auto'
+WATCH_INOTIFY = 'inotify'
+WATCH_WATCHDOG = 'watchdog'
+WATCH_POLLING = 'polling'
+
+DEBOUNCE_SECONDS = 0.1  # Quiet time after the last event before a batch goes out
+MAX_DELAY_SECONDS = 0.5  # Under a steady stream of events a batch still goes out this often
+POLL_INTERVAL = 1.0
+FULL_SYNC_PATHS = 5000  # Past this many changed paths one full sync is cheaper than listing them
+RETRY_DELAY_MAX = 30
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+# Writes are reported once, when the file is closed, not for every write() in between
+INOTIFY_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def _load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (AttributeError, OSError):
+        return None
+
+
+_inotify = _load_inotify()
+
+
+def _relative(directory: str, name: str) -> str:
+    return f"{directory}/{name}" if directory else name
+
+
+def _needs_full_sync(paths: set) -> bool:
+    """Too many paths to be worth listing, or a list longer than the peer accepts in one message"""
+    return len(paths) > FULL_SYNC_PATHS or not paths_fit(paths)
+
+
+def _ignored(relative: str) -> bool:
+    return not relative or relative.split('/')[0] == SYNC_STAGING
+
+
+class ChangeQueue:
+    """Collect changed paths and hand them out in batches once events go quiet
+
+    Repeated events for one path coalesce into one entry. A batch of None means
+    "sync everything" (too many changes, or the watcher lost events).
+    """
+
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS, max_delay: float = MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._paths = set()
+        self._full = False
+        self._first = None
+        self._last = None
+        self._woken = False
+        self._condition = threading.Condition()
+
+    def add(self, path: Optional[str]):
+        """Record a changed relative path; None asks for a full sync"""
+        with self._condition:
+            if path is None:
+                self._full = True
+            else:
+                self._paths.add(path)
+            self._last = time.monotonic()
+            if self._first is None:
+                self._first = self._last
+            self._condition.notify_all()
+
+    def wake(self):
+        """Make a waiting get_batch return early, e.g. after a new subscription"""
+        with self._condition:
+            self._woken = True
+            self._condition.notify_all()
+
+    def get_batch(self, stop: threading.Event, timeout: Optional[float] = None):
+        """Block until a batch is due; returns a sorted path list, None for a full sync, or [] on timeout/stop"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while not stop.is_set():
+                if self._woken:
+                    self._woken = False
+                    return []
+                now = time.monotonic()
+                if self._first is not None:
+                    due = min(self._last + self.debounce, self._first + self.max_delay)
+                    if now >= due:
+                        return self._take()
+                    wait = due - now
+                else:
+                    wait = None  # Idle: sleep until an event arrives, no periodic wakeups
+                if deadline is not None:
+                    if now >= deadline:
+                        return []
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._condition.wait(wait)
+            return []
+
+    def _take(self):
+        paths, full = self._paths, self._full
+        self._paths, self._full = set(), False
+        self._first = self._last = None
+        if full or _needs_full_sync(paths):
+            return None
+        return sorted(paths)
+
+
+class InotifyWatcher:
+    """Linux inotify through ctypes; the thread sleeps in poll() until the kernel reports a change"""
+
+    def __init__(self, folder: str, queue: ChangeQueue):
+        if _inotify is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.folder = folder
+        self.queue = queue
+        self._fd = _inotify.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}  # watch descriptor -> relative directory, '' for the root
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        try:
+            self._add_tree('')
+        except OSError:
+            self._close()
+            raise
+
+    def _add_watch(self, relative: str) -> bool:
+        path = os.path.join(self.folder, relative) if relative else self.folder
+        wd = _inotify.inotify_add_watch(self._fd, os.fsencode(path), INOTIFY_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached (raise fs.inotify.max_user_watches)")
+            return False  # Vanished or not a directory any more
+        self._directories[wd] = relative
+        return True
+
+    def _add_tree(self, relative: str):
+        """Watch a directory and everything below it; a moved-in tree keeps its old descriptors"""
+        pending = [relative]
+        while pending:
+            directory = pending.pop()
+            if not self._add_watch(directory):
+                continue
+            try:
+                with os.scandir(os.path.join(self.folder, directory) if directory else self.folder) as entries:
+                    for entry in entries:
+                        child = _relative(directory, entry.name)
+                        if entry.is_dir(follow_symlinks=False) and not _ignored(child):
+                            pending.append(child)
+            except OSError:
+                pass
+
+    def _drop_tree(self, relative: str):
+        for wd, directory in list(self._directories.items()):
+            if directory == relative or directory.startswith(relative + '/'):
+                _inotify.inotify_rm_watch(self._fd, wd)
+                self._directories.pop(wd, None)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        os.write(self._stop_write, b'x')
+        self._thread.join(timeout=5.0)
+        self._close()
+
+    def _close(self):
+        for fd in (self._fd, self._stop_read, self._stop_write):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        poller.register(self._stop_read, select.POLLIN)
+        while True:
+            ready = [fd for fd, _ in poller.poll()]
+            if self._stop_read in ready:
+                return
+            try:
+                data = os.read(self._fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                print(f"⚠️  inotify read failed: {e}")
+                return
+            try:
+                self._handle(data)
+            except OSError as e:
+                print(f"⚠️  {e}; falling back to full syncs")
+                self.queue.add(None)
+
+    def _handle(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.queue.add(None)
+                continue
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None or not name:
+                continue
+            relative = _relative(directory, os.fsdecode(name))
+            if _ignored(relative):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_MOVED_FROM | IN_DELETE):
+                    self._drop_tree(relative)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(relative)
+            elif mask & IN_CREATE:
+                continue  # The IN_CLOSE_WRITE that follows reports the finished file
+            self.queue.add(relative)
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        self.watcher.report(event.src_path)
+        if getattr(event, 'dest_path', None):
+            self.watcher.report(event.dest_path)
+
+
+class WatchdogWatcher:
+    """The watchdog package's native observer (FSEvents, ReadDirectoryChangesW, kqueue, ...)"""
+
+    def __init__(self, folder: str, queue: ChangeQueue):
+        if Observer is None:
+            raise OSError(errno.ENOSYS, "watchdog is not installed")
+        self.folder = folder
+        self.queue = queue
+        self._observer = Observer()
+        self._observer.schedule(_WatchdogHandler(self), folder, recursive=True)
+
+    def report(self, path):
+        relative = os.path.relpath(os.fsdecode(path), self.folder).replace(os.sep, '/')
+        if relative != '.' and not relative.startswith('../') and not _ignored(relative):
+            self.queue.add(relative)
+
+    def start(self):
+        self._observer.start()
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join(timeout=5.0)
+
+
+class PollingWatcher:
+    """Portable fallback: compare a (size, mtime) snapshot of the tree every interval"""
+
+    def __init__(self, folder: str, queue: ChangeQueue, interval: float = POLL_INTERVAL):
+        self.folder = folder
+        self.queue = queue
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._snapshot_files = self._snapshot()
+
+    def _snapshot(self) -> dict:
+        files = {}
+        pending = ['']
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(os.path.join(self.folder, directory) if directory else self.folder) as entries:
+                    for entry in entries:
+                        relative = _relative(directory, entry.name)
+                        if _ignored(relative):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(relative)
+                        elif entry.is_file(follow_symlinks=False):
+                            info = entry.stat(follow_symlinks=False)
+                            files[relative] = (info.st_size, info.st_mtime_ns)
+            except OSError:
+                pass
+        return files
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            previous, current = self._snapshot_files, self._snapshot()
+            for relative, signature in current.items():
+                if previous.get(relative) != signature:
+                    self.queue.add(relative)
+            for relative in previous.keys() - current.keys():
+                self.queue.add(relative)
+            self._snapshot_files = current
+
+
+def create_watcher(folder: str, queue: ChangeQueue, backend: str = WATCH_AUTO,
+                   poll_interval: float = POLL_INTERVAL):
+    """inotify on Linux, else watchdog when installed, else polling; an explicit backend is used as is"""
+    if backend == WATCH_POLLING:
+        return PollingWatcher(folder, queue, poll_interval)
+    if backend in (WATCH_AUTO, WATCH_INOTIFY) and (backend == WATCH_INOTIFY or _inotify is not None):
+        try:
+            return InotifyWatcher(folder, queue)
+        except OSError as e:
+            if backend == WATCH_INOTIFY:
+                raise
+            print(f"⚠️  {e}")
+    if backend in (WATCH_AUTO, WATCH_WATCHDOG) and (backend == WATCH_WATCHDOG or Observer is not None):
+        return WatchdogWatcher(folder, queue)
+    if backend != WATCH_AUTO:
+        raise ValueError(f"Unknown watch backend: {backend}")
+    return PollingWatcher(folder, queue, poll_interval)
+
+
+class FolderWatcher:
+    """Watch a synced folder and push each debounced batch of changes to every subscribed peer
+
+    sync(peer_ip, remote_name, paths) runs one sync session and returns (success, message);
+    paths is None for a full sync. Peers that fail keep their pending changes and are
+    retried with backoff, without holding up the others.
+    """
+
+    def __init__(self, folder: str, sync: Callable, backend: str = WATCH_AUTO,
+                 debounce: float = DEBOUNCE_SECONDS, max_delay: float = MAX_DELAY_SECONDS,
+                 poll_interval: float = POLL_INTERVAL):
+        self.folder = os.path.abspath(folder)
+        self.sync = sync
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.queue = ChangeQueue(debounce, max_delay)
+        self._peers = set()  # (peer_ip, remote_name)
+        self._pending = {}  # (peer_ip, remote_name) -> set of paths, or None for a full sync
+        self._retries = {}  # (peer_ip, remote_name) -> (attempts, monotonic time of the next try)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._thread = None
+
+    def subscribe(self, peer_ip: str, remote_name: Optional[str] = None):
+        """Add a peer; it gets one full sync first to catch up on anything missed"""
+        peer = (peer_ip, remote_name or os.path.basename(self.folder))
+        with self._lock:
+            self._peers.add(peer)
+            self._pending[peer] = None
+            self._retries.pop(peer, None)
+        self.queue.wake()
+
+    def unsubscribe(self, peer_ip: str, remote_name: Optional[str] = None):
+        peer = (peer_ip, remote_name or os.path.basename(self.folder))
+        with self._lock:
+            self._peers.discard(peer)
+            self._pending.pop(peer, None)
+            self._retries.pop(peer, None)
+
+    @property
+    def peers(self) -> list:
+        with self._lock:
+            return sorted(self._peers)
+
+    def start(self):
+        self._watcher = create_watcher(self.folder, self.queue, self.backend, self.poll_interval)
+        self._watcher.start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"👀 Watching {self.folder} ({type(self._watcher).__name__})")
+
+    def stop(self):
+        self._stop.set()
+        self.queue.wake()
+        if self._watcher:
+            self._watcher.stop()
+        if self._thread:
+            self._thread.join(timeout=10.0)
+
+    def _next_retry(self) -> Optional[float]:
+        with self._lock:
+            if not self._retries:
+                return None
+            return max(0.0, min(due for _, due in self._retries.values()) - time.monotonic())
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self.queue.get_batch(self._stop, self._next_retry())
+            if self._stop.is_set():
+                return
+            with self._lock:
+                if batch is None or batch:
+                    for peer in self._peers:
+                        self._merge(peer, batch)
+                now = time.monotonic()
+                due = [peer for peer in self._pending if self._retries.get(peer, (0, 0))[1] <= now]
+            for peer in due:
+                self._push(peer)
+
+    def _merge(self, peer, paths):
+        if peer in self._pending and self._pending[peer] is None:
+            return
+        if paths is None:
+            self._pending[peer] = None
+            return
+        pending = self._pending.setdefault(peer, set())
+        pending.update(paths)
+        if _needs_full_sync(pending):
+            self._pending[peer] = None
+
+    def _push(self, peer):
+        with self._lock:
+            if peer not in self._pending:
+                return
+            paths = self._pending.pop(peer)
+        start = time.monotonic()
+        success, message = self.sync(peer[0], peer[1], None if paths is None else sorted(paths))
+        with self._lock:
+            if success:
+                self._retries.pop(peer, None)
+                changes = "all files" if paths is None else f"{len(paths)} changes"
+                print(f"⚡ Synced {changes} with {peer[0]} in {time.monotonic() - start:.2f}s")
+                return
+            if peer not in self._peers:
+                return
+            # A peer with a smaller message limit than ours would refuse the same list on every retry
+            self._merge(peer, None if MESSAGE_TOO_LARGE in message else paths)
+            attempts = self._retries.get(peer, (0, 0))[0] + 1
+            self._retries[peer] = (attempts, time.monotonic() + min(2 ** attempts, RETRY_DELAY_MAX))
+        print(f"🔄 Sync with {peer[0]} failed ({message}), retrying")
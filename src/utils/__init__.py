@@ -1,11 +1,21 @@
-from .crypto import CryptoManager
-from .compression import CompressionManager, CompressionMethod
+from .crypto import CryptoManager, StreamCipher
+from .compression import (
+    AdaptiveCompressor, CompressionManager, CompressionMethod, StreamCompressor, StreamDecompressor
+)
+from .hashing import HashManager
+from .file_index import FileIndex
 from .progress import ProgressBar, TransferProgress
 
 __all__ = [
     "CryptoManager",
+    "StreamCipher",
+    "AdaptiveCompressor",
     "CompressionManager", 
     "CompressionMethod",
+    "StreamCompressor",
+    "StreamDecompressor",
+    "HashManager",
+    "FileIndex",
     "ProgressBar",
     "TransferProgress"
 ]
\ No newline at end of file
@@ -2,7 +2,28 @@ import zlib
 import gzip
 import lzma
 import bz2
+import threading
+import time
 from enum import Enum
+from typing import Iterator, Optional
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+ZSTD_DEFAULT_LEVEL = 3
+LZ4_DEFAULT_LEVEL = 0
 
 class CompressionMethod(Enum):
     NONE = 0
@@ -10,25 +31,94 @@ class CompressionMethod(Enum):
     GZIP = 2
     LZMA = 3
     BZ2 = 4
+    ADAPTIVE = 5  # Chosen per block by AdaptiveCompressor; frames record the method actually used
+    ZSTD = 6  # Optional: compression.zstd (3.14+) or zstandard
+    LZ4 = 7  # Optional: lz4
+
+
+def _zstd_compress(data, level: int) -> bytes:
+    if zstd is not None:
+        return zstd.compress(data, level)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data) -> bytes:
+    if zstd is not None:
+        return zstd.decompress(data)
+    return zstandard.ZstdDecompressor().decompress(data)
+
 
 class CompressionManager:
+    # Fast codecs that only work when both peers have the library; negotiated per transfer
+    OPTIONAL_METHODS = (CompressionMethod.ZSTD, CompressionMethod.LZ4)
+
+    @staticmethod
+    def is_available(method: CompressionMethod) -> bool:
+        if method == CompressionMethod.ZSTD:
+            return zstd is not None or zstandard is not None
+        if method == CompressionMethod.LZ4:
+            return lz4_frame is not None
+        return True
+
+    @staticmethod
+    def available_methods() -> list:
+        """Methods this peer can compress and decompress"""
+        return [method for method in CompressionMethod if CompressionManager.is_available(method)]
+
+    @staticmethod
+    def compression_offer(method: CompressionMethod) -> list:
+        """Methods to propose to the receiver for an optional codec, best first
+
+        The other fast codecs come next and ADAPTIVE, which every peer supports, last.
+        """
+        offer = [method] + [m for m in CompressionManager.OPTIONAL_METHODS if m != method]
+        return [m for m in offer if CompressionManager.is_available(m)] + [CompressionMethod.ADAPTIVE]
+
     @staticmethod
-    def compress_data(data: bytes, method: CompressionMethod = CompressionMethod.ZLIB) -> bytes:
+    def choose_method(offered: list) -> CompressionMethod:
+        """First offered method this peer can decode; ADAPTIVE when none is known"""
+        for value in offered:
+            try:
+                method = CompressionMethod(value)
+            except ValueError:
+                continue
+            if CompressionManager.is_available(method):
+                return method
+        return CompressionMethod.ADAPTIVE
+
+    @staticmethod
+    def _require(method: CompressionMethod):
+        if not CompressionManager.is_available(method):
+            raise ValueError(f"{method.name} compression is not installed")
+
+    @staticmethod
+    def compress_data(data: bytes, method: CompressionMethod = CompressionMethod.ZLIB,
+                      level: Optional[int] = None) -> bytes:
         if method == CompressionMethod.NONE:
             return data
         elif method == CompressionMethod.ZLIB:
-            return zlib.compress(data)
+            return zlib.compress(data, -1 if level is None else level)
         elif method == CompressionMethod.GZIP:
-            return gzip.compress(data)
+            return gzip.compress(data, 9 if level is None else level)
         elif method == CompressionMethod.LZMA:
-            return lzma.compress(data)
+            return lzma.compress(data, preset=level)
         elif method == CompressionMethod.BZ2:
-            return bz2.compress(data)
+            return bz2.compress(data, 9 if level is None else level)
+        elif method == CompressionMethod.ZSTD:
+            CompressionManager._require(method)
+            return _zstd_compress(data, ZSTD_DEFAULT_LEVEL if level is None else level)
+        elif method == CompressionMethod.LZ4:
+            CompressionManager._require(method)
+            return lz4_frame.compress(data, compression_level=LZ4_DEFAULT_LEVEL if level is None else level)
         else:
             raise ValueError(f"Unknown compression method: {method}")
-    
+
     @staticmethod
-    def decompress_data(compressed_data: bytes, method: CompressionMethod = CompressionMethod.ZLIB) -> bytes:
+    def decompress_data(compressed_data: bytes, method: CompressionMethod = CompressionMethod.ZLIB,
+                        max_length: Optional[int] = None) -> bytes:
+        """Inflate one block; with max_length, a block that would inflate past it raises ValueError"""
+        if max_length is not None and method != CompressionMethod.NONE:
+            return CompressionManager._decompress_bounded(compressed_data, method, max_length)
         if method == CompressionMethod.NONE:
             return compressed_data
         elif method == CompressionMethod.ZLIB:
@@ -39,12 +129,276 @@ class CompressionManager:
             return lzma.decompress(compressed_data)
         elif method == CompressionMethod.BZ2:
             return bz2.decompress(compressed_data)
+        elif method == CompressionMethod.ZSTD:
+            CompressionManager._require(method)
+            return _zstd_decompress(compressed_data)
+        elif method == CompressionMethod.LZ4:
+            CompressionManager._require(method)
+            return lz4_frame.decompress(compressed_data)
         else:
             raise ValueError(f"Unknown compression method: {method}")
-    
+
+    @staticmethod
+    def _decompress_bounded(compressed_data: bytes, method: CompressionMethod, max_length: int) -> bytes:
+        if method == CompressionMethod.ZSTD and zstd is None:
+            CompressionManager._require(method)
+            # Frames record their size; one that does not is decoded into a buffer of max_length
+            if zstandard.frame_content_size(compressed_data) > max_length:
+                raise ValueError(f"Compressed block inflates past {max_length} bytes")
+            try:
+                return zstandard.ZstdDecompressor().decompress(compressed_data, max_output_size=max_length)
+            except zstandard.ZstdError as e:
+                raise ValueError(f"Compressed block is corrupt or inflates past {max_length} bytes: {e}")
+        stream = StreamDecompressor(method, max_length)
+        output = stream.decompress(compressed_data)
+        if not stream.eof:
+            raise ValueError(f"Compressed block is truncated or inflates past {max_length} bytes")
+        return output
+
     @staticmethod
-    def get_recommended_method(data_size: int) -> CompressionMethod:
-        if data_size < 1024 * 1024:
-            return CompressionMethod.ZLIB
+    def compress_block(data: bytes, method: CompressionMethod) -> tuple:
+        """Compress one block; returns (payload, method used), storing it when compression does not help"""
+        if method == CompressionMethod.NONE:
+            return data, CompressionMethod.NONE
+        compressed = CompressionManager.compress_data(data, method)
+        if len(compressed) >= len(data):
+            return data, CompressionMethod.NONE
+        return compressed, method
+
+
+class AdaptiveCompressor:
+    """Per-block compression policy driven by sampled compressibility, CPU speed and link speed
+
+    Each block is first probed with a fast zlib pass over a few samples; blocks that barely shrink
+    (JPEG, MP4, zip, encrypted data) are stored. Otherwise the level is picked from a ladder so that
+    neither compression nor the link is left waiting: stronger levels once the link is the bottleneck,
+    cheaper ones when compression can't keep up. Speeds and ratios are re-measured on every block.
+    """
+    SAMPLE_SIZE = 16 * 1024
+    SAMPLE_COUNT = 4
+    INCOMPRESSIBLE_RATIO = 0.95
+    # (method, level, initial MB/s per core, initial ratio relative to the zlib-1 probe)
+    LEVELS = [
+        (CompressionMethod.ZLIB, 1, 80.0, 1.0),
+        (CompressionMethod.ZLIB, 6, 25.0, 0.9),
+        (CompressionMethod.LZMA, 1, 8.0, 0.75),
+        (CompressionMethod.LZMA, 6, 2.0, 0.65),
+    ]
+
+    def __init__(self, workers: int = 1):
+        self.workers = max(1, workers)
+        self.speeds = [speed * 1024 * 1024 for _, _, speed, _ in self.LEVELS]
+        self.gains = [gain for _, _, _, gain in self.LEVELS]
+        self.link_rate = None
+        self._lock = threading.Lock()
+
+    def probe(self, data) -> float:
+        """Compressed/raw ratio of a quick zlib level-1 pass over samples spread across the block"""
+        size = len(data)
+        if size <= self.SAMPLE_SIZE * self.SAMPLE_COUNT:
+            sample = bytes(data)
         else:
-            return CompressionMethod.LZMA
\ No newline at end of file
+            step = (size - self.SAMPLE_SIZE) // (self.SAMPLE_COUNT - 1)
+            sample = b''.join(
+                bytes(data[i * step:i * step + self.SAMPLE_SIZE]) for i in range(self.SAMPLE_COUNT)
+            )
+        if not sample:
+            return 1.0
+        return len(zlib.compress(sample, 1)) / len(sample)
+
+    def observe_link(self, nbytes: int, seconds: float):
+        """Record how fast compressed frames leave over the wire"""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        with self._lock:
+            self.link_rate = rate if self.link_rate is None else 0.8 * self.link_rate + 0.2 * rate
+
+    def choose_level(self, probe_ratio: float) -> int:
+        """Index into LEVELS that minimises the time per raw byte of compressing and sending"""
+        with self._lock:
+            if self.link_rate is None:
+                return 0
+            costs = [
+                max(1 / (self.speeds[i] * self.workers), probe_ratio * self.gains[i] / self.link_rate)
+                for i in range(len(self.LEVELS))
+            ]
+        return min(range(len(costs)), key=lambda i: (costs[i], -i))
+
+    def compress(self, data) -> tuple:
+        """Returns (payload, method used); CompressionMethod.NONE means the block is stored"""
+        probe_ratio = self.probe(data)
+        if probe_ratio > self.INCOMPRESSIBLE_RATIO:
+            return data, CompressionMethod.NONE
+
+        index = self.choose_level(probe_ratio)
+        method, level, _, _ = self.LEVELS[index]
+        started = time.perf_counter()
+        compressed = CompressionManager.compress_data(data, method, level)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            if elapsed > 0:
+                self.speeds[index] = 0.7 * self.speeds[index] + 0.3 * (len(data) / elapsed)
+            self.gains[index] = 0.7 * self.gains[index] + 0.3 * (len(compressed) / len(data) / probe_ratio)
+
+        if len(compressed) >= len(data):
+            return data, CompressionMethod.NONE
+        return compressed, method
+
+
+class StreamCompressor:
+    """One compressor for a whole transfer, so later chunks reuse the dictionary of earlier ones
+
+    zlib, gzip, zstd and lz4 flush after every chunk, so each output decodes fully on arrival.
+    lzma and bz2 cannot flush mid-stream; their output simply continues in the next chunk.
+    """
+
+    def __init__(self, method: CompressionMethod, level: Optional[int] = None):
+        self.method = method
+        self._sync_flush = None
+        self._header = b''
+        if method == CompressionMethod.ZLIB:
+            self._compressor = zlib.compressobj(-1 if level is None else level)
+            self._sync_flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        elif method == CompressionMethod.GZIP:
+            self._compressor = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31)
+            self._sync_flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        elif method == CompressionMethod.LZMA:
+            self._compressor = lzma.LZMACompressor(preset=level)
+        elif method == CompressionMethod.BZ2:
+            self._compressor = bz2.BZ2Compressor(9 if level is None else level)
+        elif method == CompressionMethod.ZSTD:
+            CompressionManager._require(method)
+            level = ZSTD_DEFAULT_LEVEL if level is None else level
+            if zstd is not None:
+                self._compressor = zstd.ZstdCompressor(level)
+                self._sync_flush = lambda: self._compressor.flush(zstd.ZstdCompressor.FLUSH_BLOCK)
+            else:
+                self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+                self._sync_flush = lambda: self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        elif method == CompressionMethod.LZ4:
+            CompressionManager._require(method)
+            # auto_flush emits every chunk as complete blocks; linked blocks keep the dictionary
+            self._compressor = lz4_frame.LZ4FrameCompressor(
+                compression_level=LZ4_DEFAULT_LEVEL if level is None else level, auto_flush=True
+            )
+            self._header = self._compressor.begin()
+        else:
+            raise ValueError(f"No streaming compressor for {method}")
+
+    def compress(self, data) -> bytes:
+        output = self._header + self._compressor.compress(data)
+        self._header = b''
+        if self._sync_flush:
+            output += self._sync_flush()
+        return output
+
+    def flush(self) -> bytes:
+        """End the stream; the result must be sent after the last chunk"""
+        output = self._header + self._compressor.flush()
+        self._header = b''
+        return output
+
+
+class _OutputSink:
+    """Collects what a zstandard stream_writer decompresses, refusing more than limit bytes per call"""
+
+    def __init__(self):
+        self.limit = None
+        self._parts = []
+        self._size = 0
+
+    def write(self, data) -> int:
+        self._size += len(data)
+        if self.limit is not None and self._size > self.limit:
+            raise ValueError(f"Compressed frame inflates past {self.limit} bytes")
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        output = b''.join(self._parts)
+        self._parts, self._size = [], 0
+        return output
+
+
+class StreamDecompressor:
+    """Receiving side of StreamCompressor; chunks must be fed in the order they were produced
+
+    With max_length no call returns more than that, and the whole stream no more than
+    max_length per chunk fed. Codecs that flush every chunk must fit each one in it.
+    lzma and bz2 output can lag its chunk, so what does not fit stays in the
+    decompressor and comes out with later chunks or from drain().
+    """
+
+    def __init__(self, method: CompressionMethod, max_length: Optional[int] = None):
+        self.method = method
+        self.max_length = max_length
+        self._budget = 0  # Output the chunks fed so far may still produce
+        self._carries = method in (CompressionMethod.LZMA, CompressionMethod.BZ2)
+        self._sink = None
+        if method == CompressionMethod.ZLIB:
+            self._decompressor = zlib.decompressobj()
+        elif method == CompressionMethod.GZIP:
+            self._decompressor = zlib.decompressobj(31)
+        elif method == CompressionMethod.LZMA:
+            self._decompressor = lzma.LZMADecompressor()
+        elif method == CompressionMethod.BZ2:
+            self._decompressor = bz2.BZ2Decompressor()
+        elif method == CompressionMethod.ZSTD:
+            CompressionManager._require(method)
+            if zstd is not None:
+                self._decompressor = zstd.ZstdDecompressor()
+            elif max_length is not None:
+                # Its decompressobj cannot stop early, but a stream writer hands over output as it goes.
+                # A write only holds nothing back when its output buffer can take all of it.
+                self._sink = _OutputSink()
+                self._decompressor = zstandard.ZstdDecompressor().stream_writer(
+                    self._sink, write_size=max_length + 1
+                )
+            else:
+                self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        elif method == CompressionMethod.LZ4:
+            CompressionManager._require(method)
+            self._decompressor = lz4_frame.LZ4FrameDecompressor()
+        else:
+            raise ValueError(f"No streaming decompressor for {method}")
+
+    def decompress(self, data) -> bytes:
+        if self.max_length is None:
+            return self._decompressor.decompress(data)
+        self._budget += self.max_length
+        if self._carries:
+            return self._spend(self._decompressor.decompress(data, self.max_length))
+        if self._sink is not None:
+            self._sink.limit = self.max_length
+            self._decompressor.write(data)
+            return self._spend(self._sink.take())
+        output = self._decompressor.decompress(data, self.max_length + 1)
+        if len(output) > self.max_length:
+            raise ValueError(f"Compressed frame inflates past {self.max_length} bytes")
+        return self._spend(output)
+
+    def _spend(self, output: bytes) -> bytes:
+        self._budget -= len(output)
+        if self._budget < 0:
+            raise ValueError(f"Compression stream inflates past {self.max_length} bytes per frame")
+        return output
+
+    @property
+    def eof(self) -> bool:
+        """Whether the end of the compressed stream was reached"""
+        return getattr(self._decompressor, 'eof', False)
+
+    def drain(self) -> Iterator[bytes]:
+        """Output still held once the last chunk is in, in pieces of at most max_length"""
+        if self._carries and self.max_length is not None:
+            while not self._decompressor.eof and not self._decompressor.needs_input:
+                yield self._spend(self._decompressor.decompress(b'', self.max_length))
+        elif hasattr(self._decompressor, 'flush') and self._sink is None:
+            tail = self._decompressor.flush()
+            if tail:
+                yield tail if self.max_length is None else self._spend(tail)
+
+    def flush(self) -> bytes:
+        return b''.join(self.drain())
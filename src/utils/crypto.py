@@ -4,13 +4,53 @@ import base64
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes,serialization
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography import x509
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.x509.oid import NameOID
 import datetime
 
 
+class StreamCipher:
+    """AES-GCM session that seals every chunk of a transfer with one derived key"""
+    NONCE_PREFIX_SIZE = 4
+    TAG_SIZE = 16
+
+    def __init__(self, key: bytes, nonce_prefix: bytes = b'\x00' * NONCE_PREFIX_SIZE):
+        if len(nonce_prefix) != self.NONCE_PREFIX_SIZE:
+            raise ValueError("Nonce prefix must be 4 bytes")
+        self._aead = AESGCM(key)
+        self._nonce_prefix = nonce_prefix
+        self._counter = 0
+
+    def _nonce(self, sequence: int) -> bytes:
+        # The key is unique per transfer (fresh salt), so a counter nonce never repeats
+        return self._nonce_prefix + sequence.to_bytes(8, byteorder='big')
+
+    def reserve(self) -> int:
+        """Claim the next sequence number, for callers that seal or open chunks on other threads"""
+        sequence = self._counter
+        self._counter += 1
+        return sequence
+
+    def seal(self, chunk: bytes, sequence: int = None) -> bytes:
+        """Encrypt and authenticate a chunk; sequence defaults to the next counter value"""
+        if sequence is None:
+            sequence = self._counter
+            self._counter += 1
+        return self._aead.encrypt(self._nonce(sequence), chunk, None)
+
+    def open(self, sealed_chunk: bytes, sequence: int = None) -> bytes:
+        """Verify and decrypt a chunk sealed with the same sequence number"""
+        if sequence is None:
+            sequence = self._counter
+            self._counter += 1
+        return self._aead.decrypt(self._nonce(sequence), sealed_chunk, None)
+
+
 class CryptoManager:
+    STREAM_CIPHER_NAME = "aes-256-gcm"
+
     @staticmethod
     def generate_ssl_certificates(common_name, cert_path="certs/", days_valid=365):
         try:
@@ -42,7 +82,15 @@ class CryptoManager:
     def create_ssl_context(certfile, keyfile):
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         context.load_cert_chain(certfile, keyfile)
+        CryptoManager._enable_ktls(context)
         return context
+
+    @staticmethod
+    def _enable_ktls(context):
+        """Let OpenSSL hand record encryption to the kernel when available (Linux kTLS)"""
+        ktls_option = getattr(ssl, 'OP_ENABLE_KTLS', 0)
+        if ktls_option:
+            context.options |= ktls_option
     
     @staticmethod
     def create_ssl_server_context(cert_dir):
@@ -75,10 +123,11 @@ class CryptoManager:
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
         context.check_hostname = False
         context.verify_mode = ssl.CERT_NONE
+        CryptoManager._enable_ktls(context)
         return context
     
     @staticmethod
-    def derive_key(password: str, salt: bytes = None) -> tuple:
+    def derive_raw_key(password: str, salt: bytes = None) -> tuple:
         if salt is None:
             salt = os.urandom(16)
         kdf = PBKDF2HMAC(
@@ -87,8 +136,19 @@ class CryptoManager:
             salt=salt,
             iterations=100000,
         )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        return key, salt
+        return kdf.derive(password.encode()), salt
+
+    @staticmethod
+    def derive_key(password: str, salt: bytes = None) -> tuple:
+        raw_key, salt = CryptoManager.derive_raw_key(password, salt)
+        return base64.urlsafe_b64encode(raw_key), salt
+
+    @staticmethod
+    def create_stream_cipher(password: str, salt: bytes = None,
+                             nonce_prefix: bytes = b'\x00' * StreamCipher.NONCE_PREFIX_SIZE) -> tuple:
+        """Derive one key per transfer and return (StreamCipher, salt)"""
+        key, salt = CryptoManager.derive_raw_key(password, salt)
+        return StreamCipher(key, nonce_prefix), salt
     
     @staticmethod
     def encrypt_data(data: bytes, password: str) -> bytes:
@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from .hashing import HashManager, DEFAULT_HASH_ALGORITHM
+
+DEFAULT_INDEX_PATH = "~/.filesync/index.db"
+# Files modified this recently may still change within the same mtime tick, so they are not cached
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    value BLOB NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (device, inode, kind)
+)
+"""
+
+
+def hash_kind(algorithm: str) -> str:
+    return f"hash:{algorithm}"
+
+
+class FileIndex:
+    """Persistent cache of per-file results (hashes, chunk lists, block signatures)
+
+    Entries are keyed by (device, inode, kind) and only count while the file's size and
+    mtime_ns still match, so an edited file is simply recomputed.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._connection() as connection:
+            connection.execute(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers and a writer work side by side"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, file_path: str, kind: str, info: Optional[os.stat_result] = None) -> Optional[bytes]:
+        """Cached value for the file as it is now, or None"""
+        info = info or os.stat(file_path)
+        row = self._connection().execute(
+            "SELECT size, mtime_ns, value FROM entries WHERE device = ? AND inode = ? AND kind = ?",
+            (info.st_dev, info.st_ino, kind)
+        ).fetchone()
+        hit = row is not None and row[0] == info.st_size and row[1] == info.st_mtime_ns
+        self._count(hit)
+        return bytes(row[2]) if hit else None
+
+    def put(self, file_path: str, kind: str, value: bytes, info: os.stat_result) -> bool:
+        """Store a value computed from the file as of `info` (a stat taken before reading it)"""
+        current = os.stat(file_path)
+        if (current.st_size, current.st_mtime_ns) != (info.st_size, info.st_mtime_ns):
+            return False
+        if time.time_ns() - info.st_mtime_ns < RACY_WINDOW_NS:
+            return False
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (info.st_dev, info.st_ino, kind, info.st_size, info.st_mtime_ns,
+                 os.path.abspath(file_path), value, time.time())
+            )
+        return True
+
+    def cached(self, file_path: str, kind: str, compute: Callable[[], bytes]) -> bytes:
+        """Return the indexed value, computing and storing it on a miss"""
+        info = os.stat(file_path)
+        value = self.get(file_path, kind, info)
+        if value is None:
+            value = compute()
+            self.put(file_path, kind, value, info)
+        return value
+
+    def hash_file(self, file_path: str, algorithm: str = DEFAULT_HASH_ALGORITHM) -> str:
+        return self.cached(
+            file_path, hash_kind(algorithm), lambda: HashManager.hash_file(file_path, algorithm).encode()
+        ).decode()
+
+    def record_hash(self, file_path: str, algorithm: str, checksum: str, info: os.stat_result) -> bool:
+        """Remember a hash computed elsewhere, e.g. while the file was being streamed"""
+        return self.put(file_path, hash_kind(algorithm), checksum.encode(), info)
+
+    def warm(self, paths: Iterable[str], algorithm: str = DEFAULT_HASH_ALGORITHM,
+             background: bool = True) -> Optional[threading.Thread]:
+        """Hash every file under the given files/folders that the index does not know yet"""
+        def run():
+            for path in paths:
+                for file_path in self._walk(path):
+                    try:
+                        self.hash_file(file_path, algorithm)
+                    except OSError:
+                        pass
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def rebuild(self, paths: Iterable[str], algorithm: str = DEFAULT_HASH_ALGORITHM,
+                background: bool = True) -> Optional[threading.Thread]:
+        """Drop every entry and hash the given files/folders again"""
+        self.clear()
+        return self.warm(paths, algorithm, background)
+
+    @staticmethod
+    def _walk(path: str):
+        if os.path.isfile(path):
+            yield path
+            return
+        for root, _, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                if os.path.isfile(file_path) and not os.path.islink(file_path):
+                    yield file_path
+
+    def prune(self) -> int:
+        """Forget entries whose file is gone or was replaced; returns how many were removed"""
+        connection = self._connection()
+        stale = []
+        for device, inode, kind, size, mtime_ns, path in connection.execute(
+                "SELECT device, inode, kind, size, mtime_ns, path FROM entries"):
+            try:
+                info = os.stat(path)
+                current = (info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns)
+            except OSError:
+                current = None
+            if current != (device, inode, size, mtime_ns):
+                stale.append((device, inode, kind))
+        with connection:
+            connection.executemany("DELETE FROM entries WHERE device = ? AND inode = ? AND kind = ?", stale)
+        return len(stale)
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM entries")
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        entries = self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,157 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_HASH_ALGORITHM = "blake2b"
+TREE_SUFFIX = "-tree"
+TREE_SEGMENT_SIZE = 4 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+class TreeHasher:
+    """Two-level hash: fixed-size segments are hashed separately, then the segment digests.
+
+    The streaming form matches HashManager.hash_file(..., workers=N), which hashes the
+    segments of a file on several cores.
+    """
+
+    def __init__(self, factory: Callable, segment_size: int = TREE_SEGMENT_SIZE):
+        self.factory = factory
+        self.segment_size = segment_size
+        self._root = factory()
+        self._segment = factory()
+        self._segment_filled = 0
+        self._length = 0
+
+    def update(self, data):
+        view = memoryview(data).cast('B')
+        while view:
+            take = min(len(view), self.segment_size - self._segment_filled)
+            self._segment.update(view[:take])
+            self._segment_filled += take
+            view = view[take:]
+            if self._segment_filled == self.segment_size:
+                self.add_segment_digest(self._segment.digest(), self.segment_size)
+                self._segment = self.factory()
+                self._segment_filled = 0
+
+    def add_segment_digest(self, digest: bytes, length: int):
+        """Fold in a full segment that was hashed elsewhere"""
+        self._root.update(digest)
+        self._length += length
+
+    def _final(self):
+        root = self._root.copy()
+        length = self._length + self._segment_filled
+        if self._segment_filled or not length:
+            root.update(self._segment.digest())
+        root.update(length.to_bytes(8, byteorder='big'))
+        return root
+
+    def digest(self) -> bytes:
+        return self._final().digest()
+
+    def hexdigest(self) -> str:
+        return self._final().hexdigest()
+
+
+class HashManager:
+    _algorithms = {
+        "md5": hashlib.md5,
+        "sha256": hashlib.sha256,
+        "blake2b": hashlib.blake2b,
+    }
+    if blake3 is not None:
+        _algorithms["blake3"] = blake3.blake3
+    if xxhash is not None:
+        # Non-cryptographic: fast integrity checks, not tamper resistance
+        _algorithms["xxh3_128"] = xxhash.xxh3_128
+        _algorithms["xxh64"] = xxhash.xxh64
+
+    @staticmethod
+    def register(name: str, factory: Callable):
+        """Register a hashlib-compatible constructor under a name"""
+        HashManager._algorithms[name] = factory
+
+    @staticmethod
+    def available_algorithms() -> list:
+        """Names this peer can compute, including tree variants"""
+        names = list(HashManager._algorithms)
+        return names + [name + TREE_SUFFIX for name in names]
+
+    @staticmethod
+    def is_available(name: str) -> bool:
+        return HashManager._base_name(name) in HashManager._algorithms
+
+    @staticmethod
+    def _base_name(name: str) -> str:
+        return name[:-len(TREE_SUFFIX)] if name.endswith(TREE_SUFFIX) else name
+
+    @staticmethod
+    def new(name: str = DEFAULT_HASH_ALGORITHM):
+        """Create a hasher with update()/hexdigest() for a registered algorithm"""
+        factory = HashManager._algorithms.get(HashManager._base_name(name))
+        if factory is None:
+            raise ValueError(f"Unsupported hash algorithm: {name}")
+        if name.endswith(TREE_SUFFIX):
+            return TreeHasher(factory)
+        return factory()
+
+    @staticmethod
+    def hash_file(file_path: str, algorithm: str = DEFAULT_HASH_ALGORITHM,
+                  workers: Optional[int] = None) -> str:
+        """Hash a file; tree algorithms hash their segments on `workers` threads"""
+        if algorithm.endswith(TREE_SUFFIX) and workers != 1:
+            return HashManager._hash_file_tree(file_path, algorithm, workers or os.cpu_count() or 1)
+
+        hasher = HashManager.new(algorithm)
+        buffer = memoryview(bytearray(READ_SIZE))
+        with open(file_path, "rb") as f:
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(buffer[:read])
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _hash_file_tree(file_path: str, algorithm: str, workers: int) -> str:
+        tree = HashManager.new(algorithm)
+        file_size = os.path.getsize(file_path)
+        segment_size = tree.segment_size
+        full_segments = file_size // segment_size
+
+        def hash_segment(index):
+            # hashlib releases the GIL on large updates, so segments hash in parallel
+            hasher = tree.factory()
+            buffer = memoryview(bytearray(READ_SIZE))
+            with open(file_path, "rb") as f:
+                f.seek(index * segment_size)
+                remaining = segment_size
+                while remaining:
+                    read = f.readinto(buffer[:min(READ_SIZE, remaining)])
+                    if not read:
+                        raise IOError("File changed size while hashing")
+                    hasher.update(buffer[:read])
+                    remaining -= read
+            return hasher.digest()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for digest in executor.map(hash_segment, range(full_segments)):
+                tree.add_segment_digest(digest, segment_size)
+
+        with open(file_path, "rb") as f:
+            f.seek(full_segments * segment_size)
+            tree.update(f.read())
+        return tree.hexdigest()